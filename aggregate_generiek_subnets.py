@@ -4,16 +4,30 @@ from __future__ import print_function
 import argparse
 import codecs
 import collections
+import heapq
 import json
+import os
 import re
 import sys
 
+import run_recurrence
 from country_policy import (
     DEFAULT_COUNTRY_CODES,
     default_country_block_policy,
     effective_country_codes,
     is_safe_provider,
 )
+from ipv4_index import (
+    bounds_to_cidr,
+    count_in_range,
+    interval_index_from_cidrs,
+    interval_index_overlaps,
+    ipv4_int_to_text,
+    network_bounds,
+    parse_ipv4_int,
+    sorted_unique_ints,
+)
+from ipv4_extract import read_ip_counts
 
 try:
     text_type = unicode  # Py2
@@ -104,8 +118,14 @@ def geo_detail_line(ip, details):
     )
 
 
-def build_subnets_from_ips(ips, target_prefix, min_hits):
+def build_subnets_from_ips(ips, target_prefix, min_hits, recurring=None, weights=None):
+    # recurring: /24 keys (ip >> 8) from run_recurrence; a /24 or narrower
+    # subnet holding an IP of a recurring /24 is kept even below min_hits
+    # (a wider one would block far more than the recurring /24). weights: {ip:
+    # occurrences} from parse_ips, so min_hits counts requests instead of
+    # distinct IPs; IPs missing from it count once.
     counts = {}
+    escalated = set()
     selected_ips = 0
 
     for ip in ips:
@@ -119,14 +139,16 @@ def build_subnets_from_ips(ips, target_prefix, min_hits):
         selected_ips += 1
         network = ip_network("%s/%d" % (ip, target_prefix), strict=False)
         key = str(network)
-        counts[key] = counts.get(key, 0) + 1
+        counts[key] = counts.get(key, 0) + (weights.get(ip, 1) if weights else 1)
+        if recurring and target_prefix >= 24 and (parse_ipv4_int(ip) >> 8) in recurring:
+            escalated.add(key)
 
-    subnets = [net for net, count in counts.items() if count >= min_hits]
+    subnets = [net for net, count in counts.items() if count >= min_hits or net in escalated]
     subnets.sort(key=network_sort_key)
     return selected_ips, subnets
 
 
-def build_subnets_from_geo(geo_data, country_codes, target_prefix, min_hits, source_ips=None):
+def build_subnets_from_geo(geo_data, country_codes, target_prefix, min_hits, source_ips=None, recurring=None):
     country_set = set(country_codes)
     source_ip_set = set(source_ips) if source_ips is not None else None
     ips = []
@@ -138,19 +160,22 @@ def build_subnets_from_geo(geo_data, country_codes, target_prefix, min_hits, sou
             continue
         ips.append(ip)
 
-    return build_subnets_from_ips(ips, target_prefix, min_hits)
+    return build_subnets_from_ips(ips, target_prefix, min_hits, recurring)
 
 
 def load_country_policy(path, country_codes):
-    policy = default_country_block_policy()
-    allowed = set(country_codes)
     if not path:
-        return dict((country, policy[country]) for country in policy if country in allowed)
+        return country_policy_from_rows([], country_codes)
 
     with open(path, "r") as f:
         data = json.load(f)
 
-    rows = data.get("countries", []) if isinstance(data, dict) else []
+    return country_policy_from_rows(data.get("countries", []) if isinstance(data, dict) else [], country_codes)
+
+
+def country_policy_from_rows(rows, country_codes):
+    policy = default_country_block_policy()
+    allowed = set(country_codes)
     for row in rows:
         country = to_text(row.get("country", "")).upper()
         if not country or country not in allowed:
@@ -171,7 +196,10 @@ def load_provider_policy_candidates(path):
         return []
     with open(path, "r") as f:
         data = json.load(f)
-    rows = data.get("providers", []) if isinstance(data, dict) else []
+    return provider_candidates_from_rows(data.get("providers", []) if isinstance(data, dict) else [])
+
+
+def provider_candidates_from_rows(rows):
     cidrs = []
     seen = set()
     for row in rows:
@@ -196,10 +224,13 @@ def build_subnets_from_geo_policy(
     source_ips=None,
     provider_policy_file=None,
     snapshot_min_hits=1,
+    provider_candidates=None,
+    recurring=None,
 ):
     country_set = set(country_codes)
     source_ip_set = set(source_ips) if source_ips is not None else None
     counts = collections.defaultdict(int)
+    escalated = set()
     policy_by_cidr = {}
     selected_ips = 0
 
@@ -225,14 +256,18 @@ def build_subnets_from_geo_policy(
         counts[network] += 1
         policy_by_cidr[network] = policy
         selected_ips += 1
+        if recurring and prefix >= 24 and (parse_ipv4_int(ip) >> 8) in recurring:
+            escalated.add(network)
 
     subnets = []
     for cidr, count in counts.items():
         policy = policy_by_cidr[cidr]
-        if count >= int(policy.get("min_hits", 1)):
+        if count >= int(policy.get("min_hits", 1)) or cidr in escalated:
             subnets.append(cidr)
 
-    for cidr in load_provider_policy_candidates(provider_policy_file):
+    if provider_candidates is None:
+        provider_candidates = load_provider_policy_candidates(provider_policy_file)
+    for cidr in provider_candidates:
         if cidr not in subnets:
             subnets.append(cidr)
 
@@ -240,6 +275,152 @@ def build_subnets_from_geo_policy(
     return selected_ips, subnets
 
 
+def load_allowlist_cidrs(path):
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        return list(data.get("cidrs", []))
+    if isinstance(data, list):
+        return data
+    return []
+
+
+def blocked_addresses(prefix):
+    return 2 ** (32 - prefix)
+
+
+def is_clean_block(first, last, blockers, allow_index):
+    if count_in_range(blockers, first, last):
+        return False
+    return not interval_index_overlaps(allow_index, first, last)
+
+
+def maximal_clean_blocks(targets, blockers, allow_index, min_prefix):
+    blocks = {}
+    uncoverable = []
+    current = None
+    for target in targets:
+        if current is not None and current[0] <= target <= current[1]:
+            blocks[current[2]] += 1
+            continue
+        current = None
+        for prefix in range(min_prefix, 33):
+            first, last = network_bounds(target, prefix)
+            if is_clean_block(first, last, blockers, allow_index):
+                current = (first, last, (first, prefix))
+                blocks[(first, prefix)] = 1
+                break
+        if current is None:
+            uncoverable.append(target)
+    return blocks, uncoverable
+
+
+def split_block(block, targets):
+    first, prefix = block
+    children = []
+    for child_first in (first, first + blocked_addresses(prefix + 1)):
+        hits = count_in_range(targets, child_first, child_first + blocked_addresses(prefix + 1) - 1)
+        if hits:
+            children.append(((child_first, prefix + 1), hits))
+    return children
+
+
+def split_saving(block, targets):
+    children = split_block(block, targets)
+    saving = blocked_addresses(block[1]) - sum(blocked_addresses(child[1]) for child, _hits in children)
+    return saving, children
+
+
+def fit_blocks_to_budget(blocks, targets, max_blocked_addresses):
+    total = sum(blocked_addresses(prefix) for _first, prefix in blocks)
+    heap = []
+    for block in blocks:
+        if block[1] < 32:
+            saving, children = split_saving(block, targets)
+            heapq.heappush(heap, (-saving, len(children), block, children))
+
+    while total > max_blocked_addresses:
+        if not heap:
+            raise ValueError(
+                "cannot cover %d target IP(s) within --max-blocked-addresses=%d"
+                % (len(targets), max_blocked_addresses)
+            )
+        negative_saving, _count, block, children = heapq.heappop(heap)
+        del blocks[block]
+        total += negative_saving
+        for child, hits in children:
+            blocks[child] = hits
+            if child[1] < 32:
+                saving, grandchildren = split_saving(child, targets)
+                heapq.heappush(heap, (-saving, len(grandchildren), child, grandchildren))
+    return blocks
+
+
+def build_cover_subnets(target_ips, non_target_ips, allowlist_cidrs, max_blocked_addresses=None, min_prefix=16):
+    # Every target IP gets the broadest clean ancestor prefix: no non-target
+    # geo IP and no allowlist CIDR inside it. Clean blocks nest, so these
+    # maximal blocks are the fewest rules that cover all targets. When the
+    # budget is exceeded, the block whose split frees the most addresses is
+    # split first.
+    targets = sorted_unique_ints(value for value in (parse_ipv4_int(ip) for ip in target_ips) if value is not None)
+    target_set = set(targets)
+    blockers = sorted_unique_ints(
+        value for value in (parse_ipv4_int(ip) for ip in non_target_ips)
+        if value is not None and value not in target_set
+    )
+    allow_index = interval_index_from_cidrs(allowlist_cidrs)
+
+    blocks, uncoverable = maximal_clean_blocks(targets, blockers, allow_index, min_prefix)
+    if max_blocked_addresses:
+        uncoverable_set = set(uncoverable)
+        coverable = [target for target in targets if target not in uncoverable_set]
+        blocks = fit_blocks_to_budget(blocks, coverable, max_blocked_addresses)
+
+    subnets = [bounds_to_cidr(first, prefix) for first, prefix in sorted(blocks)]
+    return {
+        "selected_ips": len(targets),
+        "subnets": subnets,
+        "blocked_addresses": sum(blocked_addresses(prefix) for _first, prefix in blocks),
+        "uncoverable_ips": [ipv4_int_to_text(value) for value in uncoverable],
+    }
+
+
+def split_geo_cover_sources(geo_data, country_codes, source_ips=None):
+    country_set = set(country_codes)
+    source_ip_set = set(source_ips) if source_ips is not None else None
+    targets = []
+    non_targets = []
+    for ip, details in geo_data.items():
+        country = geo_country(details)
+        if country not in country_set or is_safe_provider(to_text(details.get("org", ""))):
+            non_targets.append(ip)
+            continue
+        if source_ip_set is not None and ip not in source_ip_set:
+            continue
+        targets.append(ip)
+    return targets, non_targets
+
+
+def build_subnets_from_geo_cover(
+    geo_data,
+    country_codes,
+    allowlist_cidrs,
+    source_ips=None,
+    max_blocked_addresses=None,
+    min_prefix=16,
+):
+    targets, non_targets = split_geo_cover_sources(geo_data, country_codes, source_ips=source_ips)
+    return build_cover_subnets(
+        targets,
+        non_targets,
+        allowlist_cidrs,
+        max_blocked_addresses=max_blocked_addresses,
+        min_prefix=min_prefix,
+    )
+
+
 def build_country_report(geo_data, country_codes, source_ips=None):
     country_set = set(country_codes)
     ip_list = list(source_ips) if source_ips is not None else sorted(geo_data.keys())
@@ -345,87 +526,178 @@ def build_parser():
         "--min-hits",
         type=int,
         default=1,
-        help="Only output a subnet if at least this many source IPs fall inside it.",
+        help="Only output a subnet if at least this many source IPs (with --counts-file: IP occurrences) fall inside it.",
+    )
+    parser.add_argument(
+        "--counts-file",
+        help="With --source=ips, weight each IP by its count in this 'IP<TAB>count' file (parse_ips.py output_ip_counts.txt).",
     )
     parser.add_argument("--policy-mode", action="store_true", help="Use per-country policy/recommendation prefix and min_hits settings")
     parser.add_argument("--country-policy-file", help="country_prefix_recommendations.json to use in --policy-mode")
     parser.add_argument("--provider-policy-file", help="provider_subnet_recommendations.json to merge CANDIDATE provider CIDRs in --policy-mode")
+    parser.add_argument(
+        "--cover-mode",
+        action="store_true",
+        help="Compute the fewest CIDRs that cover target IPs without covering non-target geo IPs or allowlist CIDRs.",
+    )
+    parser.add_argument("--allowlist", default=os.path.join("ip_cache", "allowlist_cidrs.json"), help="Allowlist CIDRs that --cover-mode never covers")
+    parser.add_argument(
+        "--max-blocked-addresses",
+        type=int,
+        default=0,
+        help="In --cover-mode, maximum total IPv4 addresses covered by the generated CIDRs. 0 disables the budget.",
+    )
+    parser.add_argument("--cover-min-prefix", type=int, default=16, help="Broadest prefix --cover-mode may generate")
     parser.add_argument(
         "--policy-snapshot-min-hits",
         type=int,
         default=1,
         help="When --policy-mode uses --filter-ips-file, cap policy min_hits to this value for the current snapshot.",
     )
+    parser.add_argument("--recurrence-db", default=run_recurrence.DEFAULT_DB, help="run_recurrence.py index of earlier runs")
+    parser.add_argument(
+        "--recurrence-min-runs",
+        type=int,
+        default=0,
+        help="Keep /24 or narrower subnets below --min-hits when their /24 was seen in at least this many of the last --recurrence-window runs. 0 disables.",
+    )
+    parser.add_argument("--recurrence-window", type=int, default=10, help="Number of most recent runs --recurrence-min-runs looks at")
     return parser
 
 
-def main():
+def validate_args(args):
+    if args.target_prefix < 1 or args.target_prefix > 32:
+        return "--target-prefix must be between 1 and 32"
+    if args.min_hits < 1:
+        return "--min-hits must be at least 1"
+    if args.cover_min_prefix < 1 or args.cover_min_prefix > 32:
+        return "--cover-min-prefix must be between 1 and 32"
+    if args.cover_mode and args.source != "geo":
+        return "--cover-mode requires --source=geo"
+    if args.counts_file and args.source != "ips":
+        return "--counts-file requires --source=ips"
+    if args.recurrence_min_runs < 0 or args.recurrence_window < 1:
+        return "--recurrence-min-runs must be at least 0 and --recurrence-window at least 1"
+    return None
+
+
+def load_recurring(args):
+    return run_recurrence.recurring_subnet_keys(args.recurrence_db, args.recurrence_min_runs, args.recurrence_window)
+
+
+def aggregate_geo(args, geo_data, source_ips=None, country_policy_rows=None, provider_rows=None):
+    # Recommendation rows already in memory (pipeline runner) are used
+    # instead of re-reading the policy files.
+    country_codes = parse_country_codes(args.country_codes)
+    cover = None
+    if args.cover_mode:
+        cover = build_subnets_from_geo_cover(
+            geo_data,
+            country_codes,
+            load_allowlist_cidrs(args.allowlist),
+            source_ips=source_ips,
+            max_blocked_addresses=args.max_blocked_addresses,
+            min_prefix=args.cover_min_prefix,
+        )
+        selected_ips = cover["selected_ips"]
+        subnets = cover["subnets"]
+    elif args.policy_mode:
+        if country_policy_rows is None:
+            country_policy = load_country_policy(args.country_policy_file, country_codes)
+        else:
+            country_policy = country_policy_from_rows(country_policy_rows, country_codes)
+        provider_candidates = None
+        if provider_rows is not None and args.provider_policy_file:
+            provider_candidates = provider_candidates_from_rows(provider_rows)
+        selected_ips, subnets = build_subnets_from_geo_policy(
+            geo_data,
+            country_codes,
+            country_policy,
+            source_ips=source_ips,
+            provider_policy_file=args.provider_policy_file,
+            snapshot_min_hits=args.policy_snapshot_min_hits,
+            provider_candidates=provider_candidates,
+            recurring=load_recurring(args),
+        )
+    else:
+        selected_ips, subnets = build_subnets_from_geo(
+            geo_data,
+            country_codes,
+            args.target_prefix,
+            args.min_hits,
+            source_ips=source_ips,
+            recurring=load_recurring(args),
+        )
+    report = build_country_report(geo_data, country_codes, source_ips=source_ips)
+    with open(args.report_output, "w") as f:
+        json.dump(report, f, indent=4, sort_keys=True)
+    write_ip_detail_file(args.blocked_ips_output, report["blocked_ips"])
+    write_ip_detail_file(args.allowed_ips_output, report["allowed_ips"])
+    return {"selected_ips": selected_ips, "subnets": subnets, "cover": cover, "report": report}
+
+
+def write_subnets(path, subnets):
+    with open(path, "w") as f:
+        json.dump(subnets, f, indent=4)
+
+
+def print_summary(args, result):
+    cover = result["cover"]
+    print("Selected IPs:", result["selected_ips"])
+    print("Generated subnets:", len(result["subnets"]))
+    print("Source:", args.source)
+    print("Policy mode:", "yes" if getattr(args, "policy_mode", False) else "no")
+    print("Cover mode:", "yes" if args.cover_mode else "no")
+    if args.cover_mode:
+        print("Covered addresses:", cover["blocked_addresses"])
+        print("Uncoverable target IPs:", len(cover["uncoverable_ips"]))
+    elif not getattr(args, "policy_mode", False):
+        print("Target prefix:", args.target_prefix)
+    print("Output:", args.output)
+    if args.source == "geo":
+        print("Report:", args.report_output)
+        print("Blocked candidate IPs:", args.blocked_ips_output)
+        print("Allowed non-target IPs:", args.allowed_ips_output)
+        print_country_report(result["report"])
+
+
+def main(argv=None):
     if _ip is None:
         print("ERROR: Missing ipaddress module. Install one of: pip install ipaddress or pip install ipaddr", file=sys.stderr)
         return 1
 
-    args = build_parser().parse_args()
-    if args.target_prefix < 1 or args.target_prefix > 32:
-        print("ERROR: --target-prefix must be between 1 and 32", file=sys.stderr)
-        return 1
-    if args.min_hits < 1:
-        print("ERROR: --min-hits must be at least 1", file=sys.stderr)
+    args = build_parser().parse_args(argv)
+    error = validate_args(args)
+    if error:
+        print("ERROR: %s" % error, file=sys.stderr)
         return 1
 
     if args.source == "geo":
         with open(args.input, "r") as f:
             geo_data = json.load(f)
-        country_codes = parse_country_codes(args.country_codes)
         source_ips = None
         if args.filter_ips_file:
             with open(args.filter_ips_file, "r") as f:
                 source_ips = parse_ips_from_text(f.read())
-        if args.policy_mode:
-            country_policy = load_country_policy(args.country_policy_file, country_codes)
-            selected_ips, subnets = build_subnets_from_geo_policy(
-                geo_data,
-                country_codes,
-                country_policy,
-                source_ips=source_ips,
-                provider_policy_file=args.provider_policy_file,
-                snapshot_min_hits=args.policy_snapshot_min_hits,
-            )
-        else:
-            selected_ips, subnets = build_subnets_from_geo(
-                geo_data,
-                country_codes,
-                args.target_prefix,
-                args.min_hits,
-                source_ips=source_ips,
-            )
-        report = build_country_report(geo_data, country_codes, source_ips=source_ips)
-        with open(args.report_output, "w") as f:
-            json.dump(report, f, indent=4, sort_keys=True)
-        write_ip_detail_file(args.blocked_ips_output, report["blocked_ips"])
-        write_ip_detail_file(args.allowed_ips_output, report["allowed_ips"])
+        try:
+            result = aggregate_geo(args, geo_data, source_ips=source_ips)
+        except ValueError as exc:
+            print("ERROR: %s" % exc, file=sys.stderr)
+            return 1
     else:
+        weights = read_ip_counts(args.counts_file) if args.counts_file else None
         with open(args.input, "r") as f:
             selected_ips, subnets = build_subnets_from_ips(
                 parse_ips_from_text(f.read()),
                 args.target_prefix,
                 args.min_hits,
+                load_recurring(args),
+                weights,
             )
+        result = {"selected_ips": selected_ips, "subnets": subnets, "cover": None, "report": None}
 
-    with open(args.output, "w") as f:
-        json.dump(subnets, f, indent=4)
-
-    print("Selected IPs:", selected_ips)
-    print("Generated subnets:", len(subnets))
-    print("Source:", args.source)
-    print("Policy mode:", "yes" if getattr(args, "policy_mode", False) else "no")
-    if not getattr(args, "policy_mode", False):
-        print("Target prefix:", args.target_prefix)
-    print("Output:", args.output)
-    if args.source == "geo":
-        print("Report:", args.report_output)
-        print("Blocked candidate IPs:", args.blocked_ips_output)
-        print("Allowed non-target IPs:", args.allowed_ips_output)
-        print_country_report(report)
+    write_subnets(args.output, result["subnets"])
+    print_summary(args, result)
     return 0
 
 
@@ -3,12 +3,13 @@ from __future__ import print_function
 
 import argparse
 import collections
-import gzip
 import json
 import os
 import re
 import sys
 
+import log_scan
+
 try:
     text_type = unicode  # Py2
 except NameError:
@@ -21,7 +22,6 @@ except NameError:
 
 
 IPV4_RE = re.compile(r"^(?:\d{1,3}\.){3}\d{1,3}$")
-REQUEST_RE = re.compile(r'"(?P<method>[A-Z]+)\s+(?P<url>\S+)(?:\s+[^"]*)?"\s+(?P<status>\d{3}|-)')
 DEFAULT_EXTENSIONS = (".log", ".log.1", ".txt", ".gz")
 
 
@@ -81,14 +81,6 @@ def blocked_size(prefix):
     return 2 ** (32 - prefix)
 
 
-def infer_site_from_path(path):
-    name = os.path.basename(path)
-    for suffix in (".gz", ".log", ".log.1", ".txt"):
-        if name.endswith(suffix):
-            name = name[:-len(suffix)]
-    return name or "unknown"
-
-
 def iter_log_paths(log_dir, include_gz=True):
     paths = []
     for root, _dirs, files in os.walk(log_dir):
@@ -101,45 +93,25 @@ def iter_log_paths(log_dir, include_gz=True):
     return sorted(paths)
 
 
-def open_log(path):
-    if path.endswith(".gz"):
-        return gzip.open(path, "rb")
-    return open(path, "rb")
+AUTO_PATTERN = log_scan.compile_log_format("auto")
 
 
-def parse_log_line(line, fallback_site):
-    line = to_text(line).rstrip("\n")
-    if " [" not in line:
+def entry_fields(entry):
+    if not entry or not is_ipv4(entry["ip"]):
         return None
-
-    left = line.split(" [", 1)[0]
-    tokens = left.split()
-    if not tokens:
-        return None
-
-    site = fallback_site
-    ip = None
-    if is_ipv4(tokens[0]):
-        ip = tokens[0]
-    elif len(tokens) > 1 and is_ipv4(tokens[1]):
-        site = tokens[0]
-        ip = tokens[1]
-    else:
-        return None
-
-    match = REQUEST_RE.search(line)
-    method = match.group("method") if match else "-"
-    url = match.group("url") if match else "-"
-    status = match.group("status") if match else "-"
     return {
-        "ip": ip,
-        "site": site,
-        "method": method,
-        "url": url.split("?", 1)[0].split("#", 1)[0],
-        "status": status,
+        "ip": entry["ip"],
+        "site": entry["site"],
+        "method": entry.get("method") or "-",
+        "url": log_scan.normalize_url(entry.get("url") or "-"),
+        "status": entry.get("status") or "-",
     }
 
 
+def parse_log_line(line, fallback_site):
+    return entry_fields(log_scan.match_entry(to_text(line).rstrip("\n"), AUTO_PATTERN, fallback_site))
+
+
 def load_geo_data(path):
     if not path or not os.path.exists(path):
         return {}
@@ -159,72 +131,85 @@ def add_top(counter, key, limit=8):
             del counter[old_key]
 
 
-def analyze_logs(paths, geo_data, target_countries, subnet_prefixes):
-    totals = {
-        "files": len(paths),
-        "lines": 0,
-        "matched": 0,
-        "unique_ips": set(),
-    }
-    ips = {}
-    subnets = {}
-
-    for path in paths:
-        site_from_file = infer_site_from_path(path)
-        with open_log(path) as handle:
-            for line in handle:
-                totals["lines"] += 1
-                parsed = parse_log_line(line, site_from_file)
-                if not parsed:
-                    continue
-                totals["matched"] += 1
-                ip = parsed["ip"]
-                totals["unique_ips"].add(ip)
-                country = country_for_ip(geo_data, ip)
-                is_target = country in target_countries
-
-                if ip not in ips:
-                    ips[ip] = {
-                        "ip": ip,
-                        "country": country,
-                        "target_country": is_target,
-                        "requests": 0,
-                        "sites": collections.Counter(),
-                        "urls": collections.Counter(),
-                        "statuses": collections.Counter(),
-                    }
-                ips[ip]["requests"] += 1
-                add_top(ips[ip]["sites"], parsed["site"])
-                add_top(ips[ip]["urls"], parsed["url"])
-                add_top(ips[ip]["statuses"], parsed["status"])
-
-                for prefix in subnet_prefixes:
-                    key = network_for_ip(ip, prefix)
-                    if key not in subnets:
-                        subnets[key] = {
-                            "cidr": key,
-                            "prefix": prefix,
-                            "would_block_ips": blocked_size(prefix),
-                            "requests": 0,
-                            "unique_ips": set(),
-                            "target_unique_ips": set(),
-                            "non_target_unique_ips": set(),
-                            "countries": collections.Counter(),
-                            "sites": collections.Counter(),
-                            "top_ips": collections.Counter(),
-                        }
-                    item = subnets[key]
-                    item["requests"] += 1
-                    item["unique_ips"].add(ip)
-                    if is_target:
-                        item["target_unique_ips"].add(ip)
-                    else:
-                        item["non_target_unique_ips"].add(ip)
-                    add_top(item["countries"], country)
-                    add_top(item["sites"], parsed["site"])
-                    add_top(item["top_ips"], ip)
-
-    return totals, ips, subnets
+class SubnetStats(object):
+    # Per-IP and per-subnet counts of the report; an aggregator for
+    # log_scan.scan_logs.
+    def __init__(self, geo_data, target_countries, subnet_prefixes):
+        self.geo_data = geo_data
+        self.target_countries = target_countries
+        self.subnet_prefixes = subnet_prefixes
+        self.totals = {
+            "files": 0,
+            "lines": 0,
+            "matched": 0,
+            "unique_ips": set(),
+        }
+        self.ips = {}
+        self.subnets = {}
+
+    def add(self, entry):
+        parsed = entry_fields(entry)
+        if not parsed:
+            return
+        totals = self.totals
+        ips = self.ips
+        subnets = self.subnets
+        totals["matched"] += 1
+        ip = parsed["ip"]
+        totals["unique_ips"].add(ip)
+        country = country_for_ip(self.geo_data, ip)
+        is_target = country in self.target_countries
+
+        if ip not in ips:
+            ips[ip] = {
+                "ip": ip,
+                "country": country,
+                "target_country": is_target,
+                "requests": 0,
+                "sites": collections.Counter(),
+                "urls": collections.Counter(),
+                "statuses": collections.Counter(),
+            }
+        ips[ip]["requests"] += 1
+        add_top(ips[ip]["sites"], parsed["site"])
+        add_top(ips[ip]["urls"], parsed["url"])
+        add_top(ips[ip]["statuses"], parsed["status"])
+
+        for prefix in self.subnet_prefixes:
+            key = network_for_ip(ip, prefix)
+            if key not in subnets:
+                subnets[key] = {
+                    "cidr": key,
+                    "prefix": prefix,
+                    "would_block_ips": blocked_size(prefix),
+                    "requests": 0,
+                    "unique_ips": set(),
+                    "target_unique_ips": set(),
+                    "non_target_unique_ips": set(),
+                    "countries": collections.Counter(),
+                    "sites": collections.Counter(),
+                    "top_ips": collections.Counter(),
+                }
+            item = subnets[key]
+            item["requests"] += 1
+            item["unique_ips"].add(ip)
+            if is_target:
+                item["target_unique_ips"].add(ip)
+            else:
+                item["non_target_unique_ips"].add(ip)
+            add_top(item["countries"], country)
+            add_top(item["sites"], parsed["site"])
+            add_top(item["top_ips"], ip)
+
+    def finish(self, scan_stats):
+        self.totals["files"] = scan_stats["files"]
+        self.totals["lines"] = scan_stats["lines"]
+        return self.totals, self.ips, self.subnets
+
+
+def analyze_logs(paths, geo_data, target_countries, subnet_prefixes, log_format="auto"):
+    stats = SubnetStats(geo_data, target_countries, subnet_prefixes)
+    return stats.finish(log_scan.scan_logs(paths, [stats], log_format))
 
 
 def counter_to_list(counter, limit=10):
@@ -389,6 +374,7 @@ def build_parser():
     parser.add_argument("--missing-geo-output", default="apache_missing_geo_ips.txt")
     parser.add_argument("--max-report-rows", type=int, default=200)
     parser.add_argument("--no-gz", action="store_true", help="Skip .gz rotated logs.")
+    parser.add_argument("--log-format", default="auto", help="auto, common, combined, vhost_combined or an Apache LogFormat string.")
     return parser
 
 
@@ -411,7 +397,7 @@ def main():
     paths = iter_log_paths(args.log_dir, include_gz=not args.no_gz)
     geo_data = load_geo_data(args.geo_data)
     target_countries = parse_country_codes(args.country_codes)
-    totals, ips, subnets = analyze_logs(paths, geo_data, target_countries, prefixes)
+    totals, ips, subnets = analyze_logs(paths, geo_data, target_countries, prefixes, args.log_format)
     report = build_report(totals, ips, subnets, target_countries, args.min_requests, args.min_unique_ips)
 
     write_json(args.json_output, report)
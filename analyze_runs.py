@@ -2,14 +2,26 @@
 from __future__ import print_function
 
 import argparse
+import base64
 import collections
 import json
+import math
 import os
 import re
 import sys
+from array import array
+
+import run_snapshots
+from ipv4_index import count_common, count_union, ints_from_ips, sorted_unique_ints
+from prefix_histogram import UINT32_TYPECODE
 
 
 IP_RE = re.compile(r"\b(?:\d{1,3}\.){3}\d{1,3}\b")
+STAGE_SUM_FIELDS = ["wall_seconds", "cpu_seconds", "bytes_read", "bytes_written"]
+DIGEST_VERSION = 1
+DIGEST_DIR_NAME = ".digests"
+# Sorted uint32 arrays of IPv4 addresses per run, instead of sets of strings.
+IP_ARRAY_FIELDS = ["ip_ints", "blocked_ip_ints", "allowed_ip_ints"]
 
 
 def read_lines(path):
@@ -47,21 +59,195 @@ def parse_country_rows(report):
     return countries
 
 
-def extract_ips_from_file(path):
-    if not os.path.exists(path):
-        return set()
-    with open(path, "r") as f:
-        return set(IP_RE.findall(f.read()))
+def load_stage_timings(path):
+    # A stage can appear more than once per run (the shell script runs the
+    # two recommenders separately); times and bytes are summed, RSS is the
+    # maximum.
+    data = load_json(path, {})
+    stages = {}
+    for record in data.get("stages", []) if isinstance(data, dict) else []:
+        name = record.get("stage")
+        if not name:
+            continue
+        row = stages.setdefault(name, {
+            "wall_seconds": 0.0,
+            "cpu_seconds": 0.0,
+            "bytes_read": 0,
+            "bytes_written": 0,
+            "peak_rss_kb": 0,
+            "parent": record.get("parent", ""),
+            "status": "ok",
+        })
+        for field in STAGE_SUM_FIELDS:
+            row[field] += record.get(field) or 0
+        row["peak_rss_kb"] = max(row["peak_rss_kb"], int(record.get("peak_rss_kb") or 0))
+        if record.get("status", "ok") != "ok":
+            row["status"] = record["status"]
+    return stages
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    values = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def stage_percentiles(runs):
+    by_stage = collections.defaultdict(list)
+    for run in runs:
+        for name, row in run["stage_timings"].items():
+            by_stage[name].append(row)
+    result = {}
+    for name, rows in by_stage.items():
+        walls = [row["wall_seconds"] for row in rows]
+        cpus = [row["cpu_seconds"] for row in rows]
+        rss = [row["peak_rss_kb"] for row in rows]
+        result[name] = {
+            "runs": len(rows),
+            "wall_p50": percentile(walls, 50),
+            "wall_p95": percentile(walls, 95),
+            "cpu_p50": percentile(cpus, 50),
+            "cpu_p95": percentile(cpus, 95),
+            "peak_rss_kb_p95": percentile(rss, 95),
+        }
+    return result
+
+
+def find_stage_regressions(runs, factor=1.5, min_seconds=1.0, min_history=3):
+    # Compare the latest run with the median of the earlier runs per stage.
+    if len(runs) < 2:
+        return []
+    latest = runs[-1]
+    history = stage_percentiles(runs[:-1])
+    regressions = []
+    for name, row in sorted(latest["stage_timings"].items()):
+        baseline = history.get(name)
+        if not baseline or baseline["runs"] < min_history:
+            continue
+        wall = row["wall_seconds"]
+        if wall > baseline["wall_p50"] * factor and wall - baseline["wall_p50"] >= min_seconds:
+            regressions.append({
+                "run": latest["run"],
+                "stage": name,
+                "wall_seconds": wall,
+                "baseline_p50": baseline["wall_p50"],
+                "baseline_p95": baseline["wall_p95"],
+                "ratio": round(wall / baseline["wall_p50"], 2) if baseline["wall_p50"] else None,
+            })
+    return regressions
+
+
+def ip_array(ips):
+    return array(UINT32_TYPECODE, sorted_unique_ints(ints_from_ips(ips)))
+
+
+def array_to_text(values):
+    data = values.tobytes() if hasattr(values, "tobytes") else values.tostring()
+    return base64.b64encode(data).decode("ascii")
+
+
+def array_from_text(text, byteorder):
+    values = array(UINT32_TYPECODE)
+    data = base64.b64decode(text)
+    if hasattr(values, "frombytes"):
+        values.frombytes(data)
+    else:
+        values.fromstring(data)
+    if byteorder != sys.byteorder:
+        values.byteswap()
+    return values
+
+
+def run_mtime(path):
+    # summary.txt is rewritten in place at the end of a run, which does not
+    # touch the directory mtime, so the newest entry counts as well.
+    newest = os.stat(path).st_mtime
+    for name in os.listdir(path):
+        newest = max(newest, os.stat(os.path.join(path, name)).st_mtime)
+    return newest
+
+
+def digest_path(cache_dir, path):
+    return os.path.join(cache_dir, os.path.basename(path.rstrip(os.sep)) + ".json")
+
+
+def load_digest(cache_dir, path, mtime):
+    digest_file = digest_path(cache_dir, path)
+    if not os.path.exists(digest_file):
+        return None
+    try:
+        with open(digest_file, "r") as f:
+            data = json.load(f)
+    except ValueError:
+        return None
+    if data.get("version") != DIGEST_VERSION or data.get("mtime") != mtime:
+        return None
+    run = data["run"]
+    for field in IP_ARRAY_FIELDS:
+        run[field] = array_from_text(run[field], data["byteorder"])
+    run["path"] = path
+    return run
+
+
+def save_digest(cache_dir, path, mtime, run):
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    data = dict(run)
+    for field in IP_ARRAY_FIELDS:
+        data[field] = array_to_text(run[field])
+    digest_file = digest_path(cache_dir, path)
+    tmp_path = "%s.tmp-%s" % (digest_file, os.getpid())
+    with open(tmp_path, "w") as f:
+        json.dump({"version": DIGEST_VERSION, "mtime": mtime, "byteorder": sys.byteorder, "run": data}, f)
+    os.rename(tmp_path, digest_file)
+
+
+def load_runs(paths, cache_dir=None):
+    # Returns (runs, number of runs analyzed from their files). Runs whose
+    # files have not changed since the last analysis come from their digest
+    # in cache_dir; digests of runs that no longer exist are removed.
+    runs = []
+    analyzed = 0
+    for path in paths:
+        run = None
+        if cache_dir:
+            mtime = run_mtime(path)
+            run = load_digest(cache_dir, path, mtime)
+        if run is None:
+            run = analyze_run(path)
+            analyzed += 1
+            if cache_dir:
+                save_digest(cache_dir, path, mtime, run)
+        runs.append(run)
+    if cache_dir and os.path.isdir(cache_dir):
+        keep = set(os.path.basename(digest_path(cache_dir, path)) for path in paths)
+        for name in os.listdir(cache_dir):
+            if name.endswith(".json") and name not in keep:
+                os.remove(os.path.join(cache_dir, name))
+    return runs, analyzed
 
 
 def analyze_run(path):
+    # Snapshots live in the run's manifest (run_snapshots.py); runs written
+    # before that, and summary.txt/timings.json, are plain files.
+    manifest = run_snapshots.load_manifest(path)
+
+    def run_text(name):
+        return run_snapshots.read_run_text(path, name, manifest) or ""
+
+    def run_json(name, default):
+        text = run_text(name)
+        return json.loads(text) if text else default
+
     summary = load_summary(os.path.join(path, "summary.txt"))
-    country_report = load_json(os.path.join(path, "generiek_country_report.json"), {})
-    output_ips = set(read_lines(os.path.join(path, "output_ips.txt")))
-    blocked_candidate_ips = extract_ips_from_file(os.path.join(path, "generiek_blocked_candidate_ips.txt"))
-    allowed_ips = extract_ips_from_file(os.path.join(path, "generiek_allowed_non_target_ips.txt"))
-    candidates = load_json(os.path.join(path, "aggregated_generiek_subnets.json"), [])
-    bad_rules = load_json(os.path.join(path, "bad_ufw_rules.json"), {"count": 0, "rules": []})
+    country_report = run_json("generiek_country_report.json", {})
+    output_ips = ip_array(run_text("output_ips.txt").split())
+    blocked_candidate_ips = ip_array(IP_RE.findall(run_text("generiek_blocked_candidate_ips.txt")))
+    allowed_ips = ip_array(IP_RE.findall(run_text("generiek_allowed_non_target_ips.txt")))
+    candidates = run_json("aggregated_generiek_subnets.json", [])
+    bad_rules = run_json("bad_ufw_rules.json", {"count": 0, "rules": []})
 
     return {
         "run": os.path.basename(path.rstrip(os.sep)),
@@ -77,9 +263,10 @@ def analyze_run(path):
         "candidate_subnets": len(candidates) if isinstance(candidates, list) else len(candidates.keys()),
         "bad_ufw_rules": int(bad_rules.get("count", 0)),
         "countries": parse_country_rows(country_report),
-        "ip_set": output_ips,
-        "blocked_ip_set": blocked_candidate_ips,
-        "allowed_ip_set": allowed_ips,
+        "ip_ints": output_ips,
+        "blocked_ip_ints": blocked_candidate_ips,
+        "allowed_ip_ints": allowed_ips,
+        "stage_timings": load_stage_timings(os.path.join(path, "timings.json")),
     }
 
 
@@ -89,7 +276,8 @@ def iter_runs(runs_dir):
     paths = []
     for name in os.listdir(runs_dir):
         path = os.path.join(runs_dir, name)
-        if os.path.isdir(path):
+        # Skip the shared runs/.objects snapshot store.
+        if not name.startswith(".") and os.path.isdir(path):
             paths.append(path)
     return sorted(paths)
 
@@ -102,15 +290,46 @@ def country_counter(runs, field):
     return counts
 
 
-def write_text(path, runs, max_countries):
+def write_stage_timings(f, runs, regressions):
+    percentiles = stage_percentiles(runs)
+    if not percentiles:
+        return
+    f.write("\nStage timings (seconds, across runs with timings.json)\n")
+    f.write("------------------------------------------------------\n")
+    f.write("stage | runs | wall p50 | wall p95 | cpu p50 | cpu p95 | peak RSS p95 KB\n")
+    for name, row in sorted(percentiles.items(), key=lambda item: -item[1]["wall_p95"]):
+        f.write("%s | %d | %.3f | %.3f | %.3f | %.3f | %d\n" % (
+            name,
+            row["runs"],
+            row["wall_p50"],
+            row["wall_p95"],
+            row["cpu_p50"],
+            row["cpu_p95"],
+            row["peak_rss_kb_p95"],
+        ))
+    f.write("\nStage regressions in latest run\n")
+    f.write("-------------------------------\n")
+    if not regressions:
+        f.write("none\n")
+    for row in regressions:
+        f.write("REGRESSION %s %s: %.3fs vs p50 %.3fs (p95 %.3fs)\n" % (
+            row["run"],
+            row["stage"],
+            row["wall_seconds"],
+            row["baseline_p50"],
+            row["baseline_p95"],
+        ))
+
+
+def write_text(path, runs, max_countries, regressions=None):
     with open(path, "w") as f:
         f.write("Run analysis\n")
         f.write("============\n\n")
         f.write("Run | date | apply | check_existing | input IPs | blocked candidate IPs | allowed IPs | candidate subnets | bad UFW rules\n")
         previous = None
         for run in runs:
-            new_ips = len(run["ip_set"] - previous["ip_set"]) if previous else 0
-            repeated_ips = len(run["ip_set"] & previous["ip_set"]) if previous else 0
+            repeated_ips = count_common(run["ip_ints"], previous["ip_ints"]) if previous else 0
+            new_ips = len(run["ip_ints"]) - repeated_ips if previous else 0
             f.write("%s | %s | %s | %s | %d | %d | %d | %d | %d\n" % (
                 run["run"],
                 run["date"],
@@ -142,26 +361,34 @@ def write_text(path, runs, max_countries):
             f.write("\nFirst vs last\n")
             f.write("-------------\n")
             f.write("first=%s last=%s\n" % (first["run"], last["run"]))
-            f.write("last_new_vs_first=%d\n" % len(last["ip_set"] - first["ip_set"]))
-            f.write("last_repeated_vs_first=%d\n" % len(last["ip_set"] & first["ip_set"]))
-            f.write("last_still_allowed_vs_first=%d\n" % len(last["allowed_ip_set"] & first["allowed_ip_set"]))
-            f.write("last_still_block_candidate_vs_first=%d\n" % len(last["blocked_ip_set"] & first["blocked_ip_set"]))
+            repeated_ips = count_common(last["ip_ints"], first["ip_ints"])
+            f.write("last_new_vs_first=%d\n" % (len(last["ip_ints"]) - repeated_ips))
+            f.write("last_repeated_vs_first=%d\n" % repeated_ips)
+            f.write("last_still_allowed_vs_first=%d\n" % count_common(last["allowed_ip_ints"], first["allowed_ip_ints"]))
+            f.write("last_still_block_candidate_vs_first=%d\n" % count_common(last["blocked_ip_ints"], first["blocked_ip_ints"]))
+
+        write_stage_timings(f, runs, regressions or [])
 
 
 def json_safe_run(run):
     data = dict(run)
-    data.pop("ip_set", None)
-    data.pop("blocked_ip_set", None)
-    data.pop("allowed_ip_set", None)
+    for field in IP_ARRAY_FIELDS:
+        data.pop(field, None)
     return data
 
 
-def write_json(path, runs):
+def unique_ips_seen(runs):
+    return count_union([run["ip_ints"] for run in runs])
+
+
+def write_json(path, runs, regressions=None, unique_ips=None):
     payload = {
+        "stage_timings": stage_percentiles(runs),
+        "stage_regressions": regressions or [],
         "runs": [json_safe_run(run) for run in runs],
         "totals": {
             "runs": len(runs),
-            "unique_ips_seen": len(set().union(*[run["ip_set"] for run in runs])) if runs else 0,
+            "unique_ips_seen": unique_ips_seen(runs) if unique_ips is None else unique_ips,
             "blocked_candidate_ip_observations": sum(run["blocked_candidate_ips"] for run in runs),
             "allowed_ip_observations": sum(run["allowed_ips"] for run in runs),
         },
@@ -176,22 +403,31 @@ def build_parser():
     parser.add_argument("--text-output", default="runs_analysis.txt")
     parser.add_argument("--json-output", default="runs_analysis.json")
     parser.add_argument("--max-countries", type=int, default=40)
+    parser.add_argument("--cache-dir", default="", help="Per-run digest cache; default RUNS_DIR/.digests")
+    parser.add_argument("--no-cache", action="store_true", help="Analyze every run from its files and leave the digest cache alone")
+    parser.add_argument("--regression-factor", type=float, default=1.5, help="Flag a stage when the latest run is this many times slower than its earlier p50")
+    parser.add_argument("--regression-min-seconds", type=float, default=1.0, help="Ignore stage slowdowns smaller than this many seconds")
     return parser
 
 
-def main():
-    args = build_parser().parse_args()
+def main(argv=None):
+    args = build_parser().parse_args(argv)
     paths = iter_runs(args.runs_dir)
     if not paths:
         print("ERROR: no run directories found in %s" % args.runs_dir, file=sys.stderr)
         return 1
 
-    runs = [analyze_run(path) for path in paths]
-    write_text(args.text_output, runs, args.max_countries)
-    write_json(args.json_output, runs)
-
-    print("Runs:", len(runs))
-    print("Unique IPs seen:", len(set().union(*[run["ip_set"] for run in runs])) if runs else 0)
+    cache_dir = None if args.no_cache else (args.cache_dir or os.path.join(args.runs_dir, DIGEST_DIR_NAME))
+    runs, analyzed = load_runs(paths, cache_dir)
+    regressions = find_stage_regressions(runs, args.regression_factor, args.regression_min_seconds)
+    write_text(args.text_output, runs, args.max_countries, regressions)
+    unique_ips = unique_ips_seen(runs)
+    write_json(args.json_output, runs, regressions, unique_ips)
+
+    print("Runs: %d (%d analyzed, %d from digest cache)" % (len(runs), analyzed, len(runs) - analyzed))
+    print("Unique IPs seen:", unique_ips)
+    for row in regressions:
+        print("Stage regression: %s %.3fs vs p50 %.3fs" % (row["stage"], row["wall_seconds"], row["baseline_p50"]))
     print("Wrote:", args.text_output)
     print("Wrote:", args.json_output)
     return 0
@@ -5,13 +5,11 @@ import argparse
 import collections
 import json
 import os
-import re
 import sys
 
+import log_scan
 from local_ip_country import load_ranges, lookup_ip, row_to_geo_details, to_text
-
-
-REQUEST_RE = re.compile(r"\s((?:\d{1,3}\.){3}\d{1,3})\s+(\S+:\d+)\s+([A-Z]+)\s+(\S+)")
+from server_status import parse_server_status, split_request
 
 
 def read_text(path):
@@ -31,11 +29,11 @@ def load_json(path):
 
 def parse_rows(text, min_categories):
     rows = []
-    for line in text.splitlines():
-        match = REQUEST_RE.search(line)
-        if not match:
+    for worker in parse_server_status(text)["workers"]:
+        method, url = split_request(worker.request)
+        if not worker.client or not worker.vhost or not url:
             continue
-        ip, vhost, method, url = match.groups()
+        ip, vhost = worker.client, worker.vhost
         category_count = url.count("categories=")
         if category_count < min_categories:
             continue
@@ -49,6 +47,28 @@ def parse_rows(text, min_categories):
     return rows
 
 
+class CategoryRows(object):
+    # parse_rows for access log lines; an aggregator for log_scan.scan_logs.
+    def __init__(self, min_categories):
+        self.min_categories = min_categories
+        self.rows = []
+
+    def add(self, entry):
+        url = entry.get("url")
+        if not url:
+            return
+        category_count = url.count("categories=")
+        if category_count < self.min_categories:
+            return
+        self.rows.append({
+            "ip": entry["ip"],
+            "vhost": entry["site"],
+            "method": entry["method"],
+            "url": url,
+            "category_count": category_count,
+        })
+
+
 def geo_for_ip(ip, geo_data, range_index):
     details = geo_data.get(ip)
     if details:
@@ -107,6 +127,8 @@ def print_counter(title, counter, examples, limit):
 def main():
     parser = argparse.ArgumentParser(description="Analyze Apache server-status requests with repeated categories= parameters.")
     parser.add_argument("--input", default="input.txt")
+    parser.add_argument("--access-log", action="append", default=[], help="Read requests from Apache access logs instead of --input (repeatable).")
+    parser.add_argument("--log-format", default="auto", help="auto, common, combined, vhost_combined or an Apache LogFormat string.")
     parser.add_argument("--geo-data", default="geo_data.json")
     parser.add_argument("--ranges", default=os.path.join("data", "fast_geo_ranges.tsv"))
     parser.add_argument("--min-categories", type=int, default=3)
@@ -116,15 +138,19 @@ def main():
     if args.min_categories < 1:
         print("ERROR: --min-categories must be at least 1", file=sys.stderr)
         return 1
-    text = read_text(args.input)
-    rows = parse_rows(text, args.min_categories)
+    if args.access_log:
+        categories = CategoryRows(args.min_categories)
+        log_scan.scan_logs(args.access_log, [categories], args.log_format)
+        rows = categories.rows
+    else:
+        rows = parse_rows(read_text(args.input), args.min_categories)
     geo_data = load_json(args.geo_data)
     range_index = None
     if args.ranges and os.path.exists(args.ranges):
         range_index = load_ranges(args.ranges)
 
     stats = summarize(rows, geo_data, range_index)
-    print("Input:", args.input)
+    print("Input:", ", ".join(args.access_log) or args.input)
     print("Min categories:", args.min_categories)
     print("Matching request rows:", stats["rows"])
     print("Unique IPs:", stats["unique_ips"])
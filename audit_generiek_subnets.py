@@ -7,6 +7,8 @@ import json
 import os
 import sys
 
+from ipv4_index import interval_join, sorted_ipv4_items
+
 try:
     text_type = unicode  # Py2
 except NameError:
@@ -29,9 +31,6 @@ def to_text(value):
 try:
     import ipaddress as _ip
 
-    def ip_address(value):
-        return _ip.ip_address(to_text(value))
-
     def ip_network(value, strict=False):
         return _ip.ip_network(to_text(value), strict=strict)
 
@@ -41,11 +40,6 @@ except ImportError:
     except ImportError:
         _ip = None
 
-    def ip_address(value):
-        if _ip is None:
-            raise ImportError("Missing ipaddress/ipaddr module")
-        return _ip.IPAddress(to_text(value))
-
     def ip_network(value, strict=False):
         if _ip is None:
             raise ImportError("Missing ipaddress/ipaddr module")
@@ -117,34 +111,28 @@ def load_geo_counts(path, candidates):
     if not path or not os.path.exists(path):
         return {}, {}
 
-    prefix_lengths = sorted(set(net_prefixlen(net) for net in candidates if net_version(net) == 4))
-    candidate_keys = set(str(net) for net in candidates)
-    counts = {}
-    examples = {}
-
     with open(path, "r") as f:
         geo_data = json.load(f)
 
-    for ip, details in geo_data.items():
-        try:
-            addr = ip_address(ip)
-        except ValueError:
-            continue
-        if getattr(addr, "version", 4) != 4:
+    source_ints, sources = sorted_ipv4_items(
+        (ip, (ip, details.get("country", "?"), details.get("org", "?"))) for ip, details in geo_data.items()
+    )
+    counts = {}
+    examples = {}
+    for net, start, end in join_candidates(candidates, source_ints):
+        if start == end:
             continue
+        key = str(net)
+        counts[key] = end - start
+        examples[key] = ["%s %s %s" % source for source in sources[start:min(end, start + 3)]]
+    return counts, examples
 
-        for prefix in prefix_lengths:
-            net = ip_network("%s/%d" % (ip, prefix), strict=False)
-            key = str(net)
-            if key not in candidate_keys:
-                continue
-            counts[key] = counts.get(key, 0) + 1
-            if key not in examples:
-                examples[key] = []
-            if len(examples[key]) < 3:
-                examples[key].append("%s %s %s" % (ip, details.get("country", "?"), details.get("org", "?")))
 
-    return counts, examples
+def join_candidates(candidates, source_ints):
+    # One sort-merge pass of all IPv4 candidates against the sorted geo IPs.
+    candidates = [net for net in candidates if net_version(net) == 4]
+    intervals = [(net_first_int(net), net_last_int(net)) for net in candidates]
+    return [(net, start, end) for net, (start, end) in zip(candidates, interval_join(source_ints, intervals))]
 
 
 def parse_country_codes(value):
@@ -155,40 +143,20 @@ def load_country_mismatches(path, candidates, country_codes):
     if not path or not os.path.exists(path) or not country_codes:
         return []
 
-    prefix_lengths = sorted(set(net_prefixlen(net) for net in candidates if net_version(net) == 4))
-    candidate_keys = set(str(net) for net in candidates)
-    mismatches = {}
-
     with open(path, "r") as f:
         geo_data = json.load(f)
 
+    non_target = []
     for ip, details in geo_data.items():
-        try:
-            addr = ip_address(ip)
-        except ValueError:
-            continue
-        if getattr(addr, "version", 4) != 4:
-            continue
-
         country = to_text(details.get("country", "?")).upper()
-        if country in country_codes:
-            continue
-
-        for prefix in prefix_lengths:
-            net = ip_network("%s/%d" % (ip, prefix), strict=False)
-            key = str(net)
-            if key not in candidate_keys:
-                continue
-            if key not in mismatches:
-                mismatches[key] = []
-            if len(mismatches[key]) < 3:
-                mismatches[key].append("%s %s %s" % (ip, country, details.get("org", "?")))
+        if country not in country_codes:
+            non_target.append((ip, (ip, country, details.get("org", "?"))))
+    source_ints, sources = sorted_ipv4_items(non_target)
 
     result = []
-    for net in candidates:
-        key = str(net)
-        if key in mismatches:
-            result.append((net, mismatches[key]))
+    for net, start, end in join_candidates(candidates, source_ints):
+        if start != end:
+            result.append((net, ["%s %s %s" % source for source in sources[start:min(end, start + 3)]]))
     return result
 
 
@@ -216,12 +184,12 @@ def build_parser():
     return parser
 
 
-def main():
+def main(argv=None):
     if _ip is None:
         print("ERROR: Missing ipaddress module. Install one of: pip install ipaddress or pip install ipaddr", file=sys.stderr)
         return 1
 
-    args = build_parser().parse_args()
+    args = build_parser().parse_args(argv)
     candidates, invalid = load_network_list(args.input)
     prefix_counts = collections.Counter(net_prefixlen(net) for net in candidates)
 
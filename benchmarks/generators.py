@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+import os
+import random
+import sys
+import zlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from fast_apply_ufw_user_rules import generate_ufw_deny_block
+from ipv4_index import bounds_to_cidr, ipv4_int_to_text
+from local_ip_country import range_row_to_tsv
+
+
+# Rough shape of real incident traffic: most hits from a few countries,
+# a long tail from the rest.
+COUNTRY_WEIGHTS = [
+    ("CN", 30),
+    ("IN", 12),
+    ("BR", 10),
+    ("RU", 8),
+    ("VN", 8),
+    ("US", 8),
+    ("ID", 5),
+    ("DE", 4),
+    ("NL", 4),
+    ("BE", 3),
+    ("FR", 3),
+    ("KZ", 2),
+    ("GB", 2),
+    ("SG", 1),
+]
+VHOSTS = [
+    "www.nieuwejobs.com",
+    "nl.careersinfinances.com",
+    "www.careersinfinances.com",
+    "www.jobat-example.be",
+]
+URL_PATHS = [
+    "/job/viewjob/%d/bike-courier.html",
+    "/job/viewjob/%d/projectleider-studiebureau.html?categorie=%d",
+    "/search?q=%d",
+    "/company/%d",
+    "/static/css/site.css?v=%d",
+]
+STATUSES = ["200"] * 16 + ["301", "302", "304", "404", "403", "500"]
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 Mobile/15E148",
+    "Mozilla/5.0 (compatible; bingbot/2.0; +http://www.bing.com/bingbot.htm)",
+    "python-requests/2.31.0",
+]
+SCOREBOARD_MODES = "RRRRRRWWWWKC_"
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+FIRST_PUBLIC_IP = 1 << 24
+LAST_PUBLIC_IP = (224 << 24) - 1
+
+
+def make_rng(seed, name):
+    # One independent stream per data set, so adding a generator or changing
+    # one size does not shift the data of the others.
+    return random.Random(zlib.crc32(("%s:%s" % (seed, name)).encode("ascii")) & 0xffffffff)
+
+
+def weighted_country(rng):
+    total = sum(weight for _country, weight in COUNTRY_WEIGHTS)
+    value = rng.randint(1, total)
+    for country, weight in COUNTRY_WEIGHTS:
+        value -= weight
+        if value <= 0:
+            return country
+    return COUNTRY_WEIGHTS[-1][0]
+
+
+def is_public_first_octet(octet):
+    return octet not in (0, 10, 127) and octet < 224
+
+
+def random_network(rng, prefix):
+    while True:
+        value = rng.randint(FIRST_PUBLIC_IP, LAST_PUBLIC_IP)
+        if is_public_first_octet(value >> 24):
+            size = 1 << (32 - prefix)
+            return value - value % size, size
+
+
+def first_network_prefix(start, end):
+    # Largest CIDR that starts at `start` and fits inside the range.
+    prefix = 32
+    while prefix > 0 and start % (1 << (33 - prefix)) == 0 and start + (1 << (33 - prefix)) - 1 <= end:
+        prefix -= 1
+    return prefix
+
+
+def iter_range_rows(seed, count):
+    # Non-overlapping ranges over the public IPv4 space in start order,
+    # with small gaps that behave like unknown space.
+    rng = make_rng(seed, "ranges")
+    step = (LAST_PUBLIC_IP - FIRST_PUBLIC_IP) // max(count, 1)
+    for index in range(count):
+        start = FIRST_PUBLIC_IP + index * step
+        end = start + max(1, step - rng.randint(0, step // 8)) - 1
+        asn = rng.randint(1000, 65000)
+        yield {
+            "start_int": start,
+            "end_int": end,
+            "country": weighted_country(rng),
+            "asn": "AS%d" % asn,
+            "as_name": "Provider %d" % (asn % 997),
+            "network": bounds_to_cidr(start, first_network_prefix(start, end)),
+        }
+
+
+def write_range_table(path, seed, count):
+    with open(path, "w") as f:
+        f.write("# start_int\tend_int\tcountry\tasn\tas_name\tnetwork\n")
+        for row in iter_range_rows(seed, count):
+            f.write(range_row_to_tsv(row) + "\n")
+
+
+def generate_geo_data(seed, count, ips_per_network=40):
+    # IPs are clustered in /20 provider networks so the subnet planners see
+    # realistic hit counts per /24 and per provider.
+    rng = make_rng(seed, "geo")
+    geo_data = {}
+    while len(geo_data) < count:
+        network, size = random_network(rng, 20)
+        country = weighted_country(rng)
+        asn = rng.randint(1000, 65000)
+        details = {
+            "country": country,
+            "region": "Region %d" % (asn % 50),
+            "city": "City %d" % (asn % 200),
+            "org": "AS%d Provider %d" % (asn, asn % 997),
+            "loc": "0.0,0.0",
+        }
+        for _index in range(min(rng.randint(1, 2 * ips_per_network), count - len(geo_data))):
+            geo_data[ipv4_int_to_text(network + rng.randint(1, size - 2))] = dict(details)
+    return geo_data
+
+
+def deny_cidrs(seed, count):
+    rng = make_rng(seed, "denies")
+    seen = set()
+    result = []
+    while len(result) < count:
+        prefix = rng.choice([24, 24, 24, 22, 20, 16])
+        network, _size = random_network(rng, prefix)
+        cidr = bounds_to_cidr(network, prefix)
+        if cidr not in seen:
+            seen.add(cidr)
+            result.append(cidr)
+    return result
+
+
+def generate_user_rules_text(cidrs):
+    lines = [
+        "*filter",
+        ":ufw-user-input - [0:0]",
+        ":ufw-user-output - [0:0]",
+        ":ufw-user-forward - [0:0]",
+        "### RULES ###",
+        "",
+    ]
+    for cidr in cidrs:
+        lines.extend(generate_ufw_deny_block(cidr))
+    lines.extend([
+        "### tuple ### allow tcp 22 0.0.0.0/0 any 0.0.0.0/0 in",
+        "-A ufw-user-input -p tcp --dport 22 -j ACCEPT",
+        "",
+        "### tuple ### allow tcp 443 0.0.0.0/0 any 0.0.0.0/0 in",
+        "-A ufw-user-input -p tcp --dport 443 -j ACCEPT",
+        "",
+        "### END RULES ###",
+        "COMMIT",
+    ])
+    return "\n".join(lines) + "\n"
+
+
+def generate_ufw_status_text(cidrs):
+    lines = ["Status: active", "", "     To                         Action      From", "     --                         ------      ----"]
+    for number, cidr in enumerate(cidrs, 1):
+        lines.append("[%5d] Anywhere                   DENY IN     %s" % (number, cidr))
+    lines.append("[%5d] 22/tcp                     ALLOW IN    Anywhere" % (len(cidrs) + 1))
+    lines.append("[%5d] 443/tcp                    ALLOW IN    Anywhere" % (len(cidrs) + 2))
+    return "\n".join(lines) + "\n"
+
+
+def format_url(rng):
+    template = rng.choice(URL_PATHS)
+    return template % tuple(rng.randint(1, 999999) for _index in range(template.count("%d")))
+
+
+def generate_server_status_text(seed, workers, client_ips):
+    # Text copy of an Apache mod_status page with the extended scoreboard
+    # table, in the same layout as input.txt.
+    rng = make_rng(seed, "server-status")
+    client_ips = sorted(client_ips)
+    busy = sum(1 for _index in range(workers) if rng.random() < 0.9)
+    lines = [
+        "Apache Server Status for www.nieuwejobs.com (via 148.251.129.80)",
+        "Server Version: Apache/2.4.10 (Ubuntu)",
+        "Server MPM: event",
+        "Server uptime: 21 seconds",
+        "Total accesses: %d - Total Traffic: 5.9 MB" % (workers * 3),
+        "%d requests currently being processed, %d idle workers" % (busy, workers - busy),
+        "".join(rng.choice(SCOREBOARD_MODES) for _index in range(workers)),
+        "Srv\tPID\tAcc\tM\tCPU\tSS\tReq\tConn\tChild\tSlot\tClient\tVHost\tRequest",
+    ]
+    pid = 23208
+    for slot in range(workers):
+        if slot % 64 == 0:
+            pid += rng.randint(1, 40)
+        mode = "W" if rng.random() < 0.6 else "R"
+        client = rng.choice(client_ips) if client_ips else "127.0.0.1"
+        if mode == "W":
+            vhost = "%s:443" % rng.choice(VHOSTS)
+            request = "GET %s HTTP/1.1" % format_url(rng)
+        else:
+            vhost = ""
+            request = ""
+        lines.append("\t".join([
+            "%d-0" % (slot // 64),
+            str(pid),
+            "0/%d/%d" % (slot % 7, slot % 7),
+            mode,
+            "%.2f" % (rng.random() / 2),
+            str(rng.randint(0, 30)),
+            "0",
+            "0.0",
+            "0.00",
+            "0.00",
+            client,
+            vhost,
+            request,
+        ]))
+    return "\n".join(lines) + "\n"
+
+
+def write_apache_log(path, seed, target_bytes, client_ips, vhost=True):
+    # vhost_combined lines (plain combined with vhost=False) until the file
+    # reaches target_bytes. Returns the number of lines written.
+    rng = make_rng(seed, "apache-log")
+    client_ips = sorted(client_ips)
+    # A small set of heavy hitters produces most of the traffic.
+    heavy = client_ips[:max(1, len(client_ips) // 50)]
+    written = 0
+    lines = 0
+    second = 0
+    with open(path, "w") as f:
+        while written < target_bytes:
+            batch = []
+            for _index in range(1000):
+                second += 1
+                ip = rng.choice(heavy) if rng.random() < 0.5 else rng.choice(client_ips)
+                batch.append('%s%s - - [%02d/%s/2026:%02d:%02d:%02d +0200] "GET %s HTTP/1.1" %s %d "-" "%s"\n' % (
+                    "%s:443 " % rng.choice(VHOSTS) if vhost else "",
+                    ip,
+                    1 + (second // 86400) % 28,
+                    MONTHS[(second // (86400 * 28)) % 12],
+                    (second // 3600) % 24,
+                    (second // 60) % 60,
+                    second % 60,
+                    format_url(rng),
+                    rng.choice(STATUSES),
+                    rng.randint(200, 90000),
+                    rng.choice(USER_AGENTS),
+                ))
+            chunk = "".join(batch)
+            f.write(chunk)
+            written += len(chunk)
+            lines += len(batch)
+    return lines
@@ -0,0 +1,407 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import analyze_apache_subnets
+import block_generiek_subnet
+import fast_apply_ufw_user_rules
+import local_ip_country
+import log_stats_store
+import plan_ufw_country_rule_updates
+import recommend_country_prefixes
+import recommend_provider_subnets
+import server_status
+import stage_timing
+from benchmarks import generators
+
+
+RESULTS_VERSION = 1
+
+# Sizes per scale. "small" runs in seconds and is what CI-style smoke runs
+# use; "large" matches the production sizes that expose quadratic paths.
+SCALES = {
+    "tiny": {
+        "ranges": 2000,
+        "geo_ips": 2000,
+        "denies": 100,
+        "candidates": 100,
+        "new_rules": 20,
+        "status_workers": 64,
+        "log_bytes": 256 * 1024,
+        "lookups": 2000,
+    },
+    "small": {
+        "ranges": 50000,
+        "geo_ips": 20000,
+        "denies": 2000,
+        "candidates": 2000,
+        "new_rules": 200,
+        "status_workers": 512,
+        "log_bytes": 16 * 1024 * 1024,
+        "lookups": 20000,
+    },
+    "medium": {
+        "ranges": 1000000,
+        "geo_ips": 100000,
+        "denies": 10000,
+        "candidates": 10000,
+        "new_rules": 1000,
+        "status_workers": 2048,
+        "log_bytes": 512 * 1024 * 1024,
+        "lookups": 100000,
+    },
+    "large": {
+        "ranges": 4000000,
+        "geo_ips": 1000000,
+        "denies": 100000,
+        "candidates": 50000,
+        "new_rules": 5000,
+        "status_workers": 8192,
+        "log_bytes": 4 * 1024 * 1024 * 1024,
+        "lookups": 1000000,
+    },
+}
+TARGET_COUNTRIES = ["CN", "IN", "BR", "RU", "VN"]
+ALLOWLIST_CIDRS = ["66.249.64.0/19", "40.77.167.0/24", "157.55.39.0/24", "207.46.13.0/24"]
+
+
+class BenchmarkData(object):
+    # Generated inputs are written to the work directory once per scale and
+    # seed and reused by later runs; multi-GB logs take longer to generate
+    # than to benchmark.
+
+    def __init__(self, work_dir, scale, seed):
+        self.work_dir = work_dir
+        self.sizes = SCALES[scale]
+        self.seed = seed
+        self._cache = {}
+        if not os.path.isdir(work_dir):
+            os.makedirs(work_dir)
+
+    def path(self, name):
+        return os.path.join(self.work_dir, name)
+
+    def cached(self, name, build):
+        if name not in self._cache:
+            self._cache[name] = build()
+        return self._cache[name]
+
+    def ensure_file(self, name, write):
+        path = self.path(name)
+        if not os.path.exists(path):
+            tmp_path = "%s.tmp-%s" % (path, os.getpid())
+            write(tmp_path)
+            os.rename(tmp_path, path)
+        return path
+
+    def range_table_path(self):
+        return self.ensure_file(
+            "ranges-%d.tsv" % self.sizes["ranges"],
+            lambda path: generators.write_range_table(path, self.seed, self.sizes["ranges"]),
+        )
+
+    def geo_data(self):
+        return self.cached("geo_data", lambda: generators.generate_geo_data(self.seed, self.sizes["geo_ips"]))
+
+    def geo_data_path(self):
+        def write(path):
+            with open(path, "w") as f:
+                json.dump(self.geo_data(), f)
+        return self.ensure_file("geo_data-%d.json" % self.sizes["geo_ips"], write)
+
+    def deny_cidrs(self):
+        return self.cached("deny_cidrs", lambda: generators.deny_cidrs(self.seed, self.sizes["denies"]))
+
+    def candidate_networks(self):
+        # /24s around geo IPs of the target countries, like the aggregation
+        # step produces.
+        def build():
+            target = set(TARGET_COUNTRIES)
+            cidrs = set()
+            for ip, details in sorted(self.geo_data().items()):
+                if details["country"] in target:
+                    cidrs.add(ip.rsplit(".", 1)[0] + ".0/24")
+                if len(cidrs) >= self.sizes["candidates"]:
+                    break
+            return [block_generiek_subnet.ip_network(cidr) for cidr in sorted(cidrs)]
+        return self.cached("candidates", build)
+
+    def apache_log_path(self):
+        return self.ensure_file(
+            "access-%d.log" % self.sizes["log_bytes"],
+            lambda path: generators.write_apache_log(path, self.seed, self.sizes["log_bytes"], list(self.geo_data().keys())),
+        )
+
+    def combined_log_path(self):
+        return self.ensure_file(
+            "combined-%d.log" % self.sizes["log_bytes"],
+            lambda path: generators.write_apache_log(path, self.seed, self.sizes["log_bytes"], list(self.geo_data().keys()), vhost=False),
+        )
+
+
+def measure(func, repeat):
+    timings = []
+    result = None
+    for _index in range(repeat):
+        started = time.time()
+        result = func()
+        timings.append(time.time() - started)
+    return timings, result
+
+
+def bench_lookup_ip(data):
+    starts, ranges = local_ip_country.load_ranges(data.range_table_path())
+    ips = sorted(data.geo_data().keys())[:data.sizes["lookups"]]
+
+    def run():
+        return sum(1 for ip in ips if local_ip_country.lookup_ip(ip, starts, ranges) is not None)
+
+    return run, len(ips), {"ranges": len(ranges)}
+
+
+def bench_load_ranges(data):
+    path = data.range_table_path()
+
+    def run():
+        return len(local_ip_country.load_ranges(path)[0])
+
+    return run, data.sizes["ranges"], {"bytes": os.path.getsize(path)}
+
+
+def bench_plan_new_rules(data):
+    candidates = data.candidate_networks()
+    existing = [block_generiek_subnet.ip_network(cidr) for cidr in data.deny_cidrs()]
+
+    def run():
+        return len(block_generiek_subnet.plan_new_rules(candidates, existing))
+
+    return run, len(candidates), {"existing_rules": len(existing)}
+
+
+def bench_find_country_mismatches(data):
+    candidates = data.candidate_networks()
+    geo_path = data.geo_data_path()
+
+    def run():
+        return len(block_generiek_subnet.find_country_mismatches(list(candidates), geo_path, set(TARGET_COUNTRIES), 5))
+
+    return run, len(candidates), {"geo_ips": data.sizes["geo_ips"]}
+
+
+def bench_classify_rule(data):
+    # Rules come from the deny CIDRs plus the candidate /24s, so a share of
+    # them contains geo evidence; index building is part of the timing, as
+    # in build_plan().
+    cidrs = data.deny_cidrs() + [str(net) for net in data.candidate_networks()]
+    rules = plan_ufw_country_rule_updates.parse_ufw_deny_rules(generators.generate_ufw_status_text(cidrs))
+    geo_data = data.geo_data()
+    recommendations = dict(
+        (country, {"target_prefix": 24, "min_hits": 2, "reason": "benchmark"}) for country in TARGET_COUNTRIES
+    )
+    allowlist = [block_generiek_subnet.ip_network(cidr) for cidr in ALLOWLIST_CIDRS]
+
+    def run():
+        geo_index = plan_ufw_country_rule_updates.build_geo_source_index(geo_data)
+        country_ip_index = plan_ufw_country_rule_updates.build_country_ip_index(geo_index)
+        cache = {}
+        return len([
+            plan_ufw_country_rule_updates.classify_rule(rule, geo_index, recommendations, allowlist, country_ip_index, 5, cache)
+            for rule in rules
+        ])
+
+    return run, len(rules), {"geo_ips": len(geo_data)}
+
+
+def bench_analyze_logs(data):
+    path = data.apache_log_path()
+    geo_data = data.geo_data()
+
+    def run():
+        totals, _ips, _subnets = analyze_apache_subnets.analyze_logs([path], geo_data, set(TARGET_COUNTRIES), [24, 16])
+        return totals["lines"]
+
+    with open(path, "rb") as f:
+        lines = sum(1 for _line in f)
+    return run, lines, {"bytes": os.path.getsize(path)}
+
+
+def bench_log_stats_parse(data):
+    if sys.version_info[0] < 3:
+        import log_stats_py2 as log_stats
+    else:
+        import log_stats
+    path = data.combined_log_path()
+
+    def run():
+        batch = log_stats_store.CountBatch()
+        _parsed, matched = log_stats.parse_logs([path], batch)
+        return matched
+
+    with open(path, "rb") as f:
+        lines = sum(1 for _line in f)
+    return run, lines, {"bytes": os.path.getsize(path)}
+
+
+def bench_parse_server_status(data):
+    text = generators.generate_server_status_text(data.seed, data.sizes["status_workers"], list(data.geo_data().keys()))
+
+    def run():
+        return server_status.summarize_status(server_status.parse_server_status(text))["worker_rows"]
+
+    return run, data.sizes["status_workers"], {"bytes": len(text)}
+
+
+def bench_build_new_user_rules_text(data):
+    original = generators.generate_user_rules_text(data.deny_cidrs())
+    to_add = generators.deny_cidrs(data.seed + 1, data.sizes["new_rules"])
+
+    def run():
+        return len(fast_apply_ufw_user_rules.build_new_user_rules_text(original, to_add)[0])
+
+    return run, len(to_add), {"existing_rules": len(data.deny_cidrs()), "bytes": len(original)}
+
+
+def bench_recommend_country_prefixes(data):
+    geo_data = data.geo_data()
+
+    def run():
+        return len(recommend_country_prefixes.build_recommendations(
+            geo_data, TARGET_COUNTRIES, recommend_country_prefixes.DEFAULT_PREFIXES
+        ))
+
+    return run, len(geo_data), {}
+
+
+def bench_recommend_provider_subnets(data):
+    geo_data = data.geo_data()
+
+    def run():
+        return len(recommend_provider_subnets.build_recommendations(geo_data, TARGET_COUNTRIES, [24, 20, 18, 16], 3))
+
+    return run, len(geo_data), {}
+
+
+BENCHMARKS = [
+    ("load_ranges", bench_load_ranges),
+    ("lookup_ip", bench_lookup_ip),
+    ("plan_new_rules", bench_plan_new_rules),
+    ("find_country_mismatches", bench_find_country_mismatches),
+    ("classify_rule", bench_classify_rule),
+    ("analyze_logs", bench_analyze_logs),
+    ("log_stats_parse", bench_log_stats_parse),
+    ("parse_server_status", bench_parse_server_status),
+    ("build_new_user_rules_text", bench_build_new_user_rules_text),
+    ("recommend_country_prefixes", bench_recommend_country_prefixes),
+    ("recommend_provider_subnets", bench_recommend_provider_subnets),
+]
+
+
+def run_benchmark(name, setup, data, repeat):
+    func, items, params = setup(data)
+    timings, result = measure(func, repeat)
+    best = min(timings)
+    return {
+        "name": name,
+        "items": items,
+        "params": params,
+        "result": result,
+        "repeat": repeat,
+        "seconds_best": round(best, 6),
+        "seconds_mean": round(sum(timings) / len(timings), 6),
+        "items_per_second": round(items / best, 1) if best else None,
+        "peak_rss_kb": stage_timing.peak_rss_kb(),
+    }
+
+
+def select_benchmarks(only, skip):
+    names = [name for name, _setup in BENCHMARKS]
+    unknown = [name for name in list(only) + list(skip) if name not in names]
+    if unknown:
+        raise ValueError("unknown benchmark(s): %s" % ", ".join(unknown))
+    return [(name, setup) for name, setup in BENCHMARKS if (not only or name in only) and name not in skip]
+
+
+def compare_results(previous, current):
+    old = dict((row["name"], row) for row in previous.get("results", []))
+    rows = []
+    for row in current["results"]:
+        before = old.get(row["name"])
+        if not before or not before.get("seconds_best"):
+            continue
+        rows.append((row["name"], before["seconds_best"], row["seconds_best"], row["seconds_best"] / before["seconds_best"]))
+    return rows
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the blocking pipeline on deterministic synthetic data and write JSON results.")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", action="append", default=[], help="Run only this benchmark; repeatable")
+    parser.add_argument("--skip", action="append", default=[], help="Skip this benchmark; repeatable")
+    parser.add_argument("--work-dir", default="", help="Generated data directory (default: benchmarks/data/SCALE-SEED)")
+    parser.add_argument("--output", default="", help="Results JSON (default: benchmarks/results/SCALE-TIMESTAMP.json)")
+    parser.add_argument("--compare", default="", help="Earlier results JSON to compare against")
+    parser.add_argument("--list", action="store_true", help="List benchmark names and exit")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.list:
+        for name, _setup in BENCHMARKS:
+            print(name)
+        return 0
+    try:
+        selected = select_benchmarks(args.only, args.skip)
+    except ValueError as exc:
+        print("ERROR: %s" % exc, file=sys.stderr)
+        return 1
+
+    work_dir = args.work_dir or os.path.join(ROOT, "benchmarks", "data", "%s-%d" % (args.scale, args.seed))
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", "%s-%s.json" % (args.scale, time.strftime("%Y%m%d-%H%M%S")))
+    data = BenchmarkData(work_dir, args.scale, args.seed)
+
+    results = []
+    for name, setup in selected:
+        row = run_benchmark(name, setup, data, max(1, args.repeat))
+        results.append(row)
+        print("%-28s %10.4fs  %12s items/s" % (name, row["seconds_best"], row["items_per_second"]))
+
+    payload = {
+        "version": RESULTS_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "scale": args.scale,
+        "seed": args.seed,
+        "sizes": SCALES[args.scale],
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    output_dir = os.path.dirname(os.path.abspath(output))
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    with open(output, "w") as f:
+        json.dump(payload, f, indent=2, sort_keys=True)
+    print("Wrote:", output)
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            previous = json.load(f)
+        for name, before, after, ratio in compare_results(previous, payload):
+            print("%-28s %10.4fs -> %10.4fs  x%.2f" % (name, before, after, ratio))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -5,6 +5,9 @@ import json
 import os
 import subprocess
 
+import log_scan
+import log_stats_store
+
 try:
     import ipaddress as _ip
     def ip_network(value, strict=False):
@@ -99,22 +102,45 @@ def collect_accounts_hits(db, date_filter=None, prefix="/accounts/"):
     return totals
 
 
+def load_accounts_hits(path, date_filter=None, prefix="/accounts/", min_hits=1):
+    # {ip: hits} with at least min_hits. A SQLite database answers this from
+    # its url index; an old log_stats.json is still walked in full.
+    if path.endswith(".json"):
+        totals = collect_accounts_hits(load_db(path), date_filter=date_filter, prefix=prefix)
+        return dict((ip, count) for ip, count in totals.items() if count >= min_hits)
+    if not os.path.exists(path):
+        return {}
+    conn = log_stats_store.connect(path)
+    try:
+        return log_stats_store.prefix_hits_by_ip(conn, prefix, date_key=date_filter, min_hits=min_hits)
+    finally:
+        conn.close()
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Block IPs with many /accounts/ requests using UFW."
     )
-    parser.add_argument("--db", default="log_stats.json", help="Path to JSON stats database.")
+    parser.add_argument("--db", default="log_stats.sqlite", help="Path to the log_stats SQLite database (or an old log_stats.json).")
     parser.add_argument("--date", help="Date to analyze (YYYY-MM-DD). If omitted, all dates are used.")
     parser.add_argument("--min-requests", type=int, default=200, help="Minimum /accounts/ hits to block.")
+    parser.add_argument("--prefix", default="/accounts/", help="URL prefix to count.")
+    parser.add_argument("--access-log", action="append", default=[],
+                        help="Count hits straight from these Apache access logs instead of --db (repeatable).")
+    parser.add_argument("--log-format", default="auto", help="auto, common, combined, vhost_combined or an Apache LogFormat string.")
     parser.add_argument("--blocked-file", default="blocked_accounts_ips.txt", help="File to store blocked IPs.")
     parser.add_argument("--allowlist", default=os.path.join("ip_cache", "allowlist_cidrs.json"),
                         help="Allowlist CIDRs (OpenAI/Google) to skip blocking.")
     parser.add_argument("--dry-run", action="store_true", help="Only print IPs, do not block.")
     args = parser.parse_args()
 
-    db = load_db(args.db)
-    totals = collect_accounts_hits(db, date_filter=args.date)
-    candidates = set(ip for ip, count in totals.items() if count >= args.min_requests)
+    if args.access_log:
+        hits = log_scan.PrefixHits(args.prefix, date_filter=args.date)
+        log_scan.scan_logs(args.access_log, [hits], args.log_format)
+        totals = hits.at_least(args.min_requests)
+    else:
+        totals = load_accounts_hits(args.db, date_filter=args.date, prefix=args.prefix, min_hits=args.min_requests)
+    candidates = set(totals)
 
     if not candidates:
         print("No IPs found with >= {} /accounts/ requests.".format(args.min_requests))
@@ -9,6 +9,8 @@ import subprocess
 import sys
 
 from country_policy import DEFAULT_COUNTRY_CODES, effective_country_codes
+from ipv4_index import interval_join, sorted_ipv4_items
+import stage_timing
 
 try:
     text_type = unicode  # Py2
@@ -267,27 +269,21 @@ def find_country_mismatches(candidates, geo_data_path, country_codes, max_exampl
 
     candidates = [net for net in candidates if network_version(net) == 4]
     candidates.sort(key=network_sort_key)
-    candidate_keys = set(to_text(net) for net in candidates)
-    prefix_lengths = sorted(set(net.prefixlen for net in candidates))
-    mismatch_by_key = {}
-
+    non_target = []
     for ip, details in geo_data.items():
         country = to_text(details.get("country", "Unknown")).upper()
-        if country in country_codes:
+        if country not in country_codes:
+            non_target.append((ip, (ip, country, details.get("org", "Unknown"))))
+    source_ints, sources = sorted_ipv4_items(non_target)
+
+    intervals = [(network_first_int(net), network_last_int(net)) for net in candidates]
+    mismatches = []
+    for net, (start, end) in zip(candidates, interval_join(source_ints, intervals)):
+        if start == end:
             continue
-        for prefix in prefix_lengths:
-            try:
-                candidate_key = to_text(ip_network("%s/%d" % (ip, prefix), strict=False))
-            except ValueError:
-                continue
-            if candidate_key not in candidate_keys:
-                continue
-            if candidate_key not in mismatch_by_key:
-                mismatch_by_key[candidate_key] = []
-            if len(mismatch_by_key[candidate_key]) < max_examples:
-                mismatch_by_key[candidate_key].append("%s %s %s" % (ip, country, details.get("org", "Unknown")))
-
-    return [(net, mismatch_by_key[to_text(net)]) for net in candidates if to_text(net) in mismatch_by_key]
+        examples = ["%s %s %s" % source for source in sources[start:min(end, start + max_examples)]]
+        mismatches.append((net, examples))
+    return mismatches
 
 
 def split_country_mismatch_candidates(candidates, args):
@@ -446,8 +442,8 @@ def build_parser():
     return parser
 
 
-def main():
-    args = build_parser().parse_args()
+def main(argv=None):
+    args = build_parser().parse_args(argv)
 
     try:
         candidates = load_candidate_networks(args.input)
@@ -510,7 +506,8 @@ def main():
         append_tracking_file(args.blocked_file, added)
 
         if added and not args.no_reload:
-            reload_ufw(args.sudo)
+            with stage_timing.timed("reload"):
+                reload_ufw(args.sudo)
 
         print("Done. Added %d new UFW rule(s)." % len(added))
         return 0
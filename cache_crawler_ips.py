@@ -171,7 +171,7 @@ def load_cached(path, max_age_days):
         return json.load(f)
 
 
-def main():
+def main(argv=None):
     if _ip is None:
         print("ERROR: Missing ipaddress module. Install one of: pip install ipaddress (Py2 backport) or pip install ipaddr")
         return 1
@@ -179,7 +179,7 @@ def main():
     parser.add_argument("--cache-dir", default="ip_cache", help="Cache directory")
     parser.add_argument("--max-age-days", type=int, default=7, help="Max cache age in days")
     parser.add_argument("--force", action="store_true", help="Force refresh")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     try:
         os.makedirs(args.cache_dir)
@@ -15,12 +15,12 @@ def run_ufw_delete(num, sudo):
         raise RuntimeError("ufw delete failed for rule %s" % num)
 
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument("--input", default="bad_ufw_rules.json")
     parser.add_argument("--sudo", action="store_true", help="Use sudo for ufw delete")
     parser.add_argument("--dry-run", action="store_true", help="Only print planned deletions")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     with open(args.input, "r") as f:
         data = json.load(f)
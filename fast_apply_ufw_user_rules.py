@@ -9,6 +9,7 @@ import sys
 import time
 
 import block_generiek_subnet as blocker
+import stage_timing
 from local_ip_country import to_text
 
 
@@ -189,8 +190,8 @@ def build_parser():
     return parser
 
 
-def main():
-    args = build_parser().parse_args()
+def main(argv=None):
+    args = build_parser().parse_args(argv)
     try:
         plan = plan_fast_apply(args)
         print("Candidate subnets:", len(plan["candidates"]))
@@ -222,7 +223,8 @@ def main():
 
         should_reload = args.reload and not args.no_reload
         if should_reload:
-            reload_ufw(args.sudo)
+            with stage_timing.timed("reload"):
+                reload_ufw(args.sudo)
             status_text = status_ufw(args.sudo)
             print("ufw status numbered first lines:")
             print("\n".join(status_text.splitlines()[:20]))
@@ -4,26 +4,14 @@ from __future__ import print_function
 import argparse
 import json
 import os
-import re
 import time
 
+from ipv4_extract import unique_ipv4_texts
 from local_ip_country import atomic_write_json, load_ranges, lookup_ip, row_to_geo_details
 
 
-IPV4_RE = re.compile(r"\b(?:\d{1,3}\.){3}\d{1,3}\b")
-
-
 def read_ips(path):
-    ips = []
-    seen = set()
-    with open(path, "rb") as f:
-        for raw in f:
-            text = raw.decode("utf-8", "replace") if isinstance(raw, bytes) else raw
-            for ip in IPV4_RE.findall(text):
-                if ip not in seen:
-                    ips.append(ip)
-                    seen.add(ip)
-    return ips
+    return unique_ipv4_texts(path)
 
 
 def load_geo_data(path):
@@ -48,12 +36,7 @@ def unknown_details():
     }
 
 
-def update_geo_data(input_path, geo_data_path, ranges_path, write_unknown=False, refresh_existing=False):
-    start_time = time.time()
-    ips = read_ips(input_path)
-    geo_data = load_geo_data(geo_data_path)
-    starts, ranges = load_ranges(ranges_path)
-
+def lookup_geo_data(ips, geo_data, starts, ranges, write_unknown=False, refresh_existing=False):
     cache_hits = 0
     local_hits = 0
     local_misses = 0
@@ -78,19 +61,29 @@ def update_geo_data(input_path, geo_data_path, ranges_path, write_unknown=False,
                 geo_data[ip] = unknown_details()
                 updated += 1
 
-    if updated:
-        atomic_write_json(geo_data_path, geo_data)
-
     return {
         "input_ips": len(ips),
         "cache_hits": cache_hits,
         "local_hits": local_hits,
         "local_misses": local_misses,
         "updated": updated,
-        "elapsed_seconds": time.time() - start_time,
     }
 
 
+def update_geo_data(input_path, geo_data_path, ranges_path, write_unknown=False, refresh_existing=False):
+    start_time = time.time()
+    ips = read_ips(input_path)
+    geo_data = load_geo_data(geo_data_path)
+    starts, ranges = load_ranges(ranges_path)
+
+    stats = lookup_geo_data(ips, geo_data, starts, ranges, write_unknown, refresh_existing)
+    if stats["updated"]:
+        atomic_write_json(geo_data_path, geo_data)
+
+    stats["elapsed_seconds"] = time.time() - start_time
+    return stats
+
+
 def main():
     parser = argparse.ArgumentParser(description="Update geo_data.json from local fast geo ranges without external API calls.")
     parser.add_argument("--input", default="output.txt")
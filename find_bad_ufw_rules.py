@@ -38,12 +38,25 @@ import json
 import os
 import re
 import subprocess
+import sys
+import time
 
 from country_policy import DEFAULT_COUNTRY_CODES, effective_country_codes
+from ipv4_index import build_interval_index, interval_index_overlaps, interval_join, sorted_ipv4_items
+from worker_pool import parallel_imap, resolve_workers
 
 
 IPV4_RE = re.compile(r"\b(?:\d{1,3}\.){3}\d{1,3}(?:/\d{1,2})?\b")
 IPV6_RE = re.compile(r"\b[0-9a-fA-F:]{2,}(?:/\d{1,3})?\b")
+UFW_NUMBERED_RE = re.compile(r"^\[\s*(\d+)\]\s+(.*)$")
+SHARDS_PER_WORKER = 4
+
+# Read-only audit inputs, set in each pool worker by the pool initializer
+# so the geo and allowlist indexes are passed once per worker instead of
+# pickled per task (and still arrive under spawn/forkserver).
+_AUDIT_CONTEXT = {}
+
+
 def load_allowlist(path):
     with open(path, "r") as f:
         data = json.load(f)
@@ -91,6 +104,8 @@ def extract_ips(line):
                 found.append(ip_network(m + "/32"))
         except ValueError:
             continue
+    if ":" not in line:
+        return found
     for m in IPV6_RE.findall(line):
         try:
             if "/" in m:
@@ -108,21 +123,66 @@ def net_overlaps(a, b):
     return net_first_int(a) <= net_last_int(b) and net_first_int(b) <= net_last_int(a)
 
 
-def is_blocking_allowed(candidate, allowlist):
+def build_allowlist_index(allowlist):
+    ipv4 = []
+    other = []
+    for allow in allowlist:
+        if net_version(allow) == 4:
+            ipv4.append((net_first_int(allow), net_last_int(allow)))
+        else:
+            other.append(allow)
+    return build_interval_index(ipv4), other
+
+
+def is_blocking_allowed(candidate, allowlist, allowlist_index=None):
     # Flag exact allowlist blocks and broad deny rules that cover part of an
     # allowlisted crawler range.
+    if allowlist_index is not None:
+        ipv4_index, other = allowlist_index
+        if net_version(candidate) == 4:
+            return interval_index_overlaps(ipv4_index, net_first_int(candidate), net_last_int(candidate))
+        allowlist = other
     for allow in allowlist:
         if net_overlaps(candidate, allow):
             return True
     return False
 
 
-def find_non_target_sources(candidate, geo_data, country_codes, max_examples):
+def geo_country(details):
+    country = details.get("country", "Unknown")
+    if country:
+        country = country.upper()
+    return country
+
+
+def build_non_target_index(geo_data, country_codes):
+    non_target = []
+    for ip, details in geo_data.items():
+        country = geo_country(details)
+        if country not in country_codes:
+            non_target.append((ip, (ip, country, details.get("org", "Unknown"))))
+    return sorted_ipv4_items(non_target)
+
+
+def find_non_target_sources_for_candidates(candidates, index, max_examples):
+    # IPv4 candidates are answered with one sort-merge pass over the sorted
+    # non-target geo IPs.
+    source_ints, sources = index
+    intervals = [(net_first_int(c), net_last_int(c)) for c in candidates]
+    found = []
+    for start, end in interval_join(source_ints, intervals):
+        found.append(["%s %s %s" % source for source in sources[start:min(end, start + max_examples)]])
+    return found
+
+
+def find_non_target_sources(candidate, geo_data, country_codes, max_examples, index=None):
+    if net_version(candidate) == 4:
+        if index is None:
+            index = build_non_target_index(geo_data, country_codes)
+        return find_non_target_sources_for_candidates([candidate], index, max_examples)[0]
     found = []
     for ip, details in geo_data.items():
-        country = details.get("country", "Unknown")
-        if country:
-            country = country.upper()
+        country = geo_country(details)
         if country in country_codes:
             continue
         try:
@@ -138,7 +198,98 @@ def find_non_target_sources(candidate, geo_data, country_codes, max_examples):
     return found
 
 
-def main():
+def parse_numbered_rules(status):
+    rules = []
+    for line in status.splitlines():
+        line = line.strip()
+        if not line.startswith("["):
+            continue
+        m = UFW_NUMBERED_RE.match(line)
+        if not m:
+            continue
+        rules.append((int(m.group(1)), line, m.group(2)))
+    return rules
+
+
+def audit_rule(rule, context):
+    num, line, rest = rule
+    bad = []
+    reasons = []
+    for c in extract_ips(rest):
+        if is_blocking_allowed(c, None, context["allowlist_index"]):
+            bad.append(str(c))
+            reasons.append({
+                "type": "allowlist_overlap",
+                "cidr": str(c),
+            })
+        if context["check_country"]:
+            non_target_sources = find_non_target_sources(
+                c,
+                context["geo_data"],
+                context["country_codes"],
+                context["max_examples"],
+                context["non_target_index"],
+            )
+            if non_target_sources:
+                if str(c) not in bad:
+                    bad.append(str(c))
+                reasons.append({
+                    "type": "country_mismatch",
+                    "cidr": str(c),
+                    "examples": non_target_sources,
+                })
+    if not bad:
+        return None
+    return {"num": num, "line": line, "cidrs": bad, "reasons": reasons}
+
+
+def set_audit_context(context):
+    global _AUDIT_CONTEXT
+    _AUDIT_CONTEXT = context
+
+
+def audit_rule_shard(shard):
+    return [audit_rule(rule, _AUDIT_CONTEXT) for rule in shard]
+
+
+def split_shards(items, count):
+    size = max(1, (len(items) + count - 1) // count)
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def build_audit_context(allowlist, geo_data, country_codes, check_country, max_examples):
+    non_target_index = None
+    if check_country:
+        non_target_index = build_non_target_index(geo_data, country_codes)
+    return {
+        "allowlist_index": build_allowlist_index(allowlist),
+        "geo_data": geo_data,
+        "country_codes": country_codes,
+        "check_country": check_country,
+        "max_examples": max_examples,
+        "non_target_index": non_target_index,
+    }
+
+
+def audit_rules(rules, context, workers=1, progress=None):
+    # Contiguous shards keep the combined result in rule order, so the
+    # output does not depend on the worker count.
+    workers = resolve_workers(workers)
+    shards = split_shards(rules, workers * SHARDS_PER_WORKER)
+    bad_rules = []
+    try:
+        done = 0
+        for shard_result in parallel_imap(audit_rule_shard, shards, workers, initializer=set_audit_context, initargs=(context,)):
+            done += 1
+            bad_rules.extend(row for row in shard_result if row is not None)
+            if progress is not None:
+                progress(done, len(shards))
+    finally:
+        set_audit_context({})
+    return bad_rules
+
+
+def main(argv=None):
     if _ip is None:
         print("ERROR: Missing ipaddress module. Install one of: pip install ipaddress (Py2 backport) or pip install ipaddr")
         return 1
@@ -150,51 +301,42 @@ def main():
     parser.add_argument("--country-codes", default=",".join(DEFAULT_COUNTRY_CODES))
     parser.add_argument("--skip-country-check", action="store_true")
     parser.add_argument("--max-country-examples", type=int, default=10)
-    args = parser.parse_args()
+    parser.add_argument("--ufw-status-file", help="Read UFW status from a file instead of running ufw")
+    parser.add_argument("--workers", type=int, default=0, help="Audit processes; 0 uses all CPUs, 1 disables the pool")
+    args = parser.parse_args(argv)
 
+    started = time.time()
     allowlist = load_allowlist(args.allowlist)
     geo_data = load_geo_data(args.geo_data)
     country_codes = parse_country_codes(args.country_codes)
+    context = build_audit_context(
+        allowlist,
+        geo_data,
+        country_codes,
+        not args.skip_country_check,
+        args.max_country_examples,
+    )
 
-    status = run_ufw_status(args.sudo)
-    bad_rules = []
+    if args.ufw_status_file:
+        with open(args.ufw_status_file, "r") as f:
+            status = f.read()
+    else:
+        status = run_ufw_status(args.sudo)
+    rules = parse_numbered_rules(status)
+    workers = min(resolve_workers(args.workers), max(1, len(rules)))
+    print("Auditing %d UFW rule(s) with %d worker(s); indexes built in %.2fs" % (
+        len(rules),
+        workers,
+        time.time() - started,
+    ), file=sys.stderr)
 
-    for line in status.splitlines():
-        line = line.strip()
-        if not line.startswith("["):
-            continue
-        m = re.match(r"^\[\s*(\d+)\]\s+(.*)$", line)
-        if not m:
-            continue
-        num = int(m.group(1))
-        rest = m.group(2)
-        candidates = extract_ips(rest)
-        bad = []
-        reasons = []
-        for c in candidates:
-            if is_blocking_allowed(c, allowlist):
-                bad.append(str(c))
-                reasons.append({
-                    "type": "allowlist_overlap",
-                    "cidr": str(c),
-                })
-            if not args.skip_country_check:
-                non_target_sources = find_non_target_sources(
-                    c,
-                    geo_data,
-                    country_codes,
-                    args.max_country_examples,
-                )
-                if non_target_sources:
-                    if str(c) not in bad:
-                        bad.append(str(c))
-                    reasons.append({
-                        "type": "country_mismatch",
-                        "cidr": str(c),
-                        "examples": non_target_sources,
-                    })
-        if bad:
-            bad_rules.append({"num": num, "line": line, "cidrs": bad, "reasons": reasons})
+    def progress(done, total):
+        if done != total and done % max(1, total // 10):
+            return
+        print("  shard %d/%d done (%.2fs)" % (done, total, time.time() - started), file=sys.stderr)
+
+    bad_rules = audit_rules(rules, context, workers, progress)
+    print("Audit finished in %.2fs" % (time.time() - started), file=sys.stderr)
 
     with open(args.output, "w") as f:
         json.dump({"count": len(bad_rules), "rules": bad_rules}, f, indent=2)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+import re
+
+from ipv4_index import ipv4_int_to_text
+
+
+# Same match rules as the old text regex (r"\b(?:\d{1,3}\.){3}\d{1,3}\b"),
+# on bytes and with one group per octet.
+IPV4_BYTES_RE = re.compile(br"\b(\d{1,3})\.(\d{1,3})\.(\d{1,3})\.(\d{1,3})\b")
+CHUNK_SIZE = 1 << 20
+# Longest match (15 bytes) plus the byte the trailing \b looks at.
+MATCH_TAIL = 16
+
+
+def iter_file_chunks(f, chunk_size=CHUNK_SIZE):
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def octets_to_int(match):
+    value = 0
+    for group in match.groups():
+        octet = int(group)
+        if octet > 255:
+            return None
+        value = (value << 8) | octet
+    return value
+
+
+def scan_ipv4_chunks(chunks):
+    # Yields every valid IPv4 occurrence as an int. Only matches that start
+    # at least MATCH_TAIL bytes before the end of the buffer are taken; the
+    # rest is carried into the next chunk together with one byte of context,
+    # so \b at the carry start sees the real previous byte and matches that
+    # straddle a chunk boundary are found exactly once.
+    carry = b""
+    start = 0
+    for chunk in chunks:
+        buffer = carry + chunk
+        limit = len(buffer) - MATCH_TAIL
+        if limit <= start:
+            carry = buffer
+            continue
+        resume = limit
+        for match in IPV4_BYTES_RE.finditer(buffer, start):
+            if match.start() >= limit:
+                break
+            resume = max(resume, match.end())
+            value = octets_to_int(match)
+            if value is not None:
+                yield value
+        carry = buffer[resume - 1:]
+        start = 1
+    for match in IPV4_BYTES_RE.finditer(carry, start):
+        value = octets_to_int(match)
+        if value is not None:
+            yield value
+
+
+def count_ipv4_chunks(chunks):
+    # Returns (unique IP ints in first-seen order, {ip int: occurrences}).
+    counts = {}
+    order = []
+    for value in scan_ipv4_chunks(chunks):
+        if value in counts:
+            counts[value] += 1
+        else:
+            counts[value] = 1
+            order.append(value)
+    return order, counts
+
+
+def count_ipv4_file(path, chunk_size=CHUNK_SIZE):
+    with open(path, "rb") as f:
+        return count_ipv4_chunks(iter_file_chunks(f, chunk_size))
+
+
+def unique_ipv4_texts(path, chunk_size=CHUNK_SIZE):
+    order, _counts = count_ipv4_file(path, chunk_size)
+    return [ipv4_int_to_text(value) for value in order]
+
+
+def write_ip_counts(path, order, counts):
+    # Most frequent first; ties keep first-seen order.
+    position = dict((value, index) for index, value in enumerate(order))
+    with open(path, "w") as f:
+        for value in sorted(order, key=lambda item: (-counts[item], position[item])):
+            f.write("%s\t%d\n" % (ipv4_int_to_text(value), counts[value]))
+
+
+def read_ip_counts(path):
+    # {ip: count} from a write_ip_counts file; malformed lines are skipped.
+    counts = {}
+    with open(path, "r") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 2 and fields[1].isdigit():
+                counts[fields[0]] = int(fields[1])
+    return counts
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+import bisect
+import socket
+import struct
+from socket import inet_aton, inet_ntoa
+
+try:
+    text_type = unicode  # Py2
+except NameError:
+    text_type = str
+
+try:
+    binary_type = bytes
+except NameError:
+    binary_type = str
+
+
+MAX_IPV4 = 0xffffffff
+UINT32_BE = struct.Struct("!I")
+
+
+def to_text(value):
+    if isinstance(value, text_type):
+        return value
+    if isinstance(value, binary_type):
+        return value.decode("utf-8", "replace")
+    return text_type(value)
+
+
+def parse_ipv4_int(value):
+    parts = to_text(value).strip().split(".")
+    if len(parts) != 4:
+        return None
+    result = 0
+    for part in parts:
+        if not part.isdigit() or len(part) > 3:
+            return None
+        octet = int(part)
+        if octet > 255:
+            return None
+        result = (result << 8) | octet
+    return result
+
+
+def ipv4_int_to_text(value):
+    return "%d.%d.%d.%d" % ((value >> 24) & 0xff, (value >> 16) & 0xff, (value >> 8) & 0xff, value & 0xff)
+
+
+def prefix_mask(prefix):
+    if prefix <= 0:
+        return 0
+    return (MAX_IPV4 << (32 - prefix)) & MAX_IPV4
+
+
+def network_bounds(ip_int, prefix):
+    first = ip_int & prefix_mask(prefix)
+    return first, first | (MAX_IPV4 ^ prefix_mask(prefix))
+
+
+def cidr_to_bounds(value):
+    value = to_text(value).strip()
+    if "/" in value:
+        ip_text, prefix_text = value.split("/", 1)
+        if not prefix_text.isdigit():
+            raise ValueError("invalid IPv4 prefix length: %s" % value)
+        prefix = int(prefix_text)
+    else:
+        ip_text = value
+        prefix = 32
+    if prefix < 0 or prefix > 32:
+        raise ValueError("invalid IPv4 prefix length: %s" % value)
+    ip_int = parse_ipv4_int(ip_text)
+    if ip_int is None:
+        raise ValueError("invalid IPv4 address: %s" % value)
+    first, last = network_bounds(ip_int, prefix)
+    return first, last, prefix
+
+
+def bounds_to_cidr(first, prefix):
+    return "%s/%d" % (ipv4_int_to_text(first), prefix)
+
+
+def sorted_unique_ints(values):
+    return sorted(set(values))
+
+
+def ints_from_ips(ips):
+    # inet_aton is much faster than parse_ipv4_int but also accepts short
+    # and octal forms; only canonical dotted quads that survive the round
+    # trip take the fast path.
+    result = []
+    for ip in ips:
+        try:
+            packed = inet_aton(ip)
+        except (socket.error, TypeError, ValueError, UnicodeError):
+            packed = None
+        if packed is not None and inet_ntoa(packed) == ip:
+            result.append(UINT32_BE.unpack(packed)[0])
+            continue
+        value = parse_ipv4_int(ip)
+        if value is not None:
+            result.append(value)
+    return result
+
+
+def count_in_range(sorted_ints, first, last):
+    return bisect.bisect_right(sorted_ints, last) - bisect.bisect_left(sorted_ints, first)
+
+
+def build_interval_index(intervals):
+    starts = []
+    ends = []
+    for first, last in sorted(intervals):
+        if ends and first <= ends[-1] + 1:
+            if last > ends[-1]:
+                ends[-1] = last
+            continue
+        starts.append(first)
+        ends.append(last)
+    return starts, ends
+
+
+def interval_index_from_cidrs(cidrs):
+    intervals = []
+    for cidr in cidrs:
+        try:
+            first, last, _prefix = cidr_to_bounds(cidr)
+        except ValueError:
+            continue
+        intervals.append((first, last))
+    return build_interval_index(intervals)
+
+
+def interval_index_overlaps(index, first, last):
+    starts, ends = index
+    position = bisect.bisect_right(starts, last) - 1
+    return position >= 0 and ends[position] >= first
+
+
+def interval_index_covers(index, first, last):
+    starts, ends = index
+    position = bisect.bisect_right(starts, first) - 1
+    return position >= 0 and ends[position] >= last
+
+
+def sorted_ipv4_items(items):
+    entries = []
+    for ip, payload in items:
+        value = parse_ipv4_int(ip)
+        if value is not None:
+            entries.append((value, payload))
+    entries.sort(key=lambda entry: entry[0])
+    return [entry[0] for entry in entries], [entry[1] for entry in entries]
+
+
+def interval_join(sorted_ints, intervals):
+    # Sort-merge join of (first, last) intervals against sorted IP ints.
+    # Returns one (start, end) slice per interval, in input order; nested
+    # and overlapping intervals are allowed.
+    slices = [None] * len(intervals)
+    low = 0
+    for position in sorted(range(len(intervals)), key=lambda i: intervals[i]):
+        first, last = intervals[position]
+        low = bisect.bisect_left(sorted_ints, first, low)
+        slices[position] = (low, bisect.bisect_right(sorted_ints, last, low))
+    return slices
+
+
+def count_common(sorted_a, sorted_b):
+    # Size of the intersection of two sorted unique int sequences. A much
+    # smaller side is looked up by bisection; otherwise a transient set of
+    # the smaller side is cheaper than a Python-level merge.
+    if len(sorted_a) > len(sorted_b):
+        sorted_a, sorted_b = sorted_b, sorted_a
+    if len(sorted_a) * 16 >= len(sorted_b):
+        return len(set(sorted_a).intersection(sorted_b))
+    count = 0
+    low = 0
+    for value in sorted_a:
+        low = bisect.bisect_left(sorted_b, value, low)
+        if low == len(sorted_b):
+            break
+        if sorted_b[low] == value:
+            count += 1
+    return count
+
+
+def count_union(sorted_sequences, bucket_bits=8):
+    # Distinct values across sorted uint32 sequences, counted one range of
+    # the top bucket_bits at a time so only that slice is held in a set.
+    shift = 32 - bucket_bits
+    positions = [0] * len(sorted_sequences)
+    count = 0
+    for bucket in range(1 << bucket_bits):
+        limit = (bucket + 1) << shift
+        seen = set()
+        for position, values in enumerate(sorted_sequences):
+            low = positions[position]
+            high = bisect.bisect_left(values, limit, low)
+            if high > low:
+                seen.update(values[low:high])
+                positions[position] = high
+        count += len(seen)
+    return count
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import datetime as dt
+import gzip
+import os
+import re
+import sys
+
+import log_stats_store
+
+
+# Apache LogFormat strings; --log-format also takes any LogFormat string.
+LOG_FORMATS = {
+    "common": '%h %l %u %t "%r" %>s %b',
+    "combined": '%h %l %u %t "%r" %>s %b "%{Referer}i" "%{User-Agent}i"',
+    "vhost_combined": '%v:%p %h %l %u %t "%r" %>s %O "%{Referer}i" "%{User-Agent}i"',
+}
+
+DIRECTIVE_RE = re.compile(r"%[<>]?(?:\{([^}]*)\})?([a-zA-Z%])")
+QUOTED = r'[^"\\]*(?:\\.[^"\\]*)*'
+# A request line that is not "METHOD URL PROTOCOL" ("-" for a 408, or junk)
+# still matches, with method and url None. Apache writes a quote in %r as
+# \", so the URL may contain escapes (SQLi probes); it is kept as logged.
+# The URL body is unrolled like QUOTED: a per-character alternation made
+# the whole match about 1.5x slower.
+URL = r'(?:[^\s"\\]|\\.)[^\s"\\]*(?:\\.[^\s"\\]*)*'
+REQUEST = r'(?:(?P<method>[A-Z]+) (?P<url>%s)(?: %s)?|%s)' % (URL, QUOTED, QUOTED)
+
+DATE_CACHE = {}
+
+
+def directive_pattern(letter, arg, quoted):
+    # (group name or None, regex) for one LogFormat directive.
+    if letter in "ha":
+        return "ip", r"\S+"
+    if letter in "vV":
+        return "vhost", r"[^\s:]+"
+    if letter == "t":
+        return "time", None
+    if letter == "r":
+        return "request", None
+    if letter == "s":
+        return "status", r"\d{3}|-"
+    if letter == "%":
+        return None, "%"
+    if letter == "i" and arg.lower() == "referer":
+        return "referer", QUOTED
+    if letter == "i" and arg.lower() == "user-agent":
+        return "user_agent", QUOTED
+    return None, QUOTED if quoted else r"\S+"
+
+
+def log_format_source(log_format, fields=None):
+    # fields: the entry fields the caller reads; other directives are
+    # matched without a group. vhost is always captured for entry["site"].
+    def wanted(name):
+        return fields is None or name in fields or name == "vhost"
+
+    parts = []
+    used = set()
+    quoted = False
+    position = 0
+    for match in DIRECTIVE_RE.finditer(log_format):
+        literal = log_format[position:match.start()]
+        quoted ^= literal.count('"') % 2 == 1
+        parts.append(r"\s+".join(re.escape(piece) for piece in literal.split(" ")))
+        position = match.end()
+        name, body = directive_pattern(match.group(2), match.group(1) or "", quoted)
+        if name == "time":
+            parts.append(r"\[(?P<time>[^\]]+)\]" if "time" not in used and wanted("time") else r"\[[^\]]+\]")
+        elif name == "request":
+            parts.append(REQUEST if "method" not in used and (wanted("method") or wanted("url")) else QUOTED)
+            name = "method"
+        elif name and name not in used and wanted(name):
+            parts.append("(?P<%s>%s)" % (name, body))
+        else:
+            parts.append("(?:%s)" % body)
+        if name:
+            used.add(name)
+    parts.append(re.escape(log_format[position:]))
+    return "".join(parts)
+
+
+# common, combined and vhost_combined (with the vhost token as site, port
+# included) without knowing which one a file uses. The lookahead rejects a
+# first token followed by "%l %u [", so plain lines do not backtrack.
+AUTO_PREFIX = r"(?:(?P<vhost>\S+)\s+(?!\S+\s+\S+\s+\[))?"
+AUTO_TAIL = r'(?:\s+"(?P<referer>%s)"\s+"(?P<user_agent>%s)")?' % (QUOTED, QUOTED)
+AUTO_SOURCE = AUTO_PREFIX + log_format_source(LOG_FORMATS["common"]) + AUTO_TAIL
+
+
+def compile_log_format(log_format="auto", fields=None):
+    # "auto", a name from LOG_FORMATS or an Apache LogFormat string. The
+    # match is anchored at the start of the line only, so extra trailing
+    # fields are ignored. With fields, only those are captured; "auto" then
+    # also leaves out the optional referer/user agent tail.
+    if log_format != "auto":
+        return re.compile(log_format_source(LOG_FORMATS.get(log_format, log_format), fields))
+    if fields is None:
+        return re.compile(AUTO_SOURCE)
+    tail = AUTO_TAIL if "referer" in fields or "user_agent" in fields else ""
+    return re.compile(AUTO_PREFIX + log_format_source(LOG_FORMATS["common"], fields) + tail)
+
+
+def scan_fields(aggregators):
+    # Union of the fields the aggregators declare, or None (all fields) as
+    # soon as one of them does not declare any.
+    fields = set()
+    for aggregator in aggregators:
+        declared = getattr(aggregator, "fields", None)
+        if declared is None:
+            return None
+        fields.update(declared)
+    return fields
+
+
+def parse_date(date_str):
+    # Example: "01/Feb/2026:06:25:43 +0100". The date is the local date of
+    # the line, so only "01/Feb/2026" matters and is parsed once per day.
+    day = date_str[:11]
+    date_key = DATE_CACHE.get(day)
+    if date_key is None:
+        date_key = DATE_CACHE[day] = dt.datetime.strptime(day, "%d/%b/%Y").date().isoformat()
+    return date_key
+
+
+def normalize_url(url):
+    # Strip query string and fragment for generic stats.
+    if "?" in url:
+        url = url.split("?", 1)[0]
+    if "#" in url:
+        url = url.split("#", 1)[0]
+    return url
+
+
+def site_from_path(path):
+    name = os.path.basename(path)
+    for suffix in (".gz", ".log", ".log.1", ".txt"):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name or "unknown"
+
+
+def open_log(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def match_entry(line, pattern, site):
+    # Fields of one line as a dict (ip, vhost, time, method, url, status,
+    # referer, user_agent; missing ones None) plus site: the vhost of the
+    # line or the given fallback. None when the line does not match.
+    match = pattern.match(line)
+    if match is None:
+        return None
+    entry = match.groupdict()
+    entry["site"] = entry.get("vhost") or site
+    return entry
+
+
+def scan_logs(paths, aggregators, log_format="auto", offsets=None, show_errors=False):
+    # Read each file once and hand every matching line to all aggregators
+    # (objects with add(entry) and optionally fields, the entry keys they
+    # read; when all declare fields the others are not captured). With
+    # offsets ({path: {"inode", "offset"}}, updated in place) entry["new"]
+    # is False for lines before the stored
+    # offset; if every aggregator has new_lines_only those lines are not
+    # read at all. Rotated .gz files are never new and get no offset.
+    pattern = compile_log_format(log_format, scan_fields(aggregators))
+    match = pattern.match
+    adders = [aggregator.add for aggregator in aggregators]
+    full = any(not getattr(aggregator, "new_lines_only", False) for aggregator in aggregators)
+    stats = {"files": 0, "lines": 0, "matched": 0}
+    for path in paths:
+        gz = path.endswith(".gz")
+        if offsets is not None and gz and not full:
+            continue
+        site = site_from_path(path)
+        key = log_stats_store.offset_key(path)
+        with open_log(path) as f:
+            stats["files"] += 1
+            stat = os.fstat(f.fileno())
+            new_from = 0
+            if offsets is not None:
+                new_from = float("inf") if gz else log_stats_store.file_start_offset(stat, offsets.get(key))
+            offset = 0 if full else new_from
+            lines = matched = 0
+            for line, offset in log_stats_store.iter_log_lines(f, offset, complete_only=offsets is not None and not gz):
+                lines += 1
+                found = match(line)
+                if found is None:
+                    if show_errors:
+                        sys.stderr.write("No match: {}\n".format(line.rstrip("\r\n")))
+                    continue
+                matched += 1
+                entry = found.groupdict()
+                entry["site"] = entry.get("vhost") or site
+                entry["new"] = offset > new_from
+                for add in adders:
+                    add(entry)
+            stats["lines"] += lines
+            stats["matched"] += matched
+            if offsets is not None and not gz:
+                offsets[key] = {"inode": stat.st_ino, "offset": offset}
+    return stats
+
+
+class DateStats(object):
+    # Per-date URL/IP/IP+URL counts for log_stats_store, new lines only.
+    new_lines_only = True
+    fields = ("ip", "time", "url")
+
+    def __init__(self, batch=None):
+        self.batch = batch if batch is not None else log_stats_store.CountBatch()
+        self.counted = 0
+
+    def add(self, entry):
+        url = entry.get("url")
+        if url is None or not entry["new"]:
+            return
+        self.batch.add(parse_date(entry["time"]), entry["ip"], normalize_url(url))
+        self.counted += 1
+
+
+class PrefixHits(object):
+    # {ip: hits} for URLs under prefix, optionally on one date only.
+    fields = ("ip", "time", "url")
+
+    def __init__(self, prefix="/accounts/", date_filter=None):
+        self.prefix = prefix
+        self.date_filter = date_filter
+        self.hits = {}
+
+    def add(self, entry):
+        url = entry.get("url")
+        if url is None or not url.startswith(self.prefix):
+            return
+        if self.date_filter and parse_date(entry["time"]) != self.date_filter:
+            return
+        ip = entry["ip"]
+        self.hits[ip] = self.hits.get(ip, 0) + 1
+
+    def at_least(self, min_hits):
+        return dict((ip, hits) for ip, hits in self.hits.items() if hits >= min_hits)
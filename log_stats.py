@@ -3,12 +3,11 @@ import argparse
 import datetime as dt
 import json
 import os
-import re
 import sys
+import time
 
-LOG_PATTERN = re.compile(
-    r'^(?P<ip>\S+)\s+\S+\s+\S+\s+\[(?P<dt>[^\]]+)\]\s+"(?P<method>[A-Z]+)\s+(?P<url>\S+)\s+[^"]+"\s+\d{3}\s+\S+\s+"[^"]*"\s+"[^"]*"'
-)
+import log_scan
+import log_stats_store
 
 
 def load_db(path):
@@ -18,68 +17,61 @@ def load_db(path):
         return json.load(f)
 
 
-def save_db(path, data):
-    data["updated_at"] = dt.datetime.now(dt.timezone.utc).isoformat()
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, sort_keys=True, ensure_ascii=True)
-
-
-def parse_date(date_str):
-    parsed = dt.datetime.strptime(date_str, "%d/%b/%Y:%H:%M:%S %z")
-    return parsed.date().isoformat()
-
-
-def normalize_url(url):
-    # Strip query string and fragment for generic stats.
-    return url.split("?", 1)[0].split("#", 1)[0]
-
-
-def ensure_date_bucket(db, date_key):
-    dates = db["dates"]
-    if date_key not in dates:
-        dates[date_key] = {
-            "total_requests": 0,
-            "urls": {},
-            "ips": {},
-            "ip_urls": {},
-        }
-    return dates[date_key]
-
-
-def add_count(counter, key, amount=1):
-    counter[key] = counter.get(key, 0) + amount
-
-
-def add_ip_url(bucket, ip, url):
-    ip_urls = bucket["ip_urls"]
-    if ip not in ip_urls:
-        ip_urls[ip] = {}
-    add_count(ip_urls[ip], url)
-
-
-def parse_logs(log_paths, db, show_errors=False):
-    parsed_lines = 0
-    matched_lines = 0
-    for log_path in log_paths:
-        with open(log_path, "r", encoding="utf-8", errors="replace") as f:
-            for line in f:
-                parsed_lines += 1
-                match = LOG_PATTERN.match(line)
-                if not match:
-                    if show_errors:
-                        sys.stderr.write("No match: {}\n".format(line.rstrip("\n")))
-                    continue
-                matched_lines += 1
-                date_key = parse_date(match.group("dt"))
-                url = normalize_url(match.group("url"))
-                ip = match.group("ip")
-
-                bucket = ensure_date_bucket(db, date_key)
-                bucket["total_requests"] += 1
-                add_count(bucket["urls"], url)
-                add_count(bucket["ips"], ip)
-                add_ip_url(bucket, ip, url)
-    return parsed_lines, matched_lines
+def utc_timestamp():
+    return dt.datetime.now(dt.timezone.utc).isoformat()
+
+
+def parse_logs(log_paths, batch, show_errors=False, offsets=None, log_format="auto"):
+    # With offsets ({path: {"inode", "offset"}}, updated in place) only the
+    # complete lines after each file's stored offset are read.
+    counts = log_scan.DateStats(batch)
+    stats = log_scan.scan_logs(log_paths, [counts], log_format, offsets=offsets, show_errors=show_errors)
+    return stats["lines"], counts.counted
+
+
+def parse_into_store(conn, log_paths, show_errors=False, log_format="auto"):
+    # Counts for the new lines only; the merge touches just their dates and
+    # stores the new offsets in the same transaction.
+    batch = log_stats_store.CountBatch()
+    offsets = log_stats_store.load_file_offsets(conn)
+    parsed, matched = parse_logs(log_paths, batch, show_errors=show_errors, offsets=offsets, log_format=log_format)
+    log_stats_store.merge_buckets(conn, batch.to_buckets(), utc_timestamp(), offsets)
+    return parsed, matched, len(batch)
+
+
+def follow_logs(conn, log_paths, show_errors=False, flush_seconds=60.0, poll_seconds=1.0, max_polls=None, log_format="auto"):
+    offsets = log_stats_store.load_file_offsets(conn)
+    batch = log_stats_store.CountBatch()
+    pending = 0
+    last_flush = time.time()
+    polls = 0
+
+    def flush():
+        log_stats_store.merge_buckets(conn, batch.to_buckets(), utc_timestamp(), offsets)
+        print("Flushed {} lines ({} dates) at {}".format(pending, len(batch), utc_timestamp()))
+        sys.stdout.flush()
+        batch.clear()
+
+    try:
+        while max_polls is None or polls < max_polls:
+            try:
+                parsed, _matched = parse_logs(log_paths, batch, show_errors=show_errors, offsets=offsets, log_format=log_format)
+                pending += parsed
+            except (IOError, OSError) as exc:
+                # A log can be missing for a moment during rotation.
+                sys.stderr.write("WARNING: {}\n".format(exc))
+            if pending and time.time() - last_flush >= flush_seconds:
+                flush()
+                pending = 0
+                last_flush = time.time()
+            polls += 1
+            if max_polls is None or polls < max_polls:
+                time.sleep(poll_seconds)
+    except KeyboardInterrupt:
+        pass
+    if pending:
+        flush()
+    return 0
 
 
 def is_static_url(url):
@@ -97,35 +89,31 @@ def is_static_url(url):
     return lower_url.endswith(static_exts)
 
 
-def report(db, date_key=None, top_urls=20, top_ips=20, include_static=False, per_ip_urls=5):
-    dates = db.get("dates", {})
-    if not dates:
+def report(conn, date_key=None, top_urls=20, top_ips=20, include_static=False, per_ip_urls=5):
+    totals = log_stats_store.date_totals(conn)
+    if not totals:
         print("No data in database.")
         return 0
 
     if date_key is None:
         print("Available dates:")
-        for key in sorted(dates.keys()):
-            print("  {}: {} requests".format(key, dates[key].get("total_requests", 0)))
+        for key, total in totals:
+            print("  {}: {} requests".format(key, total))
         print("Use --date YYYY-MM-DD to show details.")
         return 0
 
-    if date_key not in dates:
+    totals_by_date = dict(totals)
+    if date_key not in totals_by_date:
         print("Date not found: {}".format(date_key))
-        print("Available dates: {}".format(", ".join(sorted(dates.keys()))))
+        print("Available dates: {}".format(", ".join(key for key, _total in totals)))
         return 1
 
-    bucket = dates[date_key]
     print("Date: {}".format(date_key))
-    print("Total requests: {}".format(bucket.get("total_requests", 0)))
-
-    urls = bucket.get("urls", {})
-    ips = bucket.get("ips", {})
-    ip_urls = bucket.get("ip_urls", {})
+    print("Total requests: {}".format(totals_by_date[date_key]))
 
     print("\nTop URLs:")
     shown = 0
-    for url, count in sorted(urls.items(), key=lambda x: x[1], reverse=True):
+    for url, count in log_stats_store.iter_top_urls(conn, date_key):
         if not include_static and is_static_url(url):
             continue
         print("  {}  {}".format(count, url))
@@ -136,13 +124,11 @@ def report(db, date_key=None, top_urls=20, top_ips=20, include_static=False, per
         print("  (no non-static URLs found)")
 
     print("\nTop IPs:")
-    shown_ips = 0
-    for ip, count in sorted(ips.items(), key=lambda x: x[1], reverse=True):
+    for ip, count in log_stats_store.top_ips(conn, date_key, top_ips):
         print("  {}  {}".format(count, ip))
         if per_ip_urls > 0:
-            urls_for_ip = ip_urls.get(ip, {})
             shown_urls = 0
-            for url, ucount in sorted(urls_for_ip.items(), key=lambda x: x[1], reverse=True):
+            for url, ucount in log_stats_store.iter_ip_urls(conn, date_key, ip):
                 if not include_static and is_static_url(url):
                     continue
                 print("      {}  {}".format(ucount, url))
@@ -151,32 +137,37 @@ def report(db, date_key=None, top_urls=20, top_ips=20, include_static=False, per
                     break
             if shown_urls == 0:
                 print("      (no non-static URLs found)")
-        shown_ips += 1
-        if shown_ips >= top_ips:
-            break
 
     return 0
 
 
 def build_parser():
     parser = argparse.ArgumentParser(
-        description="Parse custom access logs and store per-date stats in a JSON database."
+        description="Parse custom access logs and store per-date stats in a SQLite database."
     )
     subparsers = parser.add_subparsers(dest="command", required=True)
 
-    parse_cmd = subparsers.add_parser("parse", help="Parse logs and update JSON database.")
+    parse_cmd = subparsers.add_parser("parse", help="Parse logs and add their counts to the database.")
     parse_cmd.add_argument("--log", action="append", required=True, help="Log file path (repeatable).")
-    parse_cmd.add_argument("--db", default="log_stats.json", help="Path to JSON database.")
+    parse_cmd.add_argument("--db", default="log_stats.sqlite", help="Path to SQLite database.")
     parse_cmd.add_argument("--show-errors", action="store_true", help="Print lines that do not match.")
+    parse_cmd.add_argument("--log-format", default="auto", help="auto, common, combined, vhost_combined or an Apache LogFormat string.")
+    parse_cmd.add_argument("--follow", action="store_true", help="Keep reading new lines until interrupted.")
+    parse_cmd.add_argument("--flush-seconds", type=float, default=60.0, help="With --follow, write counts at most this often.")
+    parse_cmd.add_argument("--poll-seconds", type=float, default=1.0, help="With --follow, wait between reads.")
 
-    report_cmd = subparsers.add_parser("report", help="Show statistics from the JSON database.")
-    report_cmd.add_argument("--db", default="log_stats.json", help="Path to JSON database.")
+    report_cmd = subparsers.add_parser("report", help="Show statistics from the database.")
+    report_cmd.add_argument("--db", default="log_stats.sqlite", help="Path to SQLite database.")
     report_cmd.add_argument("--date", help="Date to report (YYYY-MM-DD).")
     report_cmd.add_argument("--top-urls", type=int, default=20, help="Number of URLs to show.")
     report_cmd.add_argument("--top-ips", type=int, default=20, help="Number of IPs to show.")
     report_cmd.add_argument("--include-static", action="store_true", help="Include static assets in URL report.")
     report_cmd.add_argument("--per-ip-urls", type=int, default=5, help="Number of URLs to show under each IP.")
 
+    import_cmd = subparsers.add_parser("import-json", help="Merge an old log_stats.json into the database.")
+    import_cmd.add_argument("--json", default="log_stats.json", help="Path to the old JSON database.")
+    import_cmd.add_argument("--db", default="log_stats.sqlite", help="Path to SQLite database.")
+
     return parser
 
 
@@ -185,17 +176,25 @@ def main():
     args = parser.parse_args()
 
     if args.command == "parse":
-        db = load_db(args.db)
-        parsed, matched = parse_logs(args.log, db, show_errors=args.show_errors)
-        save_db(args.db, db)
-        print("Parsed {} lines, matched {} lines.".format(parsed, matched))
-        print("Database saved to {}".format(args.db))
+        conn = log_stats_store.connect(args.db)
+        if args.follow:
+            return follow_logs(conn, args.log, args.show_errors, args.flush_seconds, args.poll_seconds, log_format=args.log_format)
+        parsed, matched, dates = parse_into_store(conn, args.log, show_errors=args.show_errors, log_format=args.log_format)
+        print("Parsed {} new lines, matched {} lines.".format(parsed, matched))
+        print("Database saved to {} ({} dates updated)".format(args.db, dates))
+        return 0
+
+    if args.command == "import-json":
+        data = load_db(args.json)
+        conn = log_stats_store.connect(args.db)
+        log_stats_store.merge_buckets(conn, data.get("dates", {}), utc_timestamp())
+        print("Imported {} dates from {} into {}".format(len(data.get("dates", {})), args.json, args.db))
         return 0
 
     if args.command == "report":
-        db = load_db(args.db)
+        conn = log_stats_store.connect(args.db)
         return report(
-            db,
+            conn,
             date_key=args.date,
             top_urls=args.top_urls,
             top_ips=args.top_ips,
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+    "CREATE TABLE IF NOT EXISTS date_totals (date TEXT PRIMARY KEY, total_requests INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS url_hits (date TEXT NOT NULL, url TEXT NOT NULL, hits INTEGER NOT NULL, PRIMARY KEY (date, url))",
+    "CREATE TABLE IF NOT EXISTS ip_hits (date TEXT NOT NULL, ip TEXT NOT NULL, hits INTEGER NOT NULL, PRIMARY KEY (date, ip))",
+    "CREATE TABLE IF NOT EXISTS ip_url_hits (date TEXT NOT NULL, ip TEXT NOT NULL, url TEXT NOT NULL, hits INTEGER NOT NULL, PRIMARY KEY (date, ip, url))",
+    # URL-prefix queries over all dates ("/accounts/" hits per IP) read
+    # only this index.
+    "CREATE INDEX IF NOT EXISTS ip_url_hits_by_url ON ip_url_hits (url, ip, date, hits)",
+    # Bytes of each log already counted; stored with the counts so a
+    # crash cannot count lines twice.
+    "CREATE TABLE IF NOT EXISTS file_offsets (path TEXT PRIMARY KEY, inode INTEGER NOT NULL, offset INTEGER NOT NULL)",
+]
+
+
+def connect(path):
+    conn = sqlite3.connect(path)
+    for statement in SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    return conn
+
+
+def new_bucket():
+    return {"total_requests": 0, "urls": {}, "ips": {}, "ip_urls": {}}
+
+
+class CountBatch(object):
+    # Counts of one parse before they are merged. Every URL and IP string is
+    # stored once and replaced by an integer id, and each line adds to a
+    # single int-keyed map per date (ip_id << 32 | url_id); the per-URL and
+    # per-IP totals are summed from it when the batch is expanded.
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.url_ids = {}
+        self.urls = []
+        self.ip_ids = {}
+        self.ips = []
+        # date -> [total_requests, {ip_id << 32 | url_id: hits}]
+        self.dates = {}
+
+    def __len__(self):
+        return len(self.dates)
+
+    def add(self, date_key, ip, url):
+        url_id = self.url_ids.get(url)
+        if url_id is None:
+            url_id = self.url_ids[url] = len(self.urls)
+            self.urls.append(url)
+        ip_id = self.ip_ids.get(ip)
+        if ip_id is None:
+            ip_id = self.ip_ids[ip] = len(self.ips)
+            self.ips.append(ip)
+        counts = self.dates.get(date_key)
+        if counts is None:
+            counts = self.dates[date_key] = [0, {}]
+        counts[0] += 1
+        pairs = counts[1]
+        pair = (ip_id << 32) | url_id
+        pairs[pair] = pairs.get(pair, 0) + 1
+
+    def to_buckets(self):
+        # The string-keyed per-date shape merge_buckets and the old JSON use.
+        urls = self.urls
+        ips = self.ips
+        buckets = {}
+        for date_key, (total, pairs) in self.dates.items():
+            bucket = buckets[date_key] = new_bucket()
+            bucket["total_requests"] = total
+            url_hits = bucket["urls"]
+            ip_hits = bucket["ips"]
+            ip_urls = bucket["ip_urls"]
+            for pair, hits in pairs.items():
+                ip = ips[pair >> 32]
+                url = urls[pair & 0xffffffff]
+                url_hits[url] = url_hits.get(url, 0) + hits
+                ip_hits[ip] = ip_hits.get(ip, 0) + hits
+                ip_urls.setdefault(ip, {})[url] = hits
+        return buckets
+
+
+def merge_rows(conn, table, key_columns, rows):
+    # Add hits to existing rows; INSERT OR IGNORE plus UPDATE works on the
+    # old SQLite versions that ship with python2 (no UPSERT).
+    rows = list(rows)
+    where = " AND ".join("%s = ?" % column for column in key_columns)
+    conn.executemany(
+        "INSERT OR IGNORE INTO %s (%s, hits) VALUES (%s, 0)" % (table, ", ".join(key_columns), ", ".join("?" * len(key_columns))),
+        [row[:-1] for row in rows],
+    )
+    conn.executemany(
+        "UPDATE %s SET hits = hits + ? WHERE %s" % (table, where),
+        [(row[-1],) + tuple(row[:-1]) for row in rows],
+    )
+
+
+def merge_buckets(conn, buckets, updated_at=None, file_offsets=None):
+    # buckets: {date: {"total_requests", "urls", "ips", "ip_urls"}}, the
+    # per-date shape of the old log_stats.json. Only these dates are touched.
+    with conn:
+        for path, state in (file_offsets or {}).items():
+            conn.execute(
+                "INSERT OR REPLACE INTO file_offsets (path, inode, offset) VALUES (?, ?, ?)",
+                (path, state["inode"], state["offset"]),
+            )
+        for date_key, bucket in buckets.items():
+            conn.execute("INSERT OR IGNORE INTO date_totals (date, total_requests) VALUES (?, 0)", (date_key,))
+            conn.execute(
+                "UPDATE date_totals SET total_requests = total_requests + ? WHERE date = ?",
+                (bucket.get("total_requests", 0), date_key),
+            )
+            merge_rows(conn, "url_hits", ("date", "url"), ((date_key, url, hits) for url, hits in bucket.get("urls", {}).items()))
+            merge_rows(conn, "ip_hits", ("date", "ip"), ((date_key, ip, hits) for ip, hits in bucket.get("ips", {}).items()))
+            merge_rows(
+                conn,
+                "ip_url_hits",
+                ("date", "ip", "url"),
+                ((date_key, ip, url, hits) for ip, urls in bucket.get("ip_urls", {}).items() for url, hits in urls.items()),
+            )
+        if updated_at:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('updated_at', ?)", (updated_at,))
+
+
+def load_file_offsets(conn):
+    return dict(
+        (path, {"inode": inode, "offset": offset})
+        for path, inode, offset in conn.execute("SELECT path, inode, offset FROM file_offsets")
+    )
+
+
+def file_start_offset(stat, state):
+    # A different inode (rotated) or a file shorter than the stored offset
+    # (truncated or copytruncate rotation) is read from the start.
+    if not state or state["inode"] != stat.st_ino or stat.st_size < state["offset"]:
+        return 0
+    return state["offset"]
+
+
+def iter_log_lines(f, offset, complete_only=True):
+    # (decoded line, offset after it) from offset on. A last line without
+    # newline is still being written and is left for the next parse.
+    f.seek(offset)
+    for raw in f:
+        if complete_only and not raw.endswith(b"\n"):
+            return
+        offset += len(raw)
+        yield raw.decode("utf-8", "replace"), offset
+
+
+def offset_key(path):
+    return os.path.abspath(path)
+
+
+def date_totals(conn):
+    return conn.execute("SELECT date, total_requests FROM date_totals ORDER BY date").fetchall()
+
+
+def iter_top_urls(conn, date_key):
+    return conn.execute("SELECT url, hits FROM url_hits WHERE date = ? ORDER BY hits DESC, url", (date_key,))
+
+
+def top_ips(conn, date_key, limit):
+    return conn.execute("SELECT ip, hits FROM ip_hits WHERE date = ? ORDER BY hits DESC, ip LIMIT ?", (date_key, limit)).fetchall()
+
+
+def iter_ip_urls(conn, date_key, ip):
+    return conn.execute("SELECT url, hits FROM ip_url_hits WHERE date = ? AND ip = ? ORDER BY hits DESC, url", (date_key, ip))
+
+
+def prefix_upper_bound(prefix):
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def prefix_hits_by_ip(conn, prefix, date_key=None, min_hits=1):
+    # {ip: hits} for URLs starting with prefix, as a range scan on the url
+    # index instead of a walk over every date's nested ip_urls.
+    sql = "SELECT ip, SUM(hits) FROM ip_url_hits WHERE url >= ?"
+    params = [prefix]
+    if prefix:
+        sql += " AND url < ?"
+        params.append(prefix_upper_bound(prefix))
+    if date_key:
+        sql += " AND date = ?"
+        params.append(date_key)
+    sql += " GROUP BY ip HAVING SUM(hits) >= ?"
+    params.append(min_hits)
+    return dict(conn.execute(sql, params).fetchall())
@@ -21,7 +21,7 @@ def build_headers(args):
     return status_monitor.parse_headers(headers)
 
 
-def build_prepare_env(args):
+def build_prepare_env(args, input_file=None):
     env = os.environ.copy()
     env["POLICY_MODE"] = str(args.policy_mode)
     env["TARGET_PREFIX"] = str(args.target_prefix)
@@ -30,20 +30,21 @@ def build_prepare_env(args):
     env["PYTHON"] = args.python_bin
     env["UFW_USER_RULES"] = args.user_rules
     env["FAST_UFW_BACKUP"] = "0" if args.no_ufw_backup else "1"
+    # The loop already fetched the page; the fast-all script reads it
+    # instead of running curl against the overloaded server again.
+    env["INPUT_FILE"] = input_file or args.input_file
+    env["FETCH_SERVER_STATUS"] = "0"
     return env
 
 
-def fetch_busy_requests(args):
-    status = status_monitor.fetch_url(
+def fetch_status(args):
+    # The keep-alive connection is reused by every iteration of the loop.
+    return status_monitor.fetch_url(
         args.url,
         args.timeout,
         insecure=args.insecure,
         headers=build_headers(args),
     )
-    busy = status_monitor.parse_busy_requests(status)
-    if busy is None:
-        raise RuntimeError("could not parse busy request count from server-status")
-    return busy
 
 
 def run_prepare_script(args):
@@ -54,9 +55,12 @@ def run_prepare_script(args):
         raise RuntimeError("%s failed with exit code %d" % (args.script, proc.returncode))
 
 
-def run_once(args, fetch_func=fetch_busy_requests, run_func=run_prepare_script):
+def run_once(args, fetch_func=fetch_status, run_func=run_prepare_script):
     print("Started at:", current_timestamp())
-    busy = fetch_func(args)
+    status = fetch_func(args)
+    busy = status_monitor.parse_busy_requests(status)
+    if busy is None:
+        raise RuntimeError("could not parse busy request count from server-status")
     print("Busy requests:", busy)
     print("Threshold:", args.threshold)
 
@@ -64,7 +68,8 @@ def run_once(args, fetch_func=fetch_busy_requests, run_func=run_prepare_script):
         print("Below threshold. No block run.")
         return 0
 
-    print("Threshold exceeded. Running:", args.script)
+    status_monitor.write_text(args.input_file, status)
+    print("Threshold exceeded. Wrote %s. Running: %s" % (args.input_file, args.script))
     run_func(args)
     print("Block run complete.")
     return 0
@@ -75,7 +80,8 @@ def build_parser():
     parser.add_argument("--url", default="https://www.nieuwejobs.com/server-status")
     parser.add_argument("--threshold", type=int, default=100)
     parser.add_argument("--sleep-seconds", type=int, default=300)
-    parser.add_argument("--timeout", type=int, default=30)
+    parser.add_argument("--timeout", type=int, default=30, help="Cap on the whole server-status fetch in seconds")
+    parser.add_argument("--input-file", default="input.txt", help="Where the fetched page is written for the block run")
     parser.add_argument("--insecure", action="store_true", help="Disable SSL certificate verification for trusted status endpoints")
     parser.add_argument("--header", action="append", default=[], help="HTTP header for server-status fetch, for example 'Host: www.example.com'")
     parser.add_argument("--host-header", help="Shortcut for --header 'Host: ...' when fetching a local vhost URL")
@@ -3,17 +3,14 @@ from __future__ import print_function
 
 import argparse
 import os
-import re
 import shutil
-import ssl
 import subprocess
 import sys
 import time
 
-try:
-    from urllib2 import urlopen, Request
-except ImportError:
-    from urllib.request import urlopen, Request
+import status_http
+import status_trend
+from server_status import parse_busy_workers, parse_server_status
 
 try:
     text_type = unicode
@@ -21,9 +18,6 @@ except NameError:
     text_type = str
 
 
-BUSY_RE = re.compile(r"\b(\d+)\s+requests currently being processed\b")
-
-
 def to_text(value):
     if isinstance(value, text_type):
         return value
@@ -31,16 +25,8 @@ def to_text(value):
 
 
 def parse_busy_requests(status_text):
-    match = BUSY_RE.search(status_text)
-    if not match:
-        return None
-    return int(match.group(1))
-
-
-def insecure_ssl_context():
-    if hasattr(ssl, "_create_unverified_context"):
-        return ssl._create_unverified_context()
-    return None
+    # HTML, text copies and the ?auto format (BusyWorkers:) are accepted.
+    return parse_busy_workers(status_text)
 
 
 def parse_headers(values):
@@ -58,14 +44,9 @@ def parse_headers(values):
 
 
 def fetch_url(url, timeout, insecure=False, headers=None):
-    request = Request(url, headers=headers or {"User-Agent": "DropIPsByCountry-monitor/1.0"})
-    context = insecure_ssl_context() if insecure else None
-    if context is not None:
-        response = urlopen(request, timeout=timeout, context=context)
-    else:
-        response = urlopen(request, timeout=timeout)
-    data = response.read()
-    return to_text(data)
+    # Keep-alive connection per endpoint, reused by later polls in the same
+    # process; timeout caps the whole fetch.
+    return to_text(status_http.fetch(url, timeout, insecure=insecure, headers=headers))
 
 
 def acquire_lock(lock_dir, stale_seconds):
@@ -100,10 +81,15 @@ def current_run_timestamp():
     return time.strftime("%Y-%m-%d %H:%M:%S %Z")
 
 
-def run_prepare(script, python_bin, apply, extra_env):
+def run_prepare(script, python_bin, apply, extra_env, input_file=None):
     env = os.environ.copy()
     env["PYTHON"] = python_bin
     env["APPLY"] = "1" if apply else "0"
+    if input_file:
+        # The page this monitor fetched is the pipeline input; wrappers such
+        # as run_prepare_generiek_blocks_fast_all.sh must not fetch again.
+        env["INPUT_FILE"] = input_file
+        env["FETCH_SERVER_STATUS"] = "0"
     for item in extra_env:
         if "=" not in item:
             raise RuntimeError("invalid --env value, expected KEY=VALUE: %s" % item)
@@ -123,7 +109,7 @@ def build_parser():
     parser.add_argument("--snapshot-file", default="last_server_status.txt")
     parser.add_argument("--lock-dir", default=".server_status_block.lock")
     parser.add_argument("--stale-lock-seconds", type=int, default=7200)
-    parser.add_argument("--timeout", type=int, default=30)
+    parser.add_argument("--timeout", type=int, default=30, help="Cap on the whole server-status fetch in seconds")
     parser.add_argument("--insecure", action="store_true", help="Disable SSL certificate verification for local/self-signed server-status checks")
     parser.add_argument("--header", action="append", default=[], help="HTTP header for server-status fetch, for example 'Host: www.example.com'")
     parser.add_argument("--host-header", help="Shortcut for --header 'Host: ...' when fetching a local vhost URL")
@@ -133,9 +119,48 @@ def build_parser():
     parser.add_argument("--dry-run", action="store_true", help="Run blocker with APPLY=0")
     parser.add_argument("--env", action="append", default=[], help="Extra environment KEY=VALUE for run_prepare_generiek_blocks.sh")
     parser.add_argument("--status-file", help="Read status HTML/text from file instead of fetching URL")
+    trend = status_trend.DEFAULT_CONFIG
+    parser.add_argument("--trend-file", help="Ring buffer of earlier polls; default server_status_trend.json next to --snapshot-file")
+    parser.add_argument("--no-trend", action="store_true", help="Only trigger on busy > threshold, like a single-sample check")
+    parser.add_argument("--trend-samples", type=int, default=status_trend.DEFAULT_CAPACITY, help="Polls kept in the trend file")
+    parser.add_argument("--trend-alpha", type=float, default=trend["alpha"], help="EWMA weight of the newest busy-worker slope")
+    parser.add_argument("--trend-horizon", type=float, default=trend["horizon"], help="Seconds ahead the slope is projected; match the poll interval")
+    parser.add_argument("--trend-min-ratio", type=float, default=trend["min_ratio"], help="Early trend triggers need at least this share of the threshold busy")
+    parser.add_argument("--subnet-share", type=float, default=trend["subnet_share"], help="Trigger when one /24 holds this share of the threshold in workers")
+    parser.add_argument("--hot-subnet-workers", type=int, default=trend["hot_subnet_workers"], help="Workers for a /24 to count in repeat-run suppression")
+    parser.add_argument("--suppress-seconds", type=float, default=trend["suppress_seconds"], help="Skip a run when every hot /24 was already handled within this window")
+    parser.add_argument("--blocked-file", default="blocked_generiek_ips.txt", help="Tracking file of blocked CIDRs used for suppression")
     return parser
 
 
+def trend_config(args):
+    return {
+        "threshold": args.threshold,
+        "alpha": args.trend_alpha,
+        "horizon": args.trend_horizon,
+        "min_ratio": args.trend_min_ratio,
+        "subnet_share": args.subnet_share,
+        "hot_subnet_workers": args.hot_subnet_workers,
+        "suppress_seconds": args.suppress_seconds,
+    }
+
+
+def trend_path(args):
+    if args.trend_file:
+        return args.trend_file
+    return os.path.join(os.path.dirname(args.snapshot_file), "server_status_trend.json")
+
+
+def evaluate_trend(args, status_info, now):
+    path = trend_path(args)
+    state = status_trend.load_state(path, args.trend_samples)
+    subnets = status_trend.subnet_counts(status_info["workers"])
+    status_trend.add_sample(state, now, status_info["busy_workers"], subnets)
+    decision = status_trend.evaluate(state, trend_config(args), status_trend.load_blocked_index(args.blocked_file))
+    status_trend.save_state(path, state)
+    return path, state, decision
+
+
 def main_with_args(argv):
     args = build_parser().parse_args(argv)
     print("Started at:", current_run_timestamp())
@@ -153,20 +178,41 @@ def main_with_args(argv):
             if args.host_header:
                 headers.append("Host: %s" % args.host_header)
             status = fetch_url(args.url, args.timeout, insecure=args.insecure, headers=parse_headers(headers))
-        busy = parse_busy_requests(status)
+        status_info = parse_server_status(status)
+        busy = status_info["busy_workers"]
         if busy is None:
             raise RuntimeError("could not parse busy request count from server-status")
 
         print("Busy requests:", busy)
         print("Threshold:", args.threshold)
-        if busy <= args.threshold:
+        now = time.time()
+        if args.no_trend:
+            decision = {"trigger": busy > args.threshold, "reason": "threshold", "suppressed": False, "hot_subnets": []}
+        else:
+            path, state, decision = evaluate_trend(args, status_info, now)
+            print("Trend: %+.2f busy/min, predicted %d in %ds; hot /24s: %s" % (
+                decision["slope_per_minute"],
+                decision["predicted"],
+                args.trend_horizon,
+                ", ".join(decision["hot_subnets"]) or "none",
+            ))
+        if decision["suppressed"]:
+            print("Trigger (%s) suppressed: every hot /24 was already blocked or handled. No block run." % decision["reason"])
+            return 0
+        if not decision["trigger"]:
             print("Below threshold. No block run.")
             return 0
 
         write_text(args.snapshot_file, status)
         write_text(args.input_file, status)
-        print("Threshold exceeded. Wrote %s and %s." % (args.snapshot_file, args.input_file))
-        run_prepare(args.script, args.python_bin, not args.dry_run, args.env)
+        if decision["reason"] == "threshold":
+            print("Threshold exceeded. Wrote %s and %s." % (args.snapshot_file, args.input_file))
+        else:
+            print("Early %s trigger. Wrote %s and %s." % (decision["reason"], args.snapshot_file, args.input_file))
+        run_prepare(args.script, args.python_bin, not args.dry_run, args.env, input_file=args.input_file)
+        if not args.no_trend:
+            status_trend.record_trigger(state, decision["hot_subnets"], now, args.suppress_seconds)
+            status_trend.save_state(path, state)
         print("Block run complete.")
         return 0
     except (IOError, OSError, RuntimeError) as exc:
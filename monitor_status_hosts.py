@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+
+import monitor_fast_all_loop as fast_all_loop
+import monitor_server_status_blocks as status_monitor
+
+
+NAME_RE = re.compile(r"[^A-Za-z0-9_.-]+")
+TREND_POINTS = 5
+
+_LOG_LOCK = threading.Lock()
+
+
+def log(name, message):
+    with _LOG_LOCK:
+        print("%s [%s] %s" % (fast_all_loop.current_timestamp(), name, message))
+        sys.stdout.flush()
+
+
+def endpoint_name(url):
+    host = url.split("://", 1)[-1].split("/", 1)[0]
+    return NAME_RE.sub("_", host) or "status"
+
+
+def parse_endpoint(value):
+    # "URL" or "NAME=URL"
+    name = ""
+    url = value
+    if "=" in value.split("://", 1)[0]:
+        name, url = value.split("=", 1)
+    return {"name": NAME_RE.sub("_", name.strip()) or endpoint_name(url), "url": url.strip()}
+
+
+def load_hosts_file(path):
+    with open(path, "r") as f:
+        data = json.load(f)
+    hosts = data.get("hosts", []) if isinstance(data, dict) else data
+    endpoints = []
+    for item in hosts:
+        if not item.get("url"):
+            raise RuntimeError("host entry without url in %s" % path)
+        endpoint = dict(item)
+        endpoint["name"] = NAME_RE.sub("_", item.get("name") or endpoint_name(item["url"]))
+        endpoints.append(endpoint)
+    return endpoints
+
+
+def build_endpoints(args):
+    endpoints = load_hosts_file(args.hosts_file) if args.hosts_file else []
+    endpoints.extend(parse_endpoint(value) for value in args.endpoint)
+    if not endpoints:
+        endpoints.append(parse_endpoint(args.url))
+    names = [endpoint["name"] for endpoint in endpoints]
+    duplicates = sorted(set(name for name in names if names.count(name) > 1))
+    if duplicates:
+        raise RuntimeError("duplicate endpoint name(s): %s" % ", ".join(duplicates))
+    for endpoint in endpoints:
+        endpoint.setdefault("threshold", args.threshold)
+        endpoint.setdefault("timeout", args.timeout)
+        endpoint.setdefault("insecure", args.insecure)
+        endpoint.setdefault("host_header", args.host_header)
+        endpoint.setdefault("script", args.script)
+        endpoint.setdefault("env", {})
+    return endpoints
+
+
+class AdaptiveInterval(object):
+    # Poll interval for one endpoint. Exceeding the threshold polls at the
+    # minimum interval; busy counts that are high or rising towards the
+    # threshold halve the interval; quiet polls back off towards the maximum.
+
+    def __init__(self, threshold, min_interval, max_interval, warn_ratio=0.5, backoff=1.5):
+        self.threshold = threshold
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.warn_ratio = warn_ratio
+        self.backoff = backoff
+        self.interval = min_interval
+        self.history = collections.deque(maxlen=TREND_POINTS)
+
+    def slope(self):
+        # Least-squares busy workers per second over the recent polls.
+        if len(self.history) < 2:
+            return 0.0
+        count = float(len(self.history))
+        mean_t = sum(t for t, _busy in self.history) / count
+        mean_b = sum(busy for _t, busy in self.history) / count
+        denominator = sum((t - mean_t) ** 2 for t, _busy in self.history)
+        if not denominator:
+            return 0.0
+        return sum((t - mean_t) * (busy - mean_b) for t, busy in self.history) / denominator
+
+    def update(self, busy, now):
+        self.history.append((now, busy))
+        projected = busy + self.slope() * self.interval
+        if busy > self.threshold:
+            self.interval = self.min_interval
+        elif busy >= self.threshold * self.warn_ratio or projected > self.threshold:
+            self.interval = max(self.min_interval, self.interval / 2.0)
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+        return self.interval
+
+
+class PipelineDispatcher(object):
+    # Runs block pipelines off the polling threads. At most one run per
+    # endpoint is active; a trigger that arrives during that run replaces
+    # any older pending trigger, so the next run uses the newest page.
+
+    def __init__(self, run_func, max_parallel=1):
+        self.run_func = run_func
+        self.max_parallel = max(1, max_parallel)
+        self.condition = threading.Condition()
+        self.pending = collections.OrderedDict()
+        self.running = set()
+        self.stopping = False
+        self.threads = []
+
+    def start(self):
+        for index in range(self.max_parallel):
+            thread = threading.Thread(target=self.work, name="pipeline-%d" % index)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, endpoint, status_path):
+        with self.condition:
+            self.pending.pop(endpoint["name"], None)
+            self.pending[endpoint["name"]] = (endpoint, status_path)
+            self.condition.notify()
+
+    def next_job(self):
+        for name in self.pending:
+            if name not in self.running:
+                return self.pending.pop(name)
+        return None
+
+    def work(self):
+        while True:
+            with self.condition:
+                job = self.next_job()
+                while job is None:
+                    if self.stopping:
+                        return
+                    self.condition.wait(1.0)
+                    job = self.next_job()
+                endpoint, status_path = job
+                self.running.add(endpoint["name"])
+            try:
+                self.run_func(endpoint, status_path)
+            except (IOError, OSError, RuntimeError) as exc:
+                log(endpoint["name"], "ERROR: %s" % exc)
+            except Exception as exc:
+                # A dead worker would leave the endpoint in running and make
+                # stop() wait forever; log the bug and keep the worker.
+                log(endpoint["name"], "ERROR: block run crashed: %s: %s" % (type(exc).__name__, exc))
+            finally:
+                with self.condition:
+                    self.running.discard(endpoint["name"])
+                    self.condition.notify_all()
+
+    def idle(self):
+        with self.condition:
+            return not self.pending and not self.running
+
+    def stop(self, wait=True):
+        if wait:
+            with self.condition:
+                while self.pending or self.running:
+                    self.condition.wait(1.0)
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+
+
+def fetch_status(endpoint):
+    headers = []
+    if endpoint.get("host_header"):
+        headers.append("Host: %s" % endpoint["host_header"])
+    headers.extend(endpoint.get("headers", []))
+    return status_monitor.fetch_url(
+        endpoint["url"],
+        endpoint["timeout"],
+        insecure=endpoint["insecure"],
+        headers=status_monitor.parse_headers(headers),
+    )
+
+
+def write_status_page(status_dir, endpoint, status):
+    path = os.path.join(status_dir, "%s.txt" % endpoint["name"])
+    tmp_path = "%s.tmp-%s" % (path, os.getpid())
+    status_monitor.write_text(tmp_path, status)
+    os.rename(tmp_path, path)
+    return path
+
+
+def make_run_func(args):
+    def run_pipeline(endpoint, status_path):
+        env = fast_all_loop.build_prepare_env(args, status_path)
+        env["RUN_ID"] = "%s-%s" % (time.strftime("%Y%m%d-%H%M%S"), endpoint["name"])
+        for key, value in endpoint.get("env", {}).items():
+            env[str(key)] = str(value)
+        log(endpoint["name"], "Running %s (RUN_ID=%s)" % (endpoint["script"], env["RUN_ID"]))
+        returncode = subprocess.call([endpoint["script"]], env=env)
+        if returncode != 0:
+            raise RuntimeError("%s failed with exit code %d" % (endpoint["script"], returncode))
+        log(endpoint["name"], "Block run complete.")
+    return run_pipeline
+
+
+def poll_once(endpoint, interval, dispatcher, status_dir, fetch_func=fetch_status, now=None):
+    name = endpoint["name"]
+    try:
+        status = fetch_func(endpoint)
+    except (IOError, OSError, RuntimeError) as exc:
+        # An overloaded server often fails its status request; keep the
+        # current interval instead of backing off.
+        log(name, "ERROR: fetch failed: %s" % exc)
+        return interval.interval
+    busy = status_monitor.parse_busy_requests(status)
+    if busy is None:
+        log(name, "ERROR: could not parse busy request count from server-status")
+        return interval.interval
+    next_interval = interval.update(busy, time.time() if now is None else now)
+    if busy > endpoint["threshold"]:
+        path = write_status_page(status_dir, endpoint, status)
+        log(name, "Busy requests: %d > %d. Queued block run; next poll in %.0fs." % (busy, endpoint["threshold"], next_interval))
+        dispatcher.submit(endpoint, path)
+    else:
+        log(name, "Busy requests: %d (threshold %d); next poll in %.0fs." % (busy, endpoint["threshold"], next_interval))
+    return next_interval
+
+
+def poll_loop(endpoint, args, dispatcher, stop_event, fetch_func=fetch_status):
+    interval = AdaptiveInterval(endpoint["threshold"], args.min_interval, args.max_interval, args.warn_ratio, args.backoff)
+    while not stop_event.is_set():
+        try:
+            wait = poll_once(endpoint, interval, dispatcher, args.status_dir, fetch_func)
+        except Exception as exc:
+            # e.g. a full disk in write_status_page or ssl.CertificateError
+            # on python2; one bad poll must not end this endpoint's thread.
+            log(endpoint["name"], "ERROR: poll failed: %s: %s" % (type(exc).__name__, exc))
+            wait = interval.interval
+        stop_event.wait(wait)
+
+
+def run_monitor(args, endpoints, fetch_func=fetch_status, run_func=None):
+    if not os.path.isdir(args.status_dir):
+        os.makedirs(args.status_dir)
+    dispatcher = PipelineDispatcher(run_func or make_run_func(args), args.max_parallel_runs)
+    dispatcher.start()
+
+    if args.once:
+        # One concurrent round of polls, then wait for triggered runs.
+        threads = []
+        for endpoint in endpoints:
+            interval = AdaptiveInterval(endpoint["threshold"], args.min_interval, args.max_interval, args.warn_ratio, args.backoff)
+            thread = threading.Thread(target=poll_once, args=(endpoint, interval, dispatcher, args.status_dir, fetch_func))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        dispatcher.stop()
+        return 0
+
+    stop_event = threading.Event()
+    threads = []
+    for endpoint in endpoints:
+        thread = threading.Thread(target=poll_loop, args=(endpoint, args, dispatcher, stop_event, fetch_func), name=endpoint["name"])
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    deadline = time.time() + args.duration if args.duration else None
+    try:
+        while deadline is None or time.time() < deadline:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        log("monitor", "Stopping.")
+    stop_event.set()
+    for thread in threads:
+        thread.join()
+    dispatcher.stop()
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Poll several Apache server-status endpoints concurrently and run the block pipeline per endpoint, "
+        "polling faster while busy workers approach the threshold."
+    )
+    parser.add_argument("--endpoint", action="append", default=[], help="Status URL, or NAME=URL; repeatable")
+    parser.add_argument("--hosts-file", help="JSON list of {name, url, host_header, threshold, timeout, insecure, script, env}")
+    parser.add_argument("--url", default="https://www.nieuwejobs.com/server-status", help="Used when no --endpoint or --hosts-file is given")
+    parser.add_argument("--threshold", type=int, default=100)
+    parser.add_argument("--timeout", type=int, default=10, help="Per-endpoint fetch timeout in seconds")
+    parser.add_argument("--insecure", action="store_true", help="Disable SSL certificate verification for trusted status endpoints")
+    parser.add_argument("--host-header", help="Host header for endpoints without their own host_header")
+    parser.add_argument("--min-interval", type=float, default=5.0, help="Fastest poll interval in seconds")
+    parser.add_argument("--max-interval", type=float, default=300.0, help="Slowest poll interval in seconds")
+    parser.add_argument("--warn-ratio", type=float, default=0.5, help="Poll faster once busy workers reach this share of the threshold")
+    parser.add_argument("--backoff", type=float, default=1.5, help="Interval multiplier after a quiet poll")
+    parser.add_argument("--max-parallel-runs", type=int, default=1, help="Pipelines running at the same time; local runs share files, so keep 1 unless each host has its own script")
+    parser.add_argument("--status-dir", default="status_pages", help="Fetched pages that triggered a run, one file per endpoint")
+    parser.add_argument("--script", default="./run_prepare_generiek_blocks_fast_all.sh")
+    parser.add_argument("--python-bin", default=os.environ.get("PYTHON", "python2"))
+    parser.add_argument("--user-rules", default="/lib/ufw/user.rules")
+    parser.add_argument("--policy-mode", type=int, default=0)
+    parser.add_argument("--target-prefix", type=int, default=16)
+    parser.add_argument("--min-hits", type=int, default=1)
+    parser.add_argument("--dry-run", action="store_true", help="Run the pipeline with APPLY=0")
+    parser.add_argument("--no-ufw-backup", action="store_true", default=True, help="Run fast UFW apply without timestamped user.rules backups")
+    parser.add_argument("--with-ufw-backup", dest="no_ufw_backup", action="store_false", help="Keep timestamped user.rules backups")
+    parser.add_argument("--once", action="store_true", help="Poll every endpoint once, wait for triggered runs and exit")
+    parser.add_argument("--duration", type=float, default=0, help="Stop after this many seconds; 0 runs until interrupted")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.min_interval <= 0 or args.max_interval < args.min_interval:
+        print("ERROR: need 0 < --min-interval <= --max-interval", file=sys.stderr)
+        return 1
+    try:
+        endpoints = build_endpoints(args)
+    except (IOError, OSError, ValueError, RuntimeError) as exc:
+        print("ERROR: %s" % exc, file=sys.stderr)
+        return 1
+    log("monitor", "Polling %d endpoint(s): %s" % (len(endpoints), ", ".join(endpoint["name"] for endpoint in endpoints)))
+    return run_monitor(args, endpoints)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
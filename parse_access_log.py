@@ -1,42 +1,66 @@
-import re
-import collections
+#!/usr/bin/env python
+from __future__ import print_function
+
+import argparse
 import json
+import sys
+
+import log_scan
+
+
+class UserAgents(object):
+    # Requests, user agents and distinct URLs per IP for GET/POST/HEAD
+    # lines; an aggregator for log_scan.scan_logs.
+    methods = ("GET", "POST", "HEAD")
+
+    def __init__(self):
+        self.ips = {}
+
+    def add(self, entry):
+        if entry.get("method") not in self.methods:
+            return
+        item = self.ips.get(entry["ip"])
+        if item is None:
+            item = self.ips[entry["ip"]] = {"count": 0, "user_agents": {}, "urls": set()}
+        user_agent = entry.get("user_agent") or "-"
+        item["count"] += 1
+        item["user_agents"][user_agent] = item["user_agents"].get(user_agent, 0) + 1
+        item["urls"].add(entry["url"])
 
-# Define the log file path
-log_file_path = "/var/log/apache2/nieuwejobs_custom.log"  # Change this to the actual log file path
+    def result(self):
+        # [[ip, {"count", "user_agents", "urls"}], ...] by count, highest first.
+        rows = []
+        for ip, item in self.ips.items():
+            rows.append((ip, {"count": item["count"], "user_agents": item["user_agents"], "urls": sorted(item["urls"])}))
+        rows.sort(key=lambda row: row[1]["count"], reverse=True)
+        return rows
 
-# Regular expression to parse access log entries
-log_pattern = re.compile(
-    r'(?P<ip>[\d\.]+) - - \[.*?\] "(?:GET|POST|HEAD) (?P<url>.*?) .*?" \d+ \d+ .*? "(?P<user_agent>.*?)"'
-)
 
-# Dictionary to store occurrences
-log_data = collections.defaultdict(lambda: {"count": 0, "user_agents": collections.defaultdict(int), "urls": set()})
+def write_summary(path, rows):
+    with open(path, "w") as f:
+        json.dump(rows, f, indent=4)
 
-# Read and parse the log file
-with open(log_file_path, "r") as file:
-    for line in file:
-        match = log_pattern.search(line)
-        if match:
-            ip = match.group("ip")
-            user_agent = match.group("user_agent")
-            url = match.group("url")
-            
-            log_data[ip]["count"] += 1
-            log_data[ip]["user_agents"][user_agent] += 1
-            log_data[ip]["urls"].add(url)
 
-# Convert sets to lists for JSON serialization
-for ip in log_data:
-    log_data[ip]["urls"] = list(log_data[ip]["urls"])
+def build_parser():
+    parser = argparse.ArgumentParser(description="Summarize requests, user agents and URLs per IP from Apache access logs.")
+    parser.add_argument("--log", action="append", help="Log file path (repeatable); default /var/log/apache2/nieuwejobs_custom.log")
+    parser.add_argument("--log-format", default="auto", help="auto, common, combined, vhost_combined or an Apache LogFormat string.")
+    parser.add_argument("--output", default="log_summary.json")
+    return parser
 
-# Sort by count (descending)
-sorted_log_data = sorted(log_data.items(), key=lambda x: x[1]["count"], reverse=True)
 
-# Save the result as JSON
-output_file = "log_summary.json"
-with open(output_file, "w") as json_file:
-    json.dump(sorted_log_data, json_file, indent=4, encoding='utf-8')
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    user_agents = UserAgents()
+    try:
+        log_scan.scan_logs(args.log or ["/var/log/apache2/nieuwejobs_custom.log"], [user_agents], args.log_format)
+    except (IOError, OSError) as exc:
+        print("ERROR: %s" % exc, file=sys.stderr)
+        return 1
+    write_summary(args.output, user_agents.result())
+    print("Log data has been saved to {}".format(args.output))
+    return 0
 
-print "Log data has been saved to {}".format(output_file)
 
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,17 +1,50 @@
-import re
+#!/usr/bin/env python
+from __future__ import print_function
 
-# Bestand met input lezen
-with open("input.txt", "r") as file:
-    text = file.read()
+import argparse
+import sys
 
-# Regex patroon voor IP-adressen
-ip_pattern = r'\b(?:\d{1,3}\.){3}\d{1,3}\b'
-ip_addresses = re.findall(ip_pattern, text)
+from ipv4_extract import count_ipv4_file, write_ip_counts
+from ipv4_index import ipv4_int_to_text
 
-# Opslaan van gevonden IP-adressen in een bestand
-with open("output.txt", "w") as file:
-    for ip in ip_addresses:
-        file.write(ip + "\n")
 
-print("Gevonden IP-adressen opgeslagen in output.txt ( " + str(len(ip_addresses)) + " gevonden).")
+def write_ips(path, ip_addresses):
+    # Opslaan van gevonden IP-adressen in een bestand
+    with open(path, "w") as file:
+        for ip in ip_addresses:
+            file.write(ip + "\n")
 
+
+def parse_ip_file(input_path, output_path, counts_output=""):
+    # Unieke IP-adressen in volgorde van eerste voorkomen naar output_path;
+    # het aantal keer dat elk adres voorkwam naar counts_output.
+    order, counts = count_ipv4_file(input_path)
+    ips = [ipv4_int_to_text(value) for value in order]
+    write_ips(output_path, ips)
+    if counts_output:
+        write_ip_counts(counts_output, order, counts)
+    return ips, sum(counts.values())
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Extract unique IPv4 addresses and their occurrence counts from server-status or log text.")
+    parser.add_argument("--input", default="input.txt")
+    parser.add_argument("--output", default="output.txt", help="Unique IPs, one per line, in first-seen order")
+    parser.add_argument("--counts-output", default="output_ip_counts.txt", help="'IP<TAB>count' lines, most frequent first; empty disables")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        ips, occurrences = parse_ip_file(args.input, args.output, args.counts_output)
+    except (IOError, OSError) as exc:
+        print("ERROR: %s" % exc, file=sys.stderr)
+        return 1
+
+    print("Gevonden IP-adressen opgeslagen in %s ( %d gevonden, %d uniek)." % (args.output, occurrences, len(ips)))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -2,6 +2,7 @@
 from __future__ import print_function
 
 import argparse
+import bisect
 import codecs
 import collections
 import json
@@ -11,10 +12,12 @@ import subprocess
 import sys
 
 from country_policy import PROTECTED_COUNTRY_CODES
+from ipv4_index import parse_ipv4_int
 from block_generiek_subnet import (
     ip_network,
-    is_subnet_of,
     load_allowlist_networks,
+    network_first_int,
+    network_last_int,
     network_sort_key,
     network_version,
     networks_overlap,
@@ -100,10 +103,6 @@ def load_recommendations(path):
     return result
 
 
-def geo_ip_network(ip):
-    return ip_network("%s/32" % ip, strict=False)
-
-
 def country_for_details(details):
     country = details.get("country", "Unknown")
     if country is None:
@@ -118,24 +117,32 @@ def org_for_details(details):
     return to_text(org)
 
 
-def geo_sources_in_network(net, geo_data):
-    rows = []
+def build_geo_source_index(geo_data):
+    # One sorted integer index of the geo cache; "sources inside a CIDR" is
+    # then two bisects instead of a scan of every geo entry.
+    entries = []
     for ip, details in geo_data.items():
-        try:
-            ip_net = geo_ip_network(ip)
-        except ValueError:
+        value = parse_ipv4_int(ip)
+        if value is None:
             continue
-        if network_version(ip_net) != network_version(net):
-            continue
-        if not is_subnet_of(ip_net, net):
-            continue
-        rows.append({
-            "ip": ip,
-            "country": country_for_details(details),
-            "org": org_for_details(details),
-        })
-    rows.sort(key=lambda row: row["ip"])
-    return rows
+        entries.append((value, ip, details))
+    entries.sort(key=lambda entry: entry[0])
+    ints = [entry[0] for entry in entries]
+    rows = [{
+        "ip": ip,
+        "country": country_for_details(details),
+        "org": org_for_details(details),
+    } for _value, ip, details in entries]
+    return ints, rows
+
+
+def geo_sources_in_network(net, geo_index):
+    if network_version(net) != 4:
+        return []
+    ints, rows = geo_index
+    start = bisect.bisect_left(ints, network_first_int(net))
+    end = bisect.bisect_right(ints, network_last_int(net))
+    return sorted(rows[start:end], key=lambda row: row["ip"])
 
 
 def network_for_ip_prefix(ip, prefix):
@@ -168,29 +175,61 @@ def safe_examples(sources, max_examples):
     return ["%s %s %s" % (row["ip"], row["country"], row["org"]) for row in sources[:max_examples]]
 
 
-def build_country_ip_index(geo_data):
-    index = collections.defaultdict(list)
-    for ip, details in geo_data.items():
-        country = country_for_details(details)
-        index[country].append(ip)
+def build_country_ip_index(geo_index):
+    index = {}
+    for value, row in zip(*geo_index):
+        ints, ips = index.setdefault(row["country"], ([], []))
+        ints.append(value)
+        ips.append(row["ip"])
     return index
 
 
 def country_hits_in_network(country_ips, net):
-    hits = []
-    for ip in country_ips:
-        try:
-            ip_net = geo_ip_network(ip)
-        except ValueError:
-            continue
-        if is_subnet_of(ip_net, net):
-            hits.append(ip)
-    return sorted(hits)
+    ints, ips = country_ips
+    start = bisect.bisect_left(ints, network_first_int(net))
+    end = bisect.bisect_right(ints, network_last_int(net))
+    return sorted(ips[start:end])
+
+
+def evaluate_candidate(cidr, new_net, country, min_hits, geo_index, allowlist, country_ip_index, max_examples):
+    country_hits = country_hits_in_network(country_ip_index.get(country, ([], [])), new_net)
+    if len(country_hits) < min_hits:
+        return False, {
+            "cidr": cidr,
+            "reason": "below recommended min_hits",
+            "hits": len(country_hits),
+            "min_hits": min_hits,
+        }
+    overlap = overlaps_any(new_net, allowlist)
+    if overlap:
+        return False, {
+            "cidr": cidr,
+            "reason": "allowlist overlap",
+            "hits": len(country_hits),
+            "overlaps": overlap[:5],
+        }
+    candidate_sources = geo_sources_in_network(new_net, geo_index)
+    candidate_countries = set(row["country"] for row in candidate_sources)
+    if candidate_countries - set([country]):
+        return False, {
+            "cidr": cidr,
+            "reason": "new subnet contains non-target country evidence",
+            "hits": len(country_hits),
+            "country_counts": country_counts(candidate_sources),
+        }
+    return True, {
+        "cidr": cidr,
+        "hits": len(country_hits),
+        "blocks_ips": blocked_size(new_net),
+        "example_ips": country_hits[:max_examples],
+    }
 
 
-def classify_rule(rule, geo_data, recommendations, allowlist, country_ip_index, max_examples):
+def classify_rule(rule, geo_index, recommendations, allowlist, country_ip_index, max_examples, candidate_cache=None):
+    if candidate_cache is None:
+        candidate_cache = {}
     old_net = rule["network"]
-    sources = geo_sources_in_network(old_net, geo_data)
+    sources = geo_sources_in_network(old_net, geo_index)
     base = {
         "num": rule["num"],
         "line": rule["line"],
@@ -246,40 +285,18 @@ def classify_rule(rule, geo_data, recommendations, allowlist, country_ip_index,
     kept = []
     skipped_candidates = []
     for cidr, new_net in sorted(candidate_by_cidr.items(), key=lambda item: network_sort_key(item[1])):
-        country_hits = country_hits_in_network(country_ip_index.get(country, []), new_net)
-        if len(country_hits) < min_hits:
-            skipped_candidates.append({
-                "cidr": cidr,
-                "reason": "below recommended min_hits",
-                "hits": len(country_hits),
-                "min_hits": min_hits,
-            })
-            continue
-        overlap = overlaps_any(new_net, allowlist)
-        if overlap:
-            skipped_candidates.append({
-                "cidr": cidr,
-                "reason": "allowlist overlap",
-                "hits": len(country_hits),
-                "overlaps": overlap[:5],
-            })
-            continue
-        candidate_sources = geo_sources_in_network(new_net, geo_data)
-        candidate_countries = set(row["country"] for row in candidate_sources)
-        if candidate_countries - set([country]):
-            skipped_candidates.append({
-                "cidr": cidr,
-                "reason": "new subnet contains non-target country evidence",
-                "hits": len(country_hits),
-                "country_counts": country_counts(candidate_sources),
-            })
-            continue
-        kept.append({
-            "cidr": cidr,
-            "hits": len(country_hits),
-            "blocks_ips": blocked_size(new_net),
-            "example_ips": country_hits[:max_examples],
-        })
+        # Neighbouring rules usually share replacement CIDRs; each one is
+        # evaluated once per country and min_hits.
+        cache_key = (cidr, country, min_hits)
+        if cache_key not in candidate_cache:
+            candidate_cache[cache_key] = evaluate_candidate(
+                cidr, new_net, country, min_hits, geo_index, allowlist, country_ip_index, max_examples
+            )
+        is_kept, item = candidate_cache[cache_key]
+        if is_kept:
+            kept.append(dict(item))
+        else:
+            skipped_candidates.append(dict(item))
 
     base["recommendation"] = {
         "target_prefix": target_prefix,
@@ -302,9 +319,11 @@ def classify_rule(rule, geo_data, recommendations, allowlist, country_ip_index,
 
 def build_plan(status_text, geo_data, recommendations, allowlist, max_examples):
     rules = parse_ufw_deny_rules(status_text)
-    country_ip_index = build_country_ip_index(geo_data)
+    geo_index = build_geo_source_index(geo_data)
+    country_ip_index = build_country_ip_index(geo_index)
+    candidate_cache = {}
     analyzed = [
-        classify_rule(rule, geo_data, recommendations, allowlist, country_ip_index, max_examples)
+        classify_rule(rule, geo_index, recommendations, allowlist, country_ip_index, max_examples, candidate_cache)
         for rule in rules
     ]
     replace_rules = [row for row in analyzed if row["action"] == "REPLACE"]
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+import argparse
+import os
+import re
+import sys
+
+from ipv4_index import interval_index_covers, interval_index_from_cidrs, parse_ipv4_int
+from parse_ips import write_ips
+
+
+DEFAULT_USER_RULES = "/etc/ufw/user.rules"
+USER_RULES_DROP_RE = re.compile(r"^-A ufw-user-input -s (\S+) -j DROP\s*$")
+STATUS_CIDR_RE = re.compile(r"\b(?:\d{1,3}\.){3}\d{1,3}(?:/\d{1,2})?\b")
+
+
+def read_lines(path):
+    # Missing or unreadable sources (user.rules is root-only) add nothing.
+    lines = readable_lines(path)
+    return lines if lines is not None else []
+
+
+def readable_lines(path):
+    # None when the file is missing or cannot be read.
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r") as f:
+            return f.read().splitlines()
+    except (IOError, OSError) as exc:
+        print("WARNING: skipping %s: %s" % (path, exc), file=sys.stderr)
+        return None
+
+
+def tracking_file_cidrs(path):
+    return [line.strip() for line in read_lines(path) if line.strip()]
+
+
+def user_rules_cidrs(path):
+    # None when user.rules could not be read, so callers can fall back.
+    lines = readable_lines(path)
+    if lines is None:
+        return None
+    cidrs = []
+    for line in lines:
+        match = USER_RULES_DROP_RE.match(line.strip())
+        if match:
+            cidrs.append(match.group(1))
+    return cidrs
+
+
+def ufw_status_cidrs(path):
+    cidrs = []
+    for line in read_lines(path):
+        stripped = line.strip()
+        if stripped.startswith("[") and "DENY IN" in stripped:
+            cidrs.extend(STATUS_CIDR_RE.findall(stripped))
+    return cidrs
+
+
+def load_blocked_index(blocked_files=(), user_rules=(), status_files=()):
+    # Interval index over every IPv4 range already denied; IPv6 and
+    # unparsable entries are skipped by interval_index_from_cidrs. The live
+    # user.rules is the authority: the tracking files are never pruned when
+    # rules are deleted, so they are only read when no user.rules is.
+    cidrs = []
+    live = False
+    for path in user_rules:
+        rule_cidrs = user_rules_cidrs(path)
+        if rule_cidrs is not None:
+            live = True
+            cidrs.extend(rule_cidrs)
+    if not live:
+        for path in blocked_files:
+            cidrs.extend(tracking_file_cidrs(path))
+    for path in status_files:
+        cidrs.extend(ufw_status_cidrs(path))
+    return interval_index_from_cidrs(cidrs)
+
+
+def split_blocked(ips, index):
+    # Returns (kept, dropped) in input order. Non-IPv4 values are kept.
+    kept = []
+    dropped = []
+    for ip in ips:
+        value = parse_ipv4_int(ip)
+        if value is not None and interval_index_covers(index, value, value):
+            dropped.append(ip)
+        else:
+            kept.append(ip)
+    return kept, dropped
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Drop IPs that existing deny rules already cover before geo lookup and aggregation.")
+    parser.add_argument("--input", default="output.txt")
+    parser.add_argument("--output", default="", help="Where to write the remaining IPs; default rewrites --input")
+    parser.add_argument("--dropped-output", default="prefilter_dropped_ips.txt")
+    parser.add_argument("--blocked-file", action="append", help="Tracking file with one blocked CIDR per line (repeatable), read only when no --user-rules file is readable; default blocked_generiek_ips.txt")
+    parser.add_argument("--user-rules", action="append", help="UFW user.rules file (repeatable); default %s" % DEFAULT_USER_RULES)
+    parser.add_argument("--ufw-status-file", action="append", default=[], help="Saved 'ufw status numbered' output (repeatable)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not os.path.exists(args.input):
+        print("ERROR: input file not found: %s" % args.input, file=sys.stderr)
+        return 1
+
+    index = load_blocked_index(
+        args.blocked_file or ["blocked_generiek_ips.txt"],
+        args.user_rules or [DEFAULT_USER_RULES],
+        args.ufw_status_file,
+    )
+    with open(args.input, "r") as f:
+        ips = [line.strip() for line in f if line.strip()]
+    kept, dropped = split_blocked(ips, index)
+    write_ips(args.output or args.input, kept)
+    write_ips(args.dropped_output, dropped)
+    print("Already blocked: %d of %d IPs dropped (%d blocked intervals), %d left" % (len(dropped), len(ips), len(index[0]), len(kept)))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+import heapq
+from array import array
+
+from ipv4_index import bounds_to_cidr, parse_ipv4_int
+
+
+STAT_THRESHOLDS = [2, 3, 5, 10]
+UINT32_TYPECODE = "I" if array("I").itemsize >= 4 else "L"
+
+
+def ip_int_array(ips):
+    values = []
+    for ip in ips:
+        value = parse_ipv4_int(ip)
+        if value is not None:
+            values.append(value)
+    values.sort()
+    return array(UINT32_TYPECODE, values)
+
+
+def run_length_counts(keys):
+    result_keys = []
+    result_counts = []
+    previous = None
+    for key in keys:
+        if key == previous:
+            result_counts[-1] += 1
+        else:
+            result_keys.append(key)
+            result_counts.append(1)
+            previous = key
+    return result_keys, result_counts
+
+
+def coarser_histogram(histogram, shift):
+    keys, counts = histogram
+    result_keys = []
+    result_counts = []
+    previous = None
+    for key, count in zip(keys, counts):
+        key >>= shift
+        if key == previous:
+            result_counts[-1] += count
+        else:
+            result_keys.append(key)
+            result_counts.append(count)
+            previous = key
+    return result_keys, result_counts
+
+
+def multi_prefix_histograms(sorted_ints, prefixes):
+    # The finest prefix is counted from the sorted IPs; every coarser prefix
+    # is derived from the previous histogram, which is far smaller.
+    histograms = {}
+    previous_prefix = None
+    for prefix in sorted(set(prefixes), reverse=True):
+        if previous_prefix is None:
+            shift = 32 - prefix
+            histograms[prefix] = run_length_counts(value >> shift for value in sorted_ints)
+        else:
+            histograms[prefix] = coarser_histogram(histograms[previous_prefix], previous_prefix - prefix)
+        previous_prefix = prefix
+    return histograms
+
+
+def histogram_key_to_cidr(key, prefix):
+    return bounds_to_cidr(key << (32 - prefix), prefix)
+
+
+def top_networks(histogram, prefix, top_n):
+    keys, counts = histogram
+    top = heapq.nsmallest(top_n, zip(counts, keys), key=lambda item: (-item[0], item[1]))
+    return [{"cidr": histogram_key_to_cidr(key, prefix), "hits": count} for count, key in top]
+
+
+def histogram_stats(prefix, histogram, top_n=10):
+    _keys, counts = histogram
+    stats = {
+        "prefix": prefix,
+        "networks": len(counts),
+        "max_hits": max(counts) if counts else 0,
+        "top": top_networks(histogram, prefix, top_n),
+    }
+    for threshold in STAT_THRESHOLDS:
+        stats["networks_%d_plus" % threshold] = sum(1 for count in counts if count >= threshold)
+    return stats
+
+
+def prefix_stats_for_ints(sorted_ints, prefixes, top_n=10):
+    histograms = multi_prefix_histograms(sorted_ints, prefixes)
+    return dict((prefix, histogram_stats(prefix, histograms[prefix], top_n)) for prefix in histograms)
+
+
+def networks_with_min_hits(histogram, prefix, min_hits):
+    keys, counts = histogram
+    return [(histogram_key_to_cidr(key, prefix), count) for key, count in zip(keys, counts) if count >= min_hits]
@@ -8,6 +8,9 @@ import os
 import sys
 
 from country_policy import default_country_codes, effective_country_codes
+from prefix_histogram import histogram_stats, ip_int_array, multi_prefix_histograms
+from recommendation_state import group_histograms, load_state, refresh_group_histograms, save_state
+from worker_pool import parallel_map
 
 try:
     text_type = unicode  # Py2
@@ -15,24 +18,6 @@ except NameError:
     text_type = str
 
 
-try:
-    import ipaddress as _ip
-
-    def ip_network(value, strict=False):
-        return _ip.ip_network(text_type(value), strict=strict)
-
-except ImportError:
-    try:
-        import ipaddr as _ip
-    except ImportError:
-        _ip = None
-
-    def ip_network(value, strict=False):
-        if _ip is None:
-            raise ImportError("Missing ipaddress/ipaddr module")
-        return _ip.IPNetwork(text_type(value))
-
-
 DEFAULT_PREFIXES = [24, 22, 20, 18, 16]
 
 
@@ -51,10 +36,6 @@ def load_geo_data(path):
         return json.load(f)
 
 
-def network_for_ip(ip, prefix):
-    return text_type(ip_network("%s/%d" % (ip, prefix), strict=False))
-
-
 def country_for_details(details):
     country = details.get("country", "Unknown")
     if country is None:
@@ -72,31 +53,6 @@ def collect_country_ips(geo_data, country_codes):
     return countries
 
 
-def prefix_stats_for_ips(ips, prefix):
-    counts = collections.Counter(network_for_ip(ip, prefix) for ip in ips)
-    if not counts:
-        return {
-            "prefix": prefix,
-            "networks": 0,
-            "max_hits": 0,
-            "networks_2_plus": 0,
-            "networks_3_plus": 0,
-            "networks_5_plus": 0,
-            "networks_10_plus": 0,
-            "top": [],
-        }
-    return {
-        "prefix": prefix,
-        "networks": len(counts),
-        "max_hits": max(counts.values()),
-        "networks_2_plus": sum(1 for count in counts.values() if count >= 2),
-        "networks_3_plus": sum(1 for count in counts.values() if count >= 3),
-        "networks_5_plus": sum(1 for count in counts.values() if count >= 5),
-        "networks_10_plus": sum(1 for count in counts.values() if count >= 10),
-        "top": [{"cidr": cidr, "hits": hits} for cidr, hits in counts.most_common(10)],
-    }
-
-
 def recommend_for_country(total_ips, stats_by_prefix):
     if total_ips >= 100 and stats_by_prefix[16]["networks_10_plus"]:
         return {"target_prefix": 16, "min_hits": 10, "reason": "100+ IPs and at least one /16 has 10+ observed IPs"}
@@ -109,28 +65,67 @@ def recommend_for_country(total_ips, stats_by_prefix):
     return {"target_prefix": 32, "min_hits": 1, "reason": "traffic is too distributed for safe subnet aggregation"}
 
 
-def build_recommendations(geo_data, country_codes, prefixes):
+def required_prefixes(prefixes):
+    return sorted(set(list(prefixes) + DEFAULT_PREFIXES))
+
+
+def country_row_from_histograms(country, observed_ips, histograms, prefixes):
+    stats_by_prefix = dict((prefix, histogram_stats(prefix, histograms[prefix])) for prefix in histograms)
+    recommendation = recommend_for_country(observed_ips, stats_by_prefix)
+    return {
+        "country": country,
+        "observed_ips": observed_ips,
+        "recommendation": recommendation,
+        "prefix_stats": [stats_by_prefix[prefix] for prefix in prefixes],
+    }
+
+
+def build_country_row(item):
+    country, ips, prefixes = item
+    histograms = multi_prefix_histograms(ip_int_array(ips), required_prefixes(prefixes))
+    return country_row_from_histograms(country, len(ips), histograms, prefixes)
+
+
+def build_recommendations(geo_data, country_codes, prefixes, workers=1):
     country_ips = collect_country_ips(geo_data, country_codes)
-    rows = []
-    for country in sorted(country_ips.keys()):
-        ips = country_ips[country]
-        stats_by_prefix = {}
-        for prefix in prefixes:
-            stats_by_prefix[prefix] = prefix_stats_for_ips(ips, prefix)
-        for required in DEFAULT_PREFIXES:
-            if required not in stats_by_prefix:
-                stats_by_prefix[required] = prefix_stats_for_ips(ips, required)
-        recommendation = recommend_for_country(len(ips), stats_by_prefix)
-        rows.append({
-            "country": country,
-            "observed_ips": len(ips),
-            "recommendation": recommendation,
-            "prefix_stats": [stats_by_prefix[prefix] for prefix in prefixes],
-        })
+    items = [(country, country_ips[country], prefixes) for country in sorted(country_ips.keys())]
+    rows = parallel_map(build_country_row, items, workers)
     rows.sort(key=lambda row: (-row["observed_ips"], row["country"]))
     return rows
 
 
+def collect_country_entries(geo_data, country_codes):
+    wanted = set(country_codes)
+    entries = {}
+    for ip, details in geo_data.items():
+        country = country_for_details(details)
+        if country in wanted:
+            entries[ip] = country
+    return entries
+
+
+def build_recommendations_incremental(geo_data, country_codes, prefixes, state_path, workers=1):
+    config = {"prefixes": list(prefixes), "country_codes": sorted(country_codes)}
+    state = load_state(state_path, config)
+    entries = collect_country_entries(geo_data, country_codes)
+    changed, _group_ips = refresh_group_histograms(state, entries, required_prefixes(prefixes), workers=workers)
+    for country in changed:
+        if country not in state["histograms"]:
+            state["rows"].pop(country, None)
+            continue
+        state["rows"][country] = country_row_from_histograms(
+            country,
+            state["sizes"][country],
+            group_histograms(state, country),
+            prefixes,
+        )
+    if changed or not os.path.exists(state_path):
+        save_state(state_path, state)
+    rows = list(state["rows"].values())
+    rows.sort(key=lambda row: (-row["observed_ips"], row["country"]))
+    return rows, len(changed)
+
+
 def write_json(path, rows):
     with open(path, "w") as f:
         json.dump({"countries": rows}, f, indent=2, sort_keys=True)
@@ -188,27 +183,39 @@ def build_parser():
     parser.add_argument("--json-output", default="country_prefix_recommendations.json")
     parser.add_argument("--text-output", default="country_prefix_recommendations.txt")
     parser.add_argument("--shell-output", default="country_prefix_plan.sh")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes for per-country builds; 0 uses all CPU cores")
+    parser.add_argument("--state-file", default="", help="Persist per-country prefix counters here and only recompute countries whose geo entries changed")
     return parser
 
 
-def main():
-    if _ip is None:
-        print("ERROR: Missing ipaddress module. Install one of: pip install ipaddress or pip install ipaddr", file=sys.stderr)
-        return 1
-
-    args = build_parser().parse_args()
-    if not os.path.exists(args.geo_data):
-        print("ERROR: geo data not found: %s" % args.geo_data, file=sys.stderr)
-        return 1
-
-    geo_data = load_geo_data(args.geo_data)
+def run_recommendations(args, geo_data):
     country_codes = parse_country_codes(args.country_codes)
     prefixes = parse_prefixes(args.prefixes)
-    rows = build_recommendations(geo_data, country_codes, prefixes)
+    if args.state_file:
+        rows, changed = build_recommendations_incremental(
+            geo_data,
+            country_codes,
+            prefixes,
+            args.state_file,
+            workers=args.workers,
+        )
+        print("Recomputed countries:", changed)
+    else:
+        rows = build_recommendations(geo_data, country_codes, prefixes, workers=args.workers)
     write_json(args.json_output, rows)
     write_text(args.text_output, rows)
     write_shell_plan(args.shell_output, rows)
+    return rows
+
+
+def main(argv=None):
+
+    args = build_parser().parse_args(argv)
+    if not os.path.exists(args.geo_data):
+        print("ERROR: geo data not found: %s" % args.geo_data, file=sys.stderr)
+        return 1
 
+    rows = run_recommendations(args, load_geo_data(args.geo_data))
     print("Countries:", len(rows))
     print("Wrote:", args.text_output)
     print("Wrote:", args.json_output)
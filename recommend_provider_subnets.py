@@ -10,6 +10,16 @@ import re
 import sys
 
 from country_policy import default_country_codes, effective_country_codes, is_safe_provider
+from ipv4_index import parse_ipv4_int
+from prefix_histogram import (
+    histogram_key_to_cidr,
+    histogram_stats,
+    ip_int_array,
+    multi_prefix_histograms,
+    networks_with_min_hits,
+)
+from recommendation_state import group_histograms, load_state, refresh_group_histograms, save_state
+from worker_pool import parallel_map
 
 try:
     text_type = unicode  # Py2
@@ -17,24 +27,6 @@ except NameError:
     text_type = str
 
 
-try:
-    import ipaddress as _ip
-
-    def ip_network(value, strict=False):
-        return _ip.ip_network(text_type(value), strict=strict)
-
-except ImportError:
-    try:
-        import ipaddr as _ip
-    except ImportError:
-        _ip = None
-
-    def ip_network(value, strict=False):
-        if _ip is None:
-            raise ImportError("Missing ipaddress/ipaddr module")
-        return _ip.IPNetwork(text_type(value))
-
-
 ASN_RE = re.compile(r"\b(AS\d+)\b")
 def parse_country_codes(value):
     if not value:
@@ -72,10 +64,6 @@ def org_key(org):
     return org
 
 
-def network_for_ip(ip, prefix):
-    return text_type(ip_network("%s/%d" % (ip, prefix), strict=False))
-
-
 def blocked_size(prefix):
     return 2 ** (32 - prefix)
 
@@ -92,10 +80,6 @@ def collect_groups(geo_data, country_codes):
     return groups
 
 
-def prefix_counts(ips, prefix):
-    return collections.Counter(network_for_ip(ip, prefix) for ip in ips)
-
-
 def choose_recommendation(observed_ips, stats, min_provider_ips):
     if observed_ips < min_provider_ips:
         return {"decision": "LOW_EVIDENCE", "target_prefix": 32, "min_hits": 1, "reason": "provider has too few observed IPs"}
@@ -110,43 +94,26 @@ def choose_recommendation(observed_ips, stats, min_provider_ips):
     return {"decision": "EXACT_IP_ONLY", "target_prefix": 32, "min_hits": 1, "reason": "provider traffic is distributed across subnets"}
 
 
-def stats_for_prefixes(ips, prefixes):
-    result = {}
-    for prefix in prefixes:
-        counts = prefix_counts(ips, prefix)
-        result[prefix] = {
-            "prefix": prefix,
-            "networks": len(counts),
-            "max_hits": max(counts.values()) if counts else 0,
-            "networks_2_plus": sum(1 for count in counts.values() if count >= 2),
-            "networks_3_plus": sum(1 for count in counts.values() if count >= 3),
-            "networks_5_plus": sum(1 for count in counts.values() if count >= 5),
-            "networks_10_plus": sum(1 for count in counts.values() if count >= 10),
-            "top": [{"cidr": cidr, "hits": hits} for cidr, hits in counts.most_common(10)],
-        }
-    return result
-
-
-def candidate_cidrs_for_recommendation(ips, recommendation):
-    prefix = recommendation["target_prefix"]
-    min_hits = recommendation["min_hits"]
-    counts = prefix_counts(ips, prefix)
-    return [cidr for cidr, hits in counts.items() if hits >= min_hits]
-
-
-def candidate_details_for_recommendation(ips, recommendation):
+def candidate_details_for_recommendation(ips, recommendation, ip_ints=None, histogram=None):
     prefix = recommendation["target_prefix"]
     min_hits = recommendation["min_hits"]
-    counts = prefix_counts(ips, prefix)
+    if histogram is None:
+        if ip_ints is None:
+            ip_ints = ip_int_array(ips)
+        histogram = multi_prefix_histograms(ip_ints, [prefix])[prefix]
+    candidates = networks_with_min_hits(histogram, prefix, min_hits)
+    shift = 32 - prefix
+    wanted_keys = set(histogram[0][index] for index, count in enumerate(histogram[1]) if count >= min_hits)
     examples = collections.defaultdict(list)
     for ip in sorted(ips):
-        cidr = network_for_ip(ip, prefix)
+        value = parse_ipv4_int(ip)
+        if value is None or value >> shift not in wanted_keys:
+            continue
+        cidr = histogram_key_to_cidr(value >> shift, prefix)
         if len(examples[cidr]) < 8:
             examples[cidr].append(ip)
     rows = []
-    for cidr, hits in counts.items():
-        if hits < min_hits:
-            continue
+    for cidr, hits in candidates:
         rows.append({
             "cidr": cidr,
             "hits": hits,
@@ -165,33 +132,47 @@ def risk_score(row):
     return row["observed_ips"] + prefix_weight + (len(row["candidate_cidrs"]) * 5)
 
 
-def build_recommendations(geo_data, country_codes, prefixes, min_provider_ips):
-    required_prefixes = sorted(set(prefixes + [24, 20, 18, 16]))
-    rows = []
-    for (country, org), ips in collect_groups(geo_data, country_codes).items():
-        stats = stats_for_prefixes(ips, required_prefixes)
-        recommendation = choose_recommendation(len(ips), stats, min_provider_ips)
-        if is_safe_provider(org):
-            recommendation = {
-                "decision": "SKIP_SAFE_PROVIDER",
-                "target_prefix": 32,
-                "min_hits": 1,
-                "reason": "provider name matches crawler/search allowlist provider",
-            }
-        candidate_details = []
-        if recommendation["decision"] == "CANDIDATE":
-            candidate_details = candidate_details_for_recommendation(ips, recommendation)
-        candidates = [item["cidr"] for item in candidate_details]
-        rows.append({
-            "country": country,
-            "org": org,
-            "observed_ips": len(ips),
-            "recommendation": recommendation,
-            "candidate_cidrs": sorted(candidates),
-            "candidate_details": candidate_details,
-            "prefix_stats": [stats[prefix] for prefix in prefixes],
-            "example_ips": sorted(ips)[:10],
-        })
+def provider_required_prefixes(prefixes):
+    return sorted(set(list(prefixes) + [24, 20, 18, 16]))
+
+
+def provider_row_from_histograms(country, org, ips, histograms, prefixes, min_provider_ips):
+    stats = dict((prefix, histogram_stats(prefix, histograms[prefix])) for prefix in histograms)
+    recommendation = choose_recommendation(len(ips), stats, min_provider_ips)
+    if is_safe_provider(org):
+        recommendation = {
+            "decision": "SKIP_SAFE_PROVIDER",
+            "target_prefix": 32,
+            "min_hits": 1,
+            "reason": "provider name matches crawler/search allowlist provider",
+        }
+    candidate_details = []
+    if recommendation["decision"] == "CANDIDATE":
+        candidate_details = candidate_details_for_recommendation(
+            ips,
+            recommendation,
+            histogram=histograms[recommendation["target_prefix"]],
+        )
+    candidates = [item["cidr"] for item in candidate_details]
+    return {
+        "country": country,
+        "org": org,
+        "observed_ips": len(ips),
+        "recommendation": recommendation,
+        "candidate_cidrs": sorted(candidates),
+        "candidate_details": candidate_details,
+        "prefix_stats": [stats[prefix] for prefix in prefixes],
+        "example_ips": sorted(ips)[:10],
+    }
+
+
+def build_provider_row(item):
+    country, org, ips, prefixes, min_provider_ips = item
+    histograms = multi_prefix_histograms(ip_int_array(ips), provider_required_prefixes(prefixes))
+    return provider_row_from_histograms(country, org, ips, histograms, prefixes, min_provider_ips)
+
+
+def sort_provider_rows(rows):
     rows.sort(key=lambda row: (
         row["recommendation"]["decision"] != "CANDIDATE",
         -risk_score(row),
@@ -202,6 +183,58 @@ def build_recommendations(geo_data, country_codes, prefixes, min_provider_ips):
     return rows
 
 
+def build_recommendations(geo_data, country_codes, prefixes, min_provider_ips, workers=1):
+    groups = collect_groups(geo_data, country_codes)
+    items = [(country, org, groups[(country, org)], prefixes, min_provider_ips) for country, org in sorted(groups.keys())]
+    return sort_provider_rows(parallel_map(build_provider_row, items, workers))
+
+
+def provider_group_key(country, org):
+    return "%s\t%s" % (country, org)
+
+
+def collect_group_entries(geo_data, country_codes):
+    wanted = set(country_codes)
+    entries = {}
+    keys = {}
+    for ip, details in geo_data.items():
+        country = to_country(details)
+        if country not in wanted:
+            continue
+        org = to_org(details)
+        if (country, org) not in keys:
+            keys[(country, org)] = provider_group_key(country, org_key(org))
+        entries[ip] = keys[(country, org)]
+    return entries
+
+
+def build_recommendations_incremental(geo_data, country_codes, prefixes, min_provider_ips, state_path, workers=1):
+    config = {
+        "prefixes": list(prefixes),
+        "country_codes": sorted(country_codes),
+        "min_provider_ips": min_provider_ips,
+    }
+    state = load_state(state_path, config)
+    entries = collect_group_entries(geo_data, country_codes)
+    changed, group_ips = refresh_group_histograms(state, entries, provider_required_prefixes(prefixes), workers=workers)
+    for group in changed:
+        if group not in state["histograms"]:
+            state["rows"].pop(group, None)
+            continue
+        country, org = group.split("\t", 1)
+        state["rows"][group] = provider_row_from_histograms(
+            country,
+            org,
+            group_ips[group],
+            group_histograms(state, group),
+            prefixes,
+            min_provider_ips,
+        )
+    if changed or not os.path.exists(state_path):
+        save_state(state_path, state)
+    return sort_provider_rows(list(state["rows"].values())), len(changed)
+
+
 def write_json(path, rows):
     with open(path, "w") as f:
         json.dump({"providers": rows}, f, indent=2, sort_keys=True)
@@ -304,27 +337,39 @@ def build_parser():
     parser.add_argument("--json-output", default="provider_subnet_recommendations.json")
     parser.add_argument("--candidates-output", default="provider_subnet_candidates.json")
     parser.add_argument("--max-rows", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes for per-provider builds; 0 uses all CPU cores")
+    parser.add_argument("--state-file", default="", help="Persist per-provider prefix counters here and only recompute providers whose geo entries changed")
     return parser
 
 
-def main():
-    if _ip is None:
-        print("ERROR: Missing ipaddress module. Install one of: pip install ipaddress or pip install ipaddr", file=sys.stderr)
-        return 1
-    args = build_parser().parse_args()
-    if not os.path.exists(args.geo_data):
-        print("ERROR: geo data not found: %s" % args.geo_data, file=sys.stderr)
-        return 1
-    rows = build_recommendations(
-        load_json(args.geo_data),
-        parse_country_codes(args.country_codes),
-        parse_prefixes(args.prefixes),
-        args.min_provider_ips,
-    )
+def run_recommendations(args, geo_data):
+    country_codes = parse_country_codes(args.country_codes)
+    prefixes = parse_prefixes(args.prefixes)
+    if args.state_file:
+        rows, changed = build_recommendations_incremental(
+            geo_data,
+            country_codes,
+            prefixes,
+            args.min_provider_ips,
+            args.state_file,
+            workers=args.workers,
+        )
+        print("Recomputed providers:", changed)
+    else:
+        rows = build_recommendations(geo_data, country_codes, prefixes, args.min_provider_ips, workers=args.workers)
     write_text(args.text_output, rows, args.max_rows)
     write_danger_text(args.danger_output, rows, args.max_rows)
     write_json(args.json_output, rows)
     write_candidates(args.candidates_output, rows)
+    return rows
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not os.path.exists(args.geo_data):
+        print("ERROR: geo data not found: %s" % args.geo_data, file=sys.stderr)
+        return 1
+    rows = run_recommendations(args, load_json(args.geo_data))
     print("Providers:", len(rows))
     print("Wrote:", args.text_output)
     print("Wrote:", args.danger_output)
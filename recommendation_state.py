@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+import bisect
+import collections
+import json
+import os
+
+from prefix_histogram import ip_int_array, multi_prefix_histograms
+from ipv4_index import parse_ipv4_int
+from worker_pool import parallel_map
+
+
+STATE_VERSION = 1
+REBUILD_CHANGE_RATIO = 8
+
+
+def empty_state(config):
+    return {"version": STATE_VERSION, "config": config, "entries": {}, "sizes": {}, "histograms": {}, "rows": {}}
+
+
+def load_state(path, config):
+    if not path or not os.path.exists(path):
+        return empty_state(config)
+    with open(path, "rb") as f:
+        try:
+            data = json.load(f)
+        except ValueError:
+            return empty_state(config)
+    if not isinstance(data, dict) or data.get("version") != STATE_VERSION or data.get("config") != config:
+        return empty_state(config)
+    return data
+
+
+def save_state(path, state):
+    tmp_path = "%s.tmp-%s" % (path, os.getpid())
+    with open(tmp_path, "w") as f:
+        f.write(json.dumps(state, sort_keys=True, separators=(",", ":")))
+    os.rename(tmp_path, path)
+
+
+def diff_entries(old_entries, new_entries):
+    added = collections.defaultdict(list)
+    removed = collections.defaultdict(list)
+    for ip, group in new_entries.items():
+        old_group = old_entries.get(ip)
+        if old_group == group:
+            continue
+        added[group].append(ip)
+        if old_group is not None:
+            removed[old_group].append(ip)
+    for ip, group in old_entries.items():
+        if ip not in new_entries:
+            removed[group].append(ip)
+    return added, removed
+
+
+def apply_histogram_delta(histogram, shift, added_ips, removed_ips):
+    keys, counts = histogram
+    for ip in added_ips:
+        value = parse_ipv4_int(ip)
+        if value is None:
+            continue
+        key = value >> shift
+        index = bisect.bisect_left(keys, key)
+        if index < len(keys) and keys[index] == key:
+            counts[index] += 1
+        else:
+            keys.insert(index, key)
+            counts.insert(index, 1)
+    for ip in removed_ips:
+        value = parse_ipv4_int(ip)
+        if value is None:
+            continue
+        key = value >> shift
+        index = bisect.bisect_left(keys, key)
+        if index == len(keys) or keys[index] != key:
+            continue
+        counts[index] -= 1
+        if not counts[index]:
+            del keys[index]
+            del counts[index]
+
+
+def build_group_histograms(item):
+    ips, prefixes = item
+    histograms = multi_prefix_histograms(ip_int_array(ips), prefixes)
+    return dict((str(prefix), [list(keys), list(counts)]) for prefix, (keys, counts) in histograms.items())
+
+
+def group_histograms(state, group):
+    return dict((int(prefix), tuple(histogram)) for prefix, histogram in state["histograms"][group].items())
+
+
+def refresh_group_histograms(state, entries, prefixes, workers=1):
+    # Only groups whose geo entries were added, removed or moved are touched.
+    # Small changes update the stored per-prefix counters in place; new
+    # groups and large changes are recounted from the group's IPs.
+    added, removed = diff_entries(state["entries"], entries)
+    changed = set(added) | set(removed)
+    group_ips = collections.defaultdict(list)
+    if changed:
+        for ip, group in entries.items():
+            if group in changed:
+                group_ips[group].append(ip)
+
+    rebuild = []
+    for group in sorted(changed):
+        size = len(group_ips.get(group, []))
+        if not size:
+            state["sizes"].pop(group, None)
+            state["histograms"].pop(group, None)
+            continue
+        state["sizes"][group] = size
+        delta = len(added.get(group, [])) + len(removed.get(group, []))
+        if group not in state["histograms"] or delta * REBUILD_CHANGE_RATIO > size:
+            rebuild.append(group)
+            continue
+        for prefix in prefixes:
+            apply_histogram_delta(
+                state["histograms"][group][str(prefix)],
+                32 - prefix,
+                added.get(group, []),
+                removed.get(group, []),
+            )
+
+    rebuilt = parallel_map(build_group_histograms, [(group_ips[group], prefixes) for group in rebuild], workers)
+    for group, histograms in zip(rebuild, rebuilt):
+        state["histograms"][group] = histograms
+
+    state["entries"] = entries
+    return changed, group_ips
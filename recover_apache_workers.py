@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+import argparse
+import json
+import shlex
+import subprocess
+import sys
+import time
+
+import monitor_server_status_blocks as status_monitor
+from ipv4_index import cidr_to_bounds, count_in_range, interval_index_covers, interval_index_from_cidrs, parse_ipv4_int, sorted_unique_ints
+from server_status import is_active, parse_server_status, read_text
+
+
+def load_cidrs(path):
+    # aggregated_generiek_subnets.json (JSON list) or a tracking file with
+    # one CIDR per line.
+    with open(path, "r") as f:
+        content = f.read()
+    if path.endswith(".json"):
+        return [str(cidr) for cidr in json.loads(content)]
+    return [line.split()[0] for line in content.splitlines() if line.strip() and not line.startswith("#")]
+
+
+def held_ips(status_info, blocked_index):
+    # Client IPs of active workers that fall inside a blocked CIDR, one
+    # entry per worker.
+    result = []
+    for row in status_info["workers"]:
+        if not is_active(row):
+            continue
+        value = parse_ipv4_int(row.client)
+        if value is not None and interval_index_covers(blocked_index, value, value):
+            result.append(value)
+    return result
+
+
+def cidrs_holding_workers(cidrs, held):
+    held = sorted_unique_ints(held)
+    result = []
+    for cidr in cidrs:
+        try:
+            first, last, _prefix = cidr_to_bounds(cidr)
+        except ValueError:
+            continue
+        if count_in_range(held, first, last):
+            result.append(cidr)
+    return result
+
+
+def measure(fetch_func, blocked_index):
+    try:
+        status_info = parse_server_status(fetch_func())
+    except (IOError, OSError, RuntimeError) as exc:
+        return {"busy": None, "held": None, "held_ips": [], "error": str(exc)}
+    held = held_ips(status_info, blocked_index)
+    return {"busy": status_info["busy_workers"], "held": len(held), "held_ips": held, "error": ""}
+
+
+def saturated(sample, threshold):
+    # A status page that cannot be fetched or parsed counts as saturated.
+    return sample["busy"] is None or sample["busy"] > threshold
+
+
+def format_command(template, cidr=""):
+    return shlex.split(template.replace("{cidr}", cidr))
+
+
+def recover(cidrs, fetch_func, run_func, config, sleep_func=time.sleep):
+    # Cheapest step first: drop the connections of blocked sources that
+    # still hold workers, then a graceful reload, and a full restart only
+    # while busy workers stay above the threshold.
+    blocked_index = interval_index_from_cidrs(cidrs)
+    before = measure(fetch_func, blocked_index)
+    report = {
+        "threshold": config["threshold"],
+        "blocked_cidrs": len(cidrs),
+        "busy_before": before["busy"],
+        "held_before": before["held"],
+        "steps": [],
+    }
+    current = before
+
+    def run_step(name, commands):
+        failed = 0
+        for command in commands:
+            if config["dry_run"]:
+                print("Would run:", " ".join(command))
+                continue
+            if run_func(command) != 0:
+                failed += 1
+        if not config["dry_run"] and commands:
+            sleep_func(config["settle_seconds"])
+        sample = current if config["dry_run"] else measure(fetch_func, blocked_index)
+        report["steps"].append({
+            "step": name,
+            "commands": len(commands),
+            "failed_commands": failed,
+            "busy": sample["busy"],
+            "held": sample["held"],
+            "error": sample["error"],
+        })
+        return sample
+
+    holding = cidrs_holding_workers(cidrs, before["held_ips"])
+    if holding and config["kill_cmd"]:
+        current = run_step("kill_connections", [format_command(config["kill_cmd"], cidr) for cidr in holding])
+    if saturated(current, config["threshold"]) and config["graceful_cmd"]:
+        current = run_step("graceful_reload", [format_command(config["graceful_cmd"])])
+    if saturated(current, config["threshold"]) and config["restart_cmd"]:
+        current = run_step("restart", [format_command(config["restart_cmd"])])
+
+    report["busy_after"] = current["busy"]
+    report["held_after"] = current["held"]
+    report["held_cidrs"] = holding
+    report["workers_freed"] = None
+    if before["busy"] is not None and current["busy"] is not None:
+        report["workers_freed"] = before["busy"] - current["busy"]
+    report["held_workers_freed"] = None
+    if before["held"] is not None and current["held"] is not None:
+        report["held_workers_freed"] = before["held"] - current["held"]
+    return report
+
+
+def run_command(command):
+    print("Running:", " ".join(command))
+    sys.stdout.flush()
+    try:
+        return subprocess.call(command)
+    except OSError as exc:
+        print("WARNING: %s: %s" % (command[0], exc), file=sys.stderr)
+        return 127
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Free Apache workers still held by blocked source IPs after a block run, escalating to a graceful reload and "
+        "a restart only while workers stay saturated."
+    )
+    parser.add_argument("--blocked", action="append", default=[], help="CIDRs blocked by this run (JSON list or one per line); default aggregated_generiek_subnets.json")
+    parser.add_argument("--url", default="http://127.0.0.1/server-status")
+    parser.add_argument("--host-header", help="Host header for the server-status fetch")
+    parser.add_argument("--header", action="append", default=[])
+    parser.add_argument("--timeout", type=int, default=10, help="Cap on each server-status fetch in seconds")
+    parser.add_argument("--insecure", action="store_true")
+    parser.add_argument("--status-file", help="Read the status page from a file instead of fetching it (testing)")
+    parser.add_argument("--threshold", type=int, default=100, help="Busy workers above this count as saturated")
+    parser.add_argument("--kill-cmd", default="conntrack -D -s {cidr}", help="Run once per blocked CIDR that still holds workers; empty disables")
+    parser.add_argument("--graceful-cmd", default="apachectl -k graceful", help="Empty disables")
+    parser.add_argument("--restart-cmd", default="service apache2 restart", help="Last resort; empty disables")
+    parser.add_argument("--settle-seconds", type=float, default=5.0, help="Wait after each step before measuring again")
+    parser.add_argument("--dry-run", action="store_true", help="Measure and print the commands without running them")
+    parser.add_argument("--json-output", default="apache_recovery.json")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    headers = list(args.header)
+    if args.host_header:
+        headers.append("Host: %s" % args.host_header)
+    try:
+        header_map = status_monitor.parse_headers(headers)
+        cidrs = []
+        for path in args.blocked or ["aggregated_generiek_subnets.json"]:
+            cidrs.extend(load_cidrs(path))
+    except (IOError, OSError, ValueError, RuntimeError) as exc:
+        print("ERROR: %s" % exc, file=sys.stderr)
+        return 1
+
+    if args.status_file:
+        def fetch_func():
+            return read_text(args.status_file)
+    else:
+        def fetch_func():
+            return status_monitor.fetch_url(args.url, args.timeout, insecure=args.insecure, headers=header_map)
+
+    config = {
+        "threshold": args.threshold,
+        "kill_cmd": args.kill_cmd,
+        "graceful_cmd": args.graceful_cmd,
+        "restart_cmd": args.restart_cmd,
+        "settle_seconds": args.settle_seconds,
+        "dry_run": args.dry_run,
+    }
+    report = recover(cidrs, fetch_func, run_command, config)
+    with open(args.json_output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    print("Busy workers before: %s, held by blocked CIDRs: %s" % (report["busy_before"], report["held_before"]))
+    for step in report["steps"]:
+        print("After %s (%d command(s)): busy %s, held %s" % (step["step"], step["commands"], step["busy"], step["held"]))
+    if not report["steps"]:
+        print("No blocked source holds workers and Apache is not saturated. Nothing to do.")
+    print("Workers freed: %s (held by blocked CIDRs: %s)" % (report["workers_freed"], report["held_workers_freed"]))
+    print("Wrote:", args.json_output)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,462 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import argparse
+import calendar
+import datetime as dt
+import io
+import json
+import mmap
+import os
+import sys
+from array import array
+
+import log_scan
+from ipv4_index import cidr_to_bounds, ipv4_int_to_text, parse_ipv4_int
+from prefix_histogram import UINT32_TYPECODE
+
+# One file per column per chunk (chunk-000000.time, ...), native byte order.
+# Strings are dictionary-encoded: the column holds the line number in
+# dict-<column>.txt.
+COLUMNS = [
+    ("time", UINT32_TYPECODE),  # epoch seconds, UTC
+    ("ip", UINT32_TYPECODE),
+    ("vhost", UINT32_TYPECODE),
+    ("method", "H"),
+    ("url", UINT32_TYPECODE),
+    ("status", "H"),  # 0 for "-"
+]
+TYPECODES = dict(COLUMNS)
+DICTIONARIES = ("vhost", "method", "url")
+DEFAULT_CHUNK_ROWS = 1 << 20
+WRITE_ROWS = 1 << 16
+EPOCH = dt.datetime(1970, 1, 1)
+EPOCH_DAY_CACHE = {}
+
+
+def parse_epoch(time_str):
+    # "01/Feb/2026:06:25:43 +0100" -> UTC epoch seconds; the day part is
+    # parsed once per distinct day.
+    day = time_str[:11]
+    base = EPOCH_DAY_CACHE.get(day)
+    if base is None:
+        base = EPOCH_DAY_CACHE[day] = calendar.timegm(dt.datetime.strptime(day, "%d/%b/%Y").timetuple())
+    seconds = base + int(time_str[12:14]) * 3600 + int(time_str[15:17]) * 60 + int(time_str[18:20])
+    zone = time_str[21:26]
+    if len(zone) == 5:
+        offset = int(zone[1:3]) * 3600 + int(zone[3:5]) * 60
+        seconds += -offset if zone[0] == "+" else offset
+    return seconds
+
+
+def format_epoch(seconds):
+    return (EPOCH + dt.timedelta(seconds=seconds)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def parse_time_arg(value):
+    # YYYY-MM-DD, YYYY-MM-DDTHH:MM or YYYY-MM-DDTHH:MM:SS (UTC), or epoch
+    # seconds.
+    if value.isdigit():
+        return int(value)
+    value = value.rstrip("Z")
+    for fmt in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d"):
+        try:
+            return calendar.timegm(dt.datetime.strptime(value, fmt).timetuple())
+        except ValueError:
+            continue
+    raise ValueError("invalid time: %s" % value)
+
+
+def meta_path(path):
+    return os.path.join(path, "meta.json")
+
+
+def dictionary_path(path, name):
+    return os.path.join(path, "dict-%s.txt" % name)
+
+
+def column_path(path, chunk_id, name):
+    return os.path.join(path, "chunk-%06d.%s" % (chunk_id, name))
+
+
+def new_meta(chunk_rows):
+    return {
+        "version": 1,
+        "byteorder": sys.byteorder,
+        "chunk_rows": chunk_rows,
+        "chunks": [],
+        "dictionaries": dict((name, {"count": 0, "bytes": 0}) for name in DICTIONARIES),
+        "file_offsets": {},
+    }
+
+
+def load_meta(path):
+    with open(meta_path(path), "r") as f:
+        meta = json.load(f)
+    if meta.get("byteorder") != sys.byteorder:
+        raise ValueError("%s was written with %s byte order" % (path, meta.get("byteorder")))
+    return meta
+
+
+def save_meta(path, meta):
+    tmp_path = "%s.tmp-%s" % (meta_path(path), os.getpid())
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f, indent=2, sort_keys=True)
+    os.rename(tmp_path, meta_path(path))
+
+
+def read_dictionary(path, name, count):
+    values = []
+    if count:
+        with io.open(dictionary_path(path, name), "r", encoding="utf-8", newline="\n") as f:
+            for line in f:
+                values.append(line[:-1])
+                if len(values) == count:
+                    break
+    return values
+
+
+def truncate(path, size):
+    if os.path.exists(path) and os.path.getsize(path) > size:
+        with open(path, "r+b") as f:
+            f.truncate(size)
+
+
+class RequestStoreWriter(object):
+    # Appends parsed log lines to the store; an aggregator for
+    # log_scan.scan_logs with the store's file_offsets. Rows and dictionary
+    # strings are written as they come, but only commit() records them in
+    # meta.json, together with the offsets; anything past the recorded
+    # sizes is cut off when the store is opened again.
+    new_lines_only = True
+
+    def __init__(self, path, chunk_rows=DEFAULT_CHUNK_ROWS):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.meta = load_meta(path) if os.path.exists(meta_path(path)) else new_meta(chunk_rows)
+        for name, info in self.meta["dictionaries"].items():
+            truncate(dictionary_path(path, name), info["bytes"])
+        if self.meta["chunks"]:
+            last = self.meta["chunks"][-1]
+            for name, typecode in COLUMNS:
+                truncate(column_path(path, last["id"], name), last["rows"] * array(typecode).itemsize)
+        self.ids = {}
+        self.new_strings = {}
+        for name in DICTIONARIES:
+            values = read_dictionary(path, name, self.meta["dictionaries"][name]["count"])
+            self.ids[name] = dict((value, index) for index, value in enumerate(values))
+            self.new_strings[name] = []
+        self.pending = dict((name, array(typecode)) for name, typecode in COLUMNS)
+        self.added = 0
+        self.skipped = 0
+
+    def string_id(self, name, value):
+        ids = self.ids[name]
+        result = ids.get(value)
+        if result is None:
+            result = ids[value] = len(ids)
+            self.new_strings[name].append(value)
+        return result
+
+    def add(self, entry):
+        if not entry["new"]:
+            return
+        ip = parse_ipv4_int(entry["ip"])
+        if ip is None:
+            # IPv6 clients do not fit the uint32 column.
+            self.skipped += 1
+            return
+        status = entry.get("status")
+        pending = self.pending
+        pending["time"].append(parse_epoch(entry["time"]))
+        pending["ip"].append(ip)
+        pending["vhost"].append(self.string_id("vhost", entry["site"]))
+        pending["method"].append(self.string_id("method", entry.get("method") or "-"))
+        pending["url"].append(self.string_id("url", entry.get("url") or "-"))
+        pending["status"].append(int(status) if status and status.isdigit() else 0)
+        self.added += 1
+        if len(pending["time"]) >= WRITE_ROWS:
+            self.write_pending()
+
+    def write_pending(self):
+        for name in DICTIONARIES:
+            if not self.new_strings[name]:
+                continue
+            data = "".join(value + "\n" for value in self.new_strings[name]).encode("utf-8")
+            with open(dictionary_path(self.path, name), "ab") as f:
+                f.write(data)
+            info = self.meta["dictionaries"][name]
+            info["count"] += len(self.new_strings[name])
+            info["bytes"] += len(data)
+            self.new_strings[name] = []
+
+        pending = self.pending
+        start = 0
+        total = len(pending["time"])
+        chunks = self.meta["chunks"]
+        while start < total:
+            if not chunks or chunks[-1]["rows"] >= self.meta["chunk_rows"]:
+                chunks.append({"id": len(chunks), "rows": 0, "min_time": None, "max_time": None})
+            chunk = chunks[-1]
+            end = min(total, start + self.meta["chunk_rows"] - chunk["rows"])
+            # A new chunk may have leftovers of an uncommitted write.
+            mode = "ab" if chunk["rows"] else "wb"
+            for name, _typecode in COLUMNS:
+                with open(column_path(self.path, chunk["id"], name), mode) as f:
+                    pending[name][start:end].tofile(f)
+            times = pending["time"][start:end]
+            chunk["min_time"] = min(times) if chunk["min_time"] is None else min(chunk["min_time"], min(times))
+            chunk["max_time"] = max(times) if chunk["max_time"] is None else max(chunk["max_time"], max(times))
+            chunk["rows"] += end - start
+            start = end
+        self.pending = dict((name, array(typecode)) for name, typecode in COLUMNS)
+
+    def commit(self, file_offsets=None):
+        self.write_pending()
+        if file_offsets is not None:
+            self.meta["file_offsets"] = file_offsets
+        save_meta(self.path, self.meta)
+
+
+def ingest(path, log_paths, log_format="auto", chunk_rows=DEFAULT_CHUNK_ROWS):
+    # Add the lines appended to log_paths since the last ingest.
+    writer = RequestStoreWriter(path, chunk_rows)
+    offsets = writer.meta["file_offsets"]
+    stats = log_scan.scan_logs(log_paths, [writer], log_format, offsets=offsets)
+    writer.commit(offsets)
+    stats["added"] = writer.added
+    stats["skipped"] = writer.skipped
+    return stats
+
+
+def map_column(path, typecode, rows):
+    # (mmap, typed values). On python3 the values are a memoryview on the
+    # mapping; python2 has no memoryview.cast and copies into an array.
+    size = rows * array(typecode).itemsize
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(memoryview, "cast"):
+        return mapped, memoryview(mapped)[:size].cast(typecode)
+    values = array(typecode)
+    values.fromstring(mapped[:size])
+    mapped.close()
+    return None, values
+
+
+class RequestStore(object):
+    def __init__(self, path):
+        self.path = path
+        self.meta = load_meta(path)
+        self.strings = dict(
+            (name, read_dictionary(path, name, self.meta["dictionaries"][name]["count"]))
+            for name in DICTIONARIES
+        )
+
+    def rows(self):
+        return sum(chunk["rows"] for chunk in self.meta["chunks"])
+
+    def iter_chunks(self, names, since=None, until=None):
+        # (chunk, {name: values}) for chunks that can hold rows in
+        # [since, until). The values are only valid until the next chunk.
+        for chunk in self.meta["chunks"]:
+            if not chunk["rows"]:
+                continue
+            if since is not None and chunk["max_time"] < since:
+                continue
+            if until is not None and chunk["min_time"] >= until:
+                continue
+            mappings = []
+            columns = {}
+            try:
+                for name in names:
+                    mapped, values = map_column(column_path(self.path, chunk["id"], name), TYPECODES[name], chunk["rows"])
+                    mappings.append((mapped, values))
+                    columns[name] = values
+                yield chunk, columns
+            finally:
+                columns.clear()
+                for mapped, values in mappings:
+                    if mapped is not None:
+                        values.release()
+                        mapped.close()
+
+
+def select(store, names, since=None, until=None, cidr=None, url_prefix=None, statuses=None, vhost=None, method=None):
+    # (columns, row indices or None for every row) per chunk. Each filter
+    # reads only its own column and narrows the indices of the previous one.
+    filters = []
+    if since is not None:
+        filters.append(("time", lambda value, since=since: value >= since))
+    if until is not None:
+        filters.append(("time", lambda value, until=until: value < until))
+    if cidr:
+        first, last, _prefix = cidr_to_bounds(cidr)
+        filters.append(("ip", lambda value: first <= value <= last))
+    if url_prefix:
+        url_ids = set(index for index, url in enumerate(store.strings["url"]) if url.startswith(url_prefix))
+        filters.append(("url", url_ids.__contains__))
+    if statuses:
+        filters.append(("status", set(statuses).__contains__))
+    if vhost is not None:
+        vhost_ids = set(index for index, value in enumerate(store.strings["vhost"]) if value == vhost)
+        filters.append(("vhost", vhost_ids.__contains__))
+    if method is not None:
+        method_ids = set(index for index, value in enumerate(store.strings["method"]) if value == method)
+        filters.append(("method", method_ids.__contains__))
+
+    needed = list(names)
+    for name, _test in filters:
+        if name not in needed:
+            needed.append(name)
+    for _chunk, columns in store.iter_chunks(needed, since, until):
+        indices = None
+        for name, test in filters:
+            values = columns[name]
+            if indices is None:
+                indices = [index for index, value in enumerate(values) if test(value)]
+            else:
+                indices = [index for index in indices if test(values[index])]
+            if not indices:
+                break
+        yield columns, indices
+
+
+def group_spec(store, group_by):
+    # (column, key function, label function) for "ip", "subnet/N", "url",
+    # "vhost", "method", "status" or "time/SECONDS".
+    name, _sep, size = group_by.partition("/")
+    if name == "subnet":
+        shift = 32 - int(size or 24)
+        return "ip", lambda value: value >> shift, lambda key: "%s/%d" % (ipv4_int_to_text(key << shift), 32 - shift)
+    if name == "time":
+        width = int(size or 3600)
+        return "time", lambda value: value // width, lambda key: format_epoch(key * width)
+    if name == "ip":
+        return "ip", None, ipv4_int_to_text
+    if name in DICTIONARIES:
+        strings = store.strings[name]
+        return name, None, strings.__getitem__
+    if name == "status":
+        return "status", None, lambda key: str(key) if key else "-"
+    raise ValueError("unknown group: %s" % group_by)
+
+
+def count_by(store, group_by, **filters):
+    # {label: requests} for the rows that pass the filters.
+    column, key_func, label_func = group_spec(store, group_by)
+    counts = {}
+    for columns, indices in select(store, [column], **filters):
+        values = columns[column]
+        keys = values if indices is None else (values[index] for index in indices)
+        if key_func is not None:
+            keys = (key_func(value) for value in keys)
+        for key in keys:
+            counts[key] = counts.get(key, 0) + 1
+    return dict((label_func(key), count) for key, count in counts.items())
+
+
+def export_jsonl(store, out, **filters):
+    # One JSON object per row; returns the number of rows written.
+    names = [name for name, _typecode in COLUMNS]
+    strings = store.strings
+    written = 0
+    for columns, indices in select(store, names, **filters):
+        if indices is None:
+            indices = range(len(columns["time"]))
+        for index in indices:
+            status = columns["status"][index]
+            row = {
+                "time": format_epoch(columns["time"][index]),
+                "ip": ipv4_int_to_text(columns["ip"][index]),
+                "vhost": strings["vhost"][columns["vhost"][index]],
+                "method": strings["method"][columns["method"][index]],
+                "url": strings["url"][columns["url"][index]],
+                "status": status or None,
+            }
+            out.write(json.dumps(row, sort_keys=True) + "\n")
+            written += 1
+    return written
+
+
+def add_filter_args(parser):
+    parser.add_argument("--since", help="UTC start, YYYY-MM-DD[THH:MM[:SS]] or epoch seconds")
+    parser.add_argument("--until", help="UTC end (exclusive)")
+    parser.add_argument("--cidr", help="Only client IPs in this IPv4 CIDR")
+    parser.add_argument("--url-prefix", help="Only URLs starting with this prefix")
+    parser.add_argument("--status", type=int, action="append", default=[], help="Only this status (repeatable)")
+    parser.add_argument("--vhost")
+    parser.add_argument("--method")
+
+
+def filter_kwargs(args):
+    return {
+        "since": parse_time_arg(args.since) if args.since else None,
+        "until": parse_time_arg(args.until) if args.until else None,
+        "cidr": args.cidr,
+        "url_prefix": args.url_prefix,
+        "statuses": args.status,
+        "vhost": args.vhost,
+        "method": args.method,
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Columnar store of access log requests for incident queries.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    ingest_cmd = subparsers.add_parser("ingest", help="Add the new lines of access logs to the store.")
+    ingest_cmd.add_argument("--store", default="request_store")
+    ingest_cmd.add_argument("--log", action="append", required=True, help="Log file path (repeatable).")
+    ingest_cmd.add_argument("--log-format", default="auto", help="auto, common, combined, vhost_combined or an Apache LogFormat string.")
+    ingest_cmd.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS, help="Rows per chunk file (new stores only).")
+
+    query_cmd = subparsers.add_parser("query", help="Count requests per group.")
+    query_cmd.add_argument("--store", default="request_store")
+    query_cmd.add_argument("--group-by", default="subnet/24", help="ip, subnet/N, url, vhost, method, status or time/SECONDS")
+    query_cmd.add_argument("--top", type=int, default=20)
+    add_filter_args(query_cmd)
+
+    export_cmd = subparsers.add_parser("export", help="Write the matching rows as JSON lines.")
+    export_cmd.add_argument("--store", default="request_store")
+    export_cmd.add_argument("--output", required=True, help="JSONL file to write ('-' for stdout)")
+    add_filter_args(export_cmd)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not getattr(args, "command", None):
+        parser.print_help()
+        return 2
+
+    try:
+        if args.command == "ingest":
+            stats = ingest(args.store, args.log, args.log_format, args.chunk_rows)
+            print("Read %d new lines, stored %d requests (%d non-IPv4 skipped) in %s" % (stats["lines"], stats["added"], stats["skipped"], args.store))
+            return 0
+        store = RequestStore(args.store)
+        filters = filter_kwargs(args)
+        if args.command == "query":
+            counts = count_by(store, args.group_by, **filters)
+            rows = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+            print("Requests: %d in %d groups (%d stored)" % (sum(counts.values()), len(counts), store.rows()))
+            for label, count in rows[:args.top]:
+                print("  %8d  %s" % (count, label))
+            return 0
+        if args.output == "-":
+            written = export_jsonl(store, sys.stdout, **filters)
+        else:
+            with open(args.output, "w") as out:
+                written = export_jsonl(store, out, **filters)
+        print("Exported %d requests to %s" % (written, args.output), file=sys.stderr)
+        return 0
+    except (IOError, OSError, ValueError) as exc:
+        print("ERROR: %s" % exc, file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,562 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import time
+
+import aggregate_generiek_subnets as aggregate
+import audit_generiek_subnets
+import block_generiek_subnet
+import cache_crawler_ips
+import clean_bad_ufw_rules
+import fast_apply_ufw_user_rules
+import fast_geo_lookup
+import find_bad_ufw_rules
+import parse_ips
+import prefilter_blocked_ips
+import recommend_country_prefixes
+import recommend_provider_subnets
+import run_recurrence
+import run_snapshots
+import server_status
+import stage_timing
+from country_policy import default_country_codes_csv
+from local_ip_country import atomic_write_json, load_ranges
+
+
+# Same environment variables and defaults as run_prepare_generiek_blocks.sh.
+CONFIG_DEFAULTS = [
+    ("PYTHON", ""),
+    ("POLICY_MODE", "1"),
+    ("MERGE_PROVIDER_CANDIDATES", "0"),
+    ("COVER_MODE", "0"),
+    ("COVER_MAX_BLOCKED_ADDRESSES", "0"),
+    ("COVER_MIN_PREFIX", "16"),
+    ("TARGET_PREFIX", "24"),
+    ("MIN_HITS", "1"),
+    ("RECOMMEND_WORKERS", "0"),
+    ("INCREMENTAL_RECOMMENDATIONS", "1"),
+    ("COUNTRY_CODES", ""),
+    ("AGG_SOURCE", "geo"),
+    ("INPUT_FILE", "input.txt"),
+    ("OUTPUT_FILE", "aggregated_generiek_subnets.json"),
+    ("APPLY", "1"),
+    ("CHECK_EXISTING", "0"),
+    ("SUDO_FLAG", "--sudo"),
+    ("FAST_GEO_LOOKUP", "0"),
+    ("FAST_GEO_RANGES", "data/fast_geo_ranges.tsv"),
+    ("FAST_GEO_WRITE_UNKNOWN", "0"),
+    ("SKIP_GEO_FETCH", "0"),
+    ("FAST_UFW_APPLY", "0"),
+    ("FAST_UFW_BACKUP", "1"),
+    ("UFW_USER_RULES", ""),
+    ("ALLOW_EMPTY_INPUT", "0"),
+    ("SNAPSHOT_DEDUP", "1"),
+    ("STAGE_TIMINGS", "1"),
+    ("PREFILTER_BLOCKED", "1"),
+    ("RECURRENCE_INDEX", "1"),
+    ("RECURRENCE_DB", os.path.join("runs", ".recurrence.sqlite")),
+    ("RECURRENCE_MIN_RUNS", "0"),
+    ("RECURRENCE_WINDOW", "10"),
+    ("RUN_ID", ""),
+    ("RUN_DIR", ""),
+]
+
+IP_COUNTS_FILE = "output_ip_counts.txt"
+STATUS_WORKERS_FILE = "server_status_workers.json"
+PREFILTER_DROPPED_FILE = "prefilter_dropped_ips.txt"
+
+AGGREGATE_OUTPUTS = [
+    "generiek_country_report.json",
+    "generiek_blocked_candidate_ips.txt",
+    "generiek_allowed_non_target_ips.txt",
+]
+
+RECOMMENDATION_OUTPUTS = [
+    "country_prefix_recommendations.txt",
+    "country_prefix_recommendations.json",
+    "country_prefix_plan.sh",
+    "provider_subnet_recommendations.txt",
+    "provider_dangerous_subnets.txt",
+    "provider_subnet_recommendations.json",
+    "provider_subnet_candidates.json",
+]
+
+
+class PipelineError(RuntimeError):
+    def __init__(self, message, returncode=1):
+        RuntimeError.__init__(self, message)
+        self.returncode = returncode
+
+
+def load_config(environ=None):
+    if environ is None:
+        environ = os.environ
+    # Like ${VAR:-default} in the shell script, an empty value means default.
+    config = dict((name, environ.get(name) or default) for name, default in CONFIG_DEFAULTS)
+    config["PYTHON"] = config["PYTHON"] or "python"
+    if not config["COUNTRY_CODES"]:
+        config["COUNTRY_CODES"] = default_country_codes_csv()
+    if not config["RUN_ID"]:
+        config["RUN_ID"] = time.strftime("%Y%m%d-%H%M%S")
+    if not config["RUN_DIR"]:
+        config["RUN_DIR"] = os.path.join("runs", config["RUN_ID"])
+    return config
+
+
+def snapshot_if_exists(config, src, dest):
+    if config["SNAPSHOT_DEDUP"] == "1":
+        run_snapshots.snapshot_files(config["RUN_DIR"], [(src, dest)])
+    elif os.path.exists(src):
+        shutil.copy(src, os.path.join(config["RUN_DIR"], dest))
+
+
+def count_lines(path, needle=None):
+    count = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if needle is None or needle in line:
+                count += 1
+    return count
+
+
+def write_summary(config):
+    rows = [
+        ("run_id", config["RUN_ID"]),
+        ("run_dir", config["RUN_DIR"]),
+        ("date", time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())),
+        ("python", config["PYTHON"]),
+        ("policy_mode", config["POLICY_MODE"]),
+        ("merge_provider_candidates", config["MERGE_PROVIDER_CANDIDATES"]),
+        ("cover_mode", config["COVER_MODE"]),
+        ("cover_max_blocked_addresses", config["COVER_MAX_BLOCKED_ADDRESSES"]),
+        ("cover_min_prefix", config["COVER_MIN_PREFIX"]),
+        ("target_prefix", config["TARGET_PREFIX"]),
+        ("min_hits", config["MIN_HITS"]),
+        ("recommend_workers", config["RECOMMEND_WORKERS"]),
+        ("incremental_recommendations", config["INCREMENTAL_RECOMMENDATIONS"]),
+        ("country_codes", config["COUNTRY_CODES"]),
+        ("agg_source", config["AGG_SOURCE"]),
+        ("input_file", config["INPUT_FILE"]),
+        ("output_file", config["OUTPUT_FILE"]),
+        ("apply", config["APPLY"]),
+        ("check_existing", config["CHECK_EXISTING"]),
+        ("sudo_flag", config["SUDO_FLAG"]),
+        ("fast_geo_lookup", config["FAST_GEO_LOOKUP"]),
+        ("fast_geo_ranges", config["FAST_GEO_RANGES"]),
+        ("skip_geo_fetch", config["SKIP_GEO_FETCH"]),
+        ("fast_ufw_apply", config["FAST_UFW_APPLY"]),
+        ("fast_ufw_backup", config["FAST_UFW_BACKUP"]),
+        ("ufw_user_rules", config["UFW_USER_RULES"]),
+        ("stage_timings", config["STAGE_TIMINGS"]),
+        ("prefilter_blocked", config["PREFILTER_BLOCKED"]),
+        ("pipeline", "in-process"),
+    ]
+    # output.txt loses already blocked IPs in the prefilter stage; the
+    # counts file still has one line per parsed IP.
+    if os.path.exists(IP_COUNTS_FILE):
+        rows.append(("parsed_ip_lines", count_lines(IP_COUNTS_FILE)))
+    elif os.path.exists("output.txt"):
+        rows.append(("parsed_ip_lines", count_lines("output.txt")))
+    if config["PREFILTER_BLOCKED"] == "1" and os.path.exists(PREFILTER_DROPPED_FILE):
+        rows.append(("prefilter_dropped_ips", count_lines(PREFILTER_DROPPED_FILE)))
+    if os.path.exists(IP_COUNTS_FILE):
+        rows.append(("parsed_ip_occurrences", sum_ip_counts(IP_COUNTS_FILE)))
+    if os.path.exists(config["OUTPUT_FILE"]):
+        rows.append(("candidate_subnet_lines", count_lines(config["OUTPUT_FILE"], b'"')))
+    with open(os.path.join(config["RUN_DIR"], "summary.txt"), "w") as f:
+        for key, value in rows:
+            f.write("%s=%s\n" % (key, value))
+
+
+def sum_ip_counts(path):
+    total = 0
+    with open(path, "r") as f:
+        for line in f:
+            parts = line.split("\t")
+            if len(parts) == 2 and parts[1].strip().isdigit():
+                total += int(parts[1])
+    return total
+
+
+def call_main(name, main, argv):
+    returncode = main(argv)
+    if returncode:
+        raise PipelineError("%s failed with exit code %s" % (name, returncode), returncode)
+
+
+def sudo_args(config):
+    return config["SUDO_FLAG"].split()
+
+
+def stage_parse_ips(config):
+    ips, occurrences = parse_ips.parse_ip_file("input.txt", "output.txt", IP_COUNTS_FILE)
+    print("Gevonden IP-adressen opgeslagen in output.txt ( %d gevonden, %d uniek)." % (occurrences, len(ips)))
+    return ips, occurrences
+
+
+def stage_prefilter(config, ips):
+    index = prefilter_blocked_ips.load_blocked_index(
+        ["blocked_generiek_ips.txt"],
+        [config["UFW_USER_RULES"] or prefilter_blocked_ips.DEFAULT_USER_RULES],
+    )
+    kept, dropped = prefilter_blocked_ips.split_blocked(ips, index)
+    parse_ips.write_ips("output.txt", kept)
+    parse_ips.write_ips(PREFILTER_DROPPED_FILE, dropped)
+    print("Already blocked: %d of %d IPs dropped (%d blocked intervals), %d left" % (len(dropped), len(ips), len(index[0]), len(kept)))
+    return kept
+
+
+def stage_server_status(config):
+    # Report only, like the shell runner: a failure warns and the run goes
+    # on without server_status_workers.json (no stale copy is snapshotted).
+    try:
+        summary = server_status.summarize_status(server_status.parse_server_status_file("input.txt"))
+        atomic_write_json(STATUS_WORKERS_FILE, summary)
+    except Exception as exc:
+        print("WARNING: server-status parsing failed; continuing without %s: %s" % (STATUS_WORKERS_FILE, exc), file=sys.stderr)
+        if os.path.exists(STATUS_WORKERS_FILE):
+            os.remove(STATUS_WORKERS_FILE)
+        return
+    print("Server-status worker rows: %d (%d active)" % (summary["worker_rows"], summary["active_worker_rows"]))
+
+
+def stage_recurrence(config):
+    # The index only feeds later runs; a locked or corrupt database must not
+    # fail a run whose rules are already applied.
+    try:
+        conn = run_recurrence.connect(config["RECURRENCE_DB"])
+        try:
+            run_recurrence.index_run_dir(conn, config["RUN_DIR"])
+        finally:
+            conn.close()
+    except (IOError, OSError, sqlite3.Error) as exc:
+        print("WARNING: recurrence indexing failed; continuing: %s" % exc, file=sys.stderr)
+
+
+def stage_fast_geo_lookup(config, ips, geo_data):
+    started = time.time()
+    starts, ranges = load_ranges(config["FAST_GEO_RANGES"])
+    stats = fast_geo_lookup.lookup_geo_data(
+        ips,
+        geo_data,
+        starts,
+        ranges,
+        write_unknown=config["FAST_GEO_WRITE_UNKNOWN"] == "1",
+    )
+    if stats["updated"]:
+        atomic_write_json("geo_data.json", geo_data)
+    print("Fast geo lookup complete")
+    print("Input IPs:", stats["input_ips"])
+    print("Cache hits:", stats["cache_hits"])
+    print("Local hits:", stats["local_hits"])
+    print("Local misses:", stats["local_misses"])
+    print("Updated geo_data rows:", stats["updated"])
+    print("Elapsed seconds: %.3f" % (time.time() - started))
+    snapshot_if_exists(config, "geo_data.json", "geo_data_after_fast_lookup.json")
+
+
+def stage_geo_fetch(config, ips, geo_data):
+    if config["SKIP_GEO_FETCH"] == "1":
+        print("Skipping get_ip_country.py because SKIP_GEO_FETCH=1.")
+        return
+    # get_ip_country needs the requests package; only import it when used.
+    import get_ip_country
+    get_ip_country.fetch_missing_geo_data(set(ips), geo_data)
+    get_ip_country.save_geo_data("geo_data.json", geo_data)
+    print("\nGegevens opgeslagen in geo_data.json (%d IP's)." % len(geo_data))
+
+
+def stage_recommendations(config, geo_data):
+    workers = ["--workers", config["RECOMMEND_WORKERS"]]
+    common = ["--geo-data", "geo_data.json", "--country-codes", config["COUNTRY_CODES"]] + workers
+    country_argv = list(common)
+    provider_argv = list(common)
+    if config["INCREMENTAL_RECOMMENDATIONS"] == "1":
+        country_argv += ["--state-file", "country_prefix_state.json"]
+        provider_argv += ["--state-file", "provider_subnet_state.json"]
+
+    country_args = recommend_country_prefixes.build_parser().parse_args(country_argv)
+    country_rows = recommend_country_prefixes.run_recommendations(country_args, geo_data)
+    print("Countries:", len(country_rows))
+    for path in (country_args.text_output, country_args.json_output, country_args.shell_output):
+        print("Wrote:", path)
+    provider_args = recommend_provider_subnets.build_parser().parse_args(provider_argv)
+    provider_rows = recommend_provider_subnets.run_recommendations(provider_args, geo_data)
+    print("Providers:", len(provider_rows))
+    for path in (provider_args.text_output, provider_args.danger_output, provider_args.json_output, provider_args.candidates_output):
+        print("Wrote:", path)
+    return country_rows, provider_rows
+
+
+def aggregate_argv(config):
+    argv = [
+        "--source", config["AGG_SOURCE"],
+        "--target-prefix", config["TARGET_PREFIX"],
+        "--min-hits", config["MIN_HITS"],
+        "--output", config["OUTPUT_FILE"],
+        "--recurrence-db", config["RECURRENCE_DB"],
+        "--recurrence-min-runs", config["RECURRENCE_MIN_RUNS"],
+        "--recurrence-window", config["RECURRENCE_WINDOW"],
+    ]
+    if config["AGG_SOURCE"] == "geo":
+        argv += ["--input", "geo_data.json", "--filter-ips-file", "output.txt"]
+        if config["COVER_MODE"] == "1":
+            argv += [
+                "--cover-mode",
+                "--allowlist", os.path.join("ip_cache", "allowlist_cidrs.json"),
+                "--max-blocked-addresses", config["COVER_MAX_BLOCKED_ADDRESSES"],
+                "--cover-min-prefix", config["COVER_MIN_PREFIX"],
+            ]
+        elif config["POLICY_MODE"] == "1":
+            argv += ["--policy-mode", "--country-policy-file", "country_prefix_recommendations.json"]
+            if config["MERGE_PROVIDER_CANDIDATES"] == "1":
+                argv += ["--provider-policy-file", "provider_subnet_recommendations.json"]
+        argv += ["--country-codes", config["COUNTRY_CODES"]]
+    else:
+        argv += ["--input", "output.txt"]
+        if os.path.exists(IP_COUNTS_FILE):
+            argv += ["--counts-file", IP_COUNTS_FILE]
+    return argv
+
+
+def stage_aggregate(config, ips, geo_data, country_rows=None, provider_rows=None):
+    args = aggregate.build_parser().parse_args(aggregate_argv(config))
+    error = aggregate.validate_args(args)
+    if error:
+        raise PipelineError(error)
+    # parse_ips already produced unique, valid IPv4 addresses.
+    source_ips = list(ips)
+    if args.source == "geo":
+        try:
+            result = aggregate.aggregate_geo(
+                args,
+                geo_data,
+                source_ips=source_ips,
+                country_policy_rows=country_rows,
+                provider_rows=provider_rows,
+            )
+        except ValueError as exc:
+            raise PipelineError(str(exc))
+    else:
+        weights = aggregate.read_ip_counts(args.counts_file) if args.counts_file else None
+        selected_ips, subnets = aggregate.build_subnets_from_ips(source_ips, args.target_prefix, args.min_hits, aggregate.load_recurring(args), weights)
+        result = {"selected_ips": selected_ips, "subnets": subnets, "cover": None, "report": None}
+    aggregate.write_subnets(args.output, result["subnets"])
+    aggregate.print_summary(args, result)
+    return result
+
+
+def stage_existing_audit(config):
+    if config["CHECK_EXISTING"] != "1":
+        print("Skipping existing UFW audit. Run with CHECK_EXISTING=1 for one-time cleanup.")
+        return
+    call_main("find_bad_ufw_rules.py", find_bad_ufw_rules.main, [
+        "--allowlist", os.path.join("ip_cache", "allowlist_cidrs.json"),
+        "--output", "bad_ufw_rules.json",
+        "--country-codes", config["COUNTRY_CODES"],
+    ] + sudo_args(config))
+    snapshot_if_exists(config, "bad_ufw_rules.json", "bad_ufw_rules.json")
+    clean_argv = ["--input", "bad_ufw_rules.json"] + sudo_args(config)
+    call_main("clean_bad_ufw_rules.py", clean_bad_ufw_rules.main, clean_argv + ["--dry-run"])
+    if config["APPLY"] == "1":
+        call_main("clean_bad_ufw_rules.py", clean_bad_ufw_rules.main, clean_argv)
+
+
+def default_user_rules_path():
+    for path in ("/lib/ufw/user.rules", "/etc/ufw/user.rules"):
+        if os.path.isfile(path):
+            return path
+    return ""
+
+
+def stage_apply(config):
+    if config["FAST_UFW_APPLY"] != "1":
+        argv = ["--input", config["OUTPUT_FILE"], "--country-codes", config["COUNTRY_CODES"]]
+        if config["CHECK_EXISTING"] == "1":
+            argv.append("--check-bad-rules")
+        if config["APPLY"] != "1":
+            argv.append("--dry-run")
+        call_main("block_generiek_subnet.py", block_generiek_subnet.main, argv + sudo_args(config))
+        return
+
+    user_rules = config["UFW_USER_RULES"] or default_user_rules_path()
+    if not user_rules:
+        raise PipelineError("FAST_UFW_APPLY=1 but UFW_USER_RULES was not set and no default user.rules file was found.")
+    argv = [
+        "--input", config["OUTPUT_FILE"],
+        "--user-rules", user_rules,
+        "--blocked-file", "blocked_generiek_ips.txt",
+        "--allowlist", os.path.join("ip_cache", "allowlist_cidrs.json"),
+        "--geo-data", "geo_data.json",
+        "--country-codes", config["COUNTRY_CODES"],
+    ]
+    if config["SUDO_FLAG"]:
+        argv.append("--sudo")
+    if config["FAST_UFW_BACKUP"] == "0":
+        argv.append("--no-backup")
+    if config["APPLY"] == "1":
+        argv += ["--apply", "--reload"]
+    else:
+        argv += ["--dry-run", "--output-preview", os.path.join(config["RUN_DIR"], "user.rules.preview")]
+    call_main("fast_apply_ufw_user_rules.py", fast_apply_ufw_user_rules.main, argv)
+
+
+def run_pipeline(config):
+    # The stages of run_prepare_generiek_blocks.sh as function calls in one
+    # process. Parsed IPs, geo_data and recommendation rows are passed in
+    # memory; files are still written so runs/$RUN_ID gets the same snapshots.
+    if not os.path.exists(config["INPUT_FILE"]):
+        raise PipelineError("input file not found: %s" % config["INPUT_FILE"])
+    if config["AGG_SOURCE"] not in ("geo", "ips"):
+        raise PipelineError("AGG_SOURCE must be 'ips' or 'geo'")
+    if config["AGG_SOURCE"] == "ips" and config["COVER_MODE"] == "1":
+        raise PipelineError("COVER_MODE=1 requires AGG_SOURCE=geo")
+
+    if not os.path.isdir(config["RUN_DIR"]):
+        os.makedirs(config["RUN_DIR"])
+    # STAGE_TIMINGS=0 keeps the stages but writes no timings.json, like the
+    # shell runner without the stage_timing.py wrapper.
+    timings_path = os.path.join(config["RUN_DIR"], "timings.json") if config["STAGE_TIMINGS"] == "1" else None
+    recorder = stage_timing.StageRecorder(timings_path, config["RUN_ID"])
+    previous = stage_timing.activate(recorder)
+    try:
+        run_stages(config, recorder)
+    finally:
+        stage_timing.activate(previous)
+
+
+def run_stages(config, recorder):
+    snapshot_if_exists(config, config["INPUT_FILE"], "input_raw.txt")
+    if config["INPUT_FILE"] != "input.txt":
+        shutil.copy(config["INPUT_FILE"], "input.txt")
+
+    with recorder.stage("parse_ips") as record:
+        ips, occurrences = stage_parse_ips(config)
+        record.update(
+            bytes_read=stage_timing.file_bytes(["input.txt"]),
+            bytes_written=stage_timing.file_bytes(["output.txt", IP_COUNTS_FILE]),
+            input_count=occurrences,
+            output_count=len(ips),
+        )
+    snapshot_if_exists(config, "input.txt", "input_effective.txt")
+    snapshot_if_exists(config, "output.txt", "output_ips.txt")
+    snapshot_if_exists(config, IP_COUNTS_FILE, IP_COUNTS_FILE)
+    if not ips and config["ALLOW_EMPTY_INPUT"] != "1":
+        write_summary(config)
+        raise PipelineError(
+            "parsed 0 IPs from %s. Refusing to continue with an empty block plan.\n"
+            "Set ALLOW_EMPTY_INPUT=1 only for an intentional empty dry-run." % config["INPUT_FILE"],
+            2,
+        )
+    if config["PREFILTER_BLOCKED"] == "1":
+        with recorder.stage("prefilter") as record:
+            parsed_count = len(ips)
+            ips = stage_prefilter(config, ips)
+            record.update(input_count=parsed_count, output_count=len(ips), bytes_written=stage_timing.file_bytes(["output.txt"]))
+        snapshot_if_exists(config, PREFILTER_DROPPED_FILE, PREFILTER_DROPPED_FILE)
+    stage_server_status(config)
+    snapshot_if_exists(config, STATUS_WORKERS_FILE, STATUS_WORKERS_FILE)
+
+    with recorder.stage("load_geo_data") as record:
+        geo_data = fast_geo_lookup.load_geo_data("geo_data.json")
+        record.update(bytes_read=stage_timing.file_bytes(["geo_data.json"]), output_count=len(geo_data))
+    if config["FAST_GEO_LOOKUP"] == "1":
+        with recorder.stage("fast_geo_lookup") as record:
+            stage_fast_geo_lookup(config, ips, geo_data)
+            record.update(
+                input_count=len(ips),
+                output_count=len(geo_data),
+                bytes_read=stage_timing.file_bytes([config["FAST_GEO_RANGES"]]),
+                bytes_written=stage_timing.file_bytes(["geo_data.json"]),
+            )
+
+    country_rows = provider_rows = None
+    if config["AGG_SOURCE"] == "geo":
+        with recorder.stage("geo_fetch") as record:
+            stage_geo_fetch(config, ips, geo_data)
+            record.update(input_count=len(ips), output_count=len(geo_data))
+            if config["SKIP_GEO_FETCH"] != "1":
+                record["bytes_written"] = stage_timing.file_bytes(["geo_data.json"])
+        if config["COVER_MODE"] != "1" and config["POLICY_MODE"] == "1":
+            with recorder.stage("recommendations") as record:
+                country_rows, provider_rows = stage_recommendations(config, geo_data)
+                record.update(
+                    input_count=len(geo_data),
+                    output_count=len(country_rows) + len(provider_rows),
+                    bytes_written=stage_timing.file_bytes(RECOMMENDATION_OUTPUTS),
+                )
+    elif config["POLICY_MODE"] == "1":
+        print("WARNING: POLICY_MODE=1 only applies to AGG_SOURCE=geo. Using legacy prefix mode for raw IP source.", file=sys.stderr)
+
+    with recorder.stage("aggregate") as record:
+        result = stage_aggregate(config, ips, geo_data, country_rows, provider_rows)
+        record.update(
+            input_count=len(ips),
+            output_count=len(result["subnets"]),
+            bytes_written=stage_timing.file_bytes([config["OUTPUT_FILE"]] + AGGREGATE_OUTPUTS),
+        )
+    snapshot_if_exists(config, config["OUTPUT_FILE"], os.path.basename(config["OUTPUT_FILE"]))
+    for path in AGGREGATE_OUTPUTS + RECOMMENDATION_OUTPUTS:
+        snapshot_if_exists(config, path, path)
+
+    allowlist_path = os.path.join("ip_cache", "allowlist_cidrs.json")
+    with recorder.stage("allowlist") as record:
+        call_main("cache_crawler_ips.py", cache_crawler_ips.main, ["--cache-dir", "ip_cache"])
+        record.update(output_count=stage_timing.count_items(allowlist_path), bytes_written=stage_timing.file_bytes([allowlist_path]))
+    snapshot_if_exists(config, allowlist_path, "allowlist_cidrs.json")
+    with recorder.stage("audit") as record:
+        call_main("audit_generiek_subnets.py", audit_generiek_subnets.main, [
+            "--input", config["OUTPUT_FILE"],
+            "--allowlist", allowlist_path,
+            "--country-codes", config["COUNTRY_CODES"],
+        ])
+        record.update(
+            input_count=len(result["subnets"]),
+            bytes_read=stage_timing.file_bytes([config["OUTPUT_FILE"], allowlist_path, "geo_data.json"]),
+        )
+
+    if config["CHECK_EXISTING"] == "1":
+        with recorder.stage("existing_audit") as record:
+            stage_existing_audit(config)
+            record.update(output_count=stage_timing.count_items("bad_ufw_rules.json"))
+    else:
+        stage_existing_audit(config)
+    with recorder.stage("apply") as record:
+        stage_apply(config)
+        record.update(input_count=len(result["subnets"]))
+    if config["RECURRENCE_INDEX"] == "1":
+        stage_recurrence(config)
+    write_summary(config)
+
+    if config["APPLY"] != "1":
+        print("Dry-run complete. Re-run with APPLY=1 to add the planned UFW rules.")
+    print("Run snapshot saved to %s" % config["RUN_DIR"])
+
+
+def build_parser():
+    return argparse.ArgumentParser(
+        description="Run the run_prepare_generiek_blocks.sh stages in one Python process. "
+        "Configuration comes from the same environment variables as the shell script."
+    )
+
+
+def main(argv=None):
+    build_parser().parse_args(argv)
+    try:
+        run_pipeline(load_config())
+        return 0
+    except PipelineError as exc:
+        print("ERROR: %s" % exc, file=sys.stderr)
+        return exc.returncode
+    except (IOError, OSError, ValueError) as exc:
+        print("ERROR: %s" % exc, file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -2,10 +2,20 @@
 set -euo pipefail
 
 PYTHON_BIN="${PYTHON:-python}"
+
+if [ "${IN_PROCESS_PIPELINE:-0}" = "1" ]; then
+  exec "$PYTHON_BIN" run_prepare_generiek_blocks.py
+fi
+
 POLICY_MODE="${POLICY_MODE:-1}"
 MERGE_PROVIDER_CANDIDATES="${MERGE_PROVIDER_CANDIDATES:-0}"
+COVER_MODE="${COVER_MODE:-0}"
+COVER_MAX_BLOCKED_ADDRESSES="${COVER_MAX_BLOCKED_ADDRESSES:-0}"
+COVER_MIN_PREFIX="${COVER_MIN_PREFIX:-16}"
 TARGET_PREFIX="${TARGET_PREFIX:-24}"
 MIN_HITS="${MIN_HITS:-1}"
+RECOMMEND_WORKERS="${RECOMMEND_WORKERS:-0}"
+INCREMENTAL_RECOMMENDATIONS="${INCREMENTAL_RECOMMENDATIONS:-1}"
 COUNTRY_CODES="${COUNTRY_CODES:-$("$PYTHON_BIN" -c 'import country_policy; print(country_policy.default_country_codes_csv())')}"
 AGG_SOURCE="${AGG_SOURCE:-geo}"
 INPUT_FILE="${INPUT_FILE:-input.txt}"
@@ -21,15 +31,46 @@ FAST_UFW_APPLY="${FAST_UFW_APPLY:-0}"
 FAST_UFW_BACKUP="${FAST_UFW_BACKUP:-1}"
 UFW_USER_RULES="${UFW_USER_RULES:-}"
 ALLOW_EMPTY_INPUT="${ALLOW_EMPTY_INPUT:-0}"
+STAGE_TIMINGS="${STAGE_TIMINGS:-1}"
+SNAPSHOT_DEDUP="${SNAPSHOT_DEDUP:-1}"
+PREFILTER_BLOCKED="${PREFILTER_BLOCKED:-1}"
+RECURRENCE_INDEX="${RECURRENCE_INDEX:-1}"
+RECURRENCE_DB="${RECURRENCE_DB:-runs/.recurrence.sqlite}"
+RECURRENCE_MIN_RUNS="${RECURRENCE_MIN_RUNS:-0}"
+RECURRENCE_WINDOW="${RECURRENCE_WINDOW:-10}"
 RUN_ID="${RUN_ID:-$(date +%Y%m%d-%H%M%S)}"
 RUN_DIR="${RUN_DIR:-runs/$RUN_ID}"
+TIMINGS_FILE="$RUN_DIR/timings.json"
 
+# timed_stage NAME [stage_timing.py options] -- command [args...]
+timed_stage() {
+  stage="$1"
+  shift
+  if [ "$STAGE_TIMINGS" = "1" ]; then
+    "$PYTHON_BIN" stage_timing.py --timings "$TIMINGS_FILE" --stage "$stage" "$@"
+    return
+  fi
+  while [ "$#" -gt 0 ] && [ "$1" != "--" ]; do
+    shift
+  done
+  shift
+  "$@"
+}
+
+# snapshot_if_exists SRC DEST [SRC DEST ...]
+# With SNAPSHOT_DEDUP=1 files go to runs/.objects once per content
+# (gzipped) and RUN_DIR/manifest.json points at them; see run_snapshots.py.
 snapshot_if_exists() {
-  src="$1"
-  dest="$2"
-  if [ -e "$src" ]; then
-    cp "$src" "$RUN_DIR/$dest"
+  if [ "$SNAPSHOT_DEDUP" = "1" ]; then
+    "$PYTHON_BIN" run_snapshots.py store --run-dir "$RUN_DIR" "$@"
+    return
   fi
+  while [ "$#" -gt 1 ]; do
+    if [ -e "$1" ]; then
+      cp "$1" "$RUN_DIR/$2"
+    fi
+    shift 2
+  done
 }
 
 write_summary() {
@@ -40,8 +81,13 @@ write_summary() {
     echo "python=$PYTHON_BIN"
     echo "policy_mode=$POLICY_MODE"
     echo "merge_provider_candidates=$MERGE_PROVIDER_CANDIDATES"
+    echo "cover_mode=$COVER_MODE"
+    echo "cover_max_blocked_addresses=$COVER_MAX_BLOCKED_ADDRESSES"
+    echo "cover_min_prefix=$COVER_MIN_PREFIX"
     echo "target_prefix=$TARGET_PREFIX"
     echo "min_hits=$MIN_HITS"
+    echo "recommend_workers=$RECOMMEND_WORKERS"
+    echo "incremental_recommendations=$INCREMENTAL_RECOMMENDATIONS"
     echo "country_codes=$COUNTRY_CODES"
     echo "agg_source=$AGG_SOURCE"
     echo "input_file=$INPUT_FILE"
@@ -55,9 +101,21 @@ write_summary() {
     echo "fast_ufw_apply=$FAST_UFW_APPLY"
     echo "fast_ufw_backup=$FAST_UFW_BACKUP"
     echo "ufw_user_rules=$UFW_USER_RULES"
-    if [ -f output.txt ]; then
+    echo "stage_timings=$STAGE_TIMINGS"
+    echo "prefilter_blocked=$PREFILTER_BLOCKED"
+    # output.txt loses already blocked IPs in the prefilter stage; the
+    # counts file still has one line per parsed IP.
+    if [ -f output_ip_counts.txt ]; then
+      echo "parsed_ip_lines=$(wc -l < output_ip_counts.txt | tr -d ' ')"
+    elif [ -f output.txt ]; then
       echo "parsed_ip_lines=$(wc -l < output.txt | tr -d ' ')"
     fi
+    if [ "$PREFILTER_BLOCKED" = "1" ] && [ -f prefilter_dropped_ips.txt ]; then
+      echo "prefilter_dropped_ips=$(wc -l < prefilter_dropped_ips.txt | tr -d ' ')"
+    fi
+    if [ -f output_ip_counts.txt ]; then
+      echo "parsed_ip_occurrences=$(awk -F '\t' '{ total += $2 } END { print total + 0 }' output_ip_counts.txt)"
+    fi
     if [ -f "$OUTPUT_FILE" ]; then
       echo "candidate_subnet_lines=$(grep -c '\"' "$OUTPUT_FILE" 2>/dev/null || true)"
     fi
@@ -76,18 +134,30 @@ if [ "$INPUT_FILE" != "input.txt" ]; then
   cp "$INPUT_FILE" input.txt
 fi
 
-"$PYTHON_BIN" parse_ips.py
+timed_stage parse_ips --read input.txt --write output.txt --write output_ip_counts.txt --output-count output.txt -- "$PYTHON_BIN" parse_ips.py
 PARSED_IP_LINES=$(wc -l < output.txt | tr -d ' ')
 if [ "$PARSED_IP_LINES" -eq 0 ] && [ "$ALLOW_EMPTY_INPUT" != "1" ]; then
-  snapshot_if_exists input.txt "input_effective.txt"
-  snapshot_if_exists output.txt "output_ips.txt"
+  snapshot_if_exists input.txt "input_effective.txt" \
+    output.txt "output_ips.txt" \
+    output_ip_counts.txt "output_ip_counts.txt"
   write_summary
   echo "ERROR: parsed 0 IPs from $INPUT_FILE. Refusing to continue with an empty block plan." >&2
   echo "Set ALLOW_EMPTY_INPUT=1 only for an intentional empty dry-run." >&2
   exit 2
 fi
-snapshot_if_exists input.txt "input_effective.txt"
-snapshot_if_exists output.txt "output_ips.txt"
+snapshot_if_exists input.txt "input_effective.txt" \
+  output.txt "output_ips.txt" \
+  output_ip_counts.txt "output_ip_counts.txt"
+if [ "$PREFILTER_BLOCKED" = "1" ]; then
+  timed_stage prefilter --read output.txt --write output.txt --input-count output_ip_counts.txt --output-count output.txt -- \
+    "$PYTHON_BIN" prefilter_blocked_ips.py --input output.txt --blocked-file blocked_generiek_ips.txt --user-rules "${UFW_USER_RULES:-/etc/ufw/user.rules}"
+  snapshot_if_exists prefilter_dropped_ips.txt "prefilter_dropped_ips.txt"
+fi
+if ! "$PYTHON_BIN" server_status.py --input input.txt --json-output server_status_workers.json --top 5; then
+  echo "WARNING: server_status.py failed; continuing without server_status_workers.json" >&2
+  rm -f server_status_workers.json
+fi
+snapshot_if_exists server_status_workers.json "server_status_workers.json"
 
 if [ "$FAST_GEO_LOOKUP" = "1" ]; then
   FAST_GEO_ARGS=(
@@ -98,7 +168,8 @@ if [ "$FAST_GEO_LOOKUP" = "1" ]; then
   if [ "$FAST_GEO_WRITE_UNKNOWN" = "1" ]; then
     FAST_GEO_ARGS+=(--write-unknown)
   fi
-  "$PYTHON_BIN" fast_geo_lookup.py "${FAST_GEO_ARGS[@]}"
+  timed_stage fast_geo_lookup --read "$FAST_GEO_RANGES" --write geo_data.json --input-count output.txt --output-count geo_data.json -- \
+    "$PYTHON_BIN" fast_geo_lookup.py "${FAST_GEO_ARGS[@]}"
   snapshot_if_exists geo_data.json "geo_data_after_fast_lookup.json"
 fi
 
@@ -107,18 +178,36 @@ AGG_ARGS=(
   --target-prefix "$TARGET_PREFIX"
   --min-hits "$MIN_HITS"
   --output "$OUTPUT_FILE"
+  --recurrence-db "$RECURRENCE_DB"
+  --recurrence-min-runs "$RECURRENCE_MIN_RUNS"
+  --recurrence-window "$RECURRENCE_WINDOW"
 )
 
 if [ "$AGG_SOURCE" = "geo" ]; then
   if [ "$SKIP_GEO_FETCH" = "1" ]; then
     echo "Skipping get_ip_country.py because SKIP_GEO_FETCH=1."
   else
-    "$PYTHON_BIN" get_ip_country.py
+    timed_stage geo_fetch --input-count output.txt --write geo_data.json --output-count geo_data.json -- "$PYTHON_BIN" get_ip_country.py
   fi
   AGG_ARGS+=(--input geo_data.json --filter-ips-file output.txt)
-  if [ "$POLICY_MODE" = "1" ]; then
-    "$PYTHON_BIN" recommend_country_prefixes.py --geo-data geo_data.json --country-codes "$COUNTRY_CODES"
-    "$PYTHON_BIN" recommend_provider_subnets.py --geo-data geo_data.json --country-codes "$COUNTRY_CODES"
+  if [ "$COVER_MODE" = "1" ]; then
+    AGG_ARGS+=(
+      --cover-mode
+      --allowlist ip_cache/allowlist_cidrs.json
+      --max-blocked-addresses "$COVER_MAX_BLOCKED_ADDRESSES"
+      --cover-min-prefix "$COVER_MIN_PREFIX"
+    )
+  elif [ "$POLICY_MODE" = "1" ]; then
+    COUNTRY_RECOMMEND_ARGS=(--geo-data geo_data.json --country-codes "$COUNTRY_CODES" --workers "$RECOMMEND_WORKERS")
+    PROVIDER_RECOMMEND_ARGS=(--geo-data geo_data.json --country-codes "$COUNTRY_CODES" --workers "$RECOMMEND_WORKERS")
+    if [ "$INCREMENTAL_RECOMMENDATIONS" = "1" ]; then
+      COUNTRY_RECOMMEND_ARGS+=(--state-file country_prefix_state.json)
+      PROVIDER_RECOMMEND_ARGS+=(--state-file provider_subnet_state.json)
+    fi
+    timed_stage recommendations --read geo_data.json --write country_prefix_recommendations.json --output-count country_prefix_recommendations.json -- \
+      "$PYTHON_BIN" recommend_country_prefixes.py "${COUNTRY_RECOMMEND_ARGS[@]}"
+    timed_stage recommendations --read geo_data.json --write provider_subnet_recommendations.json --output-count provider_subnet_recommendations.json -- \
+      "$PYTHON_BIN" recommend_provider_subnets.py "${PROVIDER_RECOMMEND_ARGS[@]}"
     AGG_ARGS+=(--policy-mode --country-policy-file country_prefix_recommendations.json)
     if [ "$MERGE_PROVIDER_CANDIDATES" = "1" ]; then
       AGG_ARGS+=(--provider-policy-file provider_subnet_recommendations.json)
@@ -126,6 +215,13 @@ if [ "$AGG_SOURCE" = "geo" ]; then
   fi
 elif [ "$AGG_SOURCE" = "ips" ]; then
   AGG_ARGS+=(--input output.txt)
+  if [ -f output_ip_counts.txt ]; then
+    AGG_ARGS+=(--counts-file output_ip_counts.txt)
+  fi
+  if [ "$COVER_MODE" = "1" ]; then
+    echo "ERROR: COVER_MODE=1 requires AGG_SOURCE=geo" >&2
+    exit 1
+  fi
   if [ "$POLICY_MODE" = "1" ]; then
     echo "WARNING: POLICY_MODE=1 only applies to AGG_SOURCE=geo. Using legacy prefix mode for raw IP source." >&2
   fi
@@ -138,28 +234,31 @@ if [ "$AGG_SOURCE" = "geo" ]; then
   AGG_ARGS+=(--country-codes "$COUNTRY_CODES")
 fi
 
-"$PYTHON_BIN" aggregate_generiek_subnets.py "${AGG_ARGS[@]}"
-snapshot_if_exists "$OUTPUT_FILE" "$(basename "$OUTPUT_FILE")"
-snapshot_if_exists generiek_country_report.json "generiek_country_report.json"
-snapshot_if_exists generiek_blocked_candidate_ips.txt "generiek_blocked_candidate_ips.txt"
-snapshot_if_exists generiek_allowed_non_target_ips.txt "generiek_allowed_non_target_ips.txt"
-snapshot_if_exists country_prefix_recommendations.txt "country_prefix_recommendations.txt"
-snapshot_if_exists country_prefix_recommendations.json "country_prefix_recommendations.json"
-snapshot_if_exists country_prefix_plan.sh "country_prefix_plan.sh"
-snapshot_if_exists provider_subnet_recommendations.txt "provider_subnet_recommendations.txt"
-snapshot_if_exists provider_dangerous_subnets.txt "provider_dangerous_subnets.txt"
-snapshot_if_exists provider_subnet_recommendations.json "provider_subnet_recommendations.json"
-snapshot_if_exists provider_subnet_candidates.json "provider_subnet_candidates.json"
-"$PYTHON_BIN" cache_crawler_ips.py --cache-dir ip_cache
+timed_stage aggregate --read geo_data.json --read output.txt --write "$OUTPUT_FILE" --input-count output.txt --output-count "$OUTPUT_FILE" -- \
+  "$PYTHON_BIN" aggregate_generiek_subnets.py "${AGG_ARGS[@]}"
+snapshot_if_exists "$OUTPUT_FILE" "$(basename "$OUTPUT_FILE")" \
+  generiek_country_report.json "generiek_country_report.json" \
+  generiek_blocked_candidate_ips.txt "generiek_blocked_candidate_ips.txt" \
+  generiek_allowed_non_target_ips.txt "generiek_allowed_non_target_ips.txt" \
+  country_prefix_recommendations.txt "country_prefix_recommendations.txt" \
+  country_prefix_recommendations.json "country_prefix_recommendations.json" \
+  country_prefix_plan.sh "country_prefix_plan.sh" \
+  provider_subnet_recommendations.txt "provider_subnet_recommendations.txt" \
+  provider_dangerous_subnets.txt "provider_dangerous_subnets.txt" \
+  provider_subnet_recommendations.json "provider_subnet_recommendations.json" \
+  provider_subnet_candidates.json "provider_subnet_candidates.json"
+timed_stage allowlist --write ip_cache/allowlist_cidrs.json --output-count ip_cache/allowlist_cidrs.json -- "$PYTHON_BIN" cache_crawler_ips.py --cache-dir ip_cache
 snapshot_if_exists ip_cache/allowlist_cidrs.json "allowlist_cidrs.json"
-"$PYTHON_BIN" audit_generiek_subnets.py --input "$OUTPUT_FILE" --allowlist ip_cache/allowlist_cidrs.json --country-codes "$COUNTRY_CODES"
+timed_stage audit --read "$OUTPUT_FILE" --read ip_cache/allowlist_cidrs.json --read geo_data.json --input-count "$OUTPUT_FILE" -- \
+  "$PYTHON_BIN" audit_generiek_subnets.py --input "$OUTPUT_FILE" --allowlist ip_cache/allowlist_cidrs.json --country-codes "$COUNTRY_CODES"
 
 if [ "$CHECK_EXISTING" = "1" ]; then
-  "$PYTHON_BIN" find_bad_ufw_rules.py --allowlist ip_cache/allowlist_cidrs.json --output bad_ufw_rules.json --country-codes "$COUNTRY_CODES" $SUDO_FLAG
+  timed_stage existing_audit --read geo_data.json --output-count bad_ufw_rules.json -- \
+    "$PYTHON_BIN" find_bad_ufw_rules.py --allowlist ip_cache/allowlist_cidrs.json --output bad_ufw_rules.json --country-codes "$COUNTRY_CODES" $SUDO_FLAG
   snapshot_if_exists bad_ufw_rules.json "bad_ufw_rules.json"
   "$PYTHON_BIN" clean_bad_ufw_rules.py --input bad_ufw_rules.json $SUDO_FLAG --dry-run
   if [ "$APPLY" = "1" ]; then
-    "$PYTHON_BIN" clean_bad_ufw_rules.py --input bad_ufw_rules.json $SUDO_FLAG
+    timed_stage existing_audit --input-count bad_ufw_rules.json -- "$PYTHON_BIN" clean_bad_ufw_rules.py --input bad_ufw_rules.json $SUDO_FLAG
   fi
 else
   echo "Skipping existing UFW audit. Run with CHECK_EXISTING=1 for one-time cleanup."
@@ -212,9 +311,14 @@ if [ "$FAST_UFW_APPLY" = "1" ]; then
   else
     FAST_UFW_ARGS+=(--dry-run --output-preview "$RUN_DIR/user.rules.preview")
   fi
-  "$PYTHON_BIN" fast_apply_ufw_user_rules.py "${FAST_UFW_ARGS[@]}"
+  timed_stage apply --read "$UFW_USER_RULES" --input-count "$OUTPUT_FILE" -- "$PYTHON_BIN" fast_apply_ufw_user_rules.py "${FAST_UFW_ARGS[@]}"
 else
-  "$PYTHON_BIN" block_generiek_subnet.py "${BLOCK_ARGS[@]}"
+  timed_stage apply --input-count "$OUTPUT_FILE" -- "$PYTHON_BIN" block_generiek_subnet.py "${BLOCK_ARGS[@]}"
+fi
+if [ "$RECURRENCE_INDEX" = "1" ]; then
+  if ! "$PYTHON_BIN" run_recurrence.py --db "$RECURRENCE_DB" add --run-dir "$RUN_DIR"; then
+    echo "WARNING: run_recurrence.py failed; continuing without indexing $RUN_DIR" >&2
+  fi
 fi
 write_summary
 
@@ -11,13 +11,23 @@ export INPUT_FILE="${INPUT_FILE:-input.txt}"
 FETCH_SERVER_STATUS="${FETCH_SERVER_STATUS:-1}"
 SERVER_STATUS_URL="${SERVER_STATUS_URL:-http://127.0.0.1/server-status}"
 SERVER_STATUS_HOST="${SERVER_STATUS_HOST:-www.nieuwejobs.com}"
+SERVER_STATUS_MAX_TIME="${SERVER_STATUS_MAX_TIME:-30}"
 CURL_BIN="${CURL_BIN:-curl}"
 RESTART_APACHE="${RESTART_APACHE:-1}"
 APACHE_RESTART_CMD="${APACHE_RESTART_CMD:-service apache2 restart}"
+RECOVERY_MODE="${RECOVERY_MODE:-smart}"
+RECOVERY_THRESHOLD="${RECOVERY_THRESHOLD:-100}"
+RECOVERY_SETTLE_SECONDS="${RECOVERY_SETTLE_SECONDS:-5}"
+APACHE_GRACEFUL_CMD="${APACHE_GRACEFUL_CMD:-apachectl -k graceful}"
+# Quoted default: a literal {cidr} inside ${...:-...} ends the expansion at
+# its "}". An empty value is kept and disables the kill step.
+default_kill_cmd='conntrack -D -s {cidr}'
+KILL_CONNECTIONS_CMD="${KILL_CONNECTIONS_CMD-$default_kill_cmd}"
+PYTHON_BIN="${PYTHON:-python}"
 
 if [ "$FETCH_SERVER_STATUS" = "1" ]; then
   tmp_status="${INPUT_FILE}.tmp-$$"
-  "$CURL_BIN" -fsS "$SERVER_STATUS_URL" -H "Host: $SERVER_STATUS_HOST" -o "$tmp_status"
+  "$CURL_BIN" -fsS --max-time "$SERVER_STATUS_MAX_TIME" "$SERVER_STATUS_URL" -H "Host: $SERVER_STATUS_HOST" -o "$tmp_status"
   mv "$tmp_status" "$INPUT_FILE"
   echo "Fetched server status into $INPUT_FILE from $SERVER_STATUS_URL with Host: $SERVER_STATUS_HOST"
 fi
@@ -25,6 +35,27 @@ fi
 ./run_prepare_generiek_blocks.sh
 
 if [ "$RESTART_APACHE" = "1" ]; then
-  echo "Restarting Apache with: $APACHE_RESTART_CMD"
-  $APACHE_RESTART_CMD
+  if [ "$RECOVERY_MODE" = "restart" ]; then
+    echo "Restarting Apache with: $APACHE_RESTART_CMD"
+    $APACHE_RESTART_CMD
+  else
+    recovery_dry_run=""
+    if [ "${APPLY:-1}" != "1" ]; then
+      recovery_dry_run="--dry-run"
+    fi
+    echo "Recovering Apache workers held by blocked sources (restart only if still above $RECOVERY_THRESHOLD busy)"
+    if ! "$PYTHON_BIN" recover_apache_workers.py \
+      --blocked "${OUTPUT_FILE:-aggregated_generiek_subnets.json}" \
+      --url "$SERVER_STATUS_URL" \
+      --host-header "$SERVER_STATUS_HOST" \
+      --threshold "$RECOVERY_THRESHOLD" \
+      --settle-seconds "$RECOVERY_SETTLE_SECONDS" \
+      --kill-cmd "$KILL_CONNECTIONS_CMD" \
+      --graceful-cmd "$APACHE_GRACEFUL_CMD" \
+      --restart-cmd "$APACHE_RESTART_CMD" \
+      $recovery_dry_run; then
+      echo "WARNING: worker recovery failed; restarting Apache with: $APACHE_RESTART_CMD" >&2
+      $APACHE_RESTART_CMD
+    fi
+  fi
 fi
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import argparse
+import os
+import sqlite3
+import sys
+
+import run_snapshots
+from ipv4_index import bounds_to_cidr, ints_from_ips, ipv4_int_to_text, sorted_unique_ints
+
+
+DEFAULT_DB = os.path.join("runs", ".recurrence.sqlite")
+SOURCE_FILE = "output_ips.txt"
+
+# Which source IPs (and /24s, stored as ip >> 8) appeared in which run.
+# Rows are kept in run order so adding a run only appends to the tables
+# and the by-run indexes; "seen in >= K of the last N runs" reads just the
+# index entries of those N runs and groups them by IP.
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS runs (run_seq INTEGER PRIMARY KEY, run_id TEXT NOT NULL UNIQUE, ips INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS ip_runs (run_seq INTEGER NOT NULL, ip INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS subnet_runs (run_seq INTEGER NOT NULL, subnet INTEGER NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ip_runs_by_run ON ip_runs (run_seq, ip)",
+    "CREATE INDEX IF NOT EXISTS subnet_runs_by_run ON subnet_runs (run_seq, subnet)",
+]
+
+LEVELS = {
+    "ip": ("ip_runs", "ip"),
+    "subnet": ("subnet_runs", "subnet"),
+}
+
+
+def connect(path):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    conn = sqlite3.connect(path)
+    for statement in SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    return conn
+
+
+def indexed_run_ids(conn):
+    return set(row[0] for row in conn.execute("SELECT run_id FROM runs"))
+
+
+def add_run(conn, run_id, ip_ints):
+    # Re-adding a run replaces its rows, so a re-run of the same RUN_ID
+    # does not count twice.
+    ip_ints = sorted_unique_ints(ip_ints)
+    subnets = sorted_unique_ints(value >> 8 for value in ip_ints)
+    with conn:
+        row = conn.execute("SELECT run_seq FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        if row:
+            conn.execute("DELETE FROM ip_runs WHERE run_seq = ?", row)
+            conn.execute("DELETE FROM subnet_runs WHERE run_seq = ?", row)
+            conn.execute("DELETE FROM runs WHERE run_seq = ?", row)
+        run_seq = conn.execute("INSERT INTO runs (run_id, ips) VALUES (?, ?)", (run_id, len(ip_ints))).lastrowid
+        conn.executemany("INSERT INTO ip_runs (run_seq, ip) VALUES (?, ?)", ((run_seq, value) for value in ip_ints))
+        conn.executemany("INSERT INTO subnet_runs (run_seq, subnet) VALUES (?, ?)", ((run_seq, value) for value in subnets))
+    return len(ip_ints)
+
+
+def run_source_ints(run_dir):
+    text = run_snapshots.read_run_text(run_dir, SOURCE_FILE)
+    if text is None:
+        return None
+    return ints_from_ips(text.split())
+
+
+def index_run_dir(conn, run_dir):
+    ip_ints = run_source_ints(run_dir)
+    if ip_ints is None:
+        return None
+    return add_run(conn, os.path.basename(os.path.abspath(run_dir)), ip_ints)
+
+
+def update_index(conn, runs_dir):
+    # Index every run directory not indexed yet; returns the run ids added.
+    known = indexed_run_ids(conn)
+    added = []
+    for name in sorted(os.listdir(runs_dir)):
+        run_dir = os.path.join(runs_dir, name)
+        if name.startswith(".") or name in known or not os.path.isdir(run_dir):
+            continue
+        if index_run_dir(conn, run_dir) is not None:
+            added.append(name)
+    return added
+
+
+def recurring(conn, level, min_runs, window):
+    # {key: runs} for keys seen in at least min_runs of the newest window
+    # runs (ordered by run id, which starts with the run timestamp).
+    table, column = LEVELS[level]
+    rows = conn.execute(
+        "SELECT %s, COUNT(*) FROM %s WHERE run_seq IN "
+        "(SELECT run_seq FROM runs ORDER BY run_id DESC LIMIT ?) "
+        "GROUP BY %s HAVING COUNT(*) >= ?" % (column, table, column),
+        (window, min_runs),
+    )
+    return dict(rows)
+
+
+def recurring_subnet_keys(path, min_runs, window):
+    # /24 keys (ip >> 8) for aggregate_generiek_subnets; empty when the
+    # index does not exist yet or cannot be read (locked, corrupt), so the
+    # aggregate stage runs without escalation instead of failing.
+    if not path or min_runs < 1 or not os.path.exists(path):
+        return set()
+    try:
+        conn = connect(path)
+        try:
+            return set(recurring(conn, "subnet", min_runs, window))
+        finally:
+            conn.close()
+    except sqlite3.Error as exc:
+        print("WARNING: ignoring recurrence index %s: %s" % (path, exc), file=sys.stderr)
+        return set()
+
+
+def key_to_text(level, key):
+    if level == "subnet":
+        return bounds_to_cidr(key << 8, 24)
+    return ipv4_int_to_text(key)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Index source IPs and /24s by the runs they appeared in.")
+    parser.add_argument("--db", default=DEFAULT_DB)
+    subparsers = parser.add_subparsers(dest="command")
+
+    add_cmd = subparsers.add_parser("add", help="Index one finished run directory.")
+    add_cmd.add_argument("--run-dir", required=True)
+
+    update_cmd = subparsers.add_parser("update", help="Index every run directory not indexed yet.")
+    update_cmd.add_argument("--runs-dir", default="runs")
+
+    query_cmd = subparsers.add_parser("query", help="List IPs or /24s seen in at least --min-runs of the last --window runs.")
+    query_cmd.add_argument("--level", choices=sorted(LEVELS), default="subnet")
+    query_cmd.add_argument("--min-runs", type=int, default=3)
+    query_cmd.add_argument("--window", type=int, default=10)
+    query_cmd.add_argument("--limit", type=int, default=0, help="Print at most this many rows; 0 prints all")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not getattr(args, "command", None):
+        parser.print_help()
+        return 2
+    if args.command == "query" and (args.window < 1 or args.min_runs < 1):
+        print("ERROR: --window and --min-runs must be at least 1", file=sys.stderr)
+        return 1
+
+    try:
+        conn = connect(args.db)
+        if args.command == "add":
+            count = index_run_dir(conn, args.run_dir)
+            if count is None:
+                print("ERROR: %s has no %s" % (args.run_dir, SOURCE_FILE), file=sys.stderr)
+                return 1
+            print("Indexed %s: %d IPs" % (os.path.basename(os.path.abspath(args.run_dir)), count))
+        elif args.command == "update":
+            added = update_index(conn, args.runs_dir)
+            print("Indexed runs:", len(added))
+        else:
+            rows = sorted(recurring(conn, args.level, args.min_runs, args.window).items(), key=lambda row: (-row[1], row[0]))
+            if args.limit:
+                rows = rows[:args.limit]
+            for key, runs in rows:
+                print("%s %d" % (key_to_text(args.level, key), runs))
+    except (IOError, OSError, sqlite3.Error) as exc:
+        print("ERROR: %s" % exc, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
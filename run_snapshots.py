@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+# Run artifacts are stored once under <runs dir>/.objects/ab/<sha256>.gz,
+# keyed by the hash of the uncompressed content; runs/<id>/manifest.json
+# maps each snapshot name to its hash. Files written straight into the run
+# directory (summary.txt, timings.json) stay plain and are read first.
+MANIFEST_NAME = "manifest.json"
+OBJECTS_DIR_NAME = ".objects"
+
+
+def objects_dir_for(run_dir):
+    return os.path.join(os.path.dirname(os.path.abspath(run_dir)), OBJECTS_DIR_NAME)
+
+
+def object_path(objects_dir, digest):
+    return os.path.join(objects_dir, digest[:2], digest + ".gz")
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(run_dir):
+    path = os.path.join(run_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {"version": 1, "files": {}}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(run_dir, manifest):
+    path = os.path.join(run_dir, MANIFEST_NAME)
+    tmp_path = "%s.tmp-%s" % (path, os.getpid())
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.rename(tmp_path, path)
+
+
+def store_object(objects_dir, src):
+    # Returns (digest, bytes added to the object store).
+    digest = file_sha256(src)
+    path = object_path(objects_dir, digest)
+    if os.path.exists(path):
+        return digest, 0
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp_path = "%s.tmp-%s" % (path, os.getpid())
+    with open(src, "rb") as f:
+        with open(tmp_path, "wb") as raw:
+            # mtime=0 keeps the object bytes a function of the content.
+            with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6, mtime=0) as out:
+                shutil.copyfileobj(f, out, 1 << 20)
+    os.rename(tmp_path, path)
+    return digest, os.path.getsize(path)
+
+
+def snapshot_files(run_dir, pairs, objects_dir=None):
+    # pairs: [(src, name)]; missing sources are skipped like the old
+    # snapshot_if_exists. Returns the bytes added to the object store.
+    objects_dir = objects_dir or objects_dir_for(run_dir)
+    if not os.path.isdir(run_dir):
+        os.makedirs(run_dir)
+    manifest = load_manifest(run_dir)
+    added = 0
+    for src, name in pairs:
+        if not os.path.exists(src):
+            continue
+        digest, size = store_object(objects_dir, src)
+        added += size
+        manifest["files"][name] = {"sha256": digest, "bytes": os.path.getsize(src)}
+        # A plain copy from an older run layout would shadow the object.
+        plain = os.path.join(run_dir, name)
+        if os.path.exists(plain):
+            os.remove(plain)
+    save_manifest(run_dir, manifest)
+    return added
+
+
+def read_run_bytes(run_dir, name, manifest=None, objects_dir=None):
+    # Contents of a run file (plain file or snapshot object), or None.
+    plain = os.path.join(run_dir, name)
+    if os.path.exists(plain):
+        with open(plain, "rb") as f:
+            return f.read()
+    if manifest is None:
+        manifest = load_manifest(run_dir)
+    entry = manifest["files"].get(name)
+    if not entry:
+        return None
+    path = object_path(objects_dir or objects_dir_for(run_dir), entry["sha256"])
+    if not os.path.exists(path):
+        return None
+    with gzip.open(path, "rb") as f:
+        return f.read()
+
+
+def read_run_text(run_dir, name, manifest=None, objects_dir=None):
+    data = read_run_bytes(run_dir, name, manifest, objects_dir)
+    if data is None:
+        return None
+    return data.decode("utf-8", "replace")
+
+
+def run_file_exists(run_dir, name, manifest=None):
+    if os.path.exists(os.path.join(run_dir, name)):
+        return True
+    if manifest is None:
+        manifest = load_manifest(run_dir)
+    return name in manifest["files"]
+
+
+def referenced_digests(runs_dir):
+    digests = set()
+    for name in os.listdir(runs_dir):
+        run_dir = os.path.join(runs_dir, name)
+        if name.startswith(".") or not os.path.isdir(run_dir):
+            continue
+        for entry in load_manifest(run_dir)["files"].values():
+            digests.add(entry["sha256"])
+    return digests
+
+
+def collect_garbage(runs_dir, dry_run=False):
+    # Remove objects no run manifest refers to (after runs were deleted).
+    # Returns (objects removed, bytes freed).
+    objects_dir = os.path.join(runs_dir, OBJECTS_DIR_NAME)
+    if not os.path.isdir(objects_dir):
+        return 0, 0
+    keep = referenced_digests(runs_dir)
+    removed = 0
+    freed = 0
+    for root, _dirs, files in os.walk(objects_dir):
+        for name in files:
+            if not name.endswith(".gz") or name[:-3] in keep:
+                continue
+            path = os.path.join(root, name)
+            freed += os.path.getsize(path)
+            removed += 1
+            if not dry_run:
+                os.remove(path)
+    return removed, freed
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Store run artifacts once, compressed and keyed by content hash.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    store_cmd = subparsers.add_parser("store", help="Snapshot files into a run directory.")
+    store_cmd.add_argument("--run-dir", required=True)
+    store_cmd.add_argument("pairs", nargs="*", metavar="SRC NAME", help="Source file and snapshot name, repeated")
+
+    cat_cmd = subparsers.add_parser("cat", help="Print a run file.")
+    cat_cmd.add_argument("--run-dir", required=True)
+    cat_cmd.add_argument("name")
+
+    gc_cmd = subparsers.add_parser("gc", help="Remove objects no run refers to.")
+    gc_cmd.add_argument("--runs-dir", default="runs")
+    gc_cmd.add_argument("--dry-run", action="store_true")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not getattr(args, "command", None):
+        parser.print_help()
+        return 2
+
+    try:
+        if args.command == "store":
+            if len(args.pairs) % 2:
+                print("ERROR: expected SRC NAME pairs", file=sys.stderr)
+                return 1
+            snapshot_files(args.run_dir, list(zip(args.pairs[0::2], args.pairs[1::2])))
+            return 0
+        if args.command == "cat":
+            data = read_run_bytes(args.run_dir, args.name)
+            if data is None:
+                print("ERROR: %s not found in %s" % (args.name, args.run_dir), file=sys.stderr)
+                return 1
+            getattr(sys.stdout, "buffer", sys.stdout).write(data)
+            return 0
+        removed, freed = collect_garbage(args.runs_dir, args.dry_run)
+        print("%s %d unreferenced objects (%d bytes)" % ("Would remove" if args.dry_run else "Removed", removed, freed))
+        return 0
+    except (IOError, OSError, ValueError) as exc:
+        print("ERROR: %s" % exc, file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
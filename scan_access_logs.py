@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import analyze_apache_subnets as subnet_report
+import analyze_status_category_requests as category_report
+import log_scan
+import log_stats_store
+import parse_access_log
+from local_ip_country import load_ranges
+
+REPORTS = ("stats", "subnets", "user-agents", "categories", "accounts")
+
+
+def parse_reports(value):
+    reports = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = [name for name in reports if name not in REPORTS]
+    if unknown:
+        raise ValueError("unknown report(s): %s (choose from %s)" % (", ".join(unknown), ", ".join(REPORTS)))
+    return reports
+
+
+def parse_prefixes(value):
+    prefixes = [int(p.strip()) for p in value.split(",") if p.strip()]
+    for prefix in prefixes:
+        if prefix < 1 or prefix > 32:
+            raise ValueError("invalid prefix: %s" % prefix)
+    return prefixes
+
+
+def write_json(path, data):
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+
+def category_summary(rows, geo_data, range_index, limit):
+    stats = category_report.summarize(rows, geo_data, range_index)
+    return {
+        "rows": stats["rows"],
+        "unique_ips": stats["unique_ips"],
+        "by_country": stats["by_country"].most_common(limit),
+        "by_provider": stats["by_provider"].most_common(limit),
+        "by_vhost": stats["by_vhost"].most_common(limit),
+        "examples_by_country": dict(stats["examples_by_country"]),
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Read Apache access logs once and write the log_stats counts, the subnet report, the per-IP user agent "
+        "summary, the categories= report and the /accounts/ hits from that single pass."
+    )
+    parser.add_argument("--log", action="append", default=[], help="Log file path (repeatable).")
+    parser.add_argument("--log-dir", help="Also read the access logs in this directory, as analyze_apache_subnets.py does.")
+    parser.add_argument("--no-gz", action="store_true", help="Skip .gz rotated logs under --log-dir.")
+    parser.add_argument("--log-format", default="auto", help="auto, common, combined, vhost_combined or an Apache LogFormat string.")
+    parser.add_argument("--reports", default=",".join(REPORTS), help="Comma-separated reports to build.")
+    parser.add_argument("--output-dir", default=".", help="Directory for the report files.")
+    parser.add_argument("--db", default="log_stats.sqlite", help="log_stats SQLite database (stats report).")
+    parser.add_argument("--geo-data", default="geo_data.json")
+    parser.add_argument("--ranges", default=os.path.join("data", "fast_geo_ranges.tsv"), help="Geo ranges for the categories report.")
+    parser.add_argument("--country-codes", default="CN,IN")
+    parser.add_argument("--prefixes", default="32,24,16", help="Comma-separated IPv4 prefixes for the subnet report.")
+    parser.add_argument("--min-requests", type=int, default=100)
+    parser.add_argument("--min-unique-ips", type=int, default=3)
+    parser.add_argument("--max-report-rows", type=int, default=200)
+    parser.add_argument("--min-categories", type=int, default=3)
+    parser.add_argument("--accounts-prefix", default="/accounts/")
+    parser.add_argument("--accounts-min-requests", type=int, default=200)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        reports = parse_reports(args.reports)
+        prefixes = parse_prefixes(args.prefixes)
+    except ValueError as exc:
+        print("ERROR: %s" % exc, file=sys.stderr)
+        return 1
+    if "subnets" in reports and subnet_report._ip is None:
+        print("ERROR: Missing ipaddress module. Install one of: pip install ipaddress or pip install ipaddr", file=sys.stderr)
+        return 1
+    if args.log_dir and not os.path.isdir(args.log_dir):
+        print("ERROR: log directory not found: %s" % args.log_dir, file=sys.stderr)
+        return 1
+    paths = list(args.log)
+    if args.log_dir:
+        paths.extend(subnet_report.iter_log_paths(args.log_dir, include_gz=not args.no_gz))
+    if not paths:
+        print("ERROR: no logs given; use --log or --log-dir", file=sys.stderr)
+        return 1
+
+    geo_data = subnet_report.load_geo_data(args.geo_data)
+    target_countries = subnet_report.parse_country_codes(args.country_codes)
+    aggregators = {}
+    offsets = None
+    conn = None
+    if "stats" in reports:
+        conn = log_stats_store.connect(args.db)
+        offsets = log_stats_store.load_file_offsets(conn)
+        aggregators["stats"] = log_scan.DateStats()
+    if "subnets" in reports:
+        aggregators["subnets"] = subnet_report.SubnetStats(geo_data, target_countries, prefixes)
+    if "user-agents" in reports:
+        aggregators["user-agents"] = parse_access_log.UserAgents()
+    if "categories" in reports:
+        aggregators["categories"] = category_report.CategoryRows(args.min_categories)
+    if "accounts" in reports:
+        aggregators["accounts"] = log_scan.PrefixHits(args.accounts_prefix)
+
+    try:
+        scan_stats = log_scan.scan_logs(paths, [aggregators[name] for name in reports], args.log_format, offsets=offsets)
+    except (IOError, OSError) as exc:
+        print("ERROR: %s" % exc, file=sys.stderr)
+        return 1
+    print("Files: %d, lines: %d, matched: %d" % (scan_stats["files"], scan_stats["lines"], scan_stats["matched"]))
+
+    def output(name):
+        return os.path.join(args.output_dir, name)
+
+    written = []
+    if "stats" in reports:
+        batch = aggregators["stats"].batch
+        log_stats_store.merge_buckets(conn, batch.to_buckets(), time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), offsets)
+        conn.close()
+        print("log_stats: counted %d new lines into %d dates" % (aggregators["stats"].counted, len(batch)))
+        written.append(args.db)
+    if "subnets" in reports:
+        totals, ips, subnets = aggregators["subnets"].finish(scan_stats)
+        report = subnet_report.build_report(totals, ips, subnets, target_countries, args.min_requests, args.min_unique_ips)
+        report_paths = [output(name) for name in (
+            "apache_subnet_report.json",
+            "apache_subnet_report.txt",
+            "apache_subnet_candidates.txt",
+            "apache_log_ips.txt",
+            "apache_missing_geo_ips.txt",
+        )]
+        subnet_report.write_json(report_paths[0], report)
+        subnet_report.write_text_report(report_paths[1], report, args.max_report_rows)
+        subnet_report.write_candidates(report_paths[2], report)
+        subnet_report.write_ip_lists(report_paths[3], report_paths[4], report)
+        written.extend(report_paths)
+    if "user-agents" in reports:
+        parse_access_log.write_summary(output("log_summary.json"), aggregators["user-agents"].result())
+        written.append(output("log_summary.json"))
+    if "categories" in reports:
+        range_index = None
+        if args.ranges and os.path.exists(args.ranges):
+            range_index = load_ranges(args.ranges)
+        summary = category_summary(aggregators["categories"].rows, geo_data, range_index, args.max_report_rows)
+        write_json(output("category_requests.json"), summary)
+        written.append(output("category_requests.json"))
+    if "accounts" in reports:
+        write_json(output("accounts_hits.json"), aggregators["accounts"].at_least(args.accounts_min_requests))
+        written.append(output("accounts_hits.json"))
+
+    for path in written:
+        print("Wrote:", path)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import re
+import sys
+
+from ipv4_index import bounds_to_cidr, network_bounds, parse_ipv4_int, to_text
+
+
+# Busy count as printed on the HTML page and in text copies of it.
+BUSY_RE = re.compile(r"\b(\d+)\s+requests currently being processed\b")
+IDLE_RE = re.compile(r"\b(\d+)\s+idle workers\b")
+AUTO_FIELD_RE = re.compile(r"^([A-Za-z][A-Za-z ]*):\s*(.*)$")
+SCOREBOARD_RE = re.compile(r"^[_SRWKDCLGI.]{8,}$")
+# Text copy of the extended scoreboard table: Srv, PID, Acc, M first.
+TEXT_ROW_RE = re.compile(r"^\s*(\d+-\d+|-)\s+(\d+|-)\s+(\d+/\d+/\d+)\s+([_SRWKDCLGI.])\s")
+HTML_ROW_RE = re.compile(r"<tr[^>]*>(.*?)</tr>", re.IGNORECASE | re.DOTALL)
+HTML_CELL_RE = re.compile(r"<t([dh])[^>]*>(.*?)(?=<t[dh][^>]*>|</tr>|$)", re.IGNORECASE | re.DOTALL)
+HTML_TAG_RE = re.compile(r"<[^>]+>")
+HTML_ENTITIES = [("&lt;", "<"), ("&gt;", ">"), ("&quot;", '"'), ("&#39;", "'"), ("&nbsp;", " "), ("&amp;", "&")]
+PROTOCOL_RE = re.compile(r"^(?:https?/\d(?:\.\d)?|h2c?)$", re.IGNORECASE)
+HTTP_METHODS = frozenset(["GET", "HEAD", "POST", "PUT", "DELETE", "OPTIONS", "PATCH", "CONNECT", "TRACE", "PROPFIND"])
+DEFAULT_COLUMNS = ["Srv", "PID", "Acc", "M", "CPU", "SS", "Req", "Conn", "Child", "Slot", "Client", "VHost", "Request"]
+# "_" waiting for a connection and "." open slot do not hold a request.
+IDLE_MODES = frozenset(["_", "."])
+# The format is sniffed from the head only; text inputs can be multi-GB logs.
+HEAD_BYTES = 64 * 1024
+
+WorkerRow = collections.namedtuple("WorkerRow", [
+    "srv",
+    "pid",
+    "accesses",
+    "mode",
+    "cpu",
+    "seconds",
+    "request_ms",
+    "client",
+    "protocol",
+    "vhost",
+    "request",
+])
+
+
+def parse_int(value):
+    value = value.strip()
+    return int(value) if value.isdigit() else None
+
+
+def parse_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def html_to_text(value):
+    value = HTML_TAG_RE.sub("", value)
+    for entity, char in HTML_ENTITIES:
+        value = value.replace(entity, char)
+    return value.strip()
+
+
+def make_row(values):
+    def get(name):
+        return values.get(name, "").strip()
+
+    return WorkerRow(
+        srv=get("Srv"),
+        pid=parse_int(get("PID")),
+        accesses=get("Acc"),
+        mode=get("M") or ".",
+        cpu=parse_float(get("CPU")),
+        seconds=parse_int(get("SS")),
+        request_ms=parse_int(get("Req")),
+        client=get("Client"),
+        protocol=get("Protocol"),
+        vhost=get("VHost"),
+        request=get("Request"),
+    )
+
+
+def split_text_tail(tokens, tail_columns):
+    # Columns after Client can be empty, which a text copy collapses. The
+    # request is recognised by its HTTP method, a protocol by its name
+    # (http/1.1, h2).
+    values = {}
+    if "Protocol" in tail_columns and tokens and PROTOCOL_RE.match(tokens[0]):
+        values["Protocol"] = tokens.pop(0)
+    if tokens and tokens[0] not in HTTP_METHODS:
+        values["VHost"] = tokens.pop(0)
+    values["Request"] = " ".join(tokens)
+    return values
+
+
+def parse_text_rows(lines):
+    columns = DEFAULT_COLUMNS
+    rows = []
+    for line in lines:
+        tokens = line.split()
+        if tokens[:4] == ["Srv", "PID", "Acc", "M"] and "Client" in tokens:
+            columns = tokens
+            continue
+        if not TEXT_ROW_RE.match(line):
+            continue
+        client_index = columns.index("Client")
+        if len(tokens) <= client_index:
+            continue
+        values = dict(zip(columns[:client_index + 1], tokens[:client_index + 1]))
+        values.update(split_text_tail(tokens[client_index + 1:], columns[client_index + 1:]))
+        rows.append(make_row(values))
+    return rows
+
+
+def parse_html_rows(text):
+    columns = None
+    rows = []
+    for row_html in HTML_ROW_RE.findall(text):
+        cells = HTML_CELL_RE.findall(row_html)
+        if not cells:
+            continue
+        if all(kind.lower() == "h" for kind, _value in cells):
+            names = [html_to_text(value) for _kind, value in cells]
+            columns = names if names[:2] == ["Srv", "PID"] else None
+            continue
+        if columns is None or len(cells) != len(columns):
+            continue
+        rows.append(make_row(dict(zip(columns, [html_to_text(value) for _kind, value in cells]))))
+    return rows
+
+
+def scoreboard_counts(scoreboard):
+    return dict(collections.Counter(scoreboard))
+
+
+def parse_auto(text):
+    fields = {}
+    for line in text.splitlines():
+        match = AUTO_FIELD_RE.match(line.strip())
+        if match:
+            fields[match.group(1).strip()] = match.group(2).strip()
+    return fields
+
+
+def detect_format(text):
+    head = text[:HEAD_BYTES]
+    lowered = head.lower()
+    if "<html" in lowered or "<table" in lowered:
+        return "html"
+    if re.search(r"^BusyWorkers:\s*\d+", head, re.MULTILINE) and "Scoreboard:" in head:
+        return "auto"
+    return "text"
+
+
+def empty_status(fmt):
+    return {
+        "format": fmt,
+        "busy_workers": None,
+        "idle_workers": None,
+        "scoreboard": {},
+        "workers": [],
+    }
+
+
+def parse_text_status(lines):
+    # Text copies and logs, one line at a time: busy/idle counts, the
+    # scoreboard lines and the worker rows in a single pass.
+    result = empty_status("text")
+    scoreboard_lines = []
+
+    def scan(lines):
+        for line in lines:
+            if result["busy_workers"] is None:
+                busy = BUSY_RE.search(line)
+                if busy:
+                    result["busy_workers"] = int(busy.group(1))
+            if result["idle_workers"] is None:
+                idle = IDLE_RE.search(line)
+                if idle:
+                    result["idle_workers"] = int(idle.group(1))
+            stripped = line.strip()
+            if SCOREBOARD_RE.match(stripped):
+                scoreboard_lines.append(stripped)
+            yield line
+
+    result["workers"] = parse_text_rows(scan(lines))
+    result["scoreboard"] = scoreboard_counts("".join(scoreboard_lines))
+    return result
+
+
+def parse_server_status(text):
+    # One pass over an Apache mod_status page. The ?auto format has no
+    # per-worker table, so its "workers" list is empty.
+    text = to_text(text)
+    fmt = detect_format(text)
+    if fmt == "text":
+        return parse_text_status(text.splitlines())
+    result = empty_status(fmt)
+    if fmt == "auto":
+        fields = parse_auto(text)
+        result["busy_workers"] = parse_int(fields.get("BusyWorkers", ""))
+        result["idle_workers"] = parse_int(fields.get("IdleWorkers", ""))
+        result["scoreboard"] = scoreboard_counts(fields.get("Scoreboard", ""))
+        return result
+
+    busy = BUSY_RE.search(text)
+    idle = IDLE_RE.search(text)
+    result["busy_workers"] = int(busy.group(1)) if busy else None
+    result["idle_workers"] = int(idle.group(1)) if idle else None
+    pre = re.search(r"<pre>(.*?)</pre>", text, re.IGNORECASE | re.DOTALL)
+    scoreboard_lines = pre.group(1).split() if pre else []
+    result["workers"] = parse_html_rows(text)
+    result["scoreboard"] = scoreboard_counts("".join(line for line in scoreboard_lines if SCOREBOARD_RE.match(line)))
+    return result
+
+
+def parse_busy_workers(text):
+    return parse_server_status(text)["busy_workers"]
+
+
+def split_request(request):
+    parts = request.split()
+    if len(parts) >= 2 and parts[0] in HTTP_METHODS:
+        return parts[0], parts[1]
+    return "", ""
+
+
+def is_active(row):
+    return row.mode not in IDLE_MODES
+
+
+def aggregate_workers(workers, prefix=24, active_only=True):
+    by_ip = {}
+    by_subnet = {}
+    by_vhost = {}
+    for row in workers:
+        if active_only and not is_active(row):
+            continue
+        if not row.client:
+            continue
+        item = by_ip.get(row.client)
+        if item is None:
+            item = by_ip[row.client] = {
+                "ip": row.client,
+                "workers": 0,
+                "seconds_total": 0,
+                "seconds_max": 0,
+                "modes": collections.Counter(),
+                "vhosts": collections.Counter(),
+            }
+        seconds = row.seconds or 0
+        item["workers"] += 1
+        item["seconds_total"] += seconds
+        item["seconds_max"] = max(item["seconds_max"], seconds)
+        item["modes"][row.mode] += 1
+        if row.vhost:
+            item["vhosts"][row.vhost] += 1
+            vhost = by_vhost.setdefault(row.vhost, {"vhost": row.vhost, "workers": 0, "ips": set()})
+            vhost["workers"] += 1
+            vhost["ips"].add(row.client)
+
+        value = parse_ipv4_int(row.client)
+        if value is None:
+            continue
+        first, _last = network_bounds(value, prefix)
+        cidr = bounds_to_cidr(first, prefix)
+        subnet = by_subnet.setdefault(cidr, {"cidr": cidr, "workers": 0, "ips": set()})
+        subnet["workers"] += 1
+        subnet["ips"].add(row.client)
+    return {"by_ip": by_ip, "by_subnet": by_subnet, "by_vhost": by_vhost}
+
+
+def top_rows(items, key, limit):
+    return sorted(items.values(), key=lambda item: (-item["workers"], item[key]))[:limit]
+
+
+def summarize_status(status, prefix=24, limit=50):
+    aggregates = aggregate_workers(status["workers"], prefix)
+    ips = []
+    for item in top_rows(aggregates["by_ip"], "ip", limit):
+        ips.append({
+            "ip": item["ip"],
+            "workers": item["workers"],
+            "seconds_total": item["seconds_total"],
+            "seconds_max": item["seconds_max"],
+            "modes": dict(item["modes"]),
+            "vhosts": dict(item["vhosts"].most_common(5)),
+        })
+    subnets = [
+        {"cidr": item["cidr"], "workers": item["workers"], "unique_ips": len(item["ips"])}
+        for item in top_rows(aggregates["by_subnet"], "cidr", limit)
+    ]
+    vhosts = [
+        {"vhost": item["vhost"], "workers": item["workers"], "unique_ips": len(item["ips"])}
+        for item in top_rows(aggregates["by_vhost"], "vhost", limit)
+    ]
+    return {
+        "format": status["format"],
+        "busy_workers": status["busy_workers"],
+        "idle_workers": status["idle_workers"],
+        "scoreboard": status["scoreboard"],
+        "worker_rows": len(status["workers"]),
+        "active_worker_rows": sum(1 for row in status["workers"] if is_active(row)),
+        "subnet_prefix": prefix,
+        "by_ip": ips,
+        "by_subnet": subnets,
+        "by_vhost": vhosts,
+    }
+
+
+def read_text(path):
+    with open(path, "rb") as f:
+        return to_text(f.read())
+
+
+def parse_server_status_file(path):
+    # Like parse_server_status(read_text(path)), but text inputs are parsed
+    # line by line instead of being read (and lowercased) whole. HTML and
+    # ?auto pages are small and still read at once.
+    with open(path, "rb") as f:
+        head = f.read(HEAD_BYTES)
+        fmt = detect_format(to_text(head))
+        if fmt != "text":
+            return parse_server_status(head + f.read())
+        f.seek(0)
+        return parse_text_status(to_text(line) for line in f)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Parse an Apache server-status page (HTML, text copy or ?auto) and count workers per IP, subnet and vhost.")
+    parser.add_argument("--input", default="input.txt")
+    parser.add_argument("--json-output", default="server_status_workers.json")
+    parser.add_argument("--prefix", type=int, default=24, help="Subnet prefix for the per-subnet counts")
+    parser.add_argument("--limit", type=int, default=50, help="Rows per section in the JSON output")
+    parser.add_argument("--top", type=int, default=10, help="IPs, subnets and vhosts to print")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.prefix < 0 or args.prefix > 32:
+        print("ERROR: --prefix must be between 0 and 32", file=sys.stderr)
+        return 1
+    try:
+        summary = summarize_status(parse_server_status_file(args.input), args.prefix, args.limit)
+    except (IOError, OSError) as exc:
+        print("ERROR: %s" % exc, file=sys.stderr)
+        return 1
+    with open(args.json_output, "w") as f:
+        json.dump(summary, f, indent=2, sort_keys=True)
+
+    print("Format:", summary["format"])
+    print("Busy workers:", summary["busy_workers"])
+    print("Worker rows: %d (%d active)" % (summary["worker_rows"], summary["active_worker_rows"]))
+    for title, rows, key in (("IPs", summary["by_ip"], "ip"), ("Subnets", summary["by_subnet"], "cidr"), ("VHosts", summary["by_vhost"], "vhost")):
+        if rows:
+            print("Top %s by workers:" % title)
+            for row in rows[:args.top]:
+                print("  %s | %d" % (row[key], row["workers"]))
+    print("Wrote:", args.json_output)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
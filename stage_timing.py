@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+import argparse
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+TIMINGS_FILE_ENV = "STAGE_TIMINGS_FILE"
+TIMINGS_VERSION = 1
+
+# Recorder of the in-process pipeline runner, if one is active.
+_ACTIVE_RECORDER = None
+
+
+def cpu_seconds():
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+
+
+def peak_rss_kb(who="self"):
+    # ru_maxrss is the high-water mark for the whole process (or for all
+    # waited-for children), not for a single stage.
+    if resource is None:
+        return 0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if who == "children" else resource.RUSAGE_SELF)
+    value = usage.ru_maxrss
+    if sys.platform == "darwin":
+        value //= 1024
+    return int(value)
+
+
+def file_bytes(paths):
+    total = 0
+    for path in paths:
+        if path and os.path.isfile(path):
+            total += os.path.getsize(path)
+    return total
+
+
+def count_items(path):
+    if not path or not os.path.isfile(path):
+        return 0
+    if path.endswith(".json"):
+        with open(path, "r") as f:
+            try:
+                data = json.load(f)
+            except ValueError:
+                return 0
+        if isinstance(data, dict):
+            lists = [value for value in data.values() if isinstance(value, list)]
+            if len(lists) == 1:
+                return len(lists[0])
+        return len(data) if isinstance(data, (list, dict)) else 0
+    with open(path, "rb") as f:
+        return sum(1 for line in f if line.strip())
+
+
+def new_record(name, parent=""):
+    return {
+        "stage": name,
+        "parent": parent,
+        "wall_seconds": 0.0,
+        "cpu_seconds": 0.0,
+        "peak_rss_kb": 0,
+        "input_count": None,
+        "output_count": None,
+        "bytes_read": 0,
+        "bytes_written": 0,
+        "status": "ok",
+    }
+
+
+def load_timings(path):
+    if not path or not os.path.exists(path):
+        return {"version": TIMINGS_VERSION, "stages": []}
+    with open(path, "r") as f:
+        try:
+            data = json.load(f)
+        except ValueError:
+            return {"version": TIMINGS_VERSION, "stages": []}
+    if not isinstance(data, dict) or not isinstance(data.get("stages"), list):
+        return {"version": TIMINGS_VERSION, "stages": []}
+    return data
+
+
+def write_timings(path, data):
+    tmp_path = "%s.tmp-%s" % (path, os.getpid())
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.rename(tmp_path, path)
+
+
+def append_stage(path, record):
+    data = load_timings(path)
+    data["stages"].append(record)
+    write_timings(path, data)
+
+
+class StageRecorder(object):
+    def __init__(self, path=None, run_id=""):
+        self.path = path
+        self.run_id = run_id
+        self.stages = []
+        self.current = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        # The caller fills input_count/output_count/bytes_* on the yielded
+        # record; timing and RSS are filled in here.
+        record = new_record(name, self.current[-1]["stage"] if self.current else "")
+        self.current.append(record)
+        started = time.time()
+        cpu_started = cpu_seconds()
+        try:
+            yield record
+        except BaseException:
+            record["status"] = "error"
+            raise
+        finally:
+            record["wall_seconds"] = round(time.time() - started, 6)
+            record["cpu_seconds"] = round(cpu_seconds() - cpu_started, 6)
+            record["peak_rss_kb"] = max(peak_rss_kb(), peak_rss_kb("children"))
+            self.current.pop()
+            self.stages.append(record)
+            if self.path:
+                self.write()
+
+    def write(self):
+        write_timings(self.path, {"version": TIMINGS_VERSION, "run_id": self.run_id, "stages": self.stages})
+
+
+def activate(recorder):
+    global _ACTIVE_RECORDER
+    previous = _ACTIVE_RECORDER
+    _ACTIVE_RECORDER = recorder
+    return previous
+
+
+@contextlib.contextmanager
+def timed(name):
+    # Sub-stage hook for library code (e.g. the UFW reload inside an apply
+    # step). Records into the in-process runner when one is active, appends
+    # to $STAGE_TIMINGS_FILE under the stage_timing.py wrapper, and does
+    # nothing otherwise.
+    if _ACTIVE_RECORDER is not None:
+        with _ACTIVE_RECORDER.stage(name) as record:
+            yield record
+        return
+    path = os.environ.get(TIMINGS_FILE_ENV)
+    if not path:
+        yield new_record(name)
+        return
+    recorder = StageRecorder()
+    with recorder.stage(name) as record:
+        record["parent"] = os.environ.get("STAGE_TIMINGS_PARENT", "")
+        yield record
+    append_stage(path, recorder.stages[0])
+
+
+def run_timed_command(path, name, command, read_paths=(), write_paths=(), input_count_path="", output_count_path=""):
+    record = new_record(name)
+    bytes_read = file_bytes(read_paths)
+    if input_count_path:
+        record["input_count"] = count_items(input_count_path)
+    env = dict(os.environ)
+    env[TIMINGS_FILE_ENV] = path
+    env["STAGE_TIMINGS_PARENT"] = name
+    started = time.time()
+    children_cpu = cpu_seconds()
+    returncode = subprocess.call(command, env=env)
+    record["wall_seconds"] = round(time.time() - started, 6)
+    record["cpu_seconds"] = round(cpu_seconds() - children_cpu, 6)
+    record["peak_rss_kb"] = peak_rss_kb("children")
+    record["bytes_read"] = bytes_read
+    record["bytes_written"] = file_bytes(write_paths)
+    if output_count_path:
+        record["output_count"] = count_items(output_count_path)
+    if returncode != 0:
+        record["status"] = "exit %d" % returncode
+    append_stage(path, record)
+    return returncode
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Run one pipeline stage command and append its wall/CPU time, peak RSS, counts and bytes to timings.json."
+    )
+    parser.add_argument("--timings", required=True, help="timings.json to append to")
+    parser.add_argument("--stage", required=True)
+    parser.add_argument("--read", action="append", default=[], help="File read by the stage; repeatable")
+    parser.add_argument("--write", action="append", default=[], help="File written by the stage; repeatable")
+    parser.add_argument("--input-count", default="", help="Count lines or JSON items of this file before the stage")
+    parser.add_argument("--output-count", default="", help="Count lines or JSON items of this file after the stage")
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="-- command [args...]")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    if not command:
+        print("ERROR: missing stage command after --", file=sys.stderr)
+        return 1
+    return run_timed_command(
+        args.timings,
+        args.stage,
+        command,
+        read_paths=args.read,
+        write_paths=args.write,
+        input_count_path=args.input_count,
+        output_count_path=args.output_count,
+    )
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+import socket
+import ssl
+import threading
+import time
+
+try:
+    import httplib
+    from urlparse import urlsplit
+except ImportError:
+    import http.client as httplib
+    from urllib.parse import urlsplit
+
+
+DEFAULT_USER_AGENT = "DropIPsByCountry-monitor/1.0"
+READ_SIZE = 64 * 1024
+# A reused connection the server already closed fails on the first request
+# or status line; those are retried once on a fresh connection.
+STALE_ERRORS = (httplib.BadStatusLine, httplib.CannotSendRequest, httplib.ResponseNotReady, socket.error)
+
+
+class FetchTimeout(RuntimeError):
+    pass
+
+
+class FetchError(RuntimeError):
+    # HTTP protocol errors (BadStatusLine and friends) surfaced like the
+    # other fetch failures callers already handle.
+    pass
+
+
+class StatusSession(object):
+    # One persistent HTTP/1.1 connection to a status endpoint. Polls reuse
+    # the TCP (and TLS) connection instead of handshaking again; timeout is
+    # the cap on the whole fetch, not per socket operation.
+
+    def __init__(self, scheme, netloc, insecure=False):
+        self.scheme = scheme
+        self.netloc = netloc
+        self.insecure = insecure
+        self.connection = None
+        self.requests = 0
+        self.connects = 0
+        self.lock = threading.Lock()
+
+    def connect(self, timeout):
+        if self.scheme == "https":
+            context = None
+            if self.insecure and hasattr(ssl, "_create_unverified_context"):
+                context = ssl._create_unverified_context()
+            if context is not None:
+                connection = httplib.HTTPSConnection(self.netloc, timeout=timeout, context=context)
+            else:
+                connection = httplib.HTTPSConnection(self.netloc, timeout=timeout)
+        else:
+            connection = httplib.HTTPConnection(self.netloc, timeout=timeout)
+        connection.connect()
+        self.connects += 1
+        return connection
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def fetch(self, path, timeout, headers=None):
+        with self.lock:
+            deadline = time.time() + timeout
+            retry = self.connection is not None
+            while True:
+                try:
+                    return self.request(path, deadline, headers)
+                except (socket.timeout, FetchTimeout):
+                    self.close()
+                    raise FetchTimeout("server-status fetch exceeded %ss" % timeout)
+                except STALE_ERRORS:
+                    self.close()
+                    if not retry:
+                        raise
+                    retry = False
+                except Exception:
+                    self.close()
+                    raise
+
+    def request(self, path, deadline, headers):
+        if self.connection is None:
+            self.connection = self.connect(remaining(deadline))
+        connection = self.connection
+        send_headers = {"User-Agent": DEFAULT_USER_AGENT}
+        send_headers.update(headers or {})
+        send_headers["Connection"] = "keep-alive"
+        set_timeout(connection, deadline)
+        connection.request("GET", path, headers=send_headers)
+        response = connection.getresponse()
+        self.requests += 1
+        body = read_body(connection, response, deadline)
+        if response.will_close or (response.getheader("connection") or "").lower() == "close":
+            self.close()
+        if response.status != 200:
+            raise RuntimeError("HTTP %d %s from %s://%s%s" % (response.status, response.reason, self.scheme, self.netloc, path))
+        return body
+
+
+def remaining(deadline):
+    left = deadline - time.time()
+    if left <= 0:
+        raise FetchTimeout("server-status fetch exceeded its time limit")
+    return left
+
+
+def set_timeout(connection, deadline):
+    if connection.sock is not None:
+        connection.sock.settimeout(remaining(deadline))
+
+
+def read_body(connection, response, deadline):
+    chunks = []
+    while True:
+        set_timeout(connection, deadline)
+        try:
+            chunk = response.read(READ_SIZE)
+        except socket.timeout:
+            raise FetchTimeout("server-status fetch exceeded its time limit")
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+def get_session(scheme, netloc, insecure=False):
+    key = (scheme, netloc, bool(insecure))
+    with _SESSIONS_LOCK:
+        session = _SESSIONS.get(key)
+        if session is None:
+            session = _SESSIONS[key] = StatusSession(scheme, netloc, insecure)
+        return session
+
+
+def close_sessions():
+    with _SESSIONS_LOCK:
+        for session in _SESSIONS.values():
+            session.close()
+        _SESSIONS.clear()
+
+
+def fetch(url, timeout, insecure=False, headers=None):
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https"):
+        raise RuntimeError("unsupported server-status URL scheme: %s" % url)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    try:
+        return get_session(parts.scheme, parts.netloc, insecure).fetch(path, timeout, headers)
+    except httplib.HTTPException as exc:
+        raise FetchError("%s from %s: %s" % (type(exc).__name__, url, exc))
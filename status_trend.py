@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+import json
+import os
+
+from ipv4_index import cidr_to_bounds, interval_index_covers, interval_index_from_cidrs
+from server_status import aggregate_workers
+
+
+STATE_VERSION = 1
+DEFAULT_CAPACITY = 96
+# Per-/24 counts kept per sample; the rest of a distributed attack is in
+# the busy total.
+SUBNETS_PER_SAMPLE = 20
+
+DEFAULT_CONFIG = {
+    "threshold": 200,
+    "alpha": 0.5,
+    "horizon": 1800.0,
+    "min_ratio": 0.5,
+    "subnet_share": 0.25,
+    "hot_subnet_workers": 10,
+    "suppress_seconds": 3600.0,
+}
+
+
+def empty_state(capacity=DEFAULT_CAPACITY):
+    return {"version": STATE_VERSION, "capacity": capacity, "samples": [], "triggered": {}}
+
+
+def load_state(path, capacity=DEFAULT_CAPACITY):
+    # Ring buffer of [timestamp, busy, {cidr: workers}] samples plus the
+    # subnets of earlier block runs. An unreadable file starts a new series.
+    try:
+        with open(path, "r") as f:
+            state = json.load(f)
+    except (IOError, OSError, ValueError):
+        return empty_state(capacity)
+    if not isinstance(state, dict) or state.get("version") != STATE_VERSION:
+        return empty_state(capacity)
+    state["capacity"] = capacity
+    state.setdefault("samples", [])
+    state.setdefault("triggered", {})
+    return state
+
+
+def save_state(path, state):
+    tmp_path = "%s.tmp-%s" % (path, os.getpid())
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, separators=(",", ":"), sort_keys=True)
+    os.rename(tmp_path, path)
+
+
+def subnet_counts(workers, limit=SUBNETS_PER_SAMPLE):
+    subnets = aggregate_workers(workers, prefix=24)["by_subnet"]
+    top = sorted(subnets.values(), key=lambda item: (-item["workers"], item["cidr"]))[:limit]
+    return dict((item["cidr"], item["workers"]) for item in top if item["workers"] > 1)
+
+
+def add_sample(state, now, busy, subnets):
+    samples = state["samples"]
+    samples.append([now, busy, subnets])
+    del samples[:max(0, len(samples) - state["capacity"])]
+
+
+def ewma_slope(points, alpha):
+    # EWMA of the per-second change between consecutive (time, value) points.
+    slope = None
+    previous = None
+    for now, value in points:
+        if previous is not None and now > previous[0]:
+            step = float(value - previous[1]) / (now - previous[0])
+            slope = step if slope is None else alpha * step + (1 - alpha) * slope
+        previous = (now, value)
+    return slope or 0.0
+
+
+def hot_subnets(subnets, config):
+    limit = config["hot_subnet_workers"]
+    return sorted(cidr for cidr, workers in subnets.items() if workers >= limit)
+
+
+def recently_triggered(state, cidrs, now, suppress_seconds):
+    triggered = state["triggered"]
+    return [cidr for cidr in cidrs if now - triggered.get(cidr, -suppress_seconds - 1) <= suppress_seconds]
+
+
+def blocked_cidrs(cidrs, blocked_index):
+    result = []
+    for cidr in cidrs:
+        first, last, _prefix = cidr_to_bounds(cidr)
+        if interval_index_covers(blocked_index, first, last):
+            result.append(cidr)
+    return result
+
+
+def evaluate(state, config, blocked_index=None):
+    # Decision for the newest sample. "threshold" is the old single-sample
+    # rule; "trend" fires when the busy EWMA slope projects a crossing
+    # within the horizon; "concentration" fires when one /24 alone holds a
+    # large share of the threshold and is not shrinking.
+    now, busy, subnets = state["samples"][-1]
+    threshold = config["threshold"]
+    slope = ewma_slope([(sample[0], sample[1]) for sample in state["samples"]], config["alpha"])
+    predicted = busy + max(slope, 0.0) * config["horizon"]
+    previous = state["samples"][-2][2] if len(state["samples"]) > 1 else {}
+
+    concentrated = []
+    for cidr, workers in sorted(subnets.items()):
+        if workers >= config["subnet_share"] * threshold and workers >= previous.get(cidr, 0):
+            concentrated.append(cidr)
+
+    reason = ""
+    if busy > threshold:
+        reason = "threshold"
+    elif busy >= config["min_ratio"] * threshold and predicted > threshold:
+        reason = "trend"
+    elif concentrated:
+        reason = "concentration"
+
+    hot = hot_subnets(subnets, config)
+    covered = set(recently_triggered(state, hot, now, config["suppress_seconds"]))
+    if blocked_index is not None:
+        covered.update(blocked_cidrs(hot, blocked_index))
+    # Repeat runs are suppressed only when every hot /24 was handled
+    # already; without hot subnets there is nothing to compare. Over the
+    # threshold that is not enough: the handled /24s must also account for
+    # the excess, or the load comes from somewhere else.
+    suppressed = bool(reason and hot and covered.issuperset(hot))
+    if suppressed and reason == "threshold":
+        suppressed = busy - sum(subnets[cidr] for cidr in hot) <= threshold
+    return {
+        "trigger": bool(reason) and not suppressed,
+        "reason": reason,
+        "suppressed": suppressed,
+        "busy": busy,
+        "slope_per_minute": round(slope * 60, 2),
+        "predicted": int(round(predicted)),
+        "concentrated_subnets": concentrated,
+        "hot_subnets": hot,
+    }
+
+
+def record_trigger(state, cidrs, now, suppress_seconds):
+    triggered = state["triggered"]
+    for cidr in [cidr for cidr, when in triggered.items() if now - when > suppress_seconds]:
+        del triggered[cidr]
+    for cidr in cidrs:
+        triggered[cidr] = now
+
+
+def load_blocked_index(path):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return interval_index_from_cidrs(line.split()[0] for line in f if line.strip() and not line.startswith("#"))
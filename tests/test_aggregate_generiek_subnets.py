@@ -1,6 +1,7 @@
 import unittest
 import json
 import os
+import shutil
 import tempfile
 
 import aggregate_generiek_subnets as aggregate
@@ -32,6 +33,25 @@ class AggregateGeneriekSubnetsTests(unittest.TestCase):
         self.assertEqual(selected, 3)
         self.assertEqual(subnets, ["1.2.3.0/24"])
 
+    def test_counts_file_weights_ips_toward_min_hits(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        ips_path = os.path.join(tmpdir, "output.txt")
+        counts_path = os.path.join(tmpdir, "output_ip_counts.txt")
+        output_path = os.path.join(tmpdir, "subnets.json")
+        with open(ips_path, "w") as f:
+            f.write("1.2.3.4\n5.6.7.8\n5.6.7.9\n9.9.9.9\n")
+        with open(counts_path, "w") as f:
+            f.write("1.2.3.4\t40\n5.6.7.8\t1\n5.6.7.9\t1\n9.9.9.9\t1\n")
+        argv = ["--source", "ips", "--input", ips_path, "--output", output_path, "--min-hits", "3", "--recurrence-db", ""]
+
+        self.assertEqual(aggregate.main(argv), 0)
+        with open(output_path) as f:
+            self.assertEqual(json.load(f), [])
+        self.assertEqual(aggregate.main(argv + ["--counts-file", counts_path]), 0)
+        with open(output_path) as f:
+            self.assertEqual(json.load(f), ["1.2.3.0/24"])
+
     def test_build_subnets_from_geo_can_filter_to_source_ips(self):
         geo_data = {
             "1.2.3.4": {"country": "CN"},
@@ -119,6 +139,61 @@ class AggregateGeneriekSubnetsTests(unittest.TestCase):
         self.assertEqual(selected, 0)
         self.assertEqual(subnets, [])
 
+    def test_build_cover_subnets_uses_broadest_clean_prefix(self):
+        cover = aggregate.build_cover_subnets(
+            ["10.10.1.1", "10.10.200.1", "10.11.0.1"],
+            ["10.11.0.2"],
+            [],
+            min_prefix=16,
+        )
+
+        self.assertEqual(cover["selected_ips"], 3)
+        self.assertEqual(cover["subnets"], ["10.10.0.0/16", "10.11.0.0/31"])
+
+    def test_build_cover_subnets_never_covers_allowlist(self):
+        cover = aggregate.build_cover_subnets(
+            ["66.249.75.1", "66.249.64.1"],
+            [],
+            ["66.249.75.0/24"],
+            min_prefix=16,
+        )
+
+        self.assertEqual(cover["subnets"], ["66.249.64.0/21"])
+        self.assertEqual(cover["uncoverable_ips"], ["66.249.75.1"])
+
+    def test_build_cover_subnets_splits_blocks_to_fit_budget(self):
+        cover = aggregate.build_cover_subnets(
+            ["10.10.1.1", "10.10.1.2", "10.10.200.1"],
+            [],
+            [],
+            max_blocked_addresses=600,
+            min_prefix=16,
+        )
+
+        self.assertEqual(cover["subnets"], ["10.10.1.0/24", "10.10.200.0/24"])
+        self.assertEqual(cover["blocked_addresses"], 512)
+
+    def test_build_cover_subnets_rejects_impossible_budget(self):
+        with self.assertRaises(ValueError):
+            aggregate.build_cover_subnets(["10.10.1.1", "10.10.2.1"], [], [], max_blocked_addresses=1)
+
+    def test_build_subnets_from_geo_cover_avoids_non_target_and_safe_provider_ips(self):
+        geo_data = {
+            "10.10.1.1": {"country": "CN", "org": "AS123 Example ISP"},
+            "10.10.9.1": {"country": "CN", "org": "AS123 Example ISP"},
+            "10.10.64.1": {"country": "NL", "org": "AS1136 KPN"},
+            "10.10.128.1": {"country": "US", "org": "AS15169 Google LLC"},
+        }
+
+        cover = aggregate.build_subnets_from_geo_cover(
+            geo_data,
+            ["CN", "US"],
+            [],
+            source_ips=["10.10.1.1", "10.10.9.1"],
+        )
+
+        self.assertEqual(cover["subnets"], ["10.10.0.0/18"])
+
     def test_load_country_policy_reads_recommendations_json(self):
         handle, path = tempfile.mkstemp()
         os.close(handle)
@@ -92,6 +92,48 @@ class AnalyzeRunsTests(unittest.TestCase):
             self.assertEqual(data["totals"]["runs"], 2)
             self.assertEqual(data["totals"]["unique_ips_seen"], 3)
 
+    def test_digest_cache_reuses_unchanged_runs(self):
+        first = self.write_run("20260803-100000", ["1.2.3.4", "5.6.7.8"], ["1.2.3.4 CN Example"], [], {})
+        self.write_run("20260803-110000", ["1.2.3.4"], [], [], {})
+        cache_dir = os.path.join(self.runs_dir, analyze_runs.DIGEST_DIR_NAME)
+        paths = analyze_runs.iter_runs(self.runs_dir)
+
+        runs, analyzed = analyze_runs.load_runs(paths, cache_dir)
+        cached, analyzed_again = analyze_runs.load_runs(paths, cache_dir)
+        with open(os.path.join(first, "output_ips.txt"), "a") as f:
+            f.write("9.9.9.9\n")
+        os.utime(os.path.join(first, "output_ips.txt"), (2000000000, 2000000000))
+        changed, analyzed_changed = analyze_runs.load_runs(paths, cache_dir)
+
+        self.assertEqual((analyzed, analyzed_again, analyzed_changed), (2, 0, 1))
+        self.assertEqual(list(cached[0]["ip_ints"]), list(runs[0]["ip_ints"]))
+        self.assertEqual(cached[0]["blocked_candidate_ips"], 1)
+        self.assertEqual(changed[0]["input_ips"], 3)
+        self.assertEqual(analyze_runs.unique_ips_seen(changed), 3)
+        self.assertEqual(analyze_runs.count_common(changed[0]["ip_ints"], changed[1]["ip_ints"]), 1)
+
+    def write_timings(self, path, stages):
+        records = [{"stage": name, "parent": "", "wall_seconds": wall, "cpu_seconds": wall / 2.0, "peak_rss_kb": 1000} for name, wall in stages]
+        with open(os.path.join(path, "timings.json"), "w") as f:
+            json.dump({"version": 1, "stages": records}, f)
+
+    def test_stage_percentiles_and_latest_run_regression(self):
+        walls = [1.0, 1.2, 1.1, 0.9, 6.0]
+        for position, wall in enumerate(walls):
+            path = self.write_run("20260803-1%d0000" % position, ["1.2.3.4"], [], [], {})
+            self.write_timings(path, [("parse_ips", 0.1), ("recommendations", wall / 2), ("recommendations", wall / 2)])
+        runs = [analyze_runs.analyze_run(path) for path in analyze_runs.iter_runs(self.runs_dir)]
+
+        percentiles = analyze_runs.stage_percentiles(runs)
+        regressions = analyze_runs.find_stage_regressions(runs, factor=1.5, min_seconds=1.0)
+
+        self.assertEqual(percentiles["recommendations"]["runs"], 5)
+        self.assertAlmostEqual(percentiles["recommendations"]["wall_p50"], 1.1)
+        self.assertAlmostEqual(percentiles["recommendations"]["wall_p95"], 6.0)
+        self.assertEqual([row["stage"] for row in regressions], ["recommendations"])
+        self.assertAlmostEqual(regressions[0]["baseline_p50"], 1.0)
+        self.assertEqual(analyze_runs.find_stage_regressions(runs[:-1]), [])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -48,6 +48,31 @@ class AuditGeneriekSubnetsTests(unittest.TestCase):
         finally:
             os.unlink(path)
 
+    def test_load_geo_counts_counts_nested_candidates_independently(self):
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            with open(path, "w") as f:
+                json.dump({
+                    "10.10.1.9": {"country": "CN", "org": "A"},
+                    "10.10.1.10": {"country": "CN", "org": "A"},
+                    "10.10.7.1": {"country": "CN", "org": "B"},
+                    "10.11.0.1": {"country": "CN", "org": "C"},
+                    "bogus": {"country": "CN"},
+                }, f)
+
+            candidates = [
+                audit.ip_network("10.10.0.0/16", strict=False),
+                audit.ip_network("10.10.1.0/24", strict=False),
+                audit.ip_network("10.12.0.0/16", strict=False),
+            ]
+            counts, examples = audit.load_geo_counts(path, candidates)
+
+            self.assertEqual(counts, {"10.10.0.0/16": 3, "10.10.1.0/24": 2})
+            self.assertEqual(examples["10.10.1.0/24"], ["10.10.1.9 CN A", "10.10.1.10 CN A"])
+        finally:
+            os.unlink(path)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,79 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import fast_apply_ufw_user_rules
+import local_ip_country
+from benchmarks import generators
+from benchmarks import run_benchmarks
+
+
+class GeneratorTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_generators_are_deterministic_per_seed(self):
+        self.assertEqual(generators.generate_geo_data(7, 300), generators.generate_geo_data(7, 300))
+        self.assertNotEqual(generators.generate_geo_data(7, 300), generators.generate_geo_data(8, 300))
+        self.assertEqual(len(generators.generate_geo_data(7, 300)), 300)
+        self.assertEqual(generators.deny_cidrs(7, 50), generators.deny_cidrs(7, 50))
+
+    def test_range_table_loads_as_sorted_non_overlapping_ranges(self):
+        path = os.path.join(self.tmpdir, "ranges.tsv")
+        generators.write_range_table(path, 1, 500)
+
+        starts, ranges = local_ip_country.load_ranges(path)
+
+        self.assertEqual(len(ranges), 500)
+        self.assertEqual(starts, sorted(starts))
+        for previous, row in zip(ranges, ranges[1:]):
+            self.assertLess(previous["end_int"], row["start_int"])
+
+    def test_user_rules_text_is_accepted_by_fast_apply(self):
+        text = generators.generate_user_rules_text(generators.deny_cidrs(1, 20))
+
+        new_text, _anchor = fast_apply_ufw_user_rules.build_new_user_rules_text(text, ["1.2.3.0/24"])
+
+        self.assertEqual(len(fast_apply_ufw_user_rules.parse_user_rules_denies(new_text)), 21)
+
+
+class RunBenchmarksTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_writes_json_results_for_selected_benchmarks(self):
+        output = os.path.join(self.tmpdir, "results.json")
+
+        rc = run_benchmarks.main([
+            "--scale", "tiny", "--repeat", "1",
+            "--work-dir", os.path.join(self.tmpdir, "data"),
+            "--output", output,
+            "--only", "lookup_ip", "--only", "plan_new_rules",
+        ])
+
+        self.assertEqual(rc, 0)
+        with open(output) as f:
+            data = json.load(f)
+        self.assertEqual(data["scale"], "tiny")
+        self.assertEqual([row["name"] for row in data["results"]], ["lookup_ip", "plan_new_rules"])
+        self.assertGreater(data["results"][0]["items"], 0)
+
+    def test_unknown_benchmark_is_an_error(self):
+        self.assertEqual(run_benchmarks.main(["--only", "nope", "--output", os.path.join(self.tmpdir, "x.json")]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
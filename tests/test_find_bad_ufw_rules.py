@@ -1,3 +1,5 @@
+import json
+import multiprocessing
 import os
 import sys
 import unittest
@@ -7,6 +9,7 @@ if ROOT not in sys.path:
     sys.path.insert(0, ROOT)
 
 import find_bad_ufw_rules as bad_rules
+import worker_pool
 
 
 class FindBadUfwRulesTests(unittest.TestCase):
@@ -36,6 +39,52 @@ class FindBadUfwRulesTests(unittest.TestCase):
 
         self.assertEqual(found, ["148.251.129.80 DE AS24940 Hetzner Online GmbH"])
 
+    def test_find_non_target_sources_reuses_prebuilt_index(self):
+        geo_data = {
+            "148.251.129.80": {"country": "DE", "org": "AS24940 Hetzner Online GmbH"},
+            "148.251.129.7": {"country": "NL", "org": "AS1 Example"},
+            "148.251.130.1": {"country": "CN", "org": "Example CN"},
+        }
+        index = bad_rules.build_non_target_index(geo_data, set(["CN", "IN"]))
+
+        found = bad_rules.find_non_target_sources(self.net("148.251.0.0/16"), {}, set(["CN", "IN"]), 10, index)
+
+        self.assertEqual(found, [
+            "148.251.129.7 NL AS1 Example",
+            "148.251.129.80 DE AS24940 Hetzner Online GmbH",
+        ])
+        self.assertEqual(bad_rules.find_non_target_sources(self.net("148.251.130.0/24"), {}, set(["CN"]), 10, index), [])
+
+    def test_audit_rules_is_identical_with_worker_pool(self):
+        lines = ["Status: active", ""]
+        for num in range(1, 41):
+            lines.append("[%2d] Anywhere                   DENY IN     66.249.%d.0/24" % (num, 60 + num))
+        lines.append("[41] Anywhere (v6)              DENY IN     2001:db8::/64")
+        rules = bad_rules.parse_numbered_rules("\n".join(lines))
+        geo_data = {"66.249.90.5": {"country": "DE", "org": "AS1 Example"}}
+        context = bad_rules.build_audit_context(
+            [self.net("66.249.64.0/19"), self.net("2001:db8::/32")],
+            geo_data,
+            set(["CN", "IN"]),
+            True,
+            10,
+        )
+
+        serial = bad_rules.audit_rules(rules, context, 1)
+        parallel = bad_rules.audit_rules(rules, context, 2)
+
+        self.assertEqual(json.dumps(serial), json.dumps(parallel))
+        if hasattr(multiprocessing, "get_context"):
+            # Spawned workers do not inherit module globals from the parent.
+            worker_pool.multiprocessing = multiprocessing.get_context("spawn")
+            try:
+                spawned = bad_rules.audit_rules(rules, context, 2)
+            finally:
+                worker_pool.multiprocessing = multiprocessing
+            self.assertEqual(json.dumps(serial), json.dumps(spawned))
+        self.assertEqual([row["num"] for row in serial], list(range(4, 36)) + [41])
+        self.assertEqual(serial[26]["reasons"][1]["examples"], ["66.249.90.5 DE AS1 Example"])
+
 
 if __name__ == "__main__":
     unittest.main()
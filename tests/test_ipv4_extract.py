@@ -0,0 +1,71 @@
+import os
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import ipv4_extract
+import parse_ips
+from ipv4_index import ipv4_int_to_text, parse_ipv4_int
+
+
+OLD_IP_PATTERN = re.compile(r"\b(?:\d{1,3}\.){3}\d{1,3}\b")
+
+
+def split_chunks(data, size):
+    return [data[index:index + size] for index in range(0, len(data), size)]
+
+
+class IPv4ExtractTests(unittest.TestCase):
+    def test_matches_straddling_chunk_boundaries_are_found_once(self):
+        text = b"0-0 23208 W 36.233.241.115 nl.example.com:443 GET /\nR 88.97.228.80\n1.2.3.4.5 x10.0.0.1 300.1.1.1 1.2.3.4"
+        expected = [parse_ipv4_int(ip) for ip in OLD_IP_PATTERN.findall(text.decode("ascii"))]
+        expected = [value for value in expected if value is not None]
+
+        for size in (1, 2, 5, 16, 17, len(text)):
+            self.assertEqual(list(ipv4_extract.scan_ipv4_chunks(split_chunks(text, size))), expected, size)
+
+    def test_invalid_octets_are_skipped_and_occurrences_counted(self):
+        chunks = split_chunks(b"1.2.3.4 999.1.1.1 5.6.7.8 1.2.3.4\n1.2.3.4 256.0.0.1", 3)
+
+        order, counts = ipv4_extract.count_ipv4_chunks(chunks)
+
+        self.assertEqual([ipv4_int_to_text(value) for value in order], ["1.2.3.4", "5.6.7.8"])
+        self.assertEqual(counts[parse_ipv4_int("1.2.3.4")], 3)
+        self.assertEqual(counts[parse_ipv4_int("5.6.7.8")], 1)
+
+
+class ParseIpsTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def test_writes_unique_ips_and_counts(self):
+        with open(self.path("input.txt"), "w") as f:
+            f.write("client 5.6.7.8 GET /\nclient 1.2.3.4 GET /\nclient 1.2.3.4 GET /a\n")
+
+        rc = parse_ips.main([
+            "--input", self.path("input.txt"),
+            "--output", self.path("output.txt"),
+            "--counts-output", self.path("counts.txt"),
+        ])
+
+        self.assertEqual(rc, 0)
+        with open(self.path("output.txt")) as f:
+            self.assertEqual(f.read(), "5.6.7.8\n1.2.3.4\n")
+        with open(self.path("counts.txt")) as f:
+            self.assertEqual(f.read(), "1.2.3.4\t2\n5.6.7.8\t1\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import analyze_status_category_requests
+import log_scan
+import log_stats_store
+import parse_access_log
+
+
+LOG_LINES = [
+    '1.2.3.4 - - [01/Feb/2026:06:25:43 +0100] "GET /accounts/login/?next=/ HTTP/1.1" 200 512 "-" "bot"\n',
+    'www.example.com:443 1.2.3.4 - - [01/Feb/2026:06:25:44 +0100] "POST /accounts/login/ HTTP/1.1" 200 512 "-" "bot \\"v2\\""\n',
+    '5.6.7.8 - - [02/Feb/2026:07:00:00 +0100] "GET /jobs/?categories=a&categories=b&categories=c HTTP/1.1" 200 512 "-" "browser"\n',
+    '5.6.7.8 - - [02/Feb/2026:07:00:01 +0100] "-" 408 0 "-" "-"\n',
+    'not a log line\n',
+]
+
+
+class LogScanTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_log(self, name, lines):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, "w") as f:
+            f.writelines(lines)
+        return path
+
+    def test_log_formats_compile_from_apache_logformat_strings(self):
+        line = 'www.example.com:443 1.2.3.4 - - [01/Feb/2026:06:25:44 +0100] "GET /jobs/ HTTP/1.1" 404 512 "-" "bot"'
+
+        auto = log_scan.match_entry(line, log_scan.compile_log_format(), "fallback")
+        vhost = log_scan.match_entry(line, log_scan.compile_log_format("vhost_combined"), "fallback")
+        custom = log_scan.match_entry(
+            '1.2.3.4 www.example.com [01/Feb/2026:06:25:44 +0100] 1234 "GET /jobs/ HTTP/1.1" 404',
+            log_scan.compile_log_format('%h %v %t %D "%r" %>s'),
+            "fallback",
+        )
+
+        self.assertEqual((auto["site"], auto["ip"], auto["url"], auto["status"]), ("www.example.com:443", "1.2.3.4", "/jobs/", "404"))
+        self.assertEqual((vhost["site"], vhost["user_agent"]), ("www.example.com", "bot"))
+        self.assertEqual((custom["site"], custom["method"], custom["status"]), ("www.example.com", "GET", "404"))
+        self.assertIsNone(log_scan.match_entry(line, log_scan.compile_log_format("combined"), "fallback"))
+        self.assertEqual(log_scan.parse_date("02/Feb/2026:07:00:00 +0100"), "2026-02-02")
+
+    def test_escaped_quotes_in_request_still_match(self):
+        line = '1.2.3.4 - - [01/Feb/2026:06:25:43 +0100] "GET /search?q=1\\"%20OR%20\\"1\\"=\\"1 HTTP/1.1" 200 512 "-" "sqlmap"'
+        url = '/search?q=1\\"%20OR%20\\"1\\"=\\"1'
+
+        for log_format in ("auto", "combined", "common"):
+            entry = log_scan.match_entry(line, log_scan.compile_log_format(log_format), "fallback")
+            self.assertEqual((entry["method"], entry["url"], entry["status"]), ("GET", url, "200"), log_format)
+        self.assertEqual(log_scan.normalize_url(url), "/search")
+
+    def test_declared_fields_reduce_the_captured_groups(self):
+        fields = log_scan.scan_fields([log_scan.DateStats(), log_scan.PrefixHits()])
+        reduced = log_scan.compile_log_format("auto", fields)
+        entry = log_scan.match_entry(LOG_LINES[1], reduced, "fallback")
+
+        self.assertEqual(sorted(entry), ["ip", "method", "site", "time", "url", "vhost"])
+        self.assertEqual((entry["site"], entry["url"]), ("www.example.com:443", "/accounts/login/"))
+        self.assertIsNone(log_scan.scan_fields([log_scan.DateStats(), parse_access_log.UserAgents()]))
+
+    def test_one_pass_feeds_every_aggregator(self):
+        path = self.write_log("jobs-access.log", LOG_LINES)
+        date_stats = log_scan.DateStats()
+        accounts = log_scan.PrefixHits("/accounts/")
+        user_agents = parse_access_log.UserAgents()
+        categories = analyze_status_category_requests.CategoryRows(3)
+
+        stats = log_scan.scan_logs([path], [date_stats, accounts, user_agents, categories])
+
+        self.assertEqual(stats, {"files": 1, "lines": 5, "matched": 4})
+        self.assertEqual(date_stats.counted, 3)
+        self.assertEqual(sorted(date_stats.batch.to_buckets()), ["2026-02-01", "2026-02-02"])
+        self.assertEqual(accounts.at_least(2), {"1.2.3.4": 2})
+        rows = dict(user_agents.result())
+        self.assertEqual(rows["1.2.3.4"]["user_agents"], {"bot": 1, 'bot \\"v2\\"': 1})
+        self.assertEqual(rows["5.6.7.8"]["count"], 1)
+        self.assertEqual([(row["ip"], row["vhost"], row["category_count"]) for row in categories.rows], [("5.6.7.8", "jobs-access", 3)])
+
+    def test_offsets_limit_new_line_aggregators_and_skip_rotated_gz(self):
+        path = self.write_log("access.log", LOG_LINES[:2])
+        gz_path = os.path.join(self.tmpdir, "access.log.2.gz")
+        with gzip.open(gz_path, "wb") as f:
+            f.write(LOG_LINES[2].encode("utf-8"))
+        offsets = {}
+        log_scan.scan_logs([path, gz_path], [log_scan.DateStats()], offsets=offsets)
+        with open(path, "a") as f:
+            f.write(LOG_LINES[2])
+
+        date_stats = log_scan.DateStats()
+        accounts = log_scan.PrefixHits("/")
+        stats = log_scan.scan_logs([path, gz_path], [date_stats, accounts], offsets=offsets)
+
+        self.assertEqual(stats["lines"], 4)
+        self.assertEqual(date_stats.counted, 1)
+        self.assertEqual(accounts.at_least(1), {"1.2.3.4": 2, "5.6.7.8": 2})
+        self.assertEqual(list(offsets), [log_stats_store.offset_key(path)])
+        self.assertEqual(offsets[log_stats_store.offset_key(path)]["offset"], os.path.getsize(path))
+
+
+if __name__ == "__main__":
+    unittest.main()
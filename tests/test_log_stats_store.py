@@ -0,0 +1,146 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import block_accounts_abuse
+import log_stats_store
+
+if sys.version_info[0] < 3:
+    import log_stats_py2 as log_stats
+else:
+    import log_stats
+
+
+LOG_LINES = [
+    '1.2.3.4 - - [01/Feb/2026:06:25:43 +0100] "GET /accounts/login/?next=/ HTTP/1.1" 200 512 "-" "bot"\n',
+    '1.2.3.4 - - [01/Feb/2026:06:25:44 +0100] "GET /accounts/login/ HTTP/1.1" 200 512 "-" "bot"\n',
+    '5.6.7.8 - - [01/Feb/2026:06:25:45 +0100] "GET /jobs/ HTTP/1.1" 200 512 "-" "browser"\n',
+    '1.2.3.4 - - [02/Feb/2026:07:00:00 +0100] "POST /accounts/signup/ HTTP/1.1" 200 512 "-" "bot"\n',
+    '5.6.7.8 - - [02/Feb/2026:07:00:01 +0100] "GET /accountsx/ HTTP/1.1" 200 512 "-" "browser"\n',
+]
+
+
+def buckets(date_counts):
+    result = {}
+    for date_key, ip, url, hits in date_counts:
+        bucket = result.setdefault(date_key, log_stats_store.new_bucket())
+        bucket["total_requests"] += hits
+        bucket["urls"][url] = bucket["urls"].get(url, 0) + hits
+        bucket["ips"][ip] = bucket["ips"].get(ip, 0) + hits
+        urls = bucket["ip_urls"].setdefault(ip, {})
+        urls[url] = urls.get(url, 0) + hits
+    return result
+
+
+class LogStatsStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmpdir, "log_stats.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_merge_adds_to_existing_dates_and_prefix_query_uses_ranges(self):
+        conn = log_stats_store.connect(self.db_path)
+        log_stats_store.merge_buckets(conn, buckets([
+            ("2026-02-01", "1.2.3.4", "/accounts/login/", 150),
+            ("2026-02-01", "5.6.7.8", "/accounts/login/", 20),
+            ("2026-02-01", "5.6.7.8", "/accountsx/", 500),
+        ]))
+        log_stats_store.merge_buckets(conn, buckets([
+            ("2026-02-01", "1.2.3.4", "/accounts/login/", 30),
+            ("2026-02-02", "1.2.3.4", "/accounts/signup/", 40),
+        ]))
+
+        self.assertEqual(log_stats_store.date_totals(conn), [("2026-02-01", 700), ("2026-02-02", 40)])
+        self.assertEqual(log_stats_store.prefix_hits_by_ip(conn, "/accounts/", min_hits=200), {"1.2.3.4": 220})
+        self.assertEqual(log_stats_store.prefix_hits_by_ip(conn, "/accounts/", date_key="2026-02-01"), {"1.2.3.4": 180, "5.6.7.8": 20})
+        self.assertEqual(log_stats_store.top_ips(conn, "2026-02-01", 1), [("5.6.7.8", 520)])
+
+    def test_block_accounts_abuse_reads_sqlite_and_old_json_alike(self):
+        legacy = {"dates": buckets([
+            ("2026-02-01", "1.2.3.4", "/accounts/login/", 250),
+            ("2026-02-02", "5.6.7.8", "/accounts/login/", 150),
+            ("2026-02-02", "5.6.7.8", "/jobs/", 500),
+        ])}
+        conn = log_stats_store.connect(self.db_path)
+        log_stats_store.merge_buckets(conn, legacy["dates"])
+        conn.close()
+        json_path = os.path.join(self.tmpdir, "log_stats.json")
+        with open(json_path, "w") as f:
+            import json
+            json.dump(legacy, f)
+
+        from_sqlite = block_accounts_abuse.load_accounts_hits(self.db_path, min_hits=200)
+        from_json = block_accounts_abuse.load_accounts_hits(json_path, min_hits=200)
+
+        self.assertEqual(from_sqlite, {"1.2.3.4": 250})
+        self.assertEqual(from_sqlite, from_json)
+        self.assertEqual(block_accounts_abuse.load_accounts_hits(os.path.join(self.tmpdir, "missing.sqlite")), {})
+
+    def test_parse_batch_merges_into_store(self):
+        log_path = os.path.join(self.tmpdir, "access.log")
+        with open(log_path, "w") as f:
+            f.writelines(LOG_LINES)
+        batch = log_stats_store.CountBatch()
+        parsed, matched = log_stats.parse_logs([log_path], batch)
+        conn = log_stats_store.connect(self.db_path)
+        log_stats_store.merge_buckets(conn, batch.to_buckets(), log_stats.utc_timestamp())
+
+        self.assertEqual((parsed, matched), (5, 5))
+        self.assertEqual(log_stats_store.date_totals(conn), [("2026-02-01", 3), ("2026-02-02", 2)])
+        self.assertEqual(log_stats_store.prefix_hits_by_ip(conn, "/accounts/"), {"1.2.3.4": 3})
+
+    def test_count_batch_interns_strings_and_expands_to_buckets(self):
+        batch = log_stats_store.CountBatch()
+        for date_key, ip, url in [
+            ("2026-02-01", "1.2.3.4", "/accounts/login/"),
+            ("2026-02-01", "1.2.3.4", "/accounts/login/"),
+            ("2026-02-01", "5.6.7.8", "/accounts/login/"),
+            ("2026-02-02", "1.2.3.4", "/jobs/"),
+        ]:
+            batch.add(date_key, ip, url)
+
+        self.assertEqual(batch.urls, ["/accounts/login/", "/jobs/"])
+        self.assertEqual(batch.ips, ["1.2.3.4", "5.6.7.8"])
+        self.assertEqual(batch.to_buckets(), buckets([
+            ("2026-02-01", "1.2.3.4", "/accounts/login/", 2),
+            ("2026-02-01", "5.6.7.8", "/accounts/login/", 1),
+            ("2026-02-02", "1.2.3.4", "/jobs/", 1),
+        ]))
+
+    def test_parse_reads_only_new_complete_lines_and_detects_rotation(self):
+        log_path = os.path.join(self.tmpdir, "access.log")
+        conn = log_stats_store.connect(self.db_path)
+        with open(log_path, "w") as f:
+            f.writelines(LOG_LINES[:2])
+            f.write(LOG_LINES[2].rstrip("\n"))
+
+        self.assertEqual(log_stats.parse_into_store(conn, [log_path])[:2], (2, 2))
+        self.assertEqual(log_stats.parse_into_store(conn, [log_path])[:2], (0, 0))
+        with open(log_path, "a") as f:
+            f.write("\n")
+            f.write(LOG_LINES[3])
+        self.assertEqual(log_stats.parse_into_store(conn, [log_path])[:2], (2, 2))
+        self.assertEqual(log_stats_store.date_totals(conn), [("2026-02-01", 3), ("2026-02-02", 1)])
+
+        # copytruncate rotation: the file starts over smaller than the offset.
+        with open(log_path, "w") as f:
+            f.write(LOG_LINES[4])
+        self.assertEqual(log_stats.parse_into_store(conn, [log_path])[:2], (1, 1))
+        self.assertEqual(log_stats_store.date_totals(conn), [("2026-02-01", 3), ("2026-02-02", 2)])
+
+        with open(log_path, "a") as f:
+            f.write(LOG_LINES[0])
+        log_stats.follow_logs(conn, [log_path], flush_seconds=0, poll_seconds=0, max_polls=1)
+        self.assertEqual(log_stats_store.date_totals(conn), [("2026-02-01", 4), ("2026-02-02", 2)])
+
+
+if __name__ == "__main__":
+    unittest.main()
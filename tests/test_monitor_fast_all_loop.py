@@ -1,5 +1,7 @@
 import os
+import shutil
 import sys
+import tempfile
 import unittest
 
 ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -24,10 +26,21 @@ def make_args():
     args.no_ufw_backup = True
     args.threshold = 100
     args.script = "./run_prepare_generiek_blocks_fast_all.sh"
+    args.input_file = "input.txt"
     return args
 
 
+def status_page(busy):
+    return "%d requests currently being processed, 10 idle workers\n1.2.3.4" % busy
+
+
 class MonitorFastAllLoopTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
     def test_build_prepare_env_sets_fast_incident_defaults(self):
         args = make_args()
 
@@ -40,6 +53,8 @@ class MonitorFastAllLoopTests(unittest.TestCase):
         self.assertEqual(env["PYTHON"], "python2")
         self.assertEqual(env["UFW_USER_RULES"], "/lib/ufw/user.rules")
         self.assertEqual(env["FAST_UFW_BACKUP"], "0")
+        self.assertEqual(env["INPUT_FILE"], "input.txt")
+        self.assertEqual(env["FETCH_SERVER_STATUS"], "0")
 
     def test_build_prepare_env_can_enable_backup(self):
         args = make_args()
@@ -51,21 +66,26 @@ class MonitorFastAllLoopTests(unittest.TestCase):
 
     def test_run_once_skips_below_threshold(self):
         args = make_args()
+        args.input_file = os.path.join(self.tmpdir, "input.txt")
         calls = []
 
-        result = loop.run_once(args, fetch_func=lambda _args: 100, run_func=lambda _args: calls.append("run"))
+        result = loop.run_once(args, fetch_func=lambda _args: status_page(100), run_func=lambda _args: calls.append("run"))
 
         self.assertEqual(result, 0)
         self.assertEqual(calls, [])
+        self.assertFalse(os.path.exists(args.input_file))
 
-    def test_run_once_runs_above_threshold(self):
+    def test_run_once_runs_above_threshold_on_fetched_page(self):
         args = make_args()
+        args.input_file = os.path.join(self.tmpdir, "input.txt")
         calls = []
 
-        result = loop.run_once(args, fetch_func=lambda _args: 101, run_func=lambda _args: calls.append("run"))
+        result = loop.run_once(args, fetch_func=lambda _args: status_page(101), run_func=lambda _args: calls.append("run"))
 
         self.assertEqual(result, 0)
         self.assertEqual(calls, ["run"])
+        with open(args.input_file) as f:
+            self.assertEqual(f.read(), status_page(101))
 
 
 if __name__ == "__main__":
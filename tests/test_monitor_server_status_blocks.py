@@ -1,7 +1,9 @@
+import json
 import os
 import shutil
 import sys
 import tempfile
+import time
 import unittest
 try:
     from StringIO import StringIO
@@ -111,8 +113,8 @@ class MonitorServerStatusBlocksTests(unittest.TestCase):
         original = monitor.run_prepare
         calls = []
 
-        def fake_run_prepare(script, python_bin, apply, extra_env):
-            calls.append((script, python_bin, apply, extra_env))
+        def fake_run_prepare(script, python_bin, apply, extra_env, input_file=None):
+            calls.append((script, python_bin, apply, extra_env, input_file))
 
         monitor.run_prepare = fake_run_prepare
         try:
@@ -130,12 +132,43 @@ class MonitorServerStatusBlocksTests(unittest.TestCase):
             monitor.run_prepare = original
 
         self.assertEqual(rc, 0)
-        self.assertEqual(calls, [("./run_prepare_generiek_blocks.sh", "python2", False, ["POLICY_MODE=1"])])
+        self.assertEqual(calls, [("./run_prepare_generiek_blocks.sh", "python2", False, ["POLICY_MODE=1"], input_file)])
         with open(input_file) as f:
             self.assertIn("1.2.3.4", f.read())
         with open(snapshot) as f:
             self.assertIn("201 requests", f.read())
 
+    def test_main_rising_trend_runs_prepare_before_threshold(self):
+        status = os.path.join(self.tmpdir, "status.txt")
+        input_file = os.path.join(self.tmpdir, "input.txt")
+        snapshot = os.path.join(self.tmpdir, "snapshot.txt")
+        trend_file = os.path.join(self.tmpdir, "trend.json")
+        lock_dir = os.path.join(self.tmpdir, "lock")
+        with open(status, "w") as f:
+            f.write("130 requests currently being processed, 10 idle workers\n1.2.3.4")
+        with open(trend_file, "w") as f:
+            json.dump({"version": 1, "samples": [[time.time() - 1800, 40, {}]], "triggered": {}}, f)
+
+        original = monitor.run_prepare
+        calls = []
+        monitor.run_prepare = lambda *args, **kwargs: calls.append(args)
+        try:
+            rc = monitor.main_with_args([
+                "--status-file", status,
+                "--threshold", "200",
+                "--input-file", input_file,
+                "--snapshot-file", snapshot,
+                "--trend-file", trend_file,
+                "--lock-dir", lock_dir,
+            ])
+        finally:
+            monitor.run_prepare = original
+
+        self.assertEqual(rc, 0)
+        self.assertEqual(len(calls), 1)
+        with open(trend_file) as f:
+            self.assertEqual([sample[1] for sample in json.load(f)["samples"]], [40, 130])
+
     def test_main_passes_insecure_to_fetch_url(self):
         input_file = os.path.join(self.tmpdir, "input.txt")
         snapshot = os.path.join(self.tmpdir, "snapshot.txt")
@@ -0,0 +1,145 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import monitor_status_hosts as hosts
+import status_http
+
+
+def status_page(busy):
+    return "Server Version: Apache\n%d requests currently being processed, 10 idle workers\n" % busy
+
+
+class MonitorStatusHostsTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_adaptive_interval_speeds_up_on_rising_load_and_backs_off_when_quiet(self):
+        interval = hosts.AdaptiveInterval(100, 5, 300, warn_ratio=0.5, backoff=2)
+        interval.interval = 60
+
+        self.assertEqual(interval.update(10, 0), 120)
+        # Below the warning ratio, but rising fast enough to cross the threshold.
+        self.assertEqual(interval.update(45, 60), 60)
+        self.assertEqual(interval.update(60, 120), 30)
+        self.assertEqual(interval.update(150, 150), 5)
+
+        quiet = hosts.AdaptiveInterval(100, 5, 300, backoff=2)
+        for now in range(0, 100, 10):
+            quiet.update(5, now)
+        self.assertEqual(quiet.interval, 300)
+
+    def test_once_runs_pipeline_only_for_hosts_above_threshold(self):
+        args = hosts.build_parser().parse_args([
+            "--endpoint", "web1=http://10.0.0.1/server-status",
+            "--endpoint", "web2=http://10.0.0.2/server-status",
+            "--status-dir", self.tmpdir,
+            "--once",
+        ])
+        endpoints = hosts.build_endpoints(args)
+        busy = {"web1": 250, "web2": 20}
+        runs = []
+
+        exit_code = hosts.run_monitor(
+            args,
+            endpoints,
+            fetch_func=lambda endpoint: status_page(busy[endpoint["name"]]),
+            run_func=lambda endpoint, path: runs.append((endpoint["name"], open(path).read())),
+        )
+
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(runs, [("web1", status_page(250))])
+
+    def test_dispatcher_coalesces_triggers_while_host_is_running(self):
+        started = threading.Event()
+        release = threading.Event()
+        runs = []
+
+        def run(endpoint, path):
+            runs.append((endpoint["name"], path))
+            started.set()
+            release.wait(5)
+
+        dispatcher = hosts.PipelineDispatcher(run, max_parallel=2)
+        dispatcher.start()
+        web1 = {"name": "web1"}
+        dispatcher.submit(web1, "page-1")
+        started.wait(5)
+        dispatcher.submit(web1, "page-2")
+        dispatcher.submit(web1, "page-3")
+        release.set()
+        dispatcher.stop()
+
+        self.assertEqual(runs, [("web1", "page-1"), ("web1", "page-3")])
+
+    def test_protocol_errors_keep_polling_and_crashed_runs_keep_workers(self):
+        session = status_http.get_session("http", "10.0.0.1")
+        self.addCleanup(status_http.close_sessions)
+
+        def bad_status_line(path, deadline, headers):
+            raise status_http.httplib.BadStatusLine("garbage")
+        session.request = bad_status_line
+        endpoint = {"name": "web1", "url": "http://10.0.0.1/server-status", "threshold": 100}
+        interval = hosts.AdaptiveInterval(100, 5, 300)
+        interval.interval = 60
+
+        wait = hosts.poll_once(endpoint, interval, None, self.tmpdir, lambda endpoint: status_http.fetch(endpoint["url"], 1))
+        self.assertEqual(wait, 60)
+
+        crashed = threading.Event()
+        finished = threading.Event()
+
+        def run(endpoint, path):
+            if path == "page-1":
+                crashed.set()
+                raise ValueError("bug")
+            finished.set()
+
+        dispatcher = hosts.PipelineDispatcher(run)
+        dispatcher.start()
+        dispatcher.submit(endpoint, "page-1")
+        crashed.wait(5)
+        dispatcher.submit(endpoint, "page-2")
+
+        self.assertTrue(finished.wait(5))
+        dispatcher.stop()
+
+    def test_poll_loop_survives_unexpected_errors(self):
+        args = hosts.build_parser().parse_args(["--endpoint", "web1=http://10.0.0.1/server-status", "--status-dir", self.tmpdir])
+        endpoint = hosts.build_endpoints(args)[0]
+        stop_event = threading.Event()
+        polls = []
+
+        def fetch(endpoint):
+            polls.append(endpoint["name"])
+            if len(polls) == 1:
+                raise ValueError("certificate mismatch")
+            stop_event.set()
+            return status_page(1)
+
+        args.min_interval = args.max_interval = 0
+        hosts.poll_loop(endpoint, args, None, stop_event, fetch)
+
+        self.assertEqual(polls, ["web1", "web1"])
+
+    def test_duplicate_endpoint_names_are_rejected(self):
+        args = hosts.build_parser().parse_args([
+            "--endpoint", "http://10.0.0.1/server-status",
+            "--endpoint", "http://10.0.0.1/server-status",
+        ])
+
+        self.assertRaises(RuntimeError, hosts.build_endpoints, args)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -72,6 +72,47 @@ Status: active
         self.assertEqual(plan["add_rules"], [])
         self.assertEqual(plan["rules"][0]["allowlist_overlaps"], ["66.249.75.0/24"])
 
+    def test_geo_source_index_returns_sources_in_ip_text_order(self):
+        geo_data = {
+            "10.10.1.9": {"country": "CN", "org": "AS1 A"},
+            "10.10.1.10": {"country": "CN", "org": "AS1 A"},
+            "10.10.2.1": {"country": "IN", "org": None},
+            "not-an-ip": {"country": "CN"},
+        }
+        index = planner.build_geo_source_index(geo_data)
+
+        rows = planner.geo_sources_in_network(self.net("10.10.1.0/24"), index)
+        hits = planner.country_hits_in_network(planner.build_country_ip_index(index)["CN"], self.net("10.10.0.0/16"))
+
+        self.assertEqual([row["ip"] for row in rows], ["10.10.1.10", "10.10.1.9"])
+        self.assertEqual(hits, ["10.10.1.10", "10.10.1.9"])
+        self.assertEqual(planner.geo_sources_in_network(self.net("10.10.2.0/24"), index)[0]["org"], "Unknown")
+
+    def test_rules_sharing_a_replacement_cidr_get_the_same_result(self):
+        status = "\n".join([
+            "[ 1] Anywhere                   DENY IN     10.10.1.0/24",
+            "[ 2] Anywhere                   DENY IN     10.10.2.0/24",
+            "[ 3] Anywhere                   DENY IN     10.10.9.7",
+        ])
+        geo_data = {
+            "10.10.1.1": {"country": "CN", "org": "AS123 Example ISP"},
+            "10.10.2.1": {"country": "CN", "org": "AS123 Example ISP"},
+            "10.10.9.7": {"country": "CN", "org": "AS123 Example ISP"},
+        }
+        recommendations = {"CN": {"target_prefix": 20, "min_hits": 3, "reason": "clustered"}}
+
+        plan = planner.build_plan(status, geo_data, recommendations, [], 5)
+
+        self.assertEqual(plan["summary"]["REPLACE"], 3)
+        self.assertEqual([row["num"] for row in plan["delete_rules"]], [3, 2, 1])
+        self.assertEqual(plan["add_rules"], [{
+            "cidr": "10.10.0.0/20",
+            "hits": 3,
+            "blocks_ips": 4096,
+            "example_ips": ["10.10.1.1", "10.10.2.1", "10.10.9.7"],
+        }])
+        self.assertEqual(plan["rules"][0]["new_cidrs"], plan["rules"][2]["new_cidrs"])
+
     def test_write_text_outputs_readable_plan(self):
         plan = {
             "rules_parsed": 1,
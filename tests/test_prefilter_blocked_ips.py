@@ -0,0 +1,81 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import prefilter_blocked_ips
+
+
+USER_RULES = """*filter
+:ufw-user-input - [0:0]
+### tuple ### deny any any 0.0.0.0/0 any 10.0.0.0/8 in
+-A ufw-user-input -s 10.0.0.0/8 -j DROP
+### tuple ### allow tcp 80 0.0.0.0/0 any 192.0.2.0/24 in
+-A ufw-user-input -p tcp -s 192.0.2.0/24 --dport 80 -j ACCEPT
+-A ufw-user-input -s 2001:db8::/32 -j DROP
+COMMIT
+"""
+
+UFW_STATUS = """Status: active
+
+     To                         Action      From
+     --                         ------      ----
+[ 1] Anywhere                   DENY IN     203.0.113.7
+[ 2] 80/tcp                     ALLOW IN    198.51.100.0/24
+"""
+
+
+class PrefilterBlockedIpsTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, text):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def test_drops_ips_covered_by_live_rules_and_status(self):
+        index = prefilter_blocked_ips.load_blocked_index(
+            [self.write("blocked.txt", "1.2.3.0/24\nnot-a-cidr\n"), os.path.join(self.tmpdir, "missing.txt")],
+            [self.write("user.rules", USER_RULES)],
+            [self.write("status.txt", UFW_STATUS)],
+        )
+
+        kept, dropped = prefilter_blocked_ips.split_blocked(
+            ["1.2.3.4", "10.20.30.40", "192.0.2.5", "203.0.113.7", "203.0.113.8", "198.51.100.1", "2001:db8::1"],
+            index,
+        )
+
+        # user.rules was readable, so the (possibly stale) tracking file is ignored.
+        self.assertEqual(dropped, ["10.20.30.40", "203.0.113.7"])
+        self.assertEqual(kept, ["1.2.3.4", "192.0.2.5", "203.0.113.8", "198.51.100.1", "2001:db8::1"])
+
+    def test_main_rewrites_input_and_writes_dropped_ips(self):
+        input_path = self.write("output.txt", "1.2.3.4\n5.6.7.8\n")
+        dropped_path = os.path.join(self.tmpdir, "dropped.txt")
+
+        code = prefilter_blocked_ips.main([
+            "--input", input_path,
+            "--dropped-output", dropped_path,
+            "--blocked-file", self.write("blocked.txt", "1.2.3.4\n"),
+            "--user-rules", os.path.join(self.tmpdir, "no-user.rules"),
+        ])
+
+        self.assertEqual(code, 0)
+        with open(input_path) as f:
+            self.assertEqual(f.read(), "5.6.7.8\n")
+        with open(dropped_path) as f:
+            self.assertEqual(f.read(), "1.2.3.4\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import prefix_histogram as histogram
+
+
+class PrefixHistogramTests(unittest.TestCase):
+    def test_ip_int_array_sorts_and_skips_invalid_values(self):
+        values = histogram.ip_int_array(["10.0.0.2", "bad", "10.0.0.1", "2001:db8::1"])
+
+        self.assertEqual(list(values), [167772161, 167772162])
+
+    def test_multi_prefix_histograms_derive_coarser_counts(self):
+        ints = histogram.ip_int_array(["10.10.1.1", "10.10.1.2", "10.10.2.1", "10.20.1.1"])
+
+        result = histogram.multi_prefix_histograms(ints, [24, 16])
+
+        self.assertEqual(result[24][1], [2, 1, 1])
+        self.assertEqual(result[16][1], [3, 1])
+
+    def test_histogram_stats_match_report_format(self):
+        ints = histogram.ip_int_array(["10.10.1.1", "10.10.1.2", "10.10.2.1", "10.20.1.1"])
+
+        stats = histogram.prefix_stats_for_ints(ints, [16], top_n=1)[16]
+
+        self.assertEqual(stats["networks"], 2)
+        self.assertEqual(stats["max_hits"], 3)
+        self.assertEqual(stats["networks_2_plus"], 1)
+        self.assertEqual(stats["networks_10_plus"], 0)
+        self.assertEqual(stats["top"], [{"cidr": "10.10.0.0/16", "hits": 3}])
+
+    def test_top_networks_break_ties_by_address(self):
+        ints = histogram.ip_int_array(["10.30.0.1", "10.20.0.1", "10.10.0.1"])
+
+        stats = histogram.prefix_stats_for_ints(ints, [16], top_n=2)[16]
+
+        self.assertEqual([row["cidr"] for row in stats["top"]], ["10.10.0.0/16", "10.20.0.0/16"])
+
+
+if __name__ == "__main__":
+    unittest.main()
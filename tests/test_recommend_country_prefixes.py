@@ -1,5 +1,8 @@
+import json
 import os
+import shutil
 import sys
+import tempfile
 import unittest
 
 ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -45,6 +48,38 @@ class RecommendCountryPrefixesTests(unittest.TestCase):
         self.assertEqual(rows[0]["recommendation"]["target_prefix"], 16)
         self.assertEqual(rows[0]["recommendation"]["min_hits"], 10)
 
+    def test_parallel_build_matches_serial_output(self):
+        geo_data = {}
+        for i in range(60):
+            geo_data["10.%d.%d.1" % (i % 4, i)] = {"country": ["CN", "IN", "BR"][i % 3]}
+
+        serial = recommend.build_recommendations(geo_data, ["CN", "IN", "BR"], [24, 20, 16])
+        parallel = recommend.build_recommendations(geo_data, ["CN", "IN", "BR"], [24, 20, 16], workers=2)
+
+        self.assertEqual(json.dumps(parallel, sort_keys=True), json.dumps(serial, sort_keys=True))
+
+    def test_incremental_build_only_recomputes_changed_countries(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            state_path = os.path.join(tmpdir, "state.json")
+            geo_data = {}
+            for i in range(40):
+                geo_data["10.10.%d.1" % i] = {"country": "CN"}
+                geo_data["20.20.%d.1" % i] = {"country": "IN"}
+
+            _rows, changed = recommend.build_recommendations_incremental(geo_data, ["CN", "IN"], [24, 20, 16], state_path)
+            self.assertEqual(changed, 2)
+
+            geo_data["10.10.200.1"] = {"country": "CN"}
+            del geo_data["10.10.3.1"]
+            rows, changed = recommend.build_recommendations_incremental(geo_data, ["CN", "IN"], [24, 20, 16], state_path)
+
+            self.assertEqual(changed, 1)
+            full = recommend.build_recommendations(geo_data, ["CN", "IN"], [24, 20, 16])
+            self.assertEqual(json.dumps(rows, sort_keys=True), json.dumps(full, sort_keys=True))
+        finally:
+            shutil.rmtree(tmpdir)
+
 
 if __name__ == "__main__":
     unittest.main()
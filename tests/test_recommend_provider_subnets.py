@@ -91,6 +91,42 @@ class RecommendProviderSubnetsTests(unittest.TestCase):
         self.assertIn("10.10.0.0/20 hits=3 blocks_ips=4096", output)
         self.assertNotIn("Google LLC", output)
 
+    def test_parallel_build_matches_serial_output(self):
+        geo_data = {}
+        for i in range(60):
+            geo_data["10.10.%d.1" % i] = {"country": ["CN", "IN"][i % 2], "org": "AS%d Example ISP" % (i % 5)}
+
+        serial = recommend.build_recommendations(geo_data, ["CN", "IN"], [24, 20, 16], 3)
+        parallel = recommend.build_recommendations(geo_data, ["CN", "IN"], [24, 20, 16], 3, workers=2)
+
+        self.assertEqual(json.dumps(parallel, sort_keys=True), json.dumps(serial, sort_keys=True))
+
+    def test_incremental_build_handles_moved_and_removed_ips(self):
+        state_path = os.path.join(self.tmpdir, "state.json")
+        geo_data = {}
+        for i in range(30):
+            geo_data["10.10.%d.1" % i] = {"country": "CN", "org": "AS123 Example ISP"}
+            geo_data["20.20.%d.1" % i] = {"country": "CN", "org": "AS456 Other ISP"}
+        recommend.build_recommendations_incremental(geo_data, ["CN"], [24, 20, 16], 3, state_path)
+
+        geo_data["10.10.1.1"] = {"country": "CN", "org": "AS456 Other ISP"}
+        del geo_data["10.10.2.1"]
+        rows, changed = recommend.build_recommendations_incremental(geo_data, ["CN"], [24, 20, 16], 3, state_path)
+
+        self.assertEqual(changed, 2)
+        full = recommend.build_recommendations(geo_data, ["CN"], [24, 20, 16], 3)
+        self.assertEqual(json.dumps(rows, sort_keys=True), json.dumps(full, sort_keys=True))
+
+    def test_incremental_build_without_changes_recomputes_nothing(self):
+        state_path = os.path.join(self.tmpdir, "state.json")
+        geo_data = {"10.10.1.1": {"country": "CN", "org": "AS123 Example ISP"}}
+        recommend.build_recommendations_incremental(geo_data, ["CN"], [24, 20, 16], 3, state_path)
+
+        rows, changed = recommend.build_recommendations_incremental(geo_data, ["CN"], [24, 20, 16], 3, state_path)
+
+        self.assertEqual(changed, 0)
+        self.assertEqual(len(rows), 1)
+
 
 if __name__ == "__main__":
     unittest.main()
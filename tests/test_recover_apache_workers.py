@@ -0,0 +1,134 @@
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAST_ALL_SCRIPT = os.path.join(ROOT, "run_prepare_generiek_blocks_fast_all.sh")
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import recover_apache_workers as recovery
+
+
+HEADER = "Srv\tPID\tAcc\tM\tCPU\tSS\tReq\tConn\tChild\tSlot\tClient\tVHost\tRequest\n"
+
+
+def status_page(busy, clients):
+    lines = ["%d requests currently being processed, 10 idle workers\n" % busy, HEADER]
+    for index, (client, mode) in enumerate(clients):
+        lines.append("0-0\t%d\t0/1/1\t%s\t0.01\t5\t0\t0.0\t0.01\t0.01\t%s\twww.example.com\tGET / HTTP/1.1\n" % (100 + index, mode, client))
+    return "".join(lines)
+
+
+def config(**overrides):
+    result = {
+        "threshold": 100,
+        "kill_cmd": "conntrack -D -s {cidr}",
+        "graceful_cmd": "apachectl -k graceful",
+        "restart_cmd": "service apache2 restart",
+        "settle_seconds": 0,
+        "dry_run": False,
+    }
+    result.update(overrides)
+    return result
+
+
+class StubServer(object):
+    # Status pages change as the stubbed commands run.
+    def __init__(self, pages):
+        self.pages = pages
+        self.state = "before"
+        self.commands = []
+
+    def fetch(self):
+        return self.pages[self.state]
+
+    def run(self, command):
+        self.commands.append(" ".join(command))
+        self.state = command[0]
+        return 0
+
+
+class RecoverApacheWorkersTests(unittest.TestCase):
+    def test_killing_blocked_connections_avoids_restart(self):
+        held = [("10.1.2.3", "W"), ("10.1.7.8", "W"), ("10.9.9.9", "W"), ("10.1.2.4", "_")]
+        server = StubServer({
+            "before": status_page(150, held),
+            "conntrack": status_page(60, [("10.9.9.9", "W")]),
+        })
+
+        report = recovery.recover(["10.1.0.0/16", "8.8.8.0/24"], server.fetch, server.run, config(), sleep_func=lambda _s: None)
+
+        self.assertEqual(server.commands, ["conntrack -D -s 10.1.0.0/16"])
+        self.assertEqual(report["held_before"], 2)
+        self.assertEqual(report["held_after"], 0)
+        self.assertEqual(report["held_workers_freed"], 2)
+        self.assertEqual(report["workers_freed"], 90)
+        self.assertEqual([step["step"] for step in report["steps"]], ["kill_connections"])
+
+    def test_persistent_saturation_escalates_to_graceful_then_restart(self):
+        server = StubServer({
+            "before": status_page(150, [("10.1.2.3", "W")]),
+            "conntrack": status_page(149, []),
+            "apachectl": status_page(140, []),
+            "service": status_page(5, []),
+        })
+
+        report = recovery.recover(["10.1.0.0/16"], server.fetch, server.run, config(), sleep_func=lambda _s: None)
+
+        self.assertEqual(server.commands, [
+            "conntrack -D -s 10.1.0.0/16",
+            "apachectl -k graceful",
+            "service apache2 restart",
+        ])
+        self.assertEqual(report["busy_after"], 5)
+        self.assertEqual(report["workers_freed"], 145)
+
+    def test_nothing_runs_when_no_blocked_source_holds_workers(self):
+        server = StubServer({"before": status_page(40, [("10.9.9.9", "W")])})
+
+        report = recovery.recover(["10.1.0.0/16"], server.fetch, server.run, config(), sleep_func=lambda _s: None)
+
+        self.assertEqual(server.commands, [])
+        self.assertEqual(report["steps"], [])
+        self.assertEqual(report["workers_freed"], 0)
+
+
+class FastAllKillCommandTests(unittest.TestCase):
+    # Runs the wrapper with stub prepare/python scripts and checks the
+    # --kill-cmd it hands to recover_apache_workers.py.
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.write_script("run_prepare_generiek_blocks.sh", "#!/bin/sh\nexit 0\n")
+        self.write_script("python", '#!/bin/sh\nfor arg in "$@"; do printf "%s\\n" "$arg"; done > "$(dirname "$0")/args.txt"\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_script(self, name, text):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, "w") as f:
+            f.write(text)
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+
+    def kill_cmd(self, **overrides):
+        env = dict(os.environ, FETCH_SERVER_STATUS="0", RESTART_APACHE="1", RECOVERY_MODE="smart", APPLY="0", PYTHON=os.path.join(self.tmpdir, "python"))
+        env.pop("KILL_CONNECTIONS_CMD", None)
+        env.update(overrides)
+        subprocess.check_call(["bash", FAST_ALL_SCRIPT], cwd=self.tmpdir, env=env)
+        with open(os.path.join(self.tmpdir, "args.txt")) as f:
+            args = f.read().split("\n")
+        return args[args.index("--kill-cmd") + 1]
+
+    def test_kill_command_default_override_and_empty(self):
+        self.assertEqual(self.kill_cmd(), "conntrack -D -s {cidr}")
+        self.assertEqual(self.kill_cmd(KILL_CONNECTIONS_CMD="ss -K dst {cidr}"), "ss -K dst {cidr}")
+        self.assertEqual(self.kill_cmd(KILL_CONNECTIONS_CMD=""), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import request_store
+
+
+LOG_LINES = [
+    '1.2.3.4 - - [01/Feb/2026:06:25:43 +0100] "GET /accounts/login/?next=/ HTTP/1.1" 200 512 "-" "bot"\n',
+    'www.example.com:443 1.2.3.5 - - [01/Feb/2026:06:25:44 +0100] "POST /accounts/login/ HTTP/1.1" 403 512 "-" "bot"\n',
+    '5.6.7.8 - - [01/Feb/2026:07:00:00 +0100] "GET /jobs/ HTTP/1.1" 200 512 "-" "browser"\n',
+    '2001:db8::1 - - [01/Feb/2026:07:00:01 +0100] "GET /jobs/ HTTP/1.1" 200 512 "-" "browser"\n',
+    '1.2.3.4 - - [02/Feb/2026:08:00:00 +0100] "GET /accounts/signup/ HTTP/1.1" 404 512 "-" "bot"\n',
+]
+
+
+class RequestStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store_path = os.path.join(self.tmpdir, "store")
+        self.log_path = os.path.join(self.tmpdir, "jobs-access.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_log(self, lines, mode="w"):
+        with open(self.log_path, mode) as f:
+            f.writelines(lines)
+
+    def test_ingest_appends_new_lines_across_chunks_and_queries_group(self):
+        self.write_log(LOG_LINES[:3])
+        stats = request_store.ingest(self.store_path, [self.log_path], chunk_rows=2)
+        self.write_log(LOG_LINES[3:], mode="a")
+        again = request_store.ingest(self.store_path, [self.log_path], chunk_rows=2)
+
+        store = request_store.RequestStore(self.store_path)
+        self.assertEqual((stats["added"], again["added"], again["skipped"]), (3, 1, 1))
+        self.assertEqual([chunk["rows"] for chunk in store.meta["chunks"]], [2, 2])
+        self.assertEqual(request_store.count_by(store, "subnet/24"), {"1.2.3.0/24": 3, "5.6.7.0/24": 1})
+        self.assertEqual(request_store.count_by(store, "ip", url_prefix="/accounts/", statuses=[200, 403]), {"1.2.3.4": 1, "1.2.3.5": 1})
+        self.assertEqual(request_store.count_by(store, "vhost"), {"jobs-access": 3, "www.example.com:443": 1})
+        self.assertEqual(
+            request_store.count_by(store, "time/3600", since=request_store.parse_time_arg("2026-02-01T06:00")),
+            {"2026-02-01T06:00:00Z": 1, "2026-02-02T07:00:00Z": 1},
+        )
+        self.assertEqual(request_store.count_by(store, "url", cidr="1.2.3.4/32", until=request_store.parse_time_arg("2026-02-02")), {"/accounts/login/?next=/": 1})
+
+    def test_uncommitted_writes_are_cut_off_when_reopened(self):
+        self.write_log(LOG_LINES[:2])
+        request_store.ingest(self.store_path, [self.log_path])
+        writer = request_store.RequestStoreWriter(self.store_path)
+        writer.add({"new": True, "ip": "9.9.9.9", "time": "01/Feb/2026:09:00:00 +0000", "site": "x", "method": "GET", "url": "/lost", "status": "200"})
+        writer.write_pending()
+
+        request_store.RequestStoreWriter(self.store_path).commit()
+        store = request_store.RequestStore(self.store_path)
+
+        self.assertEqual(store.rows(), 2)
+        self.assertNotIn("/lost", store.strings["url"])
+
+    def test_export_writes_json_lines(self):
+        self.write_log(LOG_LINES)
+        request_store.ingest(self.store_path, [self.log_path])
+        export_path = os.path.join(self.tmpdir, "requests.jsonl")
+
+        with open(export_path, "w") as out:
+            written = request_store.export_jsonl(request_store.RequestStore(self.store_path), out, statuses=[404])
+
+        self.assertEqual(written, 1)
+        with open(export_path) as f:
+            row = json.loads(f.read())
+        self.assertEqual(row, {
+            "time": "2026-02-02T07:00:00Z",
+            "ip": "1.2.3.4",
+            "vhost": "jobs-access",
+            "method": "GET",
+            "url": "/accounts/signup/",
+            "status": 404,
+        })
+
+
+if __name__ == "__main__":
+    unittest.main()
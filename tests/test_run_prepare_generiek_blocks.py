@@ -0,0 +1,132 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import cache_crawler_ips
+import run_prepare_generiek_blocks as runner
+import run_snapshots
+
+
+USER_RULES = """*filter
+:ufw-user-input - [0:0]
+### tuple ### allow tcp 80 0.0.0.0/0 any 0.0.0.0/0 in
+-A ufw-user-input -p tcp -m tcp --dport 80 -j ACCEPT
+### tuple ### deny any any 0.0.0.0/0 any 5.6.7.0/24 in
+-A ufw-user-input -s 5.6.7.0/24 -j DROP
+COMMIT
+"""
+
+
+class RunPrepareGeneriekBlocksTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        os.makedirs("ip_cache")
+        for name in cache_crawler_ips.SOURCES:
+            with open(os.path.join("ip_cache", "%s.json" % name), "w") as f:
+                json.dump({"prefixes": [{"ipv4Prefix": "66.249.64.0/27"}]}, f)
+        with open("user.rules", "w") as f:
+            f.write(USER_RULES)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def config(self, **overrides):
+        environ = {
+            "SKIP_GEO_FETCH": "1",
+            "APPLY": "0",
+            "FAST_UFW_APPLY": "1",
+            "UFW_USER_RULES": "user.rules",
+            "COUNTRY_CODES": "CN",
+            "RECOMMEND_WORKERS": "1",
+            "RUN_ID": "test-run",
+        }
+        environ.update(overrides)
+        return runner.load_config(environ)
+
+    def test_pipeline_runs_stages_in_process_and_snapshots_run(self):
+        geo_data = {}
+        lines = []
+        for i in range(1, 6):
+            geo_data["1.2.3.%d" % i] = {"country": "CN", "org": "AS4134 Chinanet"}
+            lines.append("client 1.2.3.%d GET /" % i)
+        geo_data["5.6.7.8"] = {"country": "NL", "org": "AS1 Example"}
+        lines.append("client 5.6.7.8 GET /")
+        with open("geo_data.json", "w") as f:
+            json.dump(geo_data, f)
+        with open("input.txt", "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+        runner.run_pipeline(self.config())
+
+        run_dir = os.path.join("runs", "test-run")
+        with open("aggregated_generiek_subnets.json") as f:
+            self.assertEqual(json.load(f), ["1.2.3.0/24"])
+        for name in ("input_raw.txt", "output_ips.txt", "country_prefix_recommendations.json", "user.rules.preview"):
+            self.assertTrue(run_snapshots.run_file_exists(run_dir, name), name)
+        self.assertFalse(os.path.exists(os.path.join(run_dir, "input_raw.txt")))
+        with open(os.path.join(run_dir, "summary.txt")) as f:
+            summary = dict(line.rstrip("\n").split("=", 1) for line in f)
+        self.assertEqual(summary["parsed_ip_lines"], "6")
+        self.assertEqual(summary["parsed_ip_occurrences"], "6")
+        self.assertEqual(summary["prefilter_dropped_ips"], "1")
+        self.assertEqual(summary["candidate_subnet_lines"], "1")
+        self.assertEqual(summary["pipeline"], "in-process")
+        with open(os.path.join(run_dir, "timings.json")) as f:
+            stages = dict((row["stage"], row) for row in json.load(f)["stages"])
+        self.assertEqual(stages["parse_ips"]["output_count"], 6)
+        self.assertEqual(stages["prefilter"]["output_count"], 5)
+        self.assertIn("aggregate", stages)
+        self.assertIn("apply", stages)
+        with open("user.rules") as f:
+            self.assertEqual(f.read(), USER_RULES)
+
+    def test_stage_timings_off_writes_no_timings_file(self):
+        with open("geo_data.json", "w") as f:
+            json.dump({"1.2.3.4": {"country": "CN", "org": "AS4134 Chinanet"}}, f)
+        with open("input.txt", "w") as f:
+            f.write("client 1.2.3.4 GET /\n")
+
+        runner.run_pipeline(self.config(STAGE_TIMINGS="0"))
+
+        run_dir = os.path.join("runs", "test-run")
+        self.assertFalse(os.path.exists(os.path.join(run_dir, "timings.json")))
+        with open(os.path.join(run_dir, "summary.txt")) as f:
+            self.assertIn("stage_timings=0\n", f.read())
+
+    def test_broken_recurrence_db_does_not_fail_the_run(self):
+        with open("broken.sqlite", "w") as f:
+            f.write("not a database\n" * 100)
+
+        runner.stage_recurrence(self.config(RECURRENCE_DB="broken.sqlite"))
+
+    def test_server_status_failure_does_not_fail_the_run(self):
+        with open(runner.STATUS_WORKERS_FILE, "w") as f:
+            f.write("{}\n")
+
+        runner.stage_server_status(self.config())
+
+        self.assertFalse(os.path.exists(runner.STATUS_WORKERS_FILE))
+
+    def test_pipeline_refuses_empty_input(self):
+        with open("input.txt", "w") as f:
+            f.write("no addresses here\n")
+
+        with self.assertRaises(runner.PipelineError) as ctx:
+            runner.run_pipeline(self.config())
+
+        self.assertEqual(ctx.exception.returncode, 2)
+        self.assertTrue(os.path.exists(os.path.join("runs", "test-run", "summary.txt")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import aggregate_generiek_subnets as aggregate
+import run_recurrence
+import run_snapshots
+from ipv4_index import parse_ipv4_int
+
+
+class RunRecurrenceTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.runs_dir = os.path.join(self.tmpdir, "runs")
+        self.db_path = os.path.join(self.runs_dir, ".recurrence.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_run(self, name, ips):
+        source = os.path.join(self.tmpdir, "output.txt")
+        with open(source, "w") as f:
+            f.write("\n".join(ips) + "\n")
+        run_dir = os.path.join(self.runs_dir, name)
+        run_snapshots.snapshot_files(run_dir, [(source, "output_ips.txt")])
+        return run_dir
+
+    def test_update_indexes_new_runs_and_answers_window_queries(self):
+        self.write_run("20260801-100000", ["1.2.3.4", "5.6.7.8"])
+        self.write_run("20260802-100000", ["1.2.3.9", "5.6.7.8"])
+        conn = run_recurrence.connect(self.db_path)
+
+        self.assertEqual(run_recurrence.update_index(conn, self.runs_dir), ["20260801-100000", "20260802-100000"])
+        latest = self.write_run("20260803-100000", ["1.2.3.4", "9.9.9.9"])
+        self.assertEqual(run_recurrence.update_index(conn, self.runs_dir), ["20260803-100000"])
+        run_recurrence.index_run_dir(conn, latest)
+
+        ips = run_recurrence.recurring(conn, "ip", 2, 3)
+        subnets = run_recurrence.recurring(conn, "subnet", 3, 3)
+        last_two = run_recurrence.recurring(conn, "subnet", 2, 2)
+        conn.close()
+
+        self.assertEqual(dict((run_recurrence.key_to_text("ip", key), runs) for key, runs in ips.items()), {"1.2.3.4": 2, "5.6.7.8": 2})
+        self.assertEqual([run_recurrence.key_to_text("subnet", key) for key in subnets], ["1.2.3.0/24"])
+        self.assertEqual(subnets[parse_ipv4_int("1.2.3.0") >> 8], 3)
+        self.assertEqual(sorted(run_recurrence.key_to_text("subnet", key) for key in last_two), ["1.2.3.0/24"])
+
+    def test_aggregate_keeps_recurring_subnets_below_min_hits(self):
+        self.write_run("20260801-100000", ["1.2.3.4"])
+        self.write_run("20260802-100000", ["1.2.3.5"])
+        conn = run_recurrence.connect(self.db_path)
+        run_recurrence.update_index(conn, self.runs_dir)
+        conn.close()
+        args = aggregate.build_parser().parse_args([
+            "--recurrence-db", self.db_path,
+            "--recurrence-min-runs", "2",
+            "--min-hits", "2",
+        ])
+
+        recurring = aggregate.load_recurring(args)
+        selected, subnets = aggregate.build_subnets_from_ips(["1.2.3.7", "8.8.8.8"], 24, 2, recurring)
+
+        self.assertEqual(selected, 2)
+        self.assertEqual(subnets, ["1.2.3.0/24"])
+        self.assertEqual(aggregate.build_subnets_from_ips(["1.2.3.7"], 24, 2)[1], [])
+        self.assertEqual(aggregate.build_subnets_from_ips(["1.2.3.7"], 16, 2, recurring)[1], [])
+        self.assertEqual(run_recurrence.recurring_subnet_keys(os.path.join(self.tmpdir, "missing.sqlite"), 2, 10), set())
+
+    def test_unreadable_index_disables_escalation(self):
+        broken = os.path.join(self.tmpdir, "broken.sqlite")
+        with open(broken, "w") as f:
+            f.write("not a database\n" * 100)
+
+        self.assertEqual(run_recurrence.recurring_subnet_keys(broken, 2, 10), set())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import analyze_runs
+import run_snapshots
+
+
+class RunSnapshotsTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.runs_dir = os.path.join(self.tmpdir, "runs")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_file(self, name, text):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def object_files(self):
+        found = []
+        for root, _dirs, files in os.walk(os.path.join(self.runs_dir, ".objects")):
+            found.extend(files)
+        return sorted(found)
+
+    def test_unchanged_files_are_stored_once_across_runs(self):
+        geo = self.write_file("geo_data.json", '{"1.2.3.4": {"country": "CN"}}')
+        ips = self.write_file("output.txt", "1.2.3.4\n")
+        first = os.path.join(self.runs_dir, "run-1")
+        second = os.path.join(self.runs_dir, "run-2")
+
+        added = run_snapshots.snapshot_files(first, [(geo, "geo_data.json"), (ips, "output_ips.txt"), ("missing.txt", "x.txt")])
+        again = run_snapshots.snapshot_files(second, [(geo, "geo_data.json"), (ips, "output_ips.txt")])
+
+        self.assertGreater(added, 0)
+        self.assertEqual(again, 0)
+        self.assertEqual(len(self.object_files()), 2)
+        self.assertEqual(sorted(run_snapshots.load_manifest(second)["files"]), ["geo_data.json", "output_ips.txt"])
+        self.assertEqual(run_snapshots.read_run_text(second, "output_ips.txt"), "1.2.3.4\n")
+        self.assertIsNone(run_snapshots.read_run_text(first, "x.txt"))
+        self.assertFalse(os.path.exists(os.path.join(second, "output_ips.txt")))
+
+    def test_gc_keeps_objects_of_remaining_runs(self):
+        old = self.write_file("old.txt", "9.9.9.9\n")
+        new = self.write_file("new.txt", "1.2.3.4\n")
+        run_snapshots.snapshot_files(os.path.join(self.runs_dir, "run-1"), [(old, "output_ips.txt")])
+        run_snapshots.snapshot_files(os.path.join(self.runs_dir, "run-2"), [(new, "output_ips.txt")])
+        shutil.rmtree(os.path.join(self.runs_dir, "run-1"))
+
+        self.assertEqual(run_snapshots.collect_garbage(self.runs_dir, dry_run=True)[0], 1)
+        removed, _freed = run_snapshots.collect_garbage(self.runs_dir)
+
+        self.assertEqual(removed, 1)
+        self.assertEqual(self.object_files(), [run_snapshots.file_sha256(new) + ".gz"])
+
+    def test_analyze_runs_reads_snapshot_objects(self):
+        ips = self.write_file("output.txt", "1.2.3.4\n5.6.7.8\n")
+        blocked = self.write_file("blocked.txt", "1.2.3.4 CN Example\n")
+        run_dir = os.path.join(self.runs_dir, "20260803-100000")
+        run_snapshots.snapshot_files(run_dir, [(ips, "output_ips.txt"), (blocked, "generiek_blocked_candidate_ips.txt")])
+
+        runs = [analyze_runs.analyze_run(path) for path in analyze_runs.iter_runs(self.runs_dir)]
+
+        self.assertEqual([run["run"] for run in runs], ["20260803-100000"])
+        self.assertEqual((runs[0]["input_ips"], runs[0]["blocked_candidate_ips"]), (2, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import server_status
+
+
+HTML_STATUS = """<html><head><title>Apache Status</title></head><body>
+<dl><dt>3 requests currently being processed, 1 idle workers</dt></dl>
+<pre>WR_K....</pre>
+<table border="0"><tr><th>Srv</th><th>PID</th><th>Acc</th><th>M</th><th>CPU
+</th><th>SS</th><th>Req</th><th>Dur</th><th>Conn</th><th>Child</th><th>Slot</th><th>Client</th><th>Protocol</th><th>VHost</th><th>Request</th></tr>
+
+<tr><td><b>0-0</b></td><td>23208</td><td>0/1/1</td><td><b>W</b>
+</td><td>0.38</td><td>12</td><td>0</td><td>0</td><td>0.0</td><td>0.02</td><td>0.02
+</td><td>1.2.3.4</td><td>http/1.1</td><td nowrap>www.example.com:443</td><td nowrap>GET /job/?a=1&amp;categories=x HTTP/1.1</td></tr>
+
+<tr><td><b>0-0</b></td><td>23208</td><td>0/0/0</td><td><b>R</b>
+</td><td>0.00</td><td>20</td><td>0</td><td>0</td><td>0.0</td><td>0.00</td><td>0.00
+</td><td>1.2.3.9</td><td>http/1.1</td><td nowrap></td><td nowrap></td></tr>
+
+<tr><td><b>0-0</b></td><td>23208</td><td>0/0/0</td><td><b>_</b>
+</td><td>0.00</td><td>300</td><td>0</td><td>0</td><td>0.0</td><td>0.00</td><td>0.00
+</td><td>5.6.7.8</td><td>http/1.1</td><td nowrap>www.example.com:443</td><td nowrap>GET / HTTP/1.1</td></tr>
+</table>
+</body></html>
+"""
+
+TEXT_STATUS = "\n".join([
+    "2 requests currently being processed, 0 idle workers",
+    "WW",
+    "Srv PID Acc M   CPU SS  Req Dur Conn    Child   Slot    Client  Protocol VHost   Request",
+    "0-0 23208   0/0/0   W   0.00    18  0   0   0.0 0.00    0.00    1.2.3.4  http/1.1 www.example.com:443    GET /a HTTP/1.1",
+    "0-0 23208   0/0/0   W   0.00    4  0   0   0.0 0.00    0.00    1.2.3.4  http/1.1 other.example.com:443    POST /b HTTP/1.1",
+    "0-0 23208   0/0/0   R   0.00    20  0  0   0.0 0.00    0.00    9.9.9.9",
+])
+
+AUTO_STATUS = "\n".join([
+    "www.example.com",
+    "ServerVersion: Apache/2.4.41 (Ubuntu)",
+    "Total Accesses: 376",
+    "BusyWorkers: 149",
+    "IdleWorkers: 56",
+    "Scoreboard: WWR__K..",
+])
+
+
+class ServerStatusTests(unittest.TestCase):
+    def test_parses_html_table_with_typed_rows(self):
+        status = server_status.parse_server_status(HTML_STATUS)
+
+        self.assertEqual(status["format"], "html")
+        self.assertEqual(status["busy_workers"], 3)
+        self.assertEqual(status["scoreboard"], {"W": 1, "R": 1, "_": 1, "K": 1, ".": 4})
+        first = status["workers"][0]
+        self.assertEqual((first.client, first.vhost, first.mode, first.seconds, first.pid), ("1.2.3.4", "www.example.com:443", "W", 12, 23208))
+        self.assertEqual(first.request, "GET /job/?a=1&categories=x HTTP/1.1")
+        self.assertEqual(server_status.split_request(first.request), ("GET", "/job/?a=1&categories=x"))
+        self.assertEqual(status["workers"][1].vhost, "")
+
+    def test_parses_text_copy_with_empty_trailing_columns(self):
+        status = server_status.parse_server_status(TEXT_STATUS)
+
+        self.assertEqual(status["format"], "text")
+        self.assertEqual([(row.client, row.protocol, row.vhost) for row in status["workers"]], [
+            ("1.2.3.4", "http/1.1", "www.example.com:443"),
+            ("1.2.3.4", "http/1.1", "other.example.com:443"),
+            ("9.9.9.9", "", ""),
+        ])
+        self.assertEqual(status["workers"][1].request, "POST /b HTTP/1.1")
+
+    def test_parses_auto_format_counts(self):
+        status = server_status.parse_server_status(AUTO_STATUS)
+
+        self.assertEqual(status["format"], "auto")
+        self.assertEqual((status["busy_workers"], status["idle_workers"]), (149, 56))
+        self.assertEqual(status["scoreboard"]["W"], 2)
+        self.assertEqual(status["workers"], [])
+        self.assertEqual(server_status.parse_busy_workers(AUTO_STATUS), 149)
+
+    def test_aggregates_active_workers_per_ip_subnet_and_vhost(self):
+        summary = server_status.summarize_status(server_status.parse_server_status(HTML_STATUS + TEXT_STATUS))
+
+        self.assertEqual(summary["by_ip"][0]["ip"], "1.2.3.4")
+        self.assertEqual(summary["by_ip"][0]["workers"], 1)
+        self.assertEqual(summary["by_subnet"], [{"cidr": "1.2.3.0/24", "workers": 2, "unique_ips": 2}])
+        self.assertEqual(summary["by_vhost"], [{"vhost": "www.example.com:443", "workers": 1, "unique_ips": 1}])
+        self.assertEqual(summary["active_worker_rows"], 2)
+
+    def test_text_summary_counts_workers_held_by_one_ip(self):
+        summary = server_status.summarize_status(server_status.parse_server_status(TEXT_STATUS))
+
+        self.assertEqual(summary["by_ip"][0], {
+            "ip": "1.2.3.4",
+            "workers": 2,
+            "seconds_total": 22,
+            "seconds_max": 18,
+            "modes": {"W": 2},
+            "vhosts": {"www.example.com:443": 1, "other.example.com:443": 1},
+        })
+
+    def test_main_writes_json_summary(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            input_path = os.path.join(tmpdir, "input.txt")
+            output_path = os.path.join(tmpdir, "workers.json")
+            with open(input_path, "w") as f:
+                f.write(TEXT_STATUS)
+
+            self.assertEqual(server_status.main(["--input", input_path, "--json-output", output_path]), 0)
+
+            with open(output_path) as f:
+                self.assertEqual(json.load(f)["worker_rows"], 3)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+    def test_file_parser_streams_text_and_sniffs_only_the_head(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            log_path = os.path.join(tmpdir, "input.txt")
+            html_path = os.path.join(tmpdir, "status.html")
+            filler = "1.2.3.4 - - [01/Feb/2026:06:25:43 +0100] \"GET / HTTP/1.1\" 200 512\n"
+            with open(log_path, "w") as f:
+                f.write(filler * (server_status.HEAD_BYTES // len(filler) + 1))
+                f.write("<table> quoted in a request after the head\n")
+                f.write(TEXT_STATUS)
+            with open(html_path, "w") as f:
+                f.write(HTML_STATUS)
+
+            from_log = server_status.parse_server_status_file(log_path)
+            from_html = server_status.parse_server_status_file(html_path)
+        finally:
+            shutil.rmtree(tmpdir)
+
+        expected = server_status.parse_server_status(TEXT_STATUS)
+        self.assertEqual(from_log["format"], "text")
+        self.assertEqual(from_log["workers"], expected["workers"])
+        self.assertEqual(from_log["busy_workers"], expected["busy_workers"])
+        self.assertEqual(from_html, server_status.parse_server_status(HTML_STATUS))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import stage_timing
+
+
+class StageTimingTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "timings.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def load(self):
+        with open(self.path) as f:
+            return json.load(f)
+
+    def test_recorder_writes_nested_stages_with_parent(self):
+        recorder = stage_timing.StageRecorder(self.path, "run-1")
+        previous = stage_timing.activate(recorder)
+        try:
+            with recorder.stage("apply") as record:
+                record["input_count"] = 3
+                with stage_timing.timed("reload"):
+                    pass
+        finally:
+            stage_timing.activate(previous)
+
+        data = self.load()
+        self.assertEqual(data["run_id"], "run-1")
+        self.assertEqual([(row["stage"], row["parent"]) for row in data["stages"]], [("reload", "apply"), ("apply", "")])
+        self.assertEqual(data["stages"][1]["input_count"], 3)
+        self.assertEqual(data["stages"][1]["status"], "ok")
+
+    def test_recorder_marks_failed_stage(self):
+        recorder = stage_timing.StageRecorder(self.path)
+        with self.assertRaises(ValueError):
+            with recorder.stage("aggregate"):
+                raise ValueError("boom")
+
+        self.assertEqual(self.load()["stages"][0]["status"], "error")
+
+    def test_cli_appends_command_record_with_counts_and_bytes(self):
+        source = os.path.join(self.tmpdir, "input.txt")
+        target = os.path.join(self.tmpdir, "output.json")
+        with open(source, "w") as f:
+            f.write("1.2.3.4\n\n5.6.7.8\n")
+        code = "import json; json.dump(['1.2.3.4'], open(%r, 'w'))" % target
+
+        rc = stage_timing.main([
+            "--timings", self.path, "--stage", "parse_ips",
+            "--read", source, "--write", target,
+            "--input-count", source, "--output-count", target,
+            "--", sys.executable, "-c", code,
+        ])
+        failed_rc = stage_timing.main(["--timings", self.path, "--stage", "apply", "--", sys.executable, "-c", "raise SystemExit(3)"])
+
+        stages = self.load()["stages"]
+        self.assertEqual((rc, failed_rc), (0, 3))
+        self.assertEqual(stages[0]["stage"], "parse_ips")
+        self.assertEqual((stages[0]["input_count"], stages[0]["output_count"]), (2, 1))
+        self.assertEqual(stages[0]["bytes_read"], os.path.getsize(source))
+        self.assertEqual(stages[0]["bytes_written"], os.path.getsize(target))
+        self.assertEqual(stages[1]["status"], "exit 3")
+
+
+if __name__ == "__main__":
+    unittest.main()
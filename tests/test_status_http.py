@@ -0,0 +1,86 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import status_http
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get("Host"), self.client_address[1]))
+        if self.path == "/slow":
+            time.sleep(1.0)
+        body = ("%d requests currently being processed, 10 idle workers\n" % len(self.server.requests)).encode("ascii")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StatusHttpTests(unittest.TestCase):
+    def setUp(self):
+        self.server = Server(("127.0.0.1", 0), StatusHandler)
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.base = "http://127.0.0.1:%d" % self.server.server_address[1]
+
+    def tearDown(self):
+        status_http.close_sessions()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_polls_reuse_one_keep_alive_connection(self):
+        first = status_http.fetch(self.base + "/server-status", 5, headers={"Host": "www.example.com"})
+        second = status_http.fetch(self.base + "/server-status", 5, headers={"Host": "www.example.com"})
+
+        self.assertIn(b"1 requests currently", first)
+        self.assertIn(b"2 requests currently", second)
+        session = status_http.get_session("http", "127.0.0.1:%d" % self.server.server_address[1])
+        self.assertEqual(session.connects, 1)
+        self.assertEqual(len(set(port for _path, _host, port in self.server.requests)), 1)
+        self.assertEqual(self.server.requests[0][1], "www.example.com")
+
+    def test_reconnects_when_server_closed_idle_connection(self):
+        status_http.fetch(self.base + "/server-status", 5)
+        session = status_http.get_session("http", "127.0.0.1:%d" % self.server.server_address[1])
+        session.connection.sock.close()
+
+        body = status_http.fetch(self.base + "/server-status", 5)
+
+        self.assertIn(b"2 requests currently", body)
+        self.assertEqual(session.connects, 2)
+
+    def test_total_fetch_time_is_capped(self):
+        started = time.time()
+
+        self.assertRaises(status_http.FetchTimeout, status_http.fetch, self.base + "/slow", 0.3)
+        self.assertLess(time.time() - started, 0.9)
+
+
+if __name__ == "__main__":
+    unittest.main()
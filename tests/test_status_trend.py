@@ -0,0 +1,94 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import status_trend
+from ipv4_index import interval_index_from_cidrs
+
+
+def config(**overrides):
+    result = dict(status_trend.DEFAULT_CONFIG, threshold=100, horizon=600.0)
+    result.update(overrides)
+    return result
+
+
+class StatusTrendTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_rising_busy_workers_trigger_before_threshold(self):
+        state = status_trend.empty_state()
+        status_trend.add_sample(state, 0, 30, {})
+        status_trend.add_sample(state, 600, 45, {})
+        self.assertEqual(status_trend.evaluate(state, config())["reason"], "")
+
+        status_trend.add_sample(state, 1200, 80, {})
+        decision = status_trend.evaluate(state, config())
+
+        self.assertTrue(decision["trigger"])
+        self.assertEqual(decision["reason"], "trend")
+        self.assertGreater(decision["predicted"], 100)
+
+    def test_concentrated_subnet_triggers_and_repeat_is_suppressed(self):
+        state = status_trend.empty_state()
+        status_trend.add_sample(state, 0, 40, {"10.1.2.0/24": 30, "10.9.9.0/24": 3})
+        decision = status_trend.evaluate(state, config())
+
+        self.assertEqual(decision["reason"], "concentration")
+        self.assertEqual(decision["concentrated_subnets"], ["10.1.2.0/24"])
+        self.assertEqual(decision["hot_subnets"], ["10.1.2.0/24"])
+
+        status_trend.record_trigger(state, decision["hot_subnets"], 0, 3600)
+        status_trend.add_sample(state, 300, 40, {"10.1.2.0/24": 30})
+        repeat = status_trend.evaluate(state, config())
+        self.assertTrue(repeat["suppressed"])
+        self.assertFalse(repeat["trigger"])
+
+        status_trend.add_sample(state, 4000, 40, {"10.1.2.0/24": 30})
+        self.assertTrue(status_trend.evaluate(state, config())["trigger"])
+
+    def test_subnets_in_blocked_file_suppress_threshold_runs(self):
+        state = status_trend.empty_state()
+        status_trend.add_sample(state, 0, 150, {"10.1.2.0/24": 60, "10.1.3.0/24": 40})
+        blocked = interval_index_from_cidrs(["10.1.0.0/16"])
+
+        decision = status_trend.evaluate(state, config(), blocked)
+
+        self.assertEqual(decision["reason"], "threshold")
+        self.assertTrue(decision["suppressed"])
+        self.assertTrue(status_trend.evaluate(state, config())["trigger"])
+
+    def test_blocked_subnets_do_not_suppress_unexplained_threshold_excess(self):
+        state = status_trend.empty_state()
+        status_trend.add_sample(state, 0, 300, {"10.1.2.0/24": 50})
+        blocked = interval_index_from_cidrs(["10.1.2.0/24"])
+
+        decision = status_trend.evaluate(state, config(threshold=200), blocked)
+
+        self.assertEqual(decision["reason"], "threshold")
+        self.assertFalse(decision["suppressed"])
+        self.assertTrue(decision["trigger"])
+
+    def test_state_file_keeps_only_capacity_samples(self):
+        path = os.path.join(self.tmpdir, "trend.json")
+        state = status_trend.load_state(path, capacity=3)
+        for now in range(5):
+            status_trend.add_sample(state, now, now * 10, {})
+        status_trend.save_state(path, state)
+
+        loaded = status_trend.load_state(path, capacity=3)
+
+        self.assertEqual([sample[0] for sample in loaded["samples"]], [2, 3, 4])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+import multiprocessing
+
+
+def resolve_workers(workers):
+    if workers is None or workers < 0:
+        return 1
+    if workers == 0:
+        try:
+            return multiprocessing.cpu_count()
+        except NotImplementedError:
+            return 1
+    return workers
+
+
+def parallel_map(func, items, workers=1, chunksize=None, initializer=None, initargs=()):
+    # initializer(*initargs) runs once per worker process (or once here when
+    # serial); use it for shared read-only state instead of module globals
+    # set in the parent, which spawn/forkserver workers never see.
+    items = list(items)
+    workers = min(resolve_workers(workers), len(items))
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        return [func(item) for item in items]
+    if chunksize is None:
+        chunksize = max(1, len(items) // (workers * 4))
+    pool = multiprocessing.Pool(workers, initializer, initargs)
+    try:
+        result = pool.map(func, items, chunksize)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return result
+
+
+def parallel_imap(func, items, workers=1, chunksize=1, initializer=None, initargs=()):
+    # Ordered results as they complete, for callers that report progress.
+    items = list(items)
+    workers = min(resolve_workers(workers), len(items))
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for item in items:
+            yield func(item)
+        return
+    pool = multiprocessing.Pool(workers, initializer, initargs)
+    try:
+        for result in pool.imap(func, items, chunksize):
+            yield result
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()